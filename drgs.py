@@ -8,6 +8,9 @@ from random import randint
 from omegaconf import OmegaConf, DictConfig
 from basicsr.utils import tensor2img, img2tensor
 from lidar2dep.data.process import colorize
+from lidar2dep.data.artifacts import writes
+from lidar2dep import telemetry
+from lidar2dep.data.point_reduce import reduce_point_cloud, REDUCE_MODES
 from PIL import Image
 
 from flash3d.models.encoder.unidepth_encoder import UniDepthExtended
@@ -237,8 +240,8 @@ def train_DRGS(
     else: args.h = h
     dataset, opt, pipe = lp.extract(args), op.extract(args), pp.extract(args)
 
-    inf_side_info['pcd'] = cut_down_points(inf_side_info['pcd'], 1. / args.downsample)
-    veh_side_info['pcd'] = cut_down_points(veh_side_info['pcd'], 1. / args.downsample)
+    inf_side_info['pcd'] = cut_down_points(inf_side_info['pcd'], 1. / args.downsample, args)
+    veh_side_info['pcd'] = cut_down_points(veh_side_info['pcd'], 1. / args.downsample, args)
 
     testing_iterations = args.test_iterations
     # saving_iterations = args.save_iterations # [30000, 30000] ?
@@ -417,6 +420,7 @@ def train_DRGS(
 
             while iteration >= first_iter and iteration <= opt.iterations:
                 iteration += 1
+                step = telemetry.begin('iteration', 'drgs', iteration=iteration)
 
                 train_now_idx = randint(0,1) # [0,1]
                 anti_idx = 0 if train_now_idx==1 else 1
@@ -431,6 +435,7 @@ def train_DRGS(
                     opt.iterations += 1
                     print('Abnormal Shape Found')
                     pdb.set_trace()
+                    step.end(abnormal=True)
                     continue
 
                 fg_mask = rearrange(torch.tensor(train_now['mask']), 'h w c -> c h w').requires_grad_(False).cuda()
@@ -468,6 +473,7 @@ def train_DRGS(
                         network_gui.conn = None
 
                 iter_start.record()
+                phase = telemetry.begin('render', 'drgs', iteration=iteration)
                 gaussian.update_learning_rate(iteration)
                 # Every 1000 its we increase the levels of SH up to a maximum degree
                 if iteration % 1000 == 0:
@@ -503,8 +509,9 @@ def train_DRGS(
                     dtype=torch.float32, device='cuda'
                 )
                 visibility_filter, radii, viewspace_point_tensor = render_pkg["visibility_filter"], render_pkg["radii"], render_pkg['viewspace_points']
+                phase.end()
 
-                if iteration % 5 == 0:
+                if iteration % 5 == 0 and writes('debug'):
                     if save_flag:
                         print('Saving tmp images...')
                         save_flag = False
@@ -525,6 +532,7 @@ def train_DRGS(
                 # Loss
                 # gt_image = viewpoint_cam.original_image.cuda()
                 # TODO: rgb的损失要分别传给对应的GS, depth是一起渲染的, 一起传播 | 修改上面这行代码，以及对应到的class下的成员读取
+                phase = telemetry.begin('loss', 'drgs', iteration=iteration)
                 gt_image, gt_depth = viewpoint.original_image, viewpoint.original_depth
                 Ll1 = l1_loss(gt_image, image_side_rendered)
 
@@ -547,7 +555,9 @@ def train_DRGS(
 
                 loss.backward()
                 iter_end.record()
+                phase.end()
 
+                phase = telemetry.begin('update', 'drgs', iteration=iteration)  # logging, saves, densification, optimizer step
                 with torch.no_grad():
                     # Progress bar
                     ema_loss_for_log = 0.4 * loss.item() + 0.6 * ema_loss_for_log
@@ -568,6 +578,8 @@ def train_DRGS(
                                             (pipe, background), txt_path=os.path.join(args.model_path, "metric.txt"))
                             scene.save(iteration)
                             print(f"!!! Stop Point: {iteration} !!!")
+                            phase.end()
+                            step.end(model=extra_name, points=gaussian._xyz.shape[0])
                             break
                         else:
                             prev_depthloss = ema_depthloss_for_log
@@ -613,6 +625,8 @@ def train_DRGS(
                         if (iteration in checkpoint_iterations):
                             print("\n[ITER {}] Saving Checkpoint".format(iteration))
                             torch.save((gaussian.capture(), iteration), scene.model_path + f"/{extra_name}-chkpnt" + str(iteration) + ".pth")
+                phase.end()
+                step.end(model=extra_name, points=gaussian._xyz.shape[0])
 
         except Exception as err:
             print(f'[Debug] Err: {err}')
@@ -622,6 +636,7 @@ def train_DRGS(
 
 
     print('\nTraining Process Finished.\n')
+    telemetry.report()
     # save weights: foc[i,j], depth, camera-param
 
     try:
@@ -711,6 +726,11 @@ def parser_add(parser=None):
     parser.add_argument("--start_checkpoint", type=str, default=None)
     parser.add_argument("--depth", action="store_true")
     parser.add_argument("--usedepthReg", action="store_true")
+    # LiDAR point reduction before Gaussian initialization
+    parser.add_argument("--pcd_reduce", type=str, default='random', choices=REDUCE_MODES)
+    parser.add_argument("--pcd_voxel_size", type=float, default=0.1)
+    parser.add_argument("--pcd_voxel_mode", type=str, default='first', choices=['first', 'centroid'])
+    parser.add_argument("--pcd_seed", type=int, default=0)
 
     return parser
 
@@ -725,12 +745,18 @@ def main():
 
     dair = DAIR_V2X_C(base_dir)
     from random import randint
+    from lidar2dep.pair_loader import PairLoader
     # prepared_idx = randint(0, 1000) % 600  # random
-    prepared_idx = 0 # TEST
-    pair = CooperativeData(dair[prepared_idx], base_dir) # dair_item
+    # PAIR_INDICES: comma separated pair indices, e.g. PAIR_INDICES=0,1,2
+    prepared_idx = [int(i) for i in os.environ.get('PAIR_INDICES', '0').split(',')] # TEST
 
     read_only = bool(int(os.environ.get('READ_ONLY')))
     print(f'READ_ONLY = {read_only}')
+    for idx, pair in PairLoader(dair, indices=prepared_idx, num_workers=2, prefetch=2, load_pcd=True):
+        train_pair(pair, save_dir, read_only)
+
+
+def train_pair(pair, save_dir, read_only):
     # exit(0)
     processed_dict = process_first(parser = None, dair_item = pair, debug_part = False, read_only=read_only)
     print('-'*20 + 'Finish Reading' + '-'*20)
@@ -779,12 +805,16 @@ def main():
         inf_view_veh = inf_view_veh, veh_view_inf = veh_view_inf
     )
 
-def cut_down_points(pcd, pro: float = 1. + 1e-3):
-    # pdb.set_trace()
-    # pro: 1. / opt.downsample
-    x = np.asarray(pcd.points)
-    uu = np.concatenate([x[i].reshape((1, 3)) for i in range(x.shape[0]) if (randint(0, 999) < 1e3 * pro)], axis=0)
-    pcd.points = o3d.cuda.pybind.utility.Vector3dVector(uu)
+def cut_down_points(pcd, pro: float = 1. + 1e-3, args=None):
+    # pro: 1. / opt.downsample, kept fraction for the 'random' / 'stride' modes
+    # args: --pcd_reduce, --pcd_voxel_size, --pcd_voxel_mode, --pcd_seed (parser_add)
+    n = len(pcd.points)
+    pcd = reduce_point_cloud(
+        pcd, mode=getattr(args, 'pcd_reduce', 'random'), ratio=pro,
+        voxel_size=getattr(args, 'pcd_voxel_size', None), seed=getattr(args, 'pcd_seed', 0),
+        voxel_mode=getattr(args, 'pcd_voxel_mode', 'first')
+    )
+    print(f'[INFO] cut_down_points: {n} -> {len(pcd.points)} points')
     return pcd
 
 
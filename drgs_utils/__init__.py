@@ -84,6 +84,9 @@ class ModelParams(ParamGroup):
         # self.usefullcolmap = False
         # self.isBA = False
         self.kshot = 1000 # a large number
+        self.fuse_pcd = False # Gaussians from both sides' clouds, see Bind_v2x_pcd
+        self.fuse_dedup_radius = 0.05
+        self.fuse_cell_size = 0.5
         super().__init__(parser, "Loading Parameters", sentinel)
 
     def extract(self, args):
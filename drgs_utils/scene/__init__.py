@@ -19,40 +19,7 @@ from .gaussian_model import GaussianModel
 from .. import *
 from ..scene.dataset_readers import Dair_v2x_Info, BasicPointCloud
 
-from .dataset_readers import Scene
-
-
-def Bind_v2x_pcd(dair: Dair_v2x_Info, inference_mode=False) -> tuple[BasicPointCloud, BasicPointCloud, BasicPointCloud]:
-    # 已经是世界坐标系，应该不用做poing cloud registration，直接拼接
-    # align infrastructure side PCD with vehicle side PCD
-    # TODO: Point Cloud Registration
-    """
-    Inference Mode:
-    「
-        Infrastructure Side:    lidar-inf-pcd -> world-inf-pcd
-        Vehicle Side:           lidar-veh-pcd -> novatel-veh-pcd -> world-veh-pcd
-
-                =>  Point Clout Registration => △p = [R|t]
-
-        lidar-veh-pcd -> cam-veh-pcd --△p--> cam-inf-pcd
-                                                                」
-
-    On DAIR-V2X Dataset:
-        △p: dair.inf2veh
-
-    """
-
-    # 已经在world坐标系下， 直接合并出新点云
-    inf_pcd, veh_pcd = dair.inf_pcd, dair.veh_pcd
-    bind_axis = 0 if inf_pcd.points.shape[0] > inf_pcd.points.shape[1] else 1
-    panoptic_pcd = BasicPointCloud(
-                        points = np.concatenate([inf_pcd.points, veh_pcd.points], aixs=bind_axis),
-                        colors = np.concatenate([inf_pcd.colors, veh_pcd.colors], axis=bind_axis),
-                        normals = np.concatenate([inf_pcd.colors, veh_pcd.colors], axis=bind_axis)
-                    )
-
-    return (panoptic_pcd, inf_pcd, veh_pcd)
-
+from .dataset_readers import Scene, Bind_v2x_pcd
 
 
 class Depth_Scene:
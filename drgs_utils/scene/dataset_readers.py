@@ -31,6 +31,9 @@ from drgs_utils import ModelParams
 from ..utils import *
 from lidar2dep.dair import CooperativeData
 from lidar2dep.data.process import colorize
+from lidar2dep.data.projector import project_points
+from lidar2dep.data.artifacts import writes
+from lidar2dep.data.voxel_hash import VoxelHashIndex, dedup_against
 
 import numpy as np
 import json
@@ -724,6 +727,9 @@ class Dair_v2x_Info(NamedTuple):
 
     normalization_inf: dict
     normalization_veh: dict
+    # lidar -> world of each side (p_world = T @ p_lidar), used to fuse the two clouds
+    inf_lidar2world: np.array = None
+    veh_lidar2world: np.array = None
 
     """
     
@@ -763,19 +769,19 @@ def readDairV2XSyntheticInfo(
 ):
     # pre-read DAIR-V2X dataset
     # dair_item: CooperativeData
+    # the clouds arrive frustum culled by process_first (stage_project, --frustum_cull), they are not culled again here
     # inf_idx, veh_idx = pair.inf_id, pair.veh_id
 
-    inf_cam_K = pair.load_intrinsic(pair.inf_cam_intrinsic_path) # h, w, K[3,3]
-    veh_cam_K = pair.load_intrinsic(pair.veh_cam_intrinsic_path, matrix_read_only=True) # h, w, K[3,3]
+    calib = pair.calib # row of DAIR_V2X_C.calib, transform chains are precomputed
+    inf_cam_K = pair.load4pcd_render('inf')['intrinsic'] # h, w, K[3,3]
+    inf_cam_K = (inf_cam_K['dict']['height'], inf_cam_K['dict']['width'], inf_cam_K['matrix'])
+    veh_cam_K = calib.veh_K.copy() # K[3,3]
 
-    lidar2cam_inf, lidar2cam_veh = pair.load_extrinsic(pair.inf_lidar2cam_path), pair.load_extrinsic(pair.veh_lidar2cam_path)
-    inf2veh = np.linalg.inv(lidar2cam_inf) @ lidar2cam_veh
+    lidar2cam_inf, lidar2cam_veh = calib.inf_lidar2cam.copy(), calib.veh_lidar2cam.copy()
+    inf2veh = calib.inf2veh.copy()
 
-    lidar2world_inf = pair.load_extrinsic(pair.inf_lidar2world_path)
-    lidar2world_veh = pair.load_extrinsic(pair.veh_lidar2novatel_path) @ pair.load_extrinsic(pair.veh_novatel2world_path)
-
-    world2cam_inf = np.linalg.inv(lidar2world_inf) @ lidar2cam_inf # [4 4]
-    world2cam_veh = np.linalg.inv(lidar2world_veh) @ lidar2cam_veh # [4 4]
+    world2cam_inf = calib.world2inf_cam # [4 4]
+    world2cam_veh = calib.world2veh_cam # [4 4]
     inf_pcd, veh_pcd = np.asarray(inf_side_info['pcd'].points), np.asarray(veh_side_info['pcd'].points)
     # -> [X 3]
     # inf_pcd, veh_pcd = lidar2world_inf @ inf_pcd, lidar2world_veh @ veh_pcd # transfer to world coordinate
@@ -804,7 +810,10 @@ def readDairV2XSyntheticInfo(
                 inf2veh_matrix = inf2veh,  # [4 4],
                 lidar2cam_inf = lidar2cam_inf, lidar2cam_veh = lidar2cam_veh,
                 world2cam_inf = world2cam_inf, world2cam_veh = world2cam_veh,
-                normalization_inf = normalized_inf, normalization_veh = normalized_veh
+                normalization_inf = normalized_inf, normalization_veh = normalized_veh,
+                # novatel2world @ lidar2novatel, not the row-order `veh_lidar2world` column
+                inf_lidar2world = calib.inf_lidar2world.copy(),
+                veh_lidar2world = calib.veh_novatel2world @ calib.veh_lidar2novatel
             )
 
 
@@ -833,52 +842,107 @@ def CreateCamera(
 
     R, T = cam_extrinsic[0:3,0:3], cam_extrinsic[0:3, 3]
     FovX, FovY = cam_K[0,0], cam_K[1,1]
-    depth_map, depth_weight = np.zeros((height, width)), np.zeros((height, width))
-    cam_coord = np.matmul(cam_K, np.matmul(R.transpose(), np.asarray(pcd_file.points).transpose()) + T.reshape(3, 1))
     ### for coordinate definition, see getWorld2View2() function
-    valid_idx = np.where(np.logical_and.reduce((cam_coord[2] > 0, cam_coord[0] / cam_coord[2] >= 0,
-                                                cam_coord[0] / cam_coord[2] <= width - 1,
-                                                cam_coord[1] / cam_coord[2] >= 0,
-                                                cam_coord[1] / cam_coord[2] <= height - 1)))[0]
-    pts_depths = cam_coord[-1:, valid_idx]
-    cam_coord = cam_coord[:2, valid_idx] / cam_coord[-1:, valid_idx]
-    depth_map[np.round(cam_coord[1]).astype(np.int32).clip(0, height - 1), np.round(cam_coord[0]).astype(np.int32).clip(0, width - 1)] = pts_depths
-    depth_weight[np.round(cam_coord[1]).astype(np.int32).clip(0, height - 1), np.round(cam_coord[0]).astype(np.int32).clip(0, width - 1)] = 1
-    depth_weight = depth_weight / depth_weight.max()
-
-    rgb_img, source_depth = side_info['rgb'], side_info['depth']['panoptic'][0] # 0, 1, 2 ?
+    world2view = np.eye(4)
+    world2view[0:3, 0:3], world2view[0:3, 3] = R.transpose(), T
+    depth_map = project_points(np.asarray(pcd_file.points), cam_K, world2view, height, width).astype(np.float64)
+    depth_weight = (depth_map > 0).astype(np.float64)
+
+    rgb_img, source_depth = side_info['rgb'], side_info['depth']['panoptic'][-1] # float depth of Args2Results / artifacts
 
     target = depth_map.copy()
     target = ((target != 0) * 255).astype(np.uint8) # mask
-    source_depth = np.mean(source_depth, axis=-1)
+    source_depth = np.asarray(source_depth, dtype=np.float64)
+    if source_depth.ndim == 3: source_depth = np.mean(source_depth, axis=-1)
     print(f'[DEBUG] rgb_img.size = {rgb_img.size},  source_depth = {source_depth.shape}, depth_map.shape = {depth_map.shape}, depth_weight.shape = {depth_weight.shape}')
 
     depth_map, depthloss = optimize_depth(source=source_depth, target=depth_map, mask=(depth_map > 0.), depth_weight=depth_weight)
 
-    print(f'depth_map.shape = {depth_map.shape}') # np.ndarray
-    if not os.path.exists('./debug'): os.mkdir('./debug')
-    pred_init = depth_map.squeeze().astype(np.uint8)
-    print(f'pred_init.shape = {pred_init.shape}')
-    # M, m = np.max(pred_init), np.min(pred_init)
-    # if M > m:
-    #     pred_init = (pred_init - m) / (M - m) * 255.
-    # colored_init = cv2.applyColorMap(pred_init.astype(np.uint8), cv2.COLORMAP_RAINBOW)
-    colored_init = colorize(pred_init.astype(np.uint8))
-    source_path = './debug/sources'
-    if not os.path.exists(source_path): os.mkdir(source_path)
-
-    print(f'[Debug] (colored_init[:, :, ::-1] * 255).astype(np.uint8).shape = {(colored_init[:, :, ::-1] * 255).astype(np.uint8).shape}')
-    print(f'[Debug] target.shape = {target.shape}')
-
-    cv2.imwrite(os.path.join(source_path, f"{uid}_source.png"), (colored_init[:, :, ::-1] * 255).astype(np.uint8))
-    # cv2.imwrite(f"./debug/{uid:03d}_refined.png", (refined[:, :, ::-1] * 255).astype(np.uint8))
-    cv2.imwrite(os.path.join(source_path, f"{uid}_target.png"), target)
+    if writes('debug'):
+        print(f'depth_map.shape = {depth_map.shape}') # np.ndarray
+        if not os.path.exists('./debug'): os.mkdir('./debug')
+        pred_init = depth_map.squeeze().astype(np.uint8)
+        print(f'pred_init.shape = {pred_init.shape}')
+        # M, m = np.max(pred_init), np.min(pred_init)
+        # if M > m:
+        #     pred_init = (pred_init - m) / (M - m) * 255.
+        # colored_init = cv2.applyColorMap(pred_init.astype(np.uint8), cv2.COLORMAP_RAINBOW)
+        colored_init = colorize(pred_init.astype(np.uint8))
+        source_path = './debug/sources'
+        if not os.path.exists(source_path): os.mkdir(source_path)
+
+        print(f'[Debug] (colored_init[:, :, ::-1] * 255).astype(np.uint8).shape = {(colored_init[:, :, ::-1] * 255).astype(np.uint8).shape}')
+        print(f'[Debug] target.shape = {target.shape}')
+
+        cv2.imwrite(os.path.join(source_path, f"{uid}_source.png"), (colored_init[:, :, ::-1] * 255).astype(np.uint8))
+        # cv2.imwrite(f"./debug/{uid:03d}_refined.png", (refined[:, :, ::-1] * 255).astype(np.uint8))
+        cv2.imwrite(os.path.join(source_path, f"{uid}_target.png"), target)
 
     return CameraInfo(uid=str(0 if type=='inf' else 1) + uid, R=R, T=T, FovY=FovY, FovX=FovX, image=rgb_img, depth=depth_map,
                depth_weight=depth_weight, image_path=getattr(dair_item, f'{type}_img_path'),
                image_name=uid, width=width, height=height, depthloss=depthloss)
 
 
+def _transform(points, T):
+    # [N 3] points, p' = T @ p
+    points = np.asarray(points, dtype=np.float64)[:, 0:3]
+    return points @ T[0:3, 0:3].T + T[0:3, 3]
+
+
+def Bind_v2x_pcd(dair: Dair_v2x_Info, inference_mode=False, dedup_radius: float = None,
+                 cell_size: float = 0.5, frame: str = 'world') -> tuple[BasicPointCloud, BasicPointCloud, BasicPointCloud, VoxelHashIndex]:
+    # align infrastructure side PCD with vehicle side PCD
+    # TODO: Point Cloud Registration
+    """
+    Inference Mode:
+    「
+        Infrastructure Side:    lidar-inf-pcd -> world-inf-pcd
+        Vehicle Side:           lidar-veh-pcd -> novatel-veh-pcd -> world-veh-pcd
+
+                =>  Point Clout Registration => △p = [R|t]
+
+        lidar-veh-pcd -> cam-veh-pcd --△p--> cam-inf-pcd
+                                                                」
+
+    On DAIR-V2X Dataset:
+        △p: dair.inf_lidar2world, dair.veh_lidar2world
+
+    dair.inf_pcd / dair.veh_pcd are in their own lidar frames, both are moved to the world frame
+    dedup_radius: veh points closer than this to an inf point are dropped from the fused cloud
+    frame:      'world', 'inf' or 'veh' (that side's lidar frame) of the returned clouds
+    Returns the fused cloud, both sides and a VoxelHashIndex over the fused points.
+    """
+    assert frame in ['world', 'inf', 'veh'], frame
+    inf_pcd, veh_pcd = dair.inf_pcd, dair.veh_pcd
+    # lidar -> world -> `frame`
+    world2frame = np.eye(4) if frame == 'world' else np.linalg.inv(getattr(dair, f'{frame}_lidar2world'))
+    inf_points = _transform(inf_pcd.points, world2frame @ dair.inf_lidar2world)
+    veh_points = _transform(veh_pcd.points, world2frame @ dair.veh_lidar2world)
+    veh_keep = np.ones(len(veh_points), dtype=bool)
+    if dedup_radius is not None:
+        # overlapping region is seen by both lidars, keep the inf copy
+        inf_index = VoxelHashIndex(inf_points, max(cell_size, dedup_radius))
+        veh_keep = dedup_against(inf_index, veh_points, dedup_radius)
+        print(f'[INFO] Bind_v2x_pcd: {int((~veh_keep).sum())} duplicated veh points dropped')
+
+    def bind(inf_attr, veh_attr):
+        # per-point attributes follow the points, empty ones (LiDAR clouds carry no color) stay empty
+        inf_attr, veh_attr = np.asarray(inf_attr), np.asarray(veh_attr)
+        if len(veh_attr) == len(veh_keep):
+            veh_attr = veh_attr[veh_keep]
+        return np.concatenate([inf_attr, veh_attr], axis=0)
+
+    panoptic_pcd = BasicPointCloud(
+                        points = bind(inf_points, veh_points),
+                        colors = bind(inf_pcd.colors, veh_pcd.colors),
+                        normals = bind(inf_pcd.normals, veh_pcd.normals)
+                    )
+    inf_pcd = BasicPointCloud(points=inf_points, colors=np.asarray(inf_pcd.colors), normals=np.asarray(inf_pcd.normals))
+    veh_pcd = BasicPointCloud(points=veh_points, colors=np.asarray(veh_pcd.colors), normals=np.asarray(veh_pcd.normals))
+
+    return (panoptic_pcd, inf_pcd, veh_pcd, VoxelHashIndex(panoptic_pcd.points, cell_size))
+
+
 class Scene:
 
     # gaussians : GaussianModel
@@ -919,8 +983,14 @@ class Scene:
         # Origin: nerf_normalization = {"translate": translate, "radius": radius}
 
         # TODO: 对dair_info中的veh&inf点云拼接后做语义切割（或者切割后分别拼接），初始化fg/bg GS
-        # panoptic_pcd, inf_pcd, veh_pcd = Bind_v2x_pcd(dair_info)
-        self.gaussians.create_from_pcd(getattr(dair_info, f'{type}_pcd'), self.cameras_extent)
+        # --fuse_pcd: Gaussians from both sides' clouds in this side's lidar frame, deduplicated;
+        # fused_index (VoxelHashIndex) answers radius / kNN / frustum queries over them
+        point_cloud, self.fused_index = getattr(dair_info, f'{type}_pcd'), None
+        if getattr(args, 'fuse_pcd', False):
+            point_cloud, _, _, self.fused_index = Bind_v2x_pcd(
+                dair_info, dedup_radius=args.fuse_dedup_radius, cell_size=args.fuse_cell_size, frame=type
+            )
+        self.gaussians.create_from_pcd(point_cloud, self.cameras_extent)
 
         cam_infos = [CreateCamera(dair_item, dair_info, side_info, type_) for type_ in [type, anti_type]]
         train_cam_infos = [cam_infos[0]] if eval else cam_infos # 当前type必然参与训练
@@ -928,7 +998,7 @@ class Scene:
 
 
         np.random.seed(seed)
-        scene_info = SceneInfo(point_cloud=getattr(dair_info, f'{type}_pcd'),
+        scene_info = SceneInfo(point_cloud=point_cloud,
                            train_cameras=train_cam_infos,
                            test_cameras=test_cam_infos,
                            nerf_normalization=self.cameras_extent,
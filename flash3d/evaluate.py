@@ -12,6 +12,8 @@ from hydra.core.hydra_config import HydraConfig
 from matplotlib import pyplot as plt
 import torchvision.transforms.functional as TF
 from flash3d.models.model import GaussianPredictor, to_device
+from lidar2dep.precision import with_precision, model_policy
+from lidar2dep import telemetry
 from evaluation.evaluator import Evaluator
 from flash3d.datasets.util import create_datasets # stuck ?
 from misc.visualise_3d import save_ply
@@ -73,13 +75,17 @@ def evaluate(opt, model, cfg, evaluator, dair_info, split='test', view_type='inf
         score_dict[fid] = {"ssim": [], "psnr": [], "lpips": [], "name": fid}
 
 
-    inputs = InferenceV2X(split, cfg, dair_info, view_type=view_type)
+    with telemetry.span('inputs', 'flash3d', view=view_type):
+        inputs = InferenceV2X(split, cfg, dair_info, view_type=view_type)
     # pdb.set_trace()
     with torch.no_grad(): # 查看同视角下的outputs[dict]
-        inputs_item = inputs.getInputs(device)
-        inputs_item["target_frame_ids"] = target_frame_ids
-        outputs = model(inputs_item) # dict ->
+        with telemetry.span('inputs to device', 'flash3d', view=view_type):
+            inputs_item = inputs.getInputs(device)
+            inputs_item["target_frame_ids"] = target_frame_ids
+        with telemetry.span('forward', 'flash3d', view=view_type):
+            outputs = model(inputs_item) # dict ->
     # pdb.set_trace()
+    phase = telemetry.begin('metrics', 'flash3d', view=view_type, save_vis=save_vis)
     for f_id in score_dict.keys():
         # score_dict.keys(): ["s0", 0]
         pred = outputs[('color_gauss', f_id, 0)] # another_view -> [1, 3, H, W]
@@ -124,6 +130,7 @@ def evaluate(opt, model, cfg, evaluator, dair_info, split='test', view_type='inf
 
 
 
+    phase.end()
     metric_names = ["psnr", "ssim", "lpips"]
     score_dict_by_name = {}
     # for f_id in score_dict.keys():
@@ -159,6 +166,7 @@ def v2x_inference(opt, dair_info, cfg: DictConfig, split='test', view_type: str
     # TODO: for GaussianPredictor loading
 
     # pdb.set_trace()
+    phase = telemetry.begin('build', 'flash3d')
     model = GaussianPredictor(cfg, unidepth_model=unidepth_model)
 
     device = torch.device("cuda:0")
@@ -167,6 +175,8 @@ def v2x_inference(opt, dair_info, cfg: DictConfig, split='test', view_type: str
     if (ckpt_dir := model.checkpoint_dir()).exists():
         # resume training
         model.load_model(ckpt_dir, ckpt_ids=0)
+    phase.end()
+    model = with_precision(model, model_policy(opt, 'flash3d'))  # opt.precision, fp32 by default
 
     evaluator = Evaluator() # crop_border = True
     evaluator.to(device)
@@ -1,5 +1,8 @@
-import anthropic
-import httpx, base64
+import os, re, json, base64, hashlib, threading
+try:
+    import anthropic, httpx
+except ImportError:  # offline: vehicle judgments fall back to VehicleJudge's rules / classifier
+    anthropic = httpx = None
 
 
 def encode_image(image_path):
@@ -20,6 +23,7 @@ class Claude():
         self.proxy = proxy
         self.max_tokens = max_tokens
         self.temperature = temperature
+        if anthropic is None: raise ImportError('pip install anthropic httpx')
         self.client = anthropic.Client(
             api_key = self.api_key,
             proxies = httpx.Proxy(proxy if isinstance(proxy, str) else 'http://127.0.0.1:7890')
@@ -31,6 +35,12 @@ class Claude():
             return True
         elif background_patial(name):
             return False
+        answer = self.vehicle_judge_request(name)
+        # didn't handle with the net work error
+        return False if answer is None else answer
+
+    def vehicle_judge_request(self, name):
+        # the model's yes / no on `name`, None when every try failed
         try_time = 3
         print('llm judging...')
         while try_time > 0:
@@ -51,8 +61,7 @@ class Claude():
 
             return 'yes' in response.lower()
 
-        # didn't handle with the net work error
-        return False
+        return None
 
 
 
@@ -86,6 +95,7 @@ class Vision_Claude():
         self.proxy = proxy
         self.max_tokens = max_tokens
         self.temperature = temperature
+        if anthropic is None: raise ImportError('pip install anthropic httpx')
         self.client = anthropic.Client(
             api_key=self.api_key,
             proxies=httpx.Proxy(proxy if isinstance(proxy, str) else 'http://127.0.0.1:7890')
@@ -163,7 +173,117 @@ vehicle_prompt = "You will receive the name of an object, and you will need to m
                  "<Question> Bus <Answer> yes\n<Question> Truck <Answer> yes\n"\
                  "<Question> road <Answer> no\m<Question> traffic Lights <Answer> no\n"
 
-def get_vehicle_agent(engine='claude-3-haiku-20240307'):
-    import pandas as pd
-    api_key = str(list(pd.read_csv('./key.csv')['anthropic'])[0])
-    return Claude(engine = engine, api_key = api_key, system_prompt=vehicle_prompt)
+# keyword rules of vehicle_judge_ask, on whole words: seeds of the judgment table
+KEYWORD_RULES = {'car': True, 'bus': True, 'truck': True, 'sky': False, 'building': False, 'light': False, 'bridge': False, 'tree': False}
+# offline stand-in for the LLM: road vehicles among the COCO / ADE20K class names
+VEHICLE_WORDS = {
+    'car', 'bus', 'truck', 'van', 'taxi', 'vehicle', 'motorcycle', 'motorbike', 'minibike', 'bicycle', 'tricycle',
+    'train', 'streetcar', 'tram', 'tramway', 'trailer', 'caravan', 'tractor', 'bulldozer', 'forklift', 'excavator', 'ambulance'
+}
+JUDGMENT_CACHE = os.environ.get('VEHICLE_JUDGMENT_CACHE', './cache/vehicle_judgments.json')
+
+
+def normalize_name(name: str) -> str:
+    # 'sky-other-merged' -> 'sky', 'Traffic_Light' -> 'traffic light'
+    name = re.sub(r'-(other|merged|stuff)\b', '', name.lower().strip())
+    return ' '.join(re.split(r'[\s_\-/,]+', name)).strip()
+
+
+def prompt_version(prompt: str) -> str:
+    return hashlib.sha1(prompt.encode()).hexdigest()[:12]
+
+
+def _words(name: str):
+    # words of a normalized name, with their singular ('buses' -> 'bus')
+    words = set(name.split())
+    return words | {w[:-2] for w in words if w.endswith('es')} | {w[:-1] for w in words if w.endswith('s')}
+
+
+def keyword_judge(name: str):
+    # True / False from KEYWORD_RULES, None when no rule applies
+    words = _words(normalize_name(name))
+    hits = [KEYWORD_RULES[w] for w in KEYWORD_RULES if w in words]
+    return any(hits) if hits else None
+
+
+def offline_vehicle_judge(name: str) -> bool:
+    # deterministic: a vehicle word anywhere in the name
+    return len(_words(normalize_name(name)) & VEHICLE_WORDS) > 0
+
+
+class VehicleJudge:
+    """
+        Memoized `vehicle_judge_ask`: judgments live in a JSON table on disk,
+        keyed by prompt version (sha1 of the prompt) and normalized class name,
+        seeded with KEYWORD_RULES. A name the table misses is asked to `agent`
+        (Claude) once; without an agent, or when every request fails, the
+        offline classifier answers and its guess is not stored.
+            agent:  Claude or None (offline)
+            path:   judgment table, shared by every process using it
+    """
+    def __init__(self, agent = None, path: str = JUDGMENT_CACHE, prompt: str = vehicle_prompt):
+        self.agent, self.path, self.version = agent, path, prompt_version(prompt)
+        self.lock = threading.Lock()
+        self.table = self.load()
+        seeds = {name: {'vehicle': value, 'source': 'rule'} for name, value in KEYWORD_RULES.items() if name not in self.table}
+        if seeds:
+            self.table.update(seeds)
+            self.save()
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path): return {}
+        try:
+            with open(self.path) as f:
+                return json.load(f).get(self.version, {})
+        except (OSError, ValueError) as err:
+            print(f'[INFO] vehicle judgments: unreadable {self.path} ({err}), starting empty')
+            return {}
+
+    def save(self):
+        if self.path is None: return
+        try:
+            tables = {}
+            if os.path.exists(self.path):
+                with open(self.path) as f: tables = json.load(f)
+            tables[self.version] = dict(tables.get(self.version, {}), **self.table)
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp = f'{self.path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp, 'w') as f: json.dump(tables, f, indent=1, sort_keys=True)
+            os.replace(tmp, self.path)
+        except (OSError, ValueError) as err:
+            print(f'[INFO] vehicle judgments: could not write {self.path} ({err})')
+
+    def vehicle_judge_ask(self, name) -> bool:
+        key = normalize_name(name)
+        with self.lock:
+            if key in self.table: return self.table[key]['vehicle']
+            value, source = keyword_judge(key), 'rule'
+            if value is None and self.agent is not None:
+                value, source = self.agent.vehicle_judge_request(key), 'llm'
+            if value is None:
+                return offline_vehicle_judge(key)
+            self.table[key] = {'vehicle': value, 'source': source}
+            self.save()
+            return value
+
+    __call__ = vehicle_judge_ask
+
+
+_judges = {}
+
+
+def get_vehicle_agent(engine='claude-3-haiku-20240307', path: str = JUDGMENT_CACHE):
+    """
+    VehicleJudge asking Claude with the key of ./key.csv, fully offline when
+    there is no key or no anthropic package. One per (engine, path) and process.
+    """
+    if (engine, path) not in _judges:
+        agent = None
+        if anthropic is not None and os.path.exists('./key.csv'):
+            import pandas as pd
+            api_key = str(list(pd.read_csv('./key.csv')['anthropic'])[0])
+            agent = Claude(engine = engine, api_key = api_key, system_prompt=vehicle_prompt)
+        else:
+            print('[INFO] vehicle judgments: no LLM endpoint configured, using the offline classifier')
+        _judges[(engine, path)] = VehicleJudge(agent, path)
+    return _judges[(engine, path)]
@@ -0,0 +1,169 @@
+"""
+    Dataset-scale batch runner
+    ======================================================================
+
+    Bookkeeping of a long preprocessing run over many cooperative pairs:
+    index / shard selection, an append-only completion manifest so a
+    killed run resumes where it stopped, per-pair failure isolation and a
+    throughput (frames / hour, one frame = one cooperative pair) + ETA
+    report. The pairs themselves are processed by any `process(todo,
+    on_error)` generator, e.g. `process.process_pairs`, so the runner can
+    be exercised with stub models.
+
+    Manifest: <root>/manifest-<rank>-of-<world_size>.jsonl, one record per
+    finished pair
+        {"idx": 12, "status": "done" | "failed", "interval": 41.2, "time": ..., "stage": ..., "error": ...}
+    Every shard appends to its own file and reads all of them, so a resume
+    with another shard layout still skips what any shard finished.
+"""
+import os, glob, json, time
+from collections import Counter
+
+from lidar2dep.sharding import shard_indices  # noqa: F401, part of the runner's interface
+
+
+def parse_indices(spec: str, total: int) -> list:
+    """
+    '3' | '0:600' | '0:600:2' | '3,7,10:20' | None (all) -> sorted pair indices in [0, total)
+    """
+    if spec is None or spec in ['', 'all']: return list(range(total))
+    indices = set()
+    for part in spec.split(','):
+        if ':' in part:
+            bounds = [int(b) if b else None for b in part.split(':')]
+            indices.update(range(total)[slice(*bounds)])
+        else:
+            idx = int(part)
+            if not 0 <= idx < total: raise ValueError(f'pair index {idx} out of range [0, {total})')
+            indices.add(idx)
+    return sorted(indices)
+
+
+def parse_shard(spec: str):
+    # 'i/n' -> (rank, world_size), None -> (0, 1)
+    if spec is None: return 0, 1
+    try:
+        rank, world_size = (int(v) for v in spec.split('/'))
+    except ValueError:
+        raise ValueError(f'shard spec must look like i/n, got {spec!r}')
+    if not 0 <= rank < world_size: raise ValueError(f'shard {rank} not in [0, {world_size})')
+    return rank, world_size
+
+
+class Manifest:
+    """
+        root:       results directory of the run
+        rank, world_size: shard writing this manifest
+        status:     idx -> latest record of the pair over all shards' manifests
+    """
+    def __init__(self, root: str, rank: int = 0, world_size: int = 1):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.path = os.path.join(root, f'manifest-{rank}-of-{world_size}.jsonl')
+        self.status = self.load()
+        self.terminate()
+
+    def terminate(self):
+        # a line cut by a kill gets its newline, else the next record would be glued to it and lost
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0: return
+        with open(self.path, 'rb+') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                f.write(b'\n')
+
+    def load(self):
+        status = {}
+        for path in sorted(glob.glob(os.path.join(self.root, 'manifest-*.jsonl'))):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # line cut by a kill
+                    status[record['idx']] = record
+        return status
+
+    def done(self):
+        return {idx for idx, record in self.status.items() if record['status'] == 'done'}
+
+    def failed(self):
+        return {idx for idx, record in self.status.items() if record['status'] == 'failed'}
+
+    def record(self, idx: int, status: str, **info):
+        record = dict(idx=int(idx), status=status, time=time.time(), **info)
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record, default=str) + '\n')
+            f.flush()
+            os.fsync(f.fileno())  # a pair is only skipped on resume once its record is on disk
+        self.status[int(idx)] = record
+
+
+def format_duration(seconds: float) -> str:
+    # '2d 18:00:00' past a day, 'HH:MM:SS' below, '--:--:--' when unknown
+    if seconds == float('inf'): return '--:--:--'
+    days, rest = divmod(int(seconds), 86400)
+    hours, rest = divmod(rest, 3600)
+    clock = f'{hours:02d}:{rest // 60:02d}:{rest % 60:02d}'
+    return f'{days}d {clock}' if days else clock
+
+
+class Throughput:
+    # frames / hour of the pairs done so far and the ETA of the rest; failed pairs leave the queue but are no throughput
+    def __init__(self, total: int):
+        self.total, self.count, self.failed, self.t0 = total, 0, 0, time.time()
+
+    def update(self, n: int = 1, done: bool = True):
+        if done:
+            self.count += n
+        else:
+            self.failed += n
+
+    @property
+    def per_hour(self):
+        elapsed = time.time() - self.t0
+        return self.count / elapsed * 3600 if elapsed > 0 else 0.
+
+    @property
+    def eta(self):
+        rate = self.per_hour
+        return (self.total - self.count - self.failed) / rate * 3600 if rate > 0 else float('inf')
+
+    def __str__(self):
+        failed = f' ({self.failed} failed)' if self.failed else ''
+        return f'{self.count} / {self.total}{failed}, {self.per_hour:.1f} frames/hour, ETA {format_duration(self.eta)}'
+
+
+def select_pairs(indices: list, manifest: Manifest, resume: bool = True, retry_failed: bool = True):
+    # the pairs of `indices` this run still has to process
+    skip = set()
+    if resume:
+        skip = manifest.done() if retry_failed else manifest.done() | manifest.failed()
+    return [idx for idx in indices if idx not in skip]
+
+
+def run_batch(todo: list, process, manifest: Manifest):
+    """
+    todo:       pair indices to process
+    process:    process(todo, on_error) -> generator of (idx, result) for the pairs that succeed;
+                on_error(idx, stage, err) is called for every pair that fails, which is then skipped
+    -> Counter of 'done' / 'failed'
+    """
+    summary, meter = Counter(), Throughput(len(todo))
+    started = {'t': time.time()}
+
+    def finish(idx, status, **info):
+        now = time.time()
+        manifest.record(idx, status, interval=round(now - started['t'], 3), **info)  # since the previous pair finished
+        started['t'] = now
+        summary[status] += 1
+        meter.update(done=status == 'done')
+
+    def on_error(idx, stage, err):
+        print(f'[INFO] pair {idx} failed in {stage}: {err!r}')
+        finish(idx, 'failed', stage=stage, error=repr(err))
+
+    for idx, _ in process(todo, on_error):
+        finish(idx, 'done')
+        print(f'[INFO] pair {idx} done: {meter}')
+    print(f'[INFO] batch finished: {dict(summary)}, {meter}')
+    return summary
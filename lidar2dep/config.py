@@ -176,6 +176,10 @@ def get_args_parser(parser=None):
                         type=int,
                         default=64,
                         help='the extracted lidar lines')
+    parser.add_argument('--ring_cache_dir',
+                        type=str,
+                        default=None,
+                        help='where per-sample lidar ring maps are cached, default next to each depth map')
     parser.add_argument('--test_crop',
                         action='store_true',
                         default=False,
@@ -4,10 +4,12 @@ BASE_DIR = './cooperative-vehicle-infrastructure'
 # TODO: read DAIR-V2X dataset
 import os, json, cv2, re, pdb
 import numpy as np
-import open3d as o3d
+from functools import cached_property
 from matplotlib import pyplot as plt
 from lidar2dep.main import get_CompletionFormer as getFormer
 from lidar2dep.main import create_former_input
+from lidar2dep.data.projector import project_points
+from lidar2dep.data.pcd_io import load_point_cloud
 from PIL import Image
 from cam_utils import ab64, downsampler
 
@@ -69,28 +71,17 @@ def load_camera_R(json_path):
 def render_pcd_view_img(pcd, c_i, c_e, shape):
     """
         pcd: pcd data
-        c_i: intrinsic
-        c_e: extrinsic dict:
+        c_i: intrinsic dict:
             {
                 'height': ..., 'width': ...,
                 'fx': ..., 'cx': ..., 'fy': ..., 'cy': ...
             }
+        c_e: extrinsic [4 4] lidar -> camera
         shape: image shape [H W 3]
+        -> sparse metric depth [H W], 0 where no point lands
     """
-    vis = o3d.visualization.Visualizer()
-    vis.create_window(visible=False, width=shape[1], height=shape[0])
-    vis.add_geometry(pcd)
-    camera_parameters = o3d.camera.PinholeCameraParameters()
-    camera_parameters.extrinsic = c_e
-    camera_parameters.intrinsic.set_intrinsics(**c_i)
-
-    view_control = vis.get_view_control()
-    view_control.convert_from_pinhole_camera_parameters(camera_parameters)
-    # -> [Open3D WARNING] [ViewControl] ConvertFromPinholeCameraParameters() failed because window height and width do not match.
-    vis.poll_events()
-    vis.update_renderer()
-
-    return np.asarray(vis.capture_screen_float_buffer(do_render=True))
+    K = np.array([[c_i['fx'], 0., c_i['cx']], [0., c_i['fy'], c_i['cy']], [0., 0., 1.]])
+    return project_points(np.asarray(pcd.points), K, c_e, shape[0], shape[1], point_size=5)
 
 
 
@@ -98,28 +89,202 @@ def lidar2word(json_path):
     pass
 
 
+def read_intrinsic(path):
+    # -> height, width (original resolution), K [3 3]
+    with open(path) as f:
+        ff = json.load(f)
+    cam_K = ff['cam_K']
+    K = np.array([cam_K[0:3], cam_K[3:6], cam_K[6:9]])
+    assert K.shape == (3, 3)
+    return ff['height'], ff['width'], K
+
+
+def read_extrinsic(path):
+    # -> [R | t]
+    with open(path) as f:
+        ff = json.load(f)
+    if 'transform' in ff:
+        ff = ff['transform']
+    R, T = np.array(ff['rotation']), np.array(ff['translation'])
+    assert R.shape == (3, 3) and T.shape == (3, 1), f'R.shape = {R.shape}\nT.shape = {T.shape}'
+    trans = np.zeros((4, 4))
+    trans[0:3, 0:3] = R
+    trans[0:3, -1] = np.squeeze(T)
+    trans[-1, -1] = 1.
+    return trans # [4 4] extrinsic matrix
+
+
+def pair_ids(dair_item: dict):
+    return re.split('[/\.]', dair_item['infrastructure_image_path'])[-2], \
+           re.split('[/\.]', dair_item['vehicle_image_path'])[-2]
+
+
+def calib_paths(base_dir: str, inf_id: str, veh_id: str) -> dict:
+    inf_calib = f'{base_dir}/cooperative-vehicle-infrastructure/infrastructure-side/calib'
+    veh_calib = f'{base_dir}/cooperative-vehicle-infrastructure/vehicle-side/calib'
+    return {
+        'inf_cam_intrinsic': f'{inf_calib}/camera_intrinsic/{inf_id}.json',
+        'veh_cam_intrinsic': f'{veh_calib}/camera_intrinsic/{veh_id}.json',
+        'inf_lidar2cam': f'{inf_calib}/virtuallidar_to_camera/{inf_id}.json',
+        'veh_lidar2cam': f'{veh_calib}/lidar_to_camera/{veh_id}.json',
+        'inf_lidar2world': f'{inf_calib}/virtuallidar_to_world/{inf_id}.json',
+        'veh_lidar2novatel': f'{veh_calib}/lidar_to_novatel/{veh_id}.json',
+        'veh_novatel2world': f'{veh_calib}/novatel_to_world/{veh_id}.json',
+    }
+
+
+def cross_view_columns(columns: dict) -> dict:
+    # -> new dict: `columns` (arrays shared, the argument is left as is) plus the cross-view chains,
+    # lidar of one side -> camera of the other, p_cam = T @ p_lidar: lidar -> world -> other lidar -> other camera
+    if 'inf_lidar2world' not in columns or 'inf_lidar2veh_cam' in columns:
+        return dict(columns)
+    # novatel2world @ lidar2novatel as in veh_side_pcd2world, not the row-order `veh_lidar2world` column
+    veh_lidar2world = columns['veh_novatel2world'] @ columns['veh_lidar2novatel']
+    return {
+        **columns,
+        'inf_lidar2veh_cam': columns['veh_lidar2cam'] @ np.linalg.inv(veh_lidar2world) @ columns['inf_lidar2world'],
+        'veh_lidar2inf_cam': columns['inf_lidar2cam'] @ np.linalg.inv(columns['inf_lidar2world']) @ veh_lidar2world,
+    }
+
+
+class PairCalibration:
+    # row view into a CalibrationIndex, attributes are the index columns at `idx`
+    def __init__(self, index, idx: int):
+        self._index, self._idx = index, idx
+
+    def __getattr__(self, name):
+        if name.startswith('_'): raise AttributeError(name)
+        try:
+            return self._index.columns[name][self._idx]
+        except KeyError:
+            raise AttributeError(name)
+
+    def detach(self):
+        # standalone single-row copy, cheap to pickle into worker processes
+        return CalibrationIndex({k: v[self._idx:self._idx + 1].copy() for k, v in self._index.columns.items()})[0]
+
+
+class CalibrationIndex:
+    """
+        Columnar calibration of DAIR-V2X cooperative pairs, one row per data_info item.
+            inf_id, veh_id:                 [N] str
+            inf_hw, veh_hw:                 [N 2] original (height, width)
+            inf_K, veh_K:                   [N 3 3]
+            inf_lidar2cam, veh_lidar2cam:   [N 4 4]
+            inf_lidar2world:                [N 4 4]
+            veh_lidar2novatel, veh_novatel2world, veh_lidar2world: [N 4 4]
+            world2inf_cam, world2veh_cam:   [N 4 4]
+            inf2veh:                        [N 4 4]
+            inf_lidar2veh_cam, veh_lidar2inf_cam: [N 4 4] one lidar into the other side's camera
+            system_error_offset:            [N 2] (delta_x, delta_y)
+        Matrices are float64 and composed exactly like the former per-call CooperativeData methods,
+        except the cross-view chains, composed for column vectors (p_cam = T @ p_lidar) like the
+        projector: inf_lidar2veh_cam = veh_lidar2cam @ inv(veh_lidar2world) @ inf_lidar2world.
+    """
+    def __init__(self, columns: dict, key=None):
+        self.columns = columns
+        self.key = key
+
+    def __len__(self):
+        return len(self.columns['inf_id'])
+
+    def __getitem__(self, idx) -> PairCalibration:
+        return PairCalibration(self, idx)
+
+    @classmethod
+    def build(cls, items: list, base_dir: str, key=None):
+        rows = []
+        for item in items:
+            inf_id, veh_id = pair_ids(item)
+            paths = calib_paths(base_dir, inf_id, veh_id)
+            inf_h, inf_w, inf_K = read_intrinsic(paths['inf_cam_intrinsic'])
+            veh_h, veh_w, veh_K = read_intrinsic(paths['veh_cam_intrinsic'])
+            offset = item.get('system_error_offset') or {}
+            rows.append({
+                'inf_id': inf_id, 'veh_id': veh_id,
+                'inf_hw': (inf_h, inf_w), 'veh_hw': (veh_h, veh_w),
+                'inf_K': inf_K, 'veh_K': veh_K,
+                'inf_lidar2cam': read_extrinsic(paths['inf_lidar2cam']),
+                'veh_lidar2cam': read_extrinsic(paths['veh_lidar2cam']),
+                'inf_lidar2world': read_extrinsic(paths['inf_lidar2world']),
+                'veh_lidar2novatel': read_extrinsic(paths['veh_lidar2novatel']),
+                'veh_novatel2world': read_extrinsic(paths['veh_novatel2world']),
+                'system_error_offset': (offset.get('delta_x', 0.), offset.get('delta_y', 0.)),
+            })
+
+        columns = {k: np.array([r[k] for r in rows]) for k in rows[0]} if rows else {'inf_id': np.array([], dtype=str)}
+        if rows:
+            for k in ['inf_K', 'veh_K', 'inf_lidar2cam', 'veh_lidar2cam', 'inf_lidar2world',
+                      'veh_lidar2novatel', 'veh_novatel2world', 'system_error_offset']:
+                columns[k] = columns[k].astype(np.float64)
+            columns['veh_lidar2world'] = columns['veh_lidar2novatel'] @ columns['veh_novatel2world']
+            columns['world2inf_cam'] = np.linalg.inv(columns['inf_lidar2world']) @ columns['inf_lidar2cam']
+            columns['world2veh_cam'] = np.linalg.inv(columns['veh_lidar2world']) @ columns['veh_lidar2cam']
+            columns['inf2veh'] = np.linalg.inv(columns['inf_lidar2cam']) @ columns['veh_lidar2cam']
+        return cls(cross_view_columns(columns), key=key)
+
+    @classmethod
+    def load_or_build(cls, items: list, base_dir: str, cache_path: str = None, key=None):
+        # key: identifies the source data_info.json, a stale cache is rebuilt
+        if cache_path is not None and os.path.exists(cache_path):
+            with np.load(cache_path) as f:
+                columns = {k: f[k] for k in f.files}
+            cached_key = columns.pop('__key__', None)
+            if key is None or (cached_key is not None and cached_key.tolist() == list(key)):
+                return cls(cross_view_columns(columns), key=key)  # caches written before the cross-view columns
+
+        index = cls.build(items, base_dir, key=key)
+        if cache_path is not None:
+            try:
+                tmp = f'{cache_path[:-4]}.{os.getpid()}.tmp.npz'
+                np.savez(tmp, **index.columns, **({} if key is None else {'__key__': np.array(key)}))
+                os.replace(tmp, cache_path)
+            except OSError as err:
+                print(f'[INFO] calibration index not cached: {err}')
+        return index
+
+
 class DAIR_V2X_C:
-    def __init__(self, base_dir):
+    def __init__(self, base_dir, calib_cache: bool = True):
         self.base_dir = base_dir
         self.config_path = os.path.join(base_dir, 'cooperative-vehicle-infrastructure/cooperative/data_info.json')
         with open(self.config_path) as f:
             self.items = json.load(f)
+        self.calib_cache_path = os.path.join(os.path.dirname(self.config_path), 'calib_index.npz') if calib_cache else None
+        self._calib = None
     def __getitem__(self, idx, require_path=False):
         return self.items[idx] if not require_path else (self.items[idx], self.base_dir)
     def __len__(self):
         return len(self.items)
+
+    @property
+    def calib(self) -> CalibrationIndex:
+        # built once over every pair of data_info.json, then reused from `calib_index.npz`
+        if self._calib is None:
+            st = os.stat(self.config_path)
+            self._calib = CalibrationIndex.load_or_build(
+                self.items, self.base_dir, self.calib_cache_path, key=(st.st_size, st.st_mtime_ns)
+            )
+        return self._calib
+
+    def pair(self, idx, downsample: int = 1, lazy: bool = False):
+        return CooperativeData(self.items[idx], self.base_dir, downsample=downsample, calib=self.calib[idx], lazy=lazy)
     
 class CooperativeData:
-    def __init__(self, dair, path: str = None, downsample: int = 1):
+    def __init__(self, dair, path: str = None, downsample: int = 1, calib: PairCalibration = None, lazy: bool = False):
         # When initailizing, set path as the base direction where DAIR-V2X locates
         # dair: DAIR_V2X_C[idx]
+        # calib: DAIR_V2X_C.calib[idx], built from the calib jsons of this pair when not given
+        # lazy: images, point clouds and the ply directories are only touched on first access
         self.downsample = int(downsample)
 
         if path is None:
             path = '..'
         self.model_path = path
-        self.inf_id = re.split('[/\.]', dair['infrastructure_image_path'])[-2]
-        self.veh_id = re.split('[/\.]', dair['vehicle_image_path'])[-2]
+        if calib is None:
+            calib = CalibrationIndex.build([dair], path)[0]
+        self.calib = calib
+        self.inf_id, self.veh_id = str(calib.inf_id), str(calib.veh_id)
         #
         # self.inf_side_img = cv2.imread(os.path.join('./cooperative-vehicle-infrastructure-infrastructure-side-image', f'{inf_id}.jpg'))
         # # print(os.path.join(BASE_DIR, dair['infrastructure_image_path']))
@@ -134,11 +299,10 @@ class CooperativeData:
         #
         # self.offset_dict = dair['system_error_offset']
         #
-        u = load_camera_intrinsic(os.path.join(f'{path}/cooperative-vehicle-infrastructure/infrastructure-side/calib/camera_intrinsic', f'{self.inf_id}.json'), downsample=self.downsample, return_dict=True)
-        self.camera_intrinsic = u['intrinsic']
-        self.inf_ex = u['extrinsic']
-        self.camera_intrinsic_matrix = u['intrinsic_matrix']
-        self.veh_ex = load_camera_R(os.path.join(f'{path}/cooperative-vehicle-infrastructure/vehicle-side/calib/lidar_to_camera', f'{self.veh_id}.json'))
+        self.camera_intrinsic_matrix = calib.inf_K.astype(np.float32)
+        self.camera_intrinsic = self._camera_intrinsic_dict()
+        self.inf_ex = np.array([[1.,0.,0.,0.],[0.,1.,0.,0.],[0.,0.,1.,0.],[0.,0.,0.,0.]])  # ?
+        self.veh_ex = calib.veh_lidar2cam
 
 
         # inf/veh rgb image file path
@@ -158,42 +322,83 @@ class CooperativeData:
         self.veh_lidar2novatel_path = f'{path}/cooperative-vehicle-infrastructure/vehicle-side/calib/lidar_to_novatel/{self.veh_id}.json'
         self.veh_novatel2world_path = f'{path}/cooperative-vehicle-infrastructure/vehicle-side/calib/novatel_to_world/{self.veh_id}.json'
 
+        # decoded originals, and downsampled images keyed on (side, downsample)
+        self._images = {}
+        if not lazy:
+            self.materialize()
+
+    def materialize(self):
+        # eager construction: decode both images and create the ply directories now
+        for attr in ['inf_ply_store_path', 'veh_ply_store_path', 'inf_side_img', 'veh_side_img']:
+            getattr(self, attr)
+        return self
+
+    def _ply_store_path(self, which):
         # DAIR: ../DAIR-V2X/...
         # PLY: ../ply
+        side_id = getattr(self, f'{which}_id')
+        init = os.path.join(f'{self.model_path}/../', which, str(side_id), 'ply')
+        os.makedirs(init, exist_ok=True)
+        return os.path.join(init, f'{side_id}.ply')
 
-        inf_path_list = ['inf', str(self.inf_id), 'ply']
-        inf_init = f'{path}/../'
-        for pp in inf_path_list:
-            inf_init = os.path.join(inf_init, pp)
-            if not os.path.exists(inf_init): os.mkdir(inf_init)
-        self.inf_ply_store_path = os.path.join(inf_init, f'{self.inf_id}.ply')
+    @cached_property
+    def inf_ply_store_path(self):
+        return self._ply_store_path('inf')
 
-        veh_path_list = ['veh', str(self.veh_id), 'ply']
-        veh_init = f'{path}/../'
-        for pp in veh_path_list:
-            veh_init = os.path.join(veh_init, pp)
-            if not os.path.exists(veh_init): os.mkdir(veh_init)
-        self.veh_ply_store_path = os.path.join(veh_init, f'{self.veh_id}.ply')
+    @cached_property
+    def veh_ply_store_path(self):
+        return self._ply_store_path('veh')
 
-        try:
-            self.inf_side_img = Image.open(self.inf_img_path)
-            self.veh_side_img = Image.open(self.veh_img_path)
-        except Exception as err:
-            print(f'err: {err}')
-            pdb.set_trace()
-
-        self.inf_side_img = downsampler(self.inf_side_img, self.downsample)
-        self.veh_side_img = downsampler(self.veh_side_img, self.downsample)
+    def side_image(self, which='inf', downsample: int = None):
+        # downsampled from the decoded original, never from an already downsampled image
+        assert which in ['inf', 'veh'], which
+        if downsample is None: downsample = self.downsample
+        key = (which, int(downsample))
+        if key not in self._images:
+            if which not in self._images:
+                path = getattr(self, f'{which}_img_path')
+                try:
+                    img = Image.open(path)
+                    img.load()
+                except Exception as err:
+                    # the batch runner records the pair as failed with this message and moves on
+                    raise OSError(f'cannot decode the {which} side image {path}: {err}') from err
+                self._images[which] = img
+            self._images[key] = downsampler(self._images[which], int(downsample))
+        return self._images[key]
+
+    @property
+    def inf_side_img(self):
+        return self.side_image('inf')
+
+    @property
+    def veh_side_img(self):
+        return self.side_image('veh')
+
+    @cached_property
+    def inf_side_pcd(self):
+        return load_point_cloud(self.inf_pcd_path)
+
+    @cached_property
+    def veh_side_pcd(self):
+        return load_point_cloud(self.veh_pcd_path)
+
+    def _camera_intrinsic_dict(self):
+        # same layout as load_camera_intrinsic(..., return_dict=True)['intrinsic']
+        h, w = ab64((int(self.calib.inf_hw[0]) // self.downsample, int(self.calib.inf_hw[1]) // self.downsample))
+        K = self.camera_intrinsic_matrix
+        return {
+            "width": int(w), "height": int(h),
+            "fx": float(K[0,0]), "fy": float(K[1,1]),
+            "cx": float(K[0,2]), "cy": float(K[1,2])
+        }
 
     def set_downsample(self, downsample):
-        self.downsample = downsample
-        u = load_camera_intrinsic(
-            os.path.join(f'{self.model_path}/cooperative-vehicle-infrastructure/infrastructure-side/calib/camera_intrinsic', f'{self.inf_id}.json'), downsample=self.downsample, return_dict=True)
-        self.camera_intrinsic = u['intrinsic']
+        self.downsample = int(downsample)
+        self.camera_intrinsic = self._camera_intrinsic_dict()
         # self.camera_intrinsic['width'] = ab64(self.camera_intrinsic['width'])
         # self.camera_intrinsic['height'] = ab64(self.camera_intrinsic['height'])
-        self.inf_side_img = downsampler(self.inf_side_img, self.downsample)
-        self.veh_side_img = downsampler(self.veh_side_img, self.downsample)
+        # inf_side_img / veh_side_img now resolve to the original downsampled by `downsample`
 
 
 
@@ -214,7 +419,7 @@ class CooperativeData:
                 getattr(self, f'{which}_ex'), 
                 getattr(self, f'{which}_side_img').shape
             )
-        ax2.imshow(cv2.cvtColor(side_pcd_img, cv2.COLOR_RGB2BGR))
+        ax2.imshow(side_pcd_img, cmap='magma_r')
         ax2.set_title('rendered-pcd')
 
         plt.tight_layout()
@@ -254,7 +459,7 @@ class CooperativeData:
     # PREVIOUS API - <End>
 
     def load_pcd(self, path):
-        pcd = o3d.io.read_point_cloud(path)
+        pcd = load_point_cloud(path) # .data keeps the intensity field
         arr = np.asarray(pcd.points)
         # print(arr.shape)
         new_arr = np.ones((arr.shape[0], 4))
@@ -265,15 +470,9 @@ class CooperativeData:
         return pcd, new_arr.T
 
     def load_intrinsic(self, path, matrix_read_only = False, downsample: int = None):
-        with open(path) as f:
-            ff = json.load(f)
-        cam_K = ff['cam_K']
-        K = np.array([cam_K[0:3], cam_K[3:6], cam_K[6:9]])
-        assert K.shape == (3, 3)
+        height, width, K = read_intrinsic(path)
         if matrix_read_only: return K
 
-        height = ff['height']
-        width = ff['width']
         if downsample is None: downsample = self.downsample
         height, width = ab64((height // downsample, width // downsample))
 
@@ -290,28 +489,15 @@ class CooperativeData:
 
     def load_extrinsic(self, path):
         # -> [R | t]
-        with open(path) as f:
-            ff = json.load(f)
-        if 'transform' in ff:
-            ff = ff['transform']
-        R, T = np.array(ff['rotation']), np.array(ff['translation'])
-        assert R.shape == (3, 3) and T.shape == (3, 1), f'R.shape = {R.shape}\nT.shape = {T.shape}'
-        trans = np.zeros((4, 4))
-        trans[0:3, 0:3] = R
-        trans[0:3, -1] = np.squeeze(T)
-        trans[-1, -1] = 1.
-        return trans # [4 4] extrinsic matrix
+        return read_extrinsic(path)
 
     def load4pcd_render(self, type='inf'):
         assert type in ['inf', 'veh'], type
-        if type == 'inf':
-            h, w, K = self.load_intrinsic(self.inf_cam_intrinsic_path)
-        else:
-            # TODO: 确认一下是不是车端路端的相机内参一致
-            h, w, _ = self.load_intrinsic(self.inf_cam_intrinsic_path)
-            K = self.load_intrinsic(self.veh_cam_intrinsic_path, matrix_read_only=True)
+        # TODO: 确认一下是不是车端路端的相机内参一致 (veh uses the inf resolution)
+        h, w = ab64((int(self.calib.inf_hw[0]) // self.downsample, int(self.calib.inf_hw[1]) // self.downsample))
+        K = getattr(self.calib, f'{type}_K').copy()
         intrinsic_dict = self.intrinsic2dict(h, w, K)
-        extrinsic_array = self.load_extrinsic(getattr(self, f'{type}_lidar2cam_path'))
+        extrinsic_array = getattr(self.calib, f'{type}_lidar2cam').copy()
 
         return {
                 'intrinsic': {
@@ -324,31 +510,38 @@ class CooperativeData:
     # 全都放到world坐标系的方法
     def inf_side_pcd2world(self):
         _, inf_pcd_arr = self.load_pcd(self.inf_pcd_path)
-        Trans = self.load_extrinsic(self.inf_lidar2world_path)  # [4 4]
+        Trans = self.calib.inf_lidar2world  # [4 4]
         pcd_world = Trans @ inf_pcd_arr
         return pcd_world[0:3, :]
 
     def veh_side_pcd2world(self):
         _, veh_pcd_arr = self.load_pcd(self.veh_pcd_path)
-        Trans1 = self.load_extrinsic(self.veh_lidar2novatel_path)
-        Trans2 = self.load_extrinsic(self.veh_novatel2world_path)
+        Trans1 = self.calib.veh_lidar2novatel
+        Trans2 = self.calib.veh_novatel2world
         pcd_world = Trans2 @ Trans1 @ veh_pcd_arr
         return pcd_world[0:3, :]
 
+    # precomputed in the CalibrationIndex, copies so callers may modify them in place
     def inf_lidar2world(self):
-        return self.load_extrinsic(self.inf_lidar2world_path)
+        return self.calib.inf_lidar2world.copy()
 
     def veh_lidar2world(self):
-        return self.load_extrinsic(self.veh_lidar2novatel_path) @ self.load_extrinsic(self.veh_novatel2world_path)
+        return self.calib.veh_lidar2world.copy()
 
     def world2inf_cam(self):
-        return np.linalg.inv(self.load_extrinsic(self.inf_lidar2world_path)) \
-                        @ self.load_extrinsic(self.inf_lidar2cam_path)
+        return self.calib.world2inf_cam.copy()
 
     def world2veh_cam(self):
-        return np.linalg.inv(self.load_extrinsic(self.veh_lidar2novatel_path) @ \
-                             self.load_extrinsic(self.veh_novatel2world_path)) \
-                                    @ self.load_extrinsic(self.veh_lidar2cam_path)
+        return self.calib.world2veh_cam.copy()
+
+    def inf2veh(self):
+        return self.calib.inf2veh.copy()
+
+    def inf_lidar2veh_cam(self):
+        return self.calib.inf_lidar2veh_cam.copy()
+
+    def veh_lidar2inf_cam(self):
+        return self.calib.veh_lidar2inf_cam.copy()
 
 
 
@@ -0,0 +1,131 @@
+"""
+    Per-frame depth artifacts
+    ======================================================================
+
+    Lossless replacement for the uint8 JPG depth outputs of the
+    preprocessing stage: one compressed `.npz` per frame holding float
+    depth / confidence maps and masks, plus a JSON header with the depth
+    units and normalization range. Written by `Args2Results` /
+    `process_first`, read back by the `read_only` path and training.
+
+    Units:
+        'm'             metres
+        'normalized'    min-max normalized to [0, 255] over `depth_range` (metres)
+        'relative'      0-255 monocular (ZoeDepth) scale, no metric range
+
+    Artifact level (ARTIFACT_LEVEL environment variable / `set_artifact_level`):
+        'none'          nothing is written
+        'essential'     only what is read downstream: these artifacts
+        'debug'         + visualizations (colored JPGs, SEEM overlays, ./debug dumps,
+                        training snapshots) and full-array prints, the default
+"""
+import os, json, zipfile, threading
+import numpy as np
+
+ARTIFACT_VERSION = 1
+ARTIFACT_DIR = 'artifacts'
+DEPTH_UNITS = ['m', 'normalized', 'relative']
+FLOAT_DTYPES = {'float16': np.float16, 'float32': np.float32}
+COMPRESS_LEVEL = 1  # zlib level: ~the size of level 6 on float maps at a fraction of the write time
+ARTIFACT_LEVELS = ['none', 'essential', 'debug']
+_artifact_level = 'debug'
+
+
+def set_artifact_level(level: str):
+    global _artifact_level
+    if level not in ARTIFACT_LEVELS:
+        raise ValueError(f'unknown artifact level {level!r}, expected one of {ARTIFACT_LEVELS}')
+    _artifact_level = level
+
+
+set_artifact_level(os.environ.get('ARTIFACT_LEVEL', 'debug'))
+
+
+def artifact_level() -> str:
+    return _artifact_level
+
+
+def writes(level: str = 'essential') -> bool:
+    # whether outputs of `level` ('essential' | 'debug') are produced at the current artifact level
+    return ARTIFACT_LEVELS.index(_artifact_level) >= ARTIFACT_LEVELS.index(level)
+
+
+def frame_artifact_path(root: str, name: str):
+    # <root>/artifacts/<name>.npz, e.g. name = 'inf-panoptic'
+    return os.path.join(root, ARTIFACT_DIR, f'{name}.npz')
+
+
+def _as_array(value):
+    if hasattr(value, 'detach'):  # torch.Tensor
+        value = value.detach().cpu().numpy()
+    return np.asarray(value)
+
+
+def _write_npz(f, payload: dict, compress_level: int):
+    # np.savez_compressed with a configurable zlib level, readable by np.load
+    mode = zipfile.ZIP_DEFLATED if compress_level > 0 else zipfile.ZIP_STORED
+    with zipfile.ZipFile(f, 'w', compression=mode, compresslevel=compress_level or None, allowZip64=True) as zf:
+        for name, value in payload.items():
+            with zf.open(f'{name}.npy', 'w', force_zip64=True) as entry:
+                np.lib.format.write_array(entry, np.asanyarray(value), allow_pickle=False)
+
+
+def save_frame_artifacts(path: str, units: str = None, dtype: str = 'float32', meta: dict = None,
+                         compress_level: int = COMPRESS_LEVEL, **arrays):
+    """
+    Args:
+        path:       target .npz file, parent directories are created
+        units:      one of DEPTH_UNITS, None for frames without depth
+        dtype:      storage type of the floating point arrays ('float16' / 'float32')
+        meta:       extra JSON-serializable header entries (e.g. depth_range)
+        compress_level: zlib level, 0 stores the arrays uncompressed
+        arrays:     name -> array / tensor; floats are stored as `dtype`,
+                    bool / integer arrays (masks) are stored unchanged
+    """
+    assert units is None or units in DEPTH_UNITS, units
+    assert dtype in FLOAT_DTYPES, dtype
+    header = dict(meta or {}, version=ARTIFACT_VERSION, units=units, dtype=dtype)
+    payload = {}
+    for name, value in arrays.items():
+        if value is None: continue
+        value = _as_array(value)
+        if np.issubdtype(value.dtype, np.floating):
+            value = value.astype(FLOAT_DTYPES[dtype])
+        payload[name] = value
+    header['shapes'] = {name: list(value.shape) for name, value in payload.items()}
+    payload['__meta__'] = np.array(json.dumps(header))
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"  # unique per writer thread
+    with open(tmp, 'wb') as f:
+        _write_npz(f, payload, compress_level)
+    os.replace(tmp, path)
+    return path
+
+
+def load_frame_artifacts(path: str, keys: list = None, dtype=np.float32):
+    """
+    -> (arrays, meta): name -> np.ndarray (floats upcast to `dtype`, None keeps
+    the stored type) and the JSON header. `keys` restricts the arrays read.
+    """
+    with np.load(path, allow_pickle=False) as data:
+        meta = json.loads(str(data['__meta__']))
+        names = [name for name in data.files if name != '__meta__'] if keys is None else keys
+        arrays = {}
+        for name in names:
+            value = data[name]
+            if dtype is not None and np.issubdtype(value.dtype, np.floating):
+                value = value.astype(dtype, copy=False)
+            arrays[name] = value
+    return arrays, meta
+
+
+def to_metric(depth, meta: dict):
+    # depth in metres from a stored map, None when its units carry no metric scale
+    units = meta.get('units')
+    if units == 'm':
+        return depth
+    if units == 'normalized' and meta.get('depth_range') is not None:
+        m, M = meta['depth_range']
+        return depth / 255. * (M - m) + m
+    return None
@@ -0,0 +1,85 @@
+"""
+    Frustum culling
+    ======================================================================
+
+    Keeps the LiDAR points that fall inside the union of a pair's camera
+    frusta (grown by a pixel margin, limited to a near / far depth range)
+    in one vectorized pass. Points outside every frustum never receive a
+    gradient, so dropping them before projection and Gaussian init saves
+    memory and per-iteration rasterization cost.
+"""
+import numpy as np
+import torch
+
+from .point_reduce import subset_point_cloud
+
+CULL_MARGIN = 32    # pixels around the image border still kept
+CULL_NEAR = 1e-3    # metres along the optical axis
+CULL_FAR = None
+
+
+def frustum_mask(points, Ks, extrinsics, sizes: list, margin: float = CULL_MARGIN,
+                 near: float = CULL_NEAR, far: float = CULL_FAR):
+    """
+    Args:
+        points:     [N 3] (or [N 4+], extra columns ignored) points in the source frame
+        Ks:         [C 3 3] camera intrinsic matrices
+        extrinsics: [C 4 4] source -> camera transformations
+        sizes:      C (height, width) pairs
+        margin:     pixels added on every side of the image
+        near, far:  depth range along each optical axis
+
+    Returns:
+        [N] bool, True for points inside at least one of the C frusta.
+        np.ndarray for array input, torch.Tensor for tensor input.
+    """
+    assert len(Ks) == len(extrinsics) == len(sizes), (len(Ks), len(extrinsics), len(sizes))
+    if isinstance(points, torch.Tensor):
+        lib, device = torch, points.device
+        points = points[:, 0:3].to(torch.float64)
+        Ks = torch.as_tensor(np.asarray(Ks), dtype=torch.float64, device=device)
+        extrinsics = torch.as_tensor(np.asarray(extrinsics), dtype=torch.float64, device=device)
+        hs = torch.as_tensor([s[0] for s in sizes], dtype=torch.float64, device=device)[:, None]
+        ws = torch.as_tensor([s[1] for s in sizes], dtype=torch.float64, device=device)[:, None]
+        rot = extrinsics[:, 0:3, 0:3].transpose(1, 2)
+    else:
+        lib = np
+        points = np.asarray(points, dtype=np.float64)[:, 0:3]
+        Ks, extrinsics = np.asarray(Ks, dtype=np.float64), np.asarray(extrinsics, dtype=np.float64)
+        hs, ws = np.array([s[0] for s in sizes])[:, None], np.array([s[1] for s in sizes])[:, None]
+        rot = extrinsics[:, 0:3, 0:3].transpose(0, 2, 1)
+
+    # [C N 3] in every camera frame, same convention as project_points_multi
+    cam = lib.matmul(points[None], rot) + extrinsics[:, None, 0:3, 3]
+    z = cam[..., 2]
+    inside = z > near
+    if far is not None:
+        inside &= z < far
+    z = lib.where(inside, z, lib.ones_like(z))
+    uv = lib.matmul(cam, Ks.transpose(1, 2) if lib is torch else Ks.transpose(0, 2, 1))
+    u, v = uv[..., 0] / z, uv[..., 1] / z
+    inside &= (u >= -margin - 0.5) & (u < ws + margin - 0.5) & (v >= -margin - 0.5) & (v < hs + margin - 0.5)
+    return inside.any(0)
+
+
+def cull_points(points, Ks, extrinsics, sizes: list, margin: float = CULL_MARGIN,
+                near: float = CULL_NEAR, far: float = CULL_FAR):
+    # -> points inside the union of frusta, {'total', 'kept', 'dropped'}
+    mask = frustum_mask(points, Ks, extrinsics, sizes, margin, near, far)
+    kept = int(mask.sum())
+    return points[mask], {'total': len(points), 'kept': kept, 'dropped': len(points) - kept}
+
+
+def cull_point_cloud(pcd, Ks, extrinsics, sizes: list, margin: float = CULL_MARGIN,
+                     near: float = CULL_NEAR, far: float = CULL_FAR, name: str = ''):
+    """
+    In-place `cull_points` on a point cloud object exposing `.points`
+    (LidarPointCloud, BasicPointCloud-like); per-point attributes follow.
+    Returns the cloud and the {'total', 'kept', 'dropped'} counts.
+    """
+    mask = frustum_mask(np.asarray(pcd.points), Ks, extrinsics, sizes, margin, near, far)
+    stats = {'total': len(mask), 'kept': int(mask.sum())}
+    stats['dropped'] = stats['total'] - stats['kept']
+    subset_point_cloud(pcd, mask)
+    print(f'[INFO] frustum culling {name}: kept {stats["kept"]} / {stats["total"]}, dropped {stats["dropped"]}')
+    return pcd, stats
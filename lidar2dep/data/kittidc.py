@@ -16,7 +16,7 @@ from PIL import Image
 import torch
 import torchvision.transforms.functional as TF
 from torchvision.transforms import InterpolationMode
-from .lidar import sample_lidar_lines
+from .lidar import sample_lidar_lines, load_ring_map
 
 
 """
@@ -89,6 +89,8 @@ class KITTIDC(BaseDataset):
         mode = 'test' if mode == 'val' else mode
         self.mode = mode
         self.lidar_lines = args.lidar_lines
+        # None: `.ring_cache` next to every depth png
+        self.ring_cache_dir = getattr(args, 'ring_cache_dir', None)
 
         if mode != 'train' and mode != 'val' and mode != 'test':
             raise NotImplementedError
@@ -282,7 +284,9 @@ class KITTIDC(BaseDataset):
             Km[1, 1] = K[1]
             Km[0, 2] = K[2]
             Km[1, 2] = K[3]
-            depth = sample_lidar_lines(depth[:, :, None], intrinsics=Km, keep_ratio=keep_ratio)[:, :, 0]
+            # ring map derived once per sample and cached, each keep ratio is then a mask lookup
+            ring_map = load_ring_map(path_depth, depth, Km, cache_dir=self.ring_cache_dir)
+            depth = sample_lidar_lines(depth[:, :, None], intrinsics=Km, keep_ratio=keep_ratio, ring_map=ring_map)[:, :, 0]
         else:
             depth = np.zeros_like(depth)
 
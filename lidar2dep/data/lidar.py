@@ -1,8 +1,98 @@
+import os, hashlib
 import numpy as np
 import cv2
 
+NUM_BEAMS = 64
+RING_CACHE_DIR = '.ring_cache'
+
+
+def _pitch_bins(pitch: np.ndarray, num_beams: int = NUM_BEAMS) -> np.ndarray:
+    # elevation -> beam label in [0, num_beams], same binning as the former per-call code
+    max_pitch, min_pitch = np.max(pitch), np.min(pitch)
+    angle_interval = (max_pitch - min_pitch) / float(num_beams)
+    if angle_interval <= 0:
+        return np.zeros(pitch.shape, dtype=np.int16)
+    return np.round((pitch - min_pitch) / angle_interval).astype(np.int16)
+
+
+def beam_rings(points: np.ndarray, num_beams: int = NUM_BEAMS, up_axis: int = 2) -> np.ndarray:
+    """
+    Beam / ring id of every raw LiDAR point by elevation binning, computed once per cloud.
+        points:     [N 3+] points in the LiDAR frame
+        up_axis:    2 for LiDAR frames (z up), 1 for camera frames (y down)
+    -> int16 [N] ring ids in [0, num_beams]
+    """
+    points = np.asarray(points, dtype=np.float64)[:, 0:3]
+    if len(points) == 0:
+        return np.zeros(0, dtype=np.int16)
+    distance = np.maximum(np.linalg.norm(points, 2, axis=1), 1e-9)
+    return _pitch_bins(np.arcsin(points[:, up_axis] / distance), num_beams)
+
+
+def ring_map_from_index(rings: np.ndarray, index: np.ndarray) -> np.ndarray:
+    # per-pixel ring channel from the per-pixel point index of `project_points(..., return_index=True)`
+    return np.where(index >= 0, np.asarray(rings)[np.maximum(index, 0)], -1).astype(np.int16)
+
+
+def ring_map_from_depth(depth_map: np.ndarray, intrinsics: np.ndarray, num_beams: int = NUM_BEAMS) -> np.ndarray:
+    # ring channel of an already rasterized depth map (no raw points, e.g. KITTI), -1 where empty
+    depth_map = depth_map[..., 0] if depth_map.ndim == 3 else depth_map
+    v, u = np.nonzero(depth_map)
+    ring_map = np.full(depth_map.shape, -1, dtype=np.int16)
+    if len(v) == 0:
+        return ring_map
+    z = depth_map[v, u]
+    K = np.asarray(intrinsics, dtype=np.float64)
+    # inv(K) @ [u v 1]^T * z, only the y row and the norm are needed
+    x = (u - K[0, 2]) / K[0, 0] * z
+    y = (v - K[1, 2]) / K[1, 1] * z
+    ring_map[v, u] = _pitch_bins(np.arcsin(y / np.sqrt(x * x + y * y + z * z)), num_beams)
+    return ring_map
+
+
+def ring_keep_mask(ring_map: np.ndarray, keep_ratio: float) -> np.ndarray:
+    # pixels of the rings kept at `keep_ratio` (1.0: 64 lines, 0.5: 32, ...)
+    if keep_ratio <= 0:
+        return np.zeros(ring_map.shape, dtype=bool)
+    # lookup table over ring ids, slot 0 is the empty pixel (-1)
+    rings = np.arange(-1, max(int(ring_map.max()), 0) + 1)
+    table = (rings >= 0) & (rings % (1.0 / keep_ratio) == 0)
+    return table[ring_map.astype(np.int64) + 1]
+
+
+def load_ring_map(depth_path: str, depth_map: np.ndarray, intrinsics: np.ndarray,
+                  use_cache: bool = True, cache_dir: str = None) -> np.ndarray:
+    """
+    Ring map of the depth image stored at `depth_path`, cached as a `.npy`
+    sidecar (default: `.ring_cache` next to the file) keyed by a hash of the
+    absolute path and `intrinsics` plus size / mtime, so augmentation at many
+    keep ratios is a mask lookup per sample. Same-named files of different
+    drives can share a `cache_dir`.
+    """
+    if not use_cache:
+        return ring_map_from_depth(depth_map, intrinsics)
+    st = os.stat(depth_path)
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(depth_path)), RING_CACHE_DIR)
+    h = hashlib.blake2b(os.path.abspath(depth_path).encode(), digest_size=12)
+    h.update(np.ascontiguousarray(intrinsics, dtype=np.float64).tobytes())
+    cache = os.path.join(cache_dir, f'{os.path.basename(depth_path)}.{h.hexdigest()}.{st.st_size}-{st.st_mtime_ns}.npy')
+    if os.path.exists(cache):
+        return np.load(cache)
+
+    ring_map = ring_map_from_depth(depth_map, intrinsics)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = f'{cache[:-4]}.{os.getpid()}.tmp.npy'
+        np.save(tmp, ring_map)
+        os.replace(tmp, cache)
+    except OSError as err:
+        print(f'[INFO] ring cache disabled for {depth_path}: {err}')
+    return ring_map
+
+
 def sample_lidar_lines(
-    depth_map: np.ndarray, intrinsics: np.ndarray, keep_ratio: float = 1.0
+    depth_map: np.ndarray, intrinsics: np.ndarray, keep_ratio: float = 1.0, ring_map: np.ndarray = None
 ) -> np.ndarray:
     """
     Takes in input a depth map generated by a 64 line lidar and sparsify the number of
@@ -15,6 +105,9 @@ def sample_lidar_lines(
         the intrinsic parameters of shape 3 x 3
     keep_ratio: float, default 1.0
         the sparsification parameter, 1.0 is 64 lines, 0.50 roughly 32 lines and so on.
+    ring_map: array like, optional
+        per-pixel ring ids of shape H x W (-1 where empty), from `beam_rings` carried through
+        the projection or from `load_ring_map`. Skips the back-projection and pitch binning.
     Returns
     -------
     sparse_depth_map: array like
@@ -22,25 +115,9 @@ def sample_lidar_lines(
     """
     if(len(depth_map.shape) < 3):
         depth_map = np.expand_dims(depth_map, axis=-1)
-    v, u, _ = np.nonzero(depth_map)
-    z = depth_map[v, u, 0]
-    points = np.linalg.inv(intrinsics) @ (np.vstack([u, v, np.ones_like(u)]) * z)
-    points = points.transpose([1, 0])
-
-    scan_y = points[:, 1]
-    distance = np.linalg.norm(points, 2, axis=1)
-    pitch = np.arcsin(scan_y / distance)
-    num_points = np.shape(pitch)[0]
-    pitch = np.reshape(pitch, (num_points, 1))
-
-    max_pitch = np.max(pitch)
-    min_pitch = np.min(pitch)
-    angle_interval = (max_pitch - min_pitch) / 64.0
-    angle_label = np.round((pitch - min_pitch) / angle_interval)
-    sampling_mask = angle_label % (1.0 / keep_ratio) == 0
-
-    final_mask = np.zeros_like(depth_map, dtype=bool)
-    final_mask[depth_map[..., 0] > 0] = sampling_mask
-    sampled_depth = np.zeros_like(final_mask, dtype=np.float32)
-    sampled_depth[final_mask] = depth_map[final_mask]
-    return sampled_depth
+    if ring_map is None:
+        ring_map = ring_map_from_depth(depth_map, intrinsics)
+    assert ring_map.shape == depth_map.shape[0:2], (ring_map.shape, depth_map.shape)
+
+    final_mask = (ring_keep_mask(ring_map, keep_ratio) & (depth_map[..., 0] > 0))[..., None]
+    return np.where(final_mask, depth_map, 0).astype(np.float32)
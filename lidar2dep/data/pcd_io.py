@@ -0,0 +1,171 @@
+"""
+    PCD reader
+    ======================================================================
+
+    Dependency-light reader for the DAIR-V2X `.pcd` files (ascii / binary /
+    LZF binary_compressed). The decoded points are kept as a structured
+    array (x, y, z, intensity, ...) and persisted as a `.npy` sidecar keyed
+    by the source size and mtime, so repeated reads are zero-copy memmaps.
+"""
+import os
+import numpy as np
+from numpy.lib.recfunctions import structured_to_unstructured
+
+try:
+    import lzf  # python-lzf, optional C implementation
+except ImportError:
+    lzf = None
+
+PCD_CACHE_DIR = '.pcd_cache'
+_PCD_TYPES = {('F', 4): 'f4', ('F', 8): 'f8', ('U', 1): 'u1', ('U', 2): 'u2', ('U', 4): 'u4', ('U', 8): 'u8',
+              ('I', 1): 'i1', ('I', 2): 'i2', ('I', 4): 'i4', ('I', 8): 'i8'}
+
+
+def lzf_decompress(data, out_size: int) -> bytes:
+    # LibLZF format, as written by PCL for `DATA binary_compressed`
+    if lzf is not None:
+        return lzf.decompress(bytes(data), out_size)
+    out = bytearray(out_size)
+    ip, op, n = 0, 0, len(data)
+    while ip < n:
+        ctrl = data[ip]
+        ip += 1
+        if ctrl < 32:
+            # literal run of ctrl + 1 bytes
+            ctrl += 1
+            out[op:op + ctrl] = data[ip:ip + ctrl]
+            ip += ctrl
+            op += ctrl
+            continue
+        # back reference
+        length = ctrl >> 5
+        if length == 7:
+            length += data[ip]
+            ip += 1
+        ref = op - ((ctrl & 0x1f) << 8) - data[ip] - 1
+        ip += 1
+        length += 2
+        while length > 0:
+            # the reference may overlap the bytes being written
+            chunk = min(length, op - ref)
+            out[op:op + chunk] = out[ref:ref + chunk]
+            op += chunk
+            ref += chunk
+            length -= chunk
+    assert op == out_size, f'LZF: decoded {op} bytes, expected {out_size}'
+    return bytes(out)
+
+
+def read_pcd_header(f) -> dict:
+    header = {}
+    while True:
+        line = f.readline()
+        if not line:
+            raise ValueError('PCD: unexpected end of file in header')
+        line = line.decode('ascii').strip()
+        if not line or line.startswith('#'):
+            continue
+        key, *values = line.split()
+        header[key.lower()] = values
+        if key.upper() == 'DATA':
+            break
+    header['points'] = int(header['points'][0])
+    header['data'] = header['data'][0]
+    return header
+
+
+def pcd_dtype(header: dict) -> np.dtype:
+    counts = header.get('count', ['1'] * len(header['fields']))
+    fields = []
+    for name, size, type_, count in zip(header['fields'], header['size'], header['type'], counts):
+        base = _PCD_TYPES[(type_, int(size))]
+        fields.append((name, base) if int(count) == 1 else (name, base, (int(count),)))
+    return np.dtype(fields)
+
+
+def decode_pcd(path: str) -> np.ndarray:
+    """ Parse a .pcd file into a structured array with one field per PCD FIELD. """
+    with open(path, 'rb') as f:
+        header = read_pcd_header(f)
+        dtype, num = pcd_dtype(header), header['points']
+        if header['data'] == 'ascii':
+            return np.loadtxt(f, dtype=dtype, ndmin=1)[:num]
+        if header['data'] == 'binary':
+            return np.frombuffer(f.read(num * dtype.itemsize), dtype=dtype).copy()
+        if header['data'] != 'binary_compressed':
+            raise ValueError(f'PCD: unsupported DATA {header["data"]}')
+
+        compressed_size, size = np.frombuffer(f.read(8), dtype='<u4')
+        raw = lzf_decompress(f.read(int(compressed_size)), int(size))
+
+    # binary_compressed payload is column major: all x, then all y, ...
+    points, offset = np.empty(num, dtype=dtype), 0
+    for name in dtype.names:
+        field = dtype.fields[name][0]
+        nbytes = field.itemsize * num
+        points[name] = np.frombuffer(raw, dtype=field.base, count=num * max(1, int(np.prod(field.shape))),
+                                     offset=offset).reshape((num,) + field.shape)
+        offset += nbytes
+    return points
+
+
+def _cache_path(path: str, cache_dir: str = None) -> str:
+    st = os.stat(path)
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), PCD_CACHE_DIR)
+    name = os.path.basename(path)
+    return os.path.join(cache_dir, f'{name}.{st.st_size}-{st.st_mtime_ns}.npy')
+
+
+def read_pcd(path: str, use_cache: bool = True, cache_dir: str = None) -> np.ndarray:
+    """
+    Read a .pcd file as a structured array (x, y, z, intensity, ...).
+
+    With `use_cache` the decoded array is stored once as a `.npy` sidecar in
+    `cache_dir` (default: `.pcd_cache` next to the file) and later reads are
+    read-only memmaps of it. A changed size / mtime of the source invalidates it.
+    """
+    if not use_cache:
+        return decode_pcd(path)
+    cache = _cache_path(path, cache_dir)
+    if os.path.exists(cache):
+        return np.load(cache, mmap_mode='r')
+
+    points = decode_pcd(path)
+    try:
+        os.makedirs(os.path.dirname(cache), exist_ok=True)
+        prefix = os.path.basename(path) + '.'
+        for stale in os.listdir(os.path.dirname(cache)):
+            if stale.startswith(prefix) and stale.endswith('.npy'):
+                os.remove(os.path.join(os.path.dirname(cache), stale))
+        tmp = f'{cache[:-4]}.{os.getpid()}.tmp.npy'
+        np.save(tmp, points)
+        os.replace(tmp, cache)  # atomic: concurrent readers never see a partial file
+    except OSError as err:
+        print(f'[INFO] PCD cache disabled for {path}: {err}')
+        return points
+    return np.load(cache, mmap_mode='r')
+
+
+class LidarPointCloud:
+    """
+        Open3D-like container of a decoded cloud, usable wherever the code reads
+        `pcd.points` / `pcd.colors` (projection, GaussianModel.create_from_pcd).
+            data:       structured array (x, y, z, intensity, ...)
+            points:     [N 3] xyz, a view into `data` when possible
+            colors:     [0 3], LiDAR clouds carry no color
+            intensity:  [N] or None
+    """
+    def __init__(self, data: np.ndarray):
+        self.data = data
+        self.points = structured_to_unstructured(data[['x', 'y', 'z']])
+        self.colors = np.zeros((0, 3))
+        self.normals = np.zeros((0, 3))
+        self.intensity = data['intensity'] if 'intensity' in data.dtype.names else None
+
+    def __len__(self):
+        return self.points.shape[0]
+
+
+def load_point_cloud(path: str, use_cache: bool = True, cache_dir: str = None) -> LidarPointCloud:
+    return LidarPointCloud(read_pcd(path, use_cache=use_cache, cache_dir=cache_dir))
@@ -0,0 +1,154 @@
+"""
+    Point reduction
+    ======================================================================
+
+    Vectorized LiDAR point-count reduction before Gaussian initialization,
+    replacing the per-point `randint` loop of `drgs.py::cut_down_points`.
+    Modes: voxel grid (hash based, centroid or first point per voxel),
+    uniform stride and seeded random. NumPy arrays or torch tensors in,
+    same type out.
+"""
+import numpy as np
+import torch
+
+REDUCE_MODES = ['none', 'random', 'stride', 'voxel']
+
+
+def _voxel_keys(points, voxel_size: float):
+    # one int64 key per point: linear index of its voxel in the cloud's bounding grid, or the rank of
+    # the voxel among the occupied ones when that grid has 2^63 cells or more (the index would overflow)
+    if isinstance(points, torch.Tensor):
+        lo, hi = points[:, 0:3].min(0).values, points[:, 0:3].max(0).values
+    else:
+        lo, hi = points[:, 0:3].min(0), points[:, 0:3].max(0)
+    span = float((hi - lo).max()) / voxel_size
+    if not span < 2 ** 62:
+        raise ValueError(f'voxel size {voxel_size} too small for a cloud spanning {float((hi - lo).max())}')
+    if isinstance(points, torch.Tensor):
+        cell = torch.floor((points[:, 0:3] - lo) / voxel_size).long()
+        extent = cell.max(0).values + 1
+    else:
+        cell = np.floor((points[:, 0:3] - lo) / voxel_size).astype(np.int64)
+        extent = cell.max(0) + 1
+    if int(extent[0]) * int(extent[1]) * int(extent[2]) >= 2 ** 63:
+        if isinstance(points, torch.Tensor):
+            return torch.unique(cell, dim=0, return_inverse=True)[1]
+        return np.unique(cell, axis=0, return_inverse=True)[1].ravel()
+    return (cell[:, 0] * extent[1] + cell[:, 1]) * extent[2] + cell[:, 2]
+
+
+def voxel_downsample(points, voxel_size: float, mode: str = 'centroid', return_index: bool = False):
+    """
+    Keep one point per occupied voxel of side `voxel_size`.
+
+    Args:
+        points:     [N 3+] array / tensor, voxels are built on the first 3 columns
+        mode:       'centroid' averages every column of the voxel,
+                    'first' keeps the first point (in input order) of each voxel
+        return_index: also return the kept row indices ('first' only)
+
+    Returns:
+        [M 3+] reduced points (and [M] indices)
+    """
+    assert mode in ['centroid', 'first'], mode
+    assert not (return_index and mode == 'centroid'), 'centroids are not rows of the input'
+    if len(points) == 0:
+        return (points, np.arange(0)) if return_index else points
+    keys = _voxel_keys(points, voxel_size)
+
+    if isinstance(points, torch.Tensor):
+        _, inverse = torch.unique(keys, return_inverse=True)
+        m = int(inverse.max()) + 1
+        if mode == 'first':
+            index = torch.full((m,), len(points), dtype=torch.long, device=points.device)
+            index.scatter_reduce_(0, inverse, torch.arange(len(points), device=points.device), reduce='amin')
+            index = index.sort().values
+            return (points[index], index) if return_index else points[index]
+        out = torch.zeros((m, points.shape[1]), dtype=torch.float64, device=points.device)
+        out.index_add_(0, inverse, points.to(torch.float64))
+        count = torch.bincount(inverse, minlength=m).to(torch.float64)
+        return (out / count[:, None]).to(points.dtype)
+
+    _, index, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    if mode == 'first':
+        index = np.sort(index)
+        return (points[index], index) if return_index else points[index]
+    inverse = inverse.ravel()
+    count = np.bincount(inverse)
+    out = np.stack([np.bincount(inverse, weights=points[:, c]) for c in range(points.shape[1])], axis=1)
+    return (out / count[:, None]).astype(points.dtype)
+
+
+def stride_index(n: int, ratio: float):
+    # evenly spaced rows, about n * ratio of them
+    step = max(1, int(round(1. / ratio))) if ratio > 0 else n + 1
+    return np.arange(0, n, step)
+
+
+def random_index(n: int, ratio: float, seed: int = 0):
+    # each row kept with probability `ratio`, reproducible for a given seed
+    keep = np.random.default_rng(seed).random(n) < ratio
+    return np.nonzero(keep)[0]
+
+
+def reduce_points(points, mode: str = 'random', ratio: float = 1., voxel_size: float = None,
+                  seed: int = 0, voxel_mode: str = 'first', return_index: bool = False):
+    """
+    Dispatch to one of REDUCE_MODES.
+        ratio:      kept fraction for 'random' / 'stride'
+        voxel_size: voxel side in metres for 'voxel'
+    """
+    assert mode in REDUCE_MODES, mode
+    if mode == 'voxel':
+        assert voxel_size is not None and voxel_size > 0, voxel_size
+        return voxel_downsample(points, voxel_size, mode=voxel_mode, return_index=return_index)
+
+    n = len(points)
+    if mode == 'none' or ratio >= 1.:
+        index = np.arange(n)
+    elif mode == 'stride':
+        index = stride_index(n, ratio)
+    else:
+        index = random_index(n, ratio, seed)
+    if isinstance(points, torch.Tensor):
+        index = torch.as_tensor(index, device=points.device)
+    return (points[index], index) if return_index else points[index]
+
+
+def reduce_point_cloud(pcd, mode: str = 'random', ratio: float = 1., voxel_size: float = None,
+                       seed: int = 0, voxel_mode: str = 'first'):
+    """
+    In-place `reduce_points` on a point cloud object exposing `.points`
+    (LidarPointCloud, BasicPointCloud-like). Row-selecting modes also subset
+    `.colors`, `.normals`, `.intensity` and `.data` when present; voxel
+    centroids average the intensity and drop `.data`.
+    """
+    points = np.asarray(pcd.points)
+    if mode == 'voxel' and voxel_mode == 'centroid':
+        # intensity is averaged with xyz, other per-point attributes no longer apply
+        intensity = getattr(pcd, 'intensity', None)
+        if intensity is not None and len(intensity) == len(points):
+            out = voxel_downsample(np.column_stack([points, intensity]), voxel_size, mode='centroid')
+            pcd.points, pcd.intensity = out[:, 0:3], out[:, 3]
+        else:
+            pcd.points = voxel_downsample(points, voxel_size, mode='centroid')
+        for attr in ['colors', 'normals']:
+            if len(getattr(pcd, attr, [])) == len(points):
+                setattr(pcd, attr, np.zeros((0, 3)))
+        if hasattr(pcd, 'data'):
+            pcd.data = None
+        return pcd
+
+    _, index = reduce_points(points, mode, ratio, voxel_size, seed, voxel_mode, return_index=True)
+    return subset_point_cloud(pcd, index)
+
+
+def subset_point_cloud(pcd, index):
+    # keep rows `index` (indices or bool mask) of `.points` and of the per-point attributes
+    n = len(pcd.points)
+    pcd.points = np.asarray(pcd.points)[index]
+    for attr in ['colors', 'normals', 'intensity', 'data']:
+        value = getattr(pcd, attr, None)
+        if value is not None and len(value) == n:
+            setattr(pcd, attr, value[index])
+    return pcd
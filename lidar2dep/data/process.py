@@ -1,13 +1,15 @@
 # reference: https://github.com/youmi-zym/CompletionFormer/blob/main/src/data/kittidc.py
 import os, json, random, pdb, cv2, matplotlib
-import open3d as o3d
 import numpy as np
 from . import BaseDataset
 from PIL import Image
 import torch
 import torchvision.transforms.functional as TF
 from torchvision.transforms import InterpolationMode
-from .lidar import sample_lidar_lines
+from .lidar import sample_lidar_lines, beam_rings, ring_map_from_index
+from .projector import project_points
+from .pcd_io import load_point_cloud
+from lidar2dep.data.artifacts import writes  # not relative: lidar2dep/main.py also loads this file as `data.process`, the level is global to both
 
 # Reference : https://github.com/utiasSTARS/pykitti/blob/master/pykitti/utils.py
 def read_calib_file(filepath):
@@ -124,10 +126,13 @@ def fix_pcd(image, mask): # mask: fg-mask -> cars
 def pre_read(
         depth_path, rgb_file_path, pcd_file_path,
         intrinsic, extrinsic, fg_mask=None,
-        extra_name='fg', lidar_lines=64, return_tensor=True
+        extra_name='fg', lidar_lines=64, return_tensor=True, pcd_img=None, ring_img=None, sparse=None
 ):
     # L109 -> L247 -> L91, L285
     # Note the 'depth_path' only related to saving directory
+    # pcd_img: sparse depth already projected (e.g. by project_points_multi), skips the projection
+    # ring_img: per-pixel beam ring ids of pcd_img (-1 where empty), lidar line sampling is then a mask lookup
+    # sparse: the 'sparse' entry returned for the same pcd_img, skips normalization and line sampling
     # TODO: read camera intrinsics
     if fg_mask is not None: assert not isinstance(rgb_file_path, str)
 
@@ -166,52 +171,56 @@ def pre_read(
 
     # TODO: 找到rgb图片视角下的pcd渲染出的sparse depth
     rgb_image = Image.open(rgb_file_path) if isinstance(rgb_file_path, str) else Image.fromarray(rgb_file_path)
-    pcd_file = o3d.io.read_point_cloud(pcd_file_path) if isinstance(pcd_file_path, str) else pcd_file_path
-
-
-    # Off Screen Rendering
-    renderer = o3d.visualization.rendering.OffscreenRenderer(K_dict['width'], K_dict['height'])
-    material = o3d.visualization.rendering.MaterialRecord()
-    material.point_size = 5
-    material.shader = 'unlit' # maintain original colors
-    renderer.scene.add_geometry("point_cloud", pcd_file, material)
-
-    renderer.setup_camera(K_matrix, A, K_dict['width'], K_dict['height'])
-    pcd_img = np.asarray(renderer.render_to_depth_image())
-    # Standard Nom First
-    # depth_image = (depth_image - np.mean(depth_image)) / np.std(depth_image)
-
-    # Max-Min Norm
-    # TODO -> Change Here !
-    if fg_mask is not None:
-        try:
-            fix_pcd(pcd_img, fg_mask)
-        except Exception as err:
-            print(f'err: {err}')
-            pdb.set_trace()
-
-    # 把mask部分的pcd点抹去，应该是把mask到的部分变白
-    # pcd_img: [H W], fg_mask: [H W 3]
-    M, m  = np.max(pcd_img), np.min(pcd_img)
-    depth_image = (pcd_img - m) / (M - m) * 255. if M > m else pcd_img
-    if len(depth_image.shape) < 3:
-        depth_image = depth_image[:,:,None]
-        colored_depth = cv2.applyColorMap(depth_image.astype(np.uint8), cv2.COLORMAP_RAINBOW)
-        colored_depth = colorize(depth_image.astype(np.uint8))
-    cv2.imwrite(os.path.join(depth_path, f'projected_pcd-{extra_name}.jpg'), cv2.cvtColor(colored_depth, cv2.COLOR_RGB2BGR))
-
-    print(f'[Debug] before sample: depth_image.shape = {depth_image.shape}')
-    sampled_depth = sample_lidar_lines(
-        depth_map = depth_image, intrinsics = K_matrix, keep_ratio=keep_ratio
-    )
-
+    if sparse is not None:
+        # sampled sparse depth of the same pcd_img (see Args2Results_batch), not recomputed
+        sampled_depth, pcd_img, (m, M) = sparse['depth'], sparse['pcd_img'], sparse['depth_range']
+    else:
+        if pcd_img is None:
+            pcd_file = load_point_cloud(pcd_file_path) if isinstance(pcd_file_path, str) else pcd_file_path
+
+            # Z-buffer projection of the LiDAR points, metric depth (0 where empty), rings carried per pixel
+            pcd_img, point_index = project_points(
+                np.asarray(pcd_file.points), K_matrix, A, K_dict['height'], K_dict['width'], point_size=5, return_index=True
+            )
+            ring_img = ring_map_from_index(beam_rings(pcd_file.points), point_index)
+        # Standard Nom First
+        # depth_image = (depth_image - np.mean(depth_image)) / np.std(depth_image)
+
+        # Max-Min Norm
+        # TODO -> Change Here !
+        if fg_mask is not None:
+            try:
+                fix_pcd(pcd_img, fg_mask)
+            except Exception as err:
+                print(f'err: {err}')
+                pdb.set_trace()
+
+        # 把mask部分的pcd点抹去，应该是把mask到的部分变白
+        # pcd_img: [H W], fg_mask: [H W 3]
+        M, m  = np.max(pcd_img), np.min(pcd_img)
+        depth_image = (pcd_img - m) / (M - m) * 255. if M > m else pcd_img
+        if len(depth_image.shape) < 3:
+            depth_image = depth_image[:,:,None]
+        if writes('debug'):
+            colored_depth = colorize(depth_image.astype(np.uint8))
+            cv2.imwrite(os.path.join(depth_path, f'projected_pcd-{extra_name}.jpg'), cv2.cvtColor(colored_depth, cv2.COLOR_RGB2BGR))
+
+        if writes('debug'): print(f'[Debug] before sample: depth_image.shape = {depth_image.shape}')
+        sampled_depth = sample_lidar_lines(
+            depth_map = depth_image, intrinsics = K_matrix, keep_ratio=keep_ratio, ring_map=ring_img
+        )
+
+    # pcd_img: metric sparse depth, depth_range: metres mapped onto [0, 255] above
+    sparse = {'depth': sampled_depth, 'pcd_img': pcd_img, 'depth_range': (float(m), float(M))}
     if not return_tensor:
-        return {'rgb': rgb_image, 'depth': sampled_depth, 'K': torch.Tensor(K_matrix)}
+        return {'rgb': rgb_image, 'depth': sampled_depth, 'K': torch.Tensor(K_matrix),
+                'pcd_img': pcd_img, 'depth_range': sparse['depth_range'], 'sparse': sparse}
     else:
         rgb = TF.to_tensor(rgb_image)
         rgb = TF.normalize(rgb, (0.485, 0.456, 0.406), (0.229, 0.224, 0.225), inplace=True)
         depth = TF.to_tensor(np.array(sampled_depth))
-        return {'rgb': rgb, 'dep': depth, 'K': torch.Tensor(K_matrix)}
+        return {'rgb': rgb, 'dep': depth, 'K': torch.Tensor(K_matrix),
+                'pcd_img': pcd_img, 'depth_range': sparse['depth_range'], 'sparse': sparse}
 
 
 
@@ -0,0 +1,167 @@
+"""
+    Z-buffer point projector
+    ======================================================================
+
+    Vectorized LiDAR -> camera projection producing metric sparse depth maps.
+    Replaces the per-call Open3D OffscreenRenderer (which needs a GL context)
+    used by `pre_read`, `Direct_Renderring`, `CreateCamera` and the legacy
+    `render_pcd_view_img`. Runs with NumPy, or with torch on CPU / GPU.
+
+    `project_points_multi` renders one cloud into C cameras in a single pass
+    (shared transform, frustum test and scatter), e.g. the inf / veh views and
+    the cross views of a cooperative pair.
+"""
+import numpy as np
+import torch
+
+
+def _splat_offsets(point_size: int):
+    # square splat of side `point_size`, same footprint as Open3D's `material.point_size`
+    assert point_size >= 1, point_size
+    d = np.arange(-((point_size - 1) // 2), point_size // 2 + 1)
+    dy, dx = np.meshgrid(d, d, indexing='ij')
+    return dx.ravel(), dy.ravel()
+
+
+def _project_multi_numpy(points, Ks, extrinsics, sizes, point_size, near, far, return_index):
+    points = np.asarray(points, dtype=np.float64)[:, 0:3]
+    Ks, extrinsics = np.asarray(Ks, dtype=np.float64), np.asarray(extrinsics, dtype=np.float64)
+    hs, ws = np.array([s[0] for s in sizes]), np.array([s[1] for s in sizes])
+    dx, dy = _splat_offsets(point_size)
+
+    # [C N 3]: the cloud in every camera frame
+    cam = np.matmul(points[None], extrinsics[:, 0:3, 0:3].transpose(0, 2, 1)) + extrinsics[:, None, 0:3, 3]
+    z = cam[..., 2]
+    keep = z > near
+    if far is not None:
+        keep &= z < far
+    z = np.where(keep, z, 1.)
+    uv = np.matmul(cam, Ks.transpose(0, 2, 1))
+    u = np.floor(uv[..., 0] / z + 0.5)
+    v = np.floor(uv[..., 1] / z + 0.5)
+    # frustum test (grown by the splat footprint: a splat reaches u + dx.min() .. u + dx.max()) before splatting
+    keep &= (u >= -dx.max()) & (u < ws[:, None] - dx.min()) & (v >= -dy.max()) & (v < hs[:, None] - dy.min())
+
+    c, n = np.nonzero(keep)
+    u, v, z = u[c, n].astype(np.int64), v[c, n].astype(np.int64), z[c, n].astype(np.float32)
+    h, w = hs[c], ws[c]
+    offsets = np.concatenate([[0], np.cumsum(hs * ws)])
+    base = offsets[c] + v * w + u
+
+    depth = np.full(offsets[-1], np.inf, dtype=np.float32)
+    targets = []
+    for ox, oy in zip(dx, dy):
+        inside = (u + ox >= 0) & (u + ox < w) & (v + oy >= 0) & (v + oy < h)
+        np.minimum.at(depth, base[inside] + (oy * w[inside] + ox), z[inside])
+        targets.append((inside, base[inside] + (oy * w[inside] + ox)))
+    depth[np.isinf(depth)] = 0.
+    depths = [depth[offsets[i]:offsets[i + 1]].reshape(hs[i], ws[i]) for i in range(len(sizes))]
+    if not return_index:
+        return depths
+
+    # source point of every pixel: the splat that won the z-buffer
+    index = np.full(offsets[-1], -1, dtype=np.int64)
+    for inside, target in targets:
+        win = depth[target] == z[inside]
+        index[target[win]] = n[inside][win]
+    return depths, [index[offsets[i]:offsets[i + 1]].reshape(hs[i], ws[i]) for i in range(len(sizes))]
+
+
+def _project_multi_torch(points, Ks, extrinsics, sizes, point_size, near, far, device, return_index):
+    # transforms run in float64: world-frame DAIR coordinates are too large for float32
+    points = torch.as_tensor(points, device=device)[:, 0:3].to(torch.float64)
+    device = points.device
+    Ks = torch.as_tensor(np.asarray(Ks), device=device, dtype=torch.float64)
+    extrinsics = torch.as_tensor(np.asarray(extrinsics), device=device, dtype=torch.float64)
+    hs = torch.as_tensor([s[0] for s in sizes], device=device)
+    ws = torch.as_tensor([s[1] for s in sizes], device=device)
+    dx, dy = _splat_offsets(point_size)
+
+    cam = torch.matmul(points[None], extrinsics[:, 0:3, 0:3].transpose(1, 2)) + extrinsics[:, None, 0:3, 3]
+    z = cam[..., 2]
+    keep = z > near
+    if far is not None:
+        keep &= z < far
+    z = torch.where(keep, z, torch.ones_like(z))
+    uv = torch.matmul(cam, Ks.transpose(1, 2))
+    u = torch.floor(uv[..., 0] / z + 0.5)
+    v = torch.floor(uv[..., 1] / z + 0.5)
+    keep &= (u >= -int(dx.max())) & (u < ws[:, None] - int(dx.min())) \
+            & (v >= -int(dy.max())) & (v < hs[:, None] - int(dy.min()))
+
+    c, n = torch.nonzero(keep, as_tuple=True)
+    u, v, z = u[c, n].long(), v[c, n].long(), z[c, n].to(torch.float32)
+    h, w = hs[c], ws[c]
+    offsets = torch.cat([torch.zeros(1, dtype=torch.long, device=device), torch.cumsum(hs * ws, 0)])
+    base = offsets[c] + v * w + u
+
+    depth = torch.full((int(offsets[-1]),), float('inf'), dtype=torch.float32, device=device)
+    targets = []
+    for ox, oy in zip(dx.tolist(), dy.tolist()):
+        inside = (u + ox >= 0) & (u + ox < w) & (v + oy >= 0) & (v + oy < h)
+        depth.scatter_reduce_(0, base[inside] + (oy * w[inside] + ox), z[inside], reduce='amin')
+        targets.append((inside, base[inside] + (oy * w[inside] + ox)))
+    depth[torch.isinf(depth)] = 0.
+    depths = [depth[int(offsets[i]):int(offsets[i + 1])].reshape(sizes[i][0], sizes[i][1]) for i in range(len(sizes))]
+    if not return_index:
+        return depths
+
+    index = torch.full((int(offsets[-1]),), -1, dtype=torch.long, device=device)
+    for inside, target in targets:
+        win = depth[target] == z[inside]
+        index[target[win]] = n[inside][win]
+    return depths, [index[int(offsets[i]):int(offsets[i + 1])].reshape(sizes[i][0], sizes[i][1]) for i in range(len(sizes))]
+
+
+def project_points_multi(
+        points, Ks, extrinsics, sizes: list,
+        point_size: int = 1, near: float = 1e-3, far: float = None, device=None, return_index: bool = False
+):
+    """
+    Scatter-min z-buffer projection of one point cloud into C cameras at once.
+
+    Args:
+        points:     [N 3] (or [N 4+], extra columns ignored) points in the source frame
+        Ks:         [C 3 3] camera intrinsic matrices
+        extrinsics: [C 4 4] source -> camera transformations, e.g. lidar2cam
+        sizes:      C (height, width) pairs, cameras may differ in resolution
+        point_size: side of the square splat in pixels, 5 matches the old Open3D material
+        near, far:  depth range kept in front of the cameras
+        device:     None keeps NumPy, otherwise runs with torch on `device`.
+                    Tensor inputs always take the torch path on their own device.
+        return_index: also return, per pixel, the index of the point that won the z-buffer,
+                    to carry per-point attributes (e.g. beam rings) into image space
+
+    Returns:
+        list of C float32 [H_c W_c] metric depth maps, 0 where no point lands.
+        np.ndarray for the NumPy path, torch.Tensor for the torch path.
+        With `return_index`: (depth maps, list of C int64 [H_c W_c] point indices, -1 where empty).
+    """
+    assert len(Ks) == len(extrinsics) == len(sizes), (len(Ks), len(extrinsics), len(sizes))
+    if isinstance(points, torch.Tensor) or device is not None:
+        return _project_multi_torch(points, Ks, extrinsics, sizes, point_size, near, far, device, return_index)
+    return _project_multi_numpy(points, Ks, extrinsics, sizes, point_size, near, far, return_index)
+
+
+def project_points(
+        points, K, extrinsic, height: int, width: int,
+        point_size: int = 1, near: float = 1e-3, far: float = None, device=None, return_index: bool = False
+):
+    """
+    Single-camera `project_points_multi`.
+
+    Args:
+        points:     [N 3] (or [N 4+], extra columns ignored) points in the source frame
+        K:          [3 3] camera intrinsic matrix
+        extrinsic:  [4 4] source -> camera transformation, e.g. lidar2cam
+        height, width: output resolution
+
+    Returns:
+        float32 [H W] metric depth along the optical axis, 0 where no point lands.
+        With `return_index`: (depth, int64 [H W] index of the source point, -1 where empty).
+    """
+    out = project_points_multi(
+        points, np.asarray(K)[None], np.asarray(extrinsic)[None], [(height, width)],
+        point_size=point_size, near=near, far=far, device=device, return_index=return_index
+    )
+    return (out[0][0], out[1][0]) if return_index else out[0]
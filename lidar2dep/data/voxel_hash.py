@@ -0,0 +1,214 @@
+"""
+    Voxel-hash spatial index
+    ======================================================================
+
+    Sparse voxel hash over a (fused inf + veh, world-frame) point cloud:
+    points are sorted by their voxel key so every occupied cell owns one
+    contiguous range [start, start + count) of `order`. Radius / kNN
+    queries are vectorized over batches of query points by visiting the
+    neighboring cells of every query at once. CPU / NumPy only.
+"""
+import numpy as np
+
+from .frustum import frustum_mask, CULL_MARGIN, CULL_NEAR, CULL_FAR
+
+
+class VoxelHashIndex:
+    """
+        points:     [N 3+] indexed points, only the first 3 columns are used
+        cell_size:  voxel side, in the units of `points`
+        Attributes:
+            order:      [N] point indices sorted by voxel key
+            cell_keys:  [M] sorted keys of the occupied voxels
+            cell_coords: [M 3] integer coordinates of the occupied voxels
+            starts, counts: [M] range of each voxel in `order`
+    """
+    def __init__(self, points, cell_size: float):
+        assert cell_size > 0, cell_size
+        self.points = np.asarray(points, dtype=np.float64)[:, 0:3]
+        self.cell_size = float(cell_size)
+        self.origin = self.points.min(0) if len(self.points) else np.zeros(3)
+
+        keys = self.keys(self.points)
+        self.order = np.argsort(keys, kind='stable')
+        self.cell_keys, self.starts, self.counts = np.unique(keys[self.order], return_index=True, return_counts=True)
+        self.cell_coords = self.cells(self.points[self.order[self.starts]])  # [M 3]
+
+    def __len__(self):
+        return len(self.points)
+
+    def cells(self, points):
+        # [Q 3] integer voxel coordinates
+        return np.floor((np.asarray(points, dtype=np.float64)[:, 0:3] - self.origin) / self.cell_size).astype(np.int64)
+
+    @staticmethod
+    def hash_cells(cells):
+        # 21 bits per axis (offset to non negative), collision free for |cell| < 2^20, -1 outside
+        cells = cells + (1 << 20)
+        valid = ((cells >= 0) & (cells < (1 << 21))).all(-1)
+        return np.where(valid, (cells[..., 0] << 42) | (cells[..., 1] << 21) | cells[..., 2], -1)
+
+    def keys(self, points):
+        return self.hash_cells(self.cells(points))
+
+    def lookup(self, keys):
+        # -> index into cell_keys of every key, -1 for empty voxels
+        pos = np.searchsorted(self.cell_keys, keys)
+        pos = np.minimum(pos, len(self.cell_keys) - 1)
+        if len(self.cell_keys) == 0:
+            return np.full(np.shape(keys), -1)
+        return np.where((keys >= 0) & (self.cell_keys[pos] == keys), pos, -1)
+
+    def cell_points(self, cell):
+        # point indices in occupied voxel number `cell`
+        return self.order[self.starts[cell]:self.starts[cell] + self.counts[cell]]
+
+    def voxel_representatives(self):
+        # first point (in input order) of every occupied voxel
+        return self.order[self.starts]
+
+    def _expand(self, q, cell):
+        # every (query, occupied cell) pair -> (query, point) pairs over the cell's range
+        count = self.counts[cell]
+        within = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+        return np.repeat(q, count), self.order[np.repeat(self.starts[cell], count) + within]
+
+    def _candidates(self, queries, radius: float, chunk: int = 1 << 22):
+        # yields (query index, point index, distance) batches from the cells within `radius` of each query
+        reach = int(np.ceil(radius / self.cell_size))
+        base = self.cells(queries)
+        if (2 * reach + 1) ** 3 <= len(self.cell_keys):
+            # hash lookups of the (2 reach + 1)^3 neighboring cells
+            d = np.arange(-reach, reach + 1)
+            batches = ((np.nonzero(cell >= 0)[0], cell) for cell in
+                       (self.lookup(self.hash_cells(base + offset))
+                        for offset in np.stack(np.meshgrid(d, d, d, indexing='ij'), -1).reshape(-1, 3)))
+            batches = ((q, cell[q]) for q, cell in batches)
+        else:
+            # large radius: test the occupied cells directly, chunked over queries
+            step = max(1, chunk // max(1, len(self.cell_keys)))
+
+            def batches_fn():
+                for i in range(0, len(queries), step):
+                    gap = np.maximum(np.abs(self.cell_coords[None] - base[i:i + step, None]) - 1, 0)
+                    q, cell = np.nonzero((gap * gap).sum(-1) * self.cell_size ** 2 <= radius * radius)
+                    yield q + i, cell
+            batches = batches_fn()
+        for q, cell in batches:
+            if len(q) == 0: continue
+            q, p = self._expand(q, cell)
+            dist = np.linalg.norm(self.points[p] - queries[q], axis=1)
+            keep = dist <= radius
+            yield q[keep], p[keep], dist[keep]
+
+    def radius_query(self, queries, radius: float, sort: bool = True):
+        """
+        All indexed points within `radius` of each query.
+
+        Returns:
+            offsets:    [Q+1], neighbors of query i are indices[offsets[i]:offsets[i+1]]
+            indices:    [K] point indices
+            distances:  [K]
+            Neighbors of a query are ordered by distance when `sort`.
+        """
+        queries = np.asarray(queries, dtype=np.float64)[:, 0:3]
+        batches = list(self._candidates(queries, radius))
+        q = np.concatenate([b[0] for b in batches]) if batches else np.zeros(0, dtype=np.int64)
+        p = np.concatenate([b[1] for b in batches]) if batches else np.zeros(0, dtype=np.int64)
+        dist = np.concatenate([b[2] for b in batches]) if batches else np.zeros(0)
+        # one float key orders by query, then by distance (dist <= radius < 2 radius)
+        perm = np.argsort(q * (2. * radius) + dist) if sort else np.argsort(q, kind='stable')
+        q, p, dist = q[perm], p[perm], dist[perm]
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(q, minlength=len(queries)))])
+        return offsets, p, dist
+
+    def count_within(self, queries, radius: float):
+        # [Q] number of indexed points within `radius`
+        queries = np.asarray(queries, dtype=np.float64)[:, 0:3]
+        counts = np.zeros(len(queries), dtype=np.int64)
+        for q, _, _ in self._candidates(queries, radius):
+            counts += np.bincount(q, minlength=len(queries))
+        return counts
+
+    def any_within(self, queries, radius: float):
+        # [Q] bool, True where at least one indexed point lies within `radius`
+        queries = np.asarray(queries, dtype=np.float64)[:, 0:3]
+        found = np.zeros(len(queries), dtype=bool)
+        todo = np.arange(len(queries))
+        # the query's own cell first: most duplicates are found there
+        reach = int(np.ceil(radius / self.cell_size))
+        if (2 * reach + 1) ** 3 <= len(self.cell_keys):
+            d = np.arange(-reach, reach + 1)
+            offsets = np.stack(np.meshgrid(d, d, d, indexing='ij'), -1).reshape(-1, 3)
+            offsets = offsets[np.argsort(np.abs(offsets).sum(1), kind='stable')]
+            base = self.cells(queries)
+            for offset in offsets:
+                cell = self.lookup(self.hash_cells(base[todo] + offset))
+                q = np.nonzero(cell >= 0)[0]
+                if len(q) == 0: continue
+                q, p = self._expand(todo[q], cell[q])
+                hit = q[np.linalg.norm(self.points[p] - queries[q], axis=1) <= radius]
+                found[hit] = True
+                todo = todo[~found[todo]]
+                if len(todo) == 0: break
+            return found
+        return self.count_within(queries, radius) > 0
+
+    def knn(self, queries, k: int, radius: float = None):
+        """
+        Hybrid search: the k nearest indexed points within `radius` of each
+        query (default: one cell), like Open3D's `search_hybrid_vector_3d`.
+        Equivalent to `cKDTree.query(queries, k, distance_upper_bound=radius)`.
+
+        Returns:
+            indices:    [Q k] point indices by increasing distance, -1 where missing
+            distances:  [Q k], inf where missing
+        """
+        if radius is None: radius = self.cell_size
+        offsets, p, dist = self.radius_query(queries, radius)
+        found = np.diff(offsets)
+        rank = np.arange(len(p)) - np.repeat(offsets[:-1], found)
+        take = rank < k
+        rows = np.repeat(np.arange(len(found)), found)[take]
+        indices = np.full((len(found), k), -1, dtype=np.int64)
+        distances = np.full((len(found), k), np.inf)
+        indices[rows, rank[take]] = p[take]
+        distances[rows, rank[take]] = dist[take]
+        return indices, distances
+
+    def frustum_cells(self, Ks, extrinsics, sizes: list, margin: float = CULL_MARGIN,
+                      near: float = CULL_NEAR, far: float = CULL_FAR):
+        """
+        [M] bool, False for occupied cells entirely outside every frustum: the bounding
+        sphere of the cell lies behind one of the frustum's planes (near, far and the
+        four image borders grown by `margin`, as in frustum.frustum_mask). Conservative,
+        a True cell may still hold no point inside.
+        """
+        Ks, extrinsics = np.asarray(Ks, dtype=np.float64), np.asarray(extrinsics, dtype=np.float64)
+        centers = self.origin + (self.cell_coords + 0.5) * self.cell_size  # [M 3]
+        r = self.cell_size * np.sqrt(3) / 2
+        keep = np.zeros(len(centers), dtype=bool)
+        for K, T, (h, w) in zip(Ks, extrinsics, sizes):
+            cam = centers @ T[0:3, 0:3].T + T[0:3, 3]
+            lo_u, hi_u, lo_v, hi_v = -margin - 0.5, w + margin - 0.5, -margin - 0.5, h + margin - 0.5
+            # u >= lo_u  <=>  (K[0] - lo_u K[2]) . p >= 0 for z > 0, likewise for the other borders
+            normals = np.stack([K[0] - lo_u * K[2], hi_u * K[2] - K[0], K[1] - lo_v * K[2], hi_v * K[2] - K[1]])
+            inside = cam[:, 2] > near - r
+            if far is not None:
+                inside &= cam[:, 2] < far + r
+            inside &= ((cam @ normals.T) / np.linalg.norm(normals, axis=1) >= -r).all(1)
+            keep |= inside
+        return keep
+
+    def frustum_query(self, Ks, extrinsics, sizes: list, **kwargs):
+        # indices (ascending) of the points inside the union of the camera frusta (see frustum.frustum_mask):
+        # the cells culled first, then only the points of the surviving cells tested
+        cell = np.nonzero(self.frustum_cells(Ks, extrinsics, sizes, **kwargs))[0]
+        _, p = self._expand(np.zeros(len(cell), dtype=np.int64), cell)
+        p = np.sort(p)
+        return p[frustum_mask(self.points[p], Ks, extrinsics, sizes, **kwargs)]
+
+
+def dedup_against(index: VoxelHashIndex, points, radius: float):
+    # [N] bool, True for `points` with no indexed point within `radius`
+    return ~index.any_within(points, radius)
@@ -14,6 +14,9 @@ from torch.nn.functional import interpolate as Inter
 torch.autograd.set_detect_anomaly(True)
 from model.completionformer import CompletionFormer
 from lidar2dep.data.process import colorize
+from lidar2dep.data.projector import project_points
+from lidar2dep.data.artifacts import save_frame_artifacts, frame_artifact_path, writes
+from lidar2dep.stage_cache import run_stage_many
 
 torch.backends.cudnn.deterministic = True
 torch.backends.cudnn.benchmark = False
@@ -55,8 +58,9 @@ def get_new_size(shape, threshold=1e3-200):
 
 def get_CompletionFormer(args):
     net = CompletionFormer(args)
-    net.cuda()
-    checkpoint = torch.load(args.pretrain)
+    device = getattr(args, 'device', 'cuda')  # cpu e.g. for the precision harness
+    net.to(device)
+    checkpoint = torch.load(args.pretrain, map_location=device)
     key_m, key_u = net.load_state_dict(checkpoint['net'], strict=False)
     if key_u:
         print('Unexpected keys :')
@@ -143,6 +147,7 @@ def main():
     # use: pdb
     # TODO: check data format
 
+    if not writes('debug'): return  # the colored JPGs below are all this entry point writes
     print(out)
     pred = out['pred'].squeeze() # [1 1 H W]
     pred = pred.detach().cpu().numpy().astype(np.uint8)
@@ -166,79 +171,174 @@ def main():
 def Args2Results(
         opt, rgb_file = None, pcd_file_path = None,
         intrinsics = None, extrinsics = None, CompletionModel = None,
-        fg_mask=None, new_path=True, extra_name='fg', depth_estimater=None
+        fg_mask=None, new_path=True, extra_name='fg', depth_estimater=None, pcd_img=None, ring_img=None,
+        cache=None
     ):
+    # cache: StageCache, ZoeDepth and CompletionFormer outputs are then reused for unchanged inputs / models
+    request = {
+        'rgb_file': rgb_file, 'pcd_file_path': pcd_file_path, 'intrinsics': intrinsics, 'extrinsics': extrinsics,
+        'fg_mask': fg_mask, 'extra_name': extra_name, 'pcd_img': pcd_img, 'ring_img': ring_img
+    }
+    return Args2Results_batch(opt, [request], CompletionModel, depth_estimater, new_path=new_path, cache=cache)[0]
+
+
+def _resolution_chunks(tensors: list, max_batch: int):
+    # indices of same-sized tensors, grouped and cut into chunks of at most max_batch
+    groups = {}
+    for i, x in enumerate(tensors):
+        groups.setdefault(tuple(x.shape[-2:]), []).append(i)
+    return [group[s:s + max_batch] for group in groups.values() for s in range(0, len(group), max_batch)]
 
-    I_dict = pre_read(
-                depth_path = opt.depth_path,
-                rgb_file_path = opt.rgb_file_path if rgb_file is None else rgb_file,
-                pcd_file_path = opt.pcd_file_path if pcd_file_path is None else pcd_file_path,
-                intrinsic = opt.intrinsic_path if intrinsics is None else intrinsics, # {'dict': ..., 'matrix': ...}
-                extrinsic = opt.extrinsic_path if extrinsics is None else extrinsics,
-                fg_mask = None if extra_name=='panoptic' else fg_mask,
-                extra_name = extra_name
-            )
 
+def estimate_depth_batch(depth_estimater, rgbs: list, cache=None, max_batch: int = 8):
+    """
+    ZoeDepth ('L' image of its depth) of normalized rgbs [3 H W], one pipeline
+    call per resolution chunk. -> [{'depth': [H W] uint8}, ...] in input order
+    """
+    outputs = [None] * len(rgbs)
+    for chunk in _resolution_chunks(rgbs, max_batch):
+        def estimate(idx, chunk=chunk):
+            images = [Image.fromarray(tensor2img(rgbs[chunk[i]][None])) for i in idx]
+            results = depth_estimater(images, batch_size=len(images))
+            results = results if isinstance(results, list) else [results]
+            return [{'depth': np.asarray(r['depth'].convert('L'))} for r in results]
+        outs = run_stage_many(cache, 'zoedepth', estimate, inputs_list=[[rgbs[i][None]] for i in chunk], models=[depth_estimater])
+        for i, out in zip(chunk, outs):
+            outputs[i] = out
+            if writes('debug'): print(f'[Debug] After ZoeDepth: depth.shape = {out["depth"].shape}') # [H W]
+    return outputs
+
+
+@torch.no_grad()
+def complete_batch(net, samples: list, cache=None, max_batch: int = 8, device='cuda'):
+    """
+    CompletionFormer on [{'rgb': [3 H W], 'dep': [1 H W]}, ...], one forward per
+    resolution chunk. -> [{'pred', 'pred_init', 'confidence'}: [H W] float32, ...]
+    """
+    outputs = [None] * len(samples)
+    for chunk in _resolution_chunks([x['rgb'] for x in samples], max_batch):
+        def complete(idx, chunk=chunk):
+            batch = {
+                'rgb': torch.stack([samples[chunk[i]]['rgb'] for i in idx]).to(device),  # torch.Tensor[B, 3, H, W]
+                'dep': torch.stack([samples[chunk[i]]['dep'] for i in idx]).to(device)   # torch.Tensor[B, 1, H, W]
+            }
+            out = net(batch)
+            confidence = out['confidence'][0] if out.get('confidence') is not None else None
+            return [{
+                'pred': out['pred'][j, 0], 'pred_init': out['pred_init'][j, 0],
+                'confidence': confidence[j, 0] if confidence is not None else None
+            } for j in range(len(idx))]
+        outs = run_stage_many(
+            cache, 'completionformer', complete,
+            inputs_list=[[samples[i]['rgb'][None], samples[i]['dep'][None]] for i in chunk], models=[net]
+        )
+        for i, out in zip(chunk, outs): outputs[i] = out
+    return outputs
+
+
+def Args2Results_batch(
+        opt, requests: list, CompletionModel = None, depth_estimater=None, new_path=True, cache=None, max_batch: int = 8,
+        write: bool = True
+    ):
+    """
+    Batched Args2Results.
+        requests:   [{'rgb_file', 'pcd_file_path', 'intrinsics', 'extrinsics', 'fg_mask',
+                      'extra_name', 'pcd_img', 'ring_img'}, ...] (keyword arguments of Args2Results)
+    Requests with the same `pcd_img` array share its normalization and lidar
+    line sampling; ZoeDepth and CompletionFormer run once per resolution chunk.
+    -> [(colored_pred, colored_init, pred), ...] in request order, the colored maps None below artifact level debug
+    write=False leaves the artifact / JPG writes to the caller:
+    -> (results, pending), `write_depth_results(pending)` does them later
+    """
     assert os.path.exists(opt.depth_path), opt.depth_path
     net = CompletionModel # get_CompletionFormer(opt)
-    rgb, depth, K = I_dict['rgb'], I_dict['dep'], I_dict['K']
-    # K: intrinsic matrix -> torch.Tensor[3 3]
-    if len(rgb.shape) <= 3:
-        rgb = rgb.unsqueeze(0)
-    if len(depth.shape) <= 3:
-        depth = depth.unsqueeze(0)
-
-    assert len(rgb.shape) == 4 and len(depth.shape) == 4, f'rgb.shape = {rgb.shape}, dep.shape = {depth.shape}'
-    # rgb_size = get_new_size(rgb.shape)
-    # dep_size = get_new_size(depth.shape)
-    # rgb = Inter(torch.tensor(rgb, dtype=torch.float32), size=rgb_size, mode="bilinear")
-    # depth = Inter(torch.tensor(depth, dtype=torch.float32), size=dep_size, mode="bilinear")
-    print(f'[Debug] rgb.shape = {rgb.shape}, depth.shape = {depth.shape}')
-
-    # TODO -> Currently: carved_image & pcd_depth
-    # TODO -> Compared with: carved_image & (1-fg_mask)*pcd_depth
-    sample = {
-        'rgb': torch.tensor(rgb, dtype=torch.float32).cuda(),  # torch.Tensor[1, 3, H, W]
-        'dep': depth.cuda()  # torch.Tensor[1, 1, H, W]
-    }
+    I_dicts, samples, sparse = [], [], {}
+    for request in requests:
+        pcd_img, extra_name = request.get('pcd_img'), request.get('extra_name', 'fg')
+        I_dict = pre_read(
+                    depth_path = opt.depth_path,
+                    rgb_file_path = opt.rgb_file_path if request.get('rgb_file') is None else request['rgb_file'],
+                    pcd_file_path = opt.pcd_file_path if request.get('pcd_file_path') is None else request['pcd_file_path'],
+                    intrinsic = opt.intrinsic_path if request.get('intrinsics') is None else request['intrinsics'], # {'dict': ..., 'matrix': ...}
+                    extrinsic = opt.extrinsic_path if request.get('extrinsics') is None else request['extrinsics'],
+                    fg_mask = None if extra_name=='panoptic' else request.get('fg_mask'),
+                    extra_name = extra_name,
+                    pcd_img = pcd_img,
+                    ring_img = request.get('ring_img'),
+                    sparse = sparse.get(id(pcd_img)) if pcd_img is not None else None
+                )
+        if pcd_img is not None: sparse[id(pcd_img)] = I_dict['sparse']
+        rgb, depth, K = I_dict['rgb'], I_dict['dep'], I_dict['K']
+        # K: intrinsic matrix -> torch.Tensor[3 3]
+        assert len(rgb.shape) == 3 and len(depth.shape) == 3, f'rgb.shape = {rgb.shape}, dep.shape = {depth.shape}'
+        if writes('debug'): print(f'[Debug] rgb.shape = {rgb.shape}, depth.shape = {depth.shape}')
+        # TODO -> Currently: carved_image & pcd_depth
+        # TODO -> Compared with: carved_image & (1-fg_mask)*pcd_depth
+        I_dicts.append(I_dict)
+        samples.append({'rgb': rgb.to(torch.float32), 'dep': depth.to(torch.float32)})
 
     if depth_estimater is not None:
         try:
-            depth = depth_estimater(Image.fromarray(tensor2img(rgb)))['depth']
-            sample['dep'] = torch.tensor(np.asarray(depth.convert('L')), dtype=torch.float32)[None,None,:,:].to('cuda')
-            print(f'[Debug] After ZoeDepth: depth.size = {depth.size}') # depth -> PIL.Image
-
+            zoe = estimate_depth_batch(depth_estimater, [x['rgb'] for x in samples], cache, max_batch)
+            for x, z in zip(samples, zoe):
+                x['dep'] = torch.tensor(z['depth'], dtype=torch.float32)[None]
         except Exception as err:
-            print(f'err: {err}')
-            pdb.set_trace()
+            # the batch runner records the pair as failed with this message and moves on
+            raise RuntimeError(f'ZoeDepth failed on {[r.get("extra_name", "fg") for r in requests]}: {err}') from err
 
     # use: pdb
     # TODO: check data format
-    out = net(sample)
-    print(out)
-    pred = out['pred'].squeeze()  # [1 1 H W] -> [H W]
-    pred = pred.detach().cpu().numpy().astype(np.uint8)
-    # M, m = np.max(pred), np.min(pred)
-    # pred = (pred - m) / (M - m) * 255.
-    # colored_pred = cv2.applyColorMap(pred.astype(np.uint8), cv2.COLORMAP_RAINBOW)
-    #
-    # pred = repeat(pred[:,:,None].astype(np.uint8), 'h w 1 -> h w c', c=3)
-    colored_pred = colorize(pred)
-
-    print(f'pred.shape = {pred.shape}')
-    # depth writing paths
-    cv2.imwrite(os.path.join(opt.depth_path if new_path else opt.results, f'pred_depth-{extra_name}.jpg'), cv2.cvtColor(pred, cv2.COLOR_RGB2BGR))
-    cv2.imwrite(os.path.join(opt.depth_path if new_path else opt.results, f'colored_pred_depth-{extra_name}.jpg'), cv2.cvtColor(colored_pred, cv2.COLOR_RGB2BGR))
-
-    pred_init = out['pred_init'].squeeze()
-    pred_init = pred_init.detach().cpu().numpy().astype(np.uint8)
-    colored_init = colorize(pred_init.astype(np.uint8))
-    print(colored_init)
-    cv2.imwrite(os.path.join(opt.depth_path if new_path else opt.results, f'colored_pred_init-{extra_name}.jpg'), cv2.cvtColor(colored_init, cv2.COLOR_RGB2BGR))
-
-    return colored_pred, colored_init, pred
+    outs = complete_batch(net, samples, cache, max_batch, device=getattr(opt, 'device', 'cuda'))
+
+    results, pending = [], []
+    save_dir = opt.depth_path if new_path else opt.results
+    for request, I_dict, out in zip(requests, I_dicts, outs):
+        extra_name = request.get('extra_name', 'fg')
+        pred = out['pred'] # same scale as sample['dep'], kept as float32
+        pred_init = out['pred_init']
+        confidence = out.get('confidence')
+        # M, m = np.max(pred), np.min(pred)
+        # pred = (pred - m) / (M - m) * 255.
+        # colored_pred = cv2.applyColorMap(pred.astype(np.uint8), cv2.COLORMAP_RAINBOW)
+        #
+        # pred = repeat(pred[:,:,None].astype(np.uint8), 'h w 1 -> h w c', c=3)
+        colored_pred = colorize(np.clip(pred, 0, 255).astype(np.uint8)) if writes('debug') else None
+
+        if writes('debug'): print(f'[Debug] pred.shape = {pred.shape}')
+        # depth writing paths: float depth -> artifacts/<extra_name>.npz, the JPGs are visualization only
+        # ZoeDepth replaces the normalized LiDAR depth as network input: no metric range then
+        units, depth_range = ('relative', None) if depth_estimater is not None else ('normalized', I_dict['depth_range'])
+        colored_init = colorize(np.clip(pred_init, 0, 255).astype(np.uint8)) if writes('debug') else None
+        pending.append({
+            'save_dir': save_dir, 'extra_name': extra_name, 'units': units, 'depth_range': depth_range,
+            'depth': pred, 'depth_init': pred_init, 'confidence': confidence, 'sparse_depth': I_dict['pcd_img'],
+            'mask': request.get('fg_mask'), 'colored_pred': colored_pred, 'colored_init': colored_init
+        })
+        results.append((colored_pred, colored_init, pred))
+
+    if not write:
+        return results, pending
+    write_depth_results(pending)
+    return results
+
+
+def write_depth_results(pending: list):
+    # float depth -> artifacts/<extra_name>.npz (essential), colored JPGs for visualization (debug), see Args2Results_batch
+    for w in pending:
+        if writes('essential'):
+            save_frame_artifacts(
+                frame_artifact_path(w['save_dir'], w['extra_name']), units=w['units'],
+                meta={'depth_range': w['depth_range'], 'sparse_depth_units': 'm'},
+                depth=w['depth'], depth_init=w['depth_init'], confidence=w['confidence'],
+                sparse_depth=w['sparse_depth'], mask=w['mask']
+            )
+        if w['colored_pred'] is None: continue
+        cv2.imwrite(os.path.join(w['save_dir'], f'colored_pred_depth-{w["extra_name"]}.jpg'),
+                    cv2.cvtColor(w['colored_pred'], cv2.COLOR_RGB2BGR))
+        cv2.imwrite(os.path.join(w['save_dir'], f'colored_pred_init-{w["extra_name"]}.jpg'),
+                    cv2.cvtColor(w['colored_init'], cv2.COLOR_RGB2BGR))
 
-def Direct_Renderring(pcd_file, depth_path: str, extra_name: str, cam_intrinsics: dict, cam_extrinsics: np.array):
+def Direct_Renderring(pcd_file, depth_path: str, extra_name: str, cam_intrinsics: dict, cam_extrinsics: np.array, pcd_img=None):
     """
     camera_param
         {
@@ -248,28 +348,23 @@ def Direct_Renderring(pcd_file, depth_path: str, extra_name: str, cam_intrinsics
                         },
                     'extrinsic': extrinsic_array, # [4 4] array
         }
+        pcd_img: sparse depth already projected (e.g. by project_points_multi), skips the projection
     """
     print(cam_intrinsics['dict'])
     H, W = cam_intrinsics['dict']['height'], cam_intrinsics['dict']['width']
     cam_K = cam_intrinsics['matrix']
 
-    renderer = o3d.visualization.rendering.OffscreenRenderer(width=W, height=H)
-    material = o3d.visualization.rendering.MaterialRecord()
-    material.point_size = 5
-    material.shader = 'unlit'  # maintain original colors
-    renderer.scene.add_geometry("point_cloud", pcd_file, material)
-    # vis.add_geometry(pcd_file)
-
-    renderer.setup_camera(cam_K, cam_extrinsics, W, H)
-    pcd_img = np.asarray(renderer.render_to_depth_image())
+    if pcd_img is None:
+        pcd_img = project_points(np.asarray(pcd_file.points), cam_K, cam_extrinsics, H, W, point_size=5)
 
     M, m = np.max(pcd_img), np.min(pcd_img)
-    depth_image = (pcd_img - m) / (M - m) * 255.
+    depth_image = (pcd_img - m) / (M - m) * 255. if M > m else pcd_img
 
-    # colored_depth = cv2.applyColorMap(depth_image.astype(np.uint8), cv2.COLORMAP_RAINBOW)
-    colored_depth = colorize(depth_image.astype(np.uint8))
-    cv2.imwrite(os.path.join(depth_path, f'projected_pcd-{extra_name}.jpg'),
-                cv2.cvtColor(colored_depth, cv2.COLOR_RGB2BGR))
+    if writes('debug'):
+        # colored_depth = cv2.applyColorMap(depth_image.astype(np.uint8), cv2.COLORMAP_RAINBOW)
+        colored_depth = colorize(depth_image.astype(np.uint8))
+        cv2.imwrite(os.path.join(depth_path, f'projected_pcd-{extra_name}.jpg'),
+                    cv2.cvtColor(colored_depth, cv2.COLOR_RGB2BGR))
 
     return {'side-depth': pcd_img}
 
@@ -0,0 +1,180 @@
+"""
+    Model registry
+    ======================================================================
+
+    Process-wide cache of the preprocessing models (SEEM, LaMa,
+    CompletionFormer, ZoeDepth): each model is built lazily on first use
+    and reused by every later `process_first` call, keyed by its name, the
+    config entries that shape it and a fingerprint of its checkpoint
+    (path, size, mtime), so a changed config or checkpoint builds a new one.
+    A model runs under the precision policy of opt.precision (see
+    lidar2dep/precision.py), which is part of its key unless fp32.
+    Entries live on an explicit device and can be offloaded or evicted
+    (least recently used first when `max_models` is set).
+"""
+import os, gc, json, time, hashlib
+from collections import OrderedDict, Counter
+import torch
+from lidar2dep.precision import with_precision, model_policy
+from lidar2dep import telemetry
+
+# CompletionFormer(args) only reads these, plus the weights in args.pretrain
+COMPLETION_KEYS = ['model_name', 'affinity', 'affinity_gamma', 'conf_prop', 'legacy', 'preserve_input', 'prop_kernel', 'prop_time']
+ZOEDEPTH_PATH = '../Intel/zoedepth-kitti'
+
+_models = OrderedDict()  # key -> {'name', 'model', 'device', 'built'}, least recently used first
+build_counts = Counter()  # name -> number of constructions in this process
+max_models = None
+
+
+def checkpoint_fingerprint(path: str):
+    # cheap identity of a checkpoint file or folder: sha1 over (relative path, size, mtime_ns) of its files
+    if path is None: return None
+    if not os.path.exists(path): return f'missing:{os.path.abspath(path)}'
+    files = [path] if os.path.isfile(path) else sorted(
+        os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+    sha = hashlib.sha1(os.path.abspath(path).encode())
+    for file in files:
+        st = os.stat(file)
+        sha.update(f'{os.path.relpath(file, path)}:{st.st_size}:{st.st_mtime_ns}'.encode())
+    return sha.hexdigest()
+
+
+def model_key(name: str, config: dict = None, checkpoint: str = None):
+    return name, json.dumps(config or {}, sort_keys=True, default=str), checkpoint_fingerprint(checkpoint)
+
+
+def _modules(model):
+    # torch modules held by a registry entry (module, pipeline, or the dicts of seem.masks)
+    if isinstance(model, torch.nn.Module): return [model]
+    if isinstance(model, dict): return [m for value in model.values() for m in _modules(value)]
+    if isinstance(getattr(model, 'model', None), torch.nn.Module): return [model.model]  # transformers pipeline
+    return []
+
+
+def to_device(model, device):
+    for module in _modules(model):
+        module.to(device)
+    if hasattr(model, 'device') and not isinstance(model, torch.nn.Module):
+        model.device = torch.device(device)  # transformers pipeline moves its inputs to .device
+    return model
+
+
+def get_model(name: str, builder, config: dict = None, checkpoint: str = None, device: str = None, policy = None):
+    """
+    The registered model for (name, config, checkpoint), built by `builder()` on
+    first request. `device` moves the entry if it lives elsewhere; `policy`
+    (precision.Policy) wraps it for reduced precision / channels_last calls.
+    """
+    key = model_key(name, config, checkpoint)
+    if key not in _models:
+        if max_models is not None:
+            while len(_models) >= max_models: evict(key=next(iter(_models)))
+        t0 = time.time()
+        with telemetry.span(name, 'model build'):
+            model = builder()
+        build_counts[name] += 1
+        print(f'[INFO] model registry: built {name} in {time.time() - t0:.1f}s')
+        _models[key] = {
+            'name': name, 'model': model, 'device': device, 'built': time.time(),
+            'run': model if policy is None else with_precision(model, policy)  # what callers get
+        }
+    entry = _models[key]
+    _models.move_to_end(key)
+    if device is not None and entry['device'] != device:
+        to_device(entry['model'], device)
+        entry['device'] = device
+    return entry['run']
+
+
+def offload(name: str = None, device: str = 'cpu'):
+    # move entries (all, or those called `name`) off the GPU but keep them registered
+    for entry in _models.values():
+        if name is None or entry['name'] == name:
+            to_device(entry['model'], device)
+            entry['device'] = device
+    _release()
+
+
+def evict(name: str = None, key=None):
+    # drop entries (all, those called `name`, or one `key`) and release their memory
+    for k in [k for k, entry in _models.items() if (key is None or k == key) and (name is None or entry['name'] == name)]:
+        print(f'[INFO] model registry: evicted {_models[k]["name"]}')
+        del _models[k]
+    _release()
+
+
+def _release():
+    gc.collect()
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+def registered():
+    return [(entry['name'], entry['device']) for entry in _models.values()]
+
+
+def _specs(opt):
+    # name -> (config, checkpoint) identifying each preprocessing model
+    specs = {
+        'seem': ({'cfg': opt.seem_cfg}, opt.seem_ckpt),
+        'lama': ({'cfg': opt.lama_cfg}, opt.lama_ckpt),
+        'completionformer': ({k: getattr(opt, k, None) for k in COMPLETION_KEYS}, opt.pretrain),
+        'zoedepth': ({'model': getattr(opt, 'zoedepth_path', ZOEDEPTH_PATH)}, getattr(opt, 'zoedepth_path', ZOEDEPTH_PATH)),
+    }
+    for name, (config, _) in specs.items():
+        policy = model_policy(opt, name)
+        if not policy.is_default: config['precision'] = str(policy)  # fp32 keeps the keys of earlier runs
+    return specs
+
+
+def model_id(name: str, opt):
+    # registry key of a preprocessing model, also its identity in stage cache keys
+    return model_key(name, *_specs(opt)[name])
+
+
+def get_seem(opt):
+    from seem.masks import preload_seem_detector
+    return get_model('seem', lambda: preload_seem_detector(opt), *_specs(opt)['seem'], device=opt.device, policy=model_policy(opt, 'seem'))
+
+
+def get_lama(opt):
+    from seem.masks import preload_lama_remover
+    return get_model('lama', lambda: preload_lama_remover(opt), *_specs(opt)['lama'], device=opt.device, policy=model_policy(opt, 'lama'))
+
+
+def get_completion_former(opt):
+    from lidar2dep.main import get_CompletionFormer
+    return get_model('completionformer', lambda: get_CompletionFormer(opt), *_specs(opt)['completionformer'],
+                     device=opt.device, policy=model_policy(opt, 'completionformer'))
+
+
+def get_zoedepth(opt):
+    # monocular depth estimation pipeline
+    from transformers import pipeline
+    config, path = _specs(opt)['zoedepth']
+    return get_model('zoedepth', lambda: pipeline(task='depth-estimation', model=path, device=opt.device),
+                     config, path, device=opt.device, policy=model_policy(opt, 'zoedepth'))
+
+
+GETTERS = {'seem': get_seem, 'lama': get_lama, 'completionformer': get_completion_former, 'zoedepth': get_zoedepth}
+
+
+class LazyModel:
+    """
+        Stand-in for a registry model that is only built when first called,
+        so stages served from the stage cache never load it.
+    """
+    def __init__(self, name: str, opt):
+        assert name in GETTERS, name
+        self.name, self.opt = name, opt
+
+    @property
+    def model_id(self):
+        return model_id(self.name, self.opt)
+
+    def get(self):
+        return GETTERS[self.name](self.opt)
+
+    def __call__(self, *args, **kwargs):
+        return self.get()(*args, **kwargs)
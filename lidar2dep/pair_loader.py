@@ -0,0 +1,108 @@
+"""
+    DAIR-V2X pair loader
+    ======================================================================
+
+    Streams fully loaded cooperative pairs (decoded images, decoded point
+    clouds, calibration from `DAIR_V2X_C.calib`) from a thread or process
+    pool with a bounded number of pairs in flight, so the GPU stages of
+    preprocessing / training do not wait for JPEG and PCD decoding.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from lidar2dep.dair import DAIR_V2X_C, CooperativeData
+from lidar2dep.sharding import env_shard, shard_indices
+
+
+def load_pair(item: dict, base_dir: str, downsample: int = 1, calib=None, load_pcd: bool = True) -> CooperativeData:
+    # decode everything a pipeline stage reads from the pair
+    pair = CooperativeData(item, base_dir, downsample=downsample, calib=calib, lazy=False)
+    if load_pcd:
+        pair.inf_side_pcd, pair.veh_side_pcd
+    return pair
+
+
+class PairLoader:
+    """
+        Iterable over `CooperativeData` pairs of a `DAIR_V2X_C`.
+            indices:        pair indices to visit, default all
+            num_workers:    pool size, 0 loads in the calling thread
+            prefetch:       max pairs decoded ahead of the consumer
+            executor:       'thread' | 'process'
+            ordered:        yield in `indices` order, else as soon as a pair is ready
+            rank, world_size: shard of `indices` for this worker / node,
+                            default from the RANK / WORLD_SIZE environment variables
+            on_error:       on_error(idx, err) for a pair that fails to load, which is skipped; None raises
+        Yields (idx, pair).
+    """
+    def __init__(
+            self, dair: DAIR_V2X_C, indices: list = None, downsample: int = 1,
+            num_workers: int = 4, prefetch: int = 8, executor: str = 'thread', ordered: bool = True,
+            rank: int = None, world_size: int = None, load_pcd: bool = True, on_error=None
+    ):
+        assert executor in ['thread', 'process'], executor
+        assert prefetch >= 1, prefetch
+        env_rank, env_world_size = env_shard()
+        if rank is None: rank = env_rank
+        if world_size is None: world_size = env_world_size
+        if indices is None: indices = range(len(dair))
+
+        self.dair = dair
+        self.indices = shard_indices(indices, rank, world_size)
+        self.downsample = downsample
+        self.num_workers = num_workers
+        self.prefetch = prefetch
+        self.executor = executor
+        self.ordered = ordered
+        self.load_pcd = load_pcd
+        self.on_error = on_error
+
+    def __len__(self):
+        return len(self.indices)
+
+    def _args(self, idx):
+        calib = self.dair.calib[idx]
+        if self.executor == 'process':
+            calib = calib.detach()
+        return self.dair[idx], self.dair.base_dir, self.downsample, calib, self.load_pcd
+
+    def __iter__(self):
+        if self.num_workers == 0:
+            for idx in self.indices:
+                try:
+                    pair = load_pair(*self._args(idx))
+                except Exception as err:
+                    if self.on_error is None: raise
+                    self.on_error(idx, err)
+                    continue
+                yield idx, pair
+            return
+
+        pool_cls = ThreadPoolExecutor if self.executor == 'thread' else ProcessPoolExecutor
+        todo = iter(self.indices)
+        with pool_cls(max_workers=self.num_workers) as pool:
+            pending = deque()
+
+            def submit():
+                idx = next(todo, None)
+                if idx is not None:
+                    pending.append((idx, pool.submit(load_pair, *self._args(idx))))
+
+            for _ in range(self.prefetch):
+                submit()
+            while pending:
+                if self.ordered:
+                    idx, future = pending.popleft()
+                else:
+                    wait([f for _, f in pending], return_when=FIRST_COMPLETED)
+                    k = next(k for k, (_, f) in enumerate(pending) if f.done())
+                    idx, future = pending[k]
+                    del pending[k]
+                try:
+                    pair = future.result()
+                except Exception as err:
+                    if self.on_error is None: raise
+                    self.on_error(idx, err)
+                    pair = None
+                submit()  # once `future` is done: never more than `prefetch` pairs loading
+                if pair is not None: yield idx, pair
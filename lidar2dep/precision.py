@@ -0,0 +1,163 @@
+"""
+    Inference precision policies
+    ======================================================================
+
+    One wrapper running a model in reduced precision and / or channels_last
+    memory format, whatever its form: a torch module, a transformers
+    pipeline, or the dict entries of seem.masks ({'seem_model': ...},
+    {'model': ..., 'config': ...}).
+
+        policy spec:  'fp32' | 'bf16' | 'fp16', '+cl' for channels_last,
+                      e.g. 'bf16+cl'; per model with
+                      'seem=fp16,lama=fp16+cl,completionformer=bf16'
+                      (a bare entry applies to the models not named)
+
+    Calls run under torch.autocast, so weights stay fp32 and numerically
+    sensitive ops keep autocast's fp32 list; reduced precision float
+    outputs are returned as float32 so that the numpy code downstream is
+    unchanged.
+"""
+import torch
+
+PRECISIONS = {'fp32': torch.float32, 'bf16': torch.bfloat16, 'fp16': torch.float16}
+MODELS = ['seem', 'lama', 'completionformer', 'zoedepth', 'flash3d']
+
+
+class Policy:
+    """
+        precision:      'fp32' | 'bf16' | 'fp16'
+        channels_last:  convert the 4-D weights and inputs to channels_last
+    """
+    def __init__(self, precision: str = 'fp32', channels_last: bool = False):
+        assert precision in PRECISIONS, f'precision {precision!r} not in {list(PRECISIONS)}'
+        self.precision, self.channels_last = precision, channels_last
+
+    @classmethod
+    def parse(cls, spec: str):
+        # 'bf16+cl' -> Policy('bf16', True)
+        precision, *flags = spec.strip().split('+')
+        assert all(flag == 'cl' for flag in flags), f'unknown precision flag in {spec!r}'
+        return cls(precision or 'fp32', 'cl' in flags)
+
+    @property
+    def dtype(self):
+        return PRECISIONS[self.precision]
+
+    @property
+    def is_default(self):
+        return self.precision == 'fp32' and not self.channels_last
+
+    def __str__(self):
+        return self.precision + ('+cl' if self.channels_last else '')
+
+    def __repr__(self):
+        return f'Policy({self})'
+
+
+def parse_policies(spec: str = None):
+    # 'seem=fp16,bf16+cl' -> {model name: Policy} for every name of MODELS
+    spec = spec or 'fp32'
+    default, named = Policy(), {}
+    for part in spec.split(','):
+        if not part.strip(): continue
+        if '=' in part:
+            name, value = (s.strip() for s in part.split('=', 1))
+            assert name in MODELS, f'unknown model {name!r} in precision spec, expected one of {MODELS}'
+            named[name] = Policy.parse(value)
+        else:
+            default = Policy.parse(part)
+    return {name: named.get(name, default) for name in MODELS}
+
+
+def model_policy(opt, name: str):
+    # Policy of model `name` from opt.precision (fp32 without the option)
+    return parse_policies(getattr(opt, 'precision', None))[name]
+
+
+def _modules(model):
+    if isinstance(model, torch.nn.Module): return [model]
+    if isinstance(model, dict): return [m for value in model.values() for m in _modules(value)]
+    if isinstance(getattr(model, 'model', None), torch.nn.Module): return [model.model]  # transformers pipeline
+    return []
+
+
+def _device_type(model):
+    for module in _modules(model):
+        for param in module.parameters():
+            return param.device.type
+    return 'cuda' if torch.cuda.is_available() else 'cpu'
+
+
+def _map_tensors(obj, fn):
+    # fn over the tensors of nested dicts / lists / tuples, other values unchanged
+    if isinstance(obj, torch.Tensor): return fn(obj)
+    if isinstance(obj, dict): return {k: _map_tensors(v, fn) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)) and not hasattr(obj, '_fields'): return type(obj)(_map_tensors(v, fn) for v in obj)
+    return obj
+
+
+def _channels_last(x):
+    return x.contiguous(memory_format=torch.channels_last) if x.dim() == 4 and x.is_floating_point() else x
+
+
+def _float32(x):
+    return x.float() if x.is_floating_point() and x.dtype != torch.float32 and x.dtype != torch.float64 else x
+
+
+class PrecisionModel:
+    """
+        Proxy of `model` running its calls and method calls under `policy`.
+        Sub-modules reached through attributes are proxied as well, so e.g.
+        seem_model.model.evaluate_all(...) runs in the policy's precision;
+        attribute writes go to the wrapped object.
+    """
+    def __init__(self, model, policy: Policy):
+        object.__setattr__(self, '_model', model)
+        object.__setattr__(self, '_policy', policy)
+
+    def _run(self, fn, args, kwargs):
+        policy = self._policy
+        if policy.channels_last:
+            args, kwargs = _map_tensors(args, _channels_last), _map_tensors(kwargs, _channels_last)
+        with torch.autocast(_device_type(self._model), dtype=policy.dtype, enabled=policy.precision != 'fp32'):
+            out = fn(*args, **kwargs)
+        if out is self._model: return self  # model.eval() & co. keep the proxy
+        return _map_tensors(out, _float32)
+
+    def __call__(self, *args, **kwargs):
+        return self._run(self._model, args, kwargs)
+
+    def __getattr__(self, name):
+        value = getattr(self._model, name)
+        if isinstance(value, torch.nn.Module):
+            return PrecisionModel(value, self._policy)
+        if callable(value) and hasattr(value, '__self__'):  # bound method
+            return lambda *args, **kwargs: self._run(value, args, kwargs)
+        return value
+
+    def __getitem__(self, key):  # nn.Sequential / ModuleList / ModuleDict
+        value = self._model[key]
+        return PrecisionModel(value, self._policy) if isinstance(value, torch.nn.Module) else value
+
+    def __setattr__(self, name, value):
+        setattr(self._model, name, value)
+
+    def __repr__(self):
+        return f'PrecisionModel({self._policy}, {type(self._model).__name__})'
+
+
+def with_precision(model, policy):
+    """
+    model:  module | transformers pipeline | dict of them (seem.masks entries)
+    policy: Policy or spec string ('bf16+cl')
+    -> `model` itself for fp32 without channels_last, else the wrapped model
+       (dict entries wrapped one by one); channels_last converts the weights in place.
+    """
+    policy = Policy.parse(policy) if isinstance(policy, str) else policy
+    if policy.is_default: return model
+    if isinstance(model, dict):
+        return {key: with_precision(value, policy) if _modules(value) else value for key, value in model.items()}
+    if policy.channels_last:
+        for module in _modules(model):
+            module.to(memory_format=torch.channels_last)
+    return PrecisionModel(model, policy)
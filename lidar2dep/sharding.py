@@ -0,0 +1,20 @@
+"""
+    Pair sharding
+    ======================================================================
+
+    Split of the pair indices of a run over `world_size` workers / nodes,
+    shared by the batch runner (manifests, resume) and the pair loader.
+    Rank i takes every world_size-th index starting at i, so the shards
+    are disjoint, cover every index and stay balanced for any order.
+"""
+import os
+
+
+def env_shard():
+    # (rank, world_size) of this process from the RANK / WORLD_SIZE environment variables, default (0, 1)
+    return int(os.environ.get('RANK', 0)), int(os.environ.get('WORLD_SIZE', 1))
+
+
+def shard_indices(indices: list, rank: int = 0, world_size: int = 1) -> list:
+    assert 0 <= rank < world_size, (rank, world_size)
+    return list(indices)[rank::world_size]
@@ -0,0 +1,146 @@
+"""
+    Content-addressed stage cache
+    ======================================================================
+
+    Memoizes the preprocessing stages of `process_first` (segmentation +
+    mask merge, inpainting, sparse projection, ZoeDepth, CompletionFormer)
+    on disk. A stage's key hashes the content of its inputs, its
+    parameters and the identity of the models it runs (see
+    `model_registry.model_id`); its outputs are stored as a lossless
+    artifact (`data/artifacts.py`) under
+
+        <root>/<stage>/<key[:2]>/<key>.npz
+
+    so a rerun only recomputes what changed, whatever the file names.
+"""
+import os, json, hashlib
+from collections import Counter
+import numpy as np
+import torch
+from PIL import Image
+
+from lidar2dep.data.artifacts import save_frame_artifacts, load_frame_artifacts
+
+
+def _update(h, value):
+    # feed a value into hash `h`: arrays / tensors / images by content, containers recursively
+    if value is None:
+        h.update(b'N')
+    elif isinstance(value, (str, bytes)):
+        h.update(b'S' + (value.encode() if isinstance(value, str) else value))
+    elif isinstance(value, (bool, int, float, np.number)):
+        h.update(b'V' + repr(value).encode())
+    elif isinstance(value, dict):
+        h.update(b'D')
+        for k in sorted(value, key=str):
+            _update(h, str(k)); _update(h, value[k])
+    elif isinstance(value, (list, tuple)):
+        h.update(b'L%d' % len(value))
+        for v in value: _update(h, v)
+    else:
+        if isinstance(value, torch.Tensor): value = value.detach().cpu().numpy()
+        elif isinstance(value, Image.Image): value = np.asarray(value)
+        elif hasattr(value, 'points'): value = np.asarray(value.points)  # point clouds
+        value = np.ascontiguousarray(value)
+        h.update(f'A{value.dtype.str}{value.shape}'.encode())
+        h.update(value.data)
+
+
+def content_hash(*values):
+    h = hashlib.blake2b(digest_size=20)
+    for value in values: _update(h, value)
+    return h.hexdigest()
+
+
+class StageCache:
+    """
+        root:       cache directory
+        enabled:    False turns every lookup into a miss and skips the writes
+        stats:      Counter of '<stage>/hit' and '<stage>/miss'
+    """
+    def __init__(self, root: str, enabled: bool = True):
+        self.root, self.enabled = root, enabled
+        self.stats = Counter()
+
+    def key(self, stage: str, inputs=(), params: dict = None, models=()):
+        # models: registry ids (model_registry.model_id) or LazyModel instances, None if one has no identity
+        models = [getattr(m, 'model_id', m) for m in models]
+        if not all(isinstance(m, (str, tuple)) for m in models): return None
+        return content_hash(stage, list(inputs), json.dumps(params or {}, sort_keys=True, default=str), models)
+
+    def path(self, stage: str, key: str):
+        return os.path.join(self.root, stage, key[:2], f'{key}.npz')
+
+    def load(self, stage: str, key: str):
+        # -> {name: array} or None on a miss
+        path = self.path(stage, key)
+        if not self.enabled or not os.path.exists(path): return None
+        try:
+            return load_frame_artifacts(path, dtype=None)[0]
+        except (OSError, ValueError) as err:
+            print(f'[INFO] stage cache: unreadable {path} ({err}), recomputing')
+            return None
+
+    def save(self, stage: str, key: str, outputs: dict):
+        if not self.enabled: return
+        try:
+            save_frame_artifacts(self.path(stage, key), meta={'stage': stage}, **outputs)
+        except OSError as err:
+            print(f'[INFO] stage cache: could not write {stage} ({err})')
+
+    def run(self, stage: str, fn, inputs=(), params: dict = None, models=()):
+        """
+        Outputs of `fn()` (a dict of arrays, None values are dropped) for this
+        key, read from disk on a hit. Floats come back as stored (float32).
+        """
+        key = self.key(stage, inputs, params, models)
+        if key is None:  # e.g. a bare nn.Module: its weights are unknown, never cache its outputs
+            return run_stage(None, stage, fn)
+        outputs = self.load(stage, key)
+        if outputs is not None:
+            self.stats[f'{stage}/hit'] += 1
+            print(f'[INFO] stage cache: {stage} hit {key[:12]}')
+            return outputs
+        self.stats[f'{stage}/miss'] += 1
+        outputs = {name: _as_stored(value) for name, value in fn().items() if value is not None}
+        self.save(stage, key, outputs)
+        return outputs
+
+    def run_many(self, stage: str, fn, inputs_list: list, params: dict = None, models=()):
+        """
+        Batched `run`: one output dict per entry of `inputs_list`. `fn(indices)`
+        computes the misses together and returns their dicts in that order.
+        """
+        keys = [self.key(stage, inputs, params, models) for inputs in inputs_list]
+        outputs = [self.load(stage, key) if key is not None else None for key in keys]
+        misses = [i for i, out in enumerate(outputs) if out is None]
+        self.stats[f'{stage}/hit'] += len(keys) - len(misses)
+        self.stats[f'{stage}/miss'] += len(misses)
+        if len(keys) > len(misses):
+            print(f'[INFO] stage cache: {stage} hit {len(keys) - len(misses)} / {len(keys)}')
+        if misses:
+            for i, out in zip(misses, fn(misses)):
+                outputs[i] = {name: _as_stored(value) for name, value in out.items() if value is not None}
+                if keys[i] is not None: self.save(stage, keys[i], outputs[i])
+        return outputs
+
+
+def _as_stored(value):
+    # the form a hit returns: numpy, floats as float32
+    if isinstance(value, torch.Tensor): value = value.detach().cpu().numpy()
+    value = np.asarray(value)
+    return value.astype(np.float32) if np.issubdtype(value.dtype, np.floating) else value
+
+
+def run_stage(cache, stage: str, fn, inputs=(), params: dict = None, models=()):
+    # StageCache.run, or fn() (same output form) without a cache
+    if cache is None: return {name: _as_stored(value) for name, value in fn().items() if value is not None}
+    return cache.run(stage, fn, inputs, params, models)
+
+
+def run_stage_many(cache, stage: str, fn, inputs_list: list, params: dict = None, models=()):
+    # StageCache.run_many, or fn(all indices) (same output form) without a cache
+    if cache is None:
+        return [{name: _as_stored(value) for name, value in out.items() if value is not None}
+                for out in fn(list(range(len(inputs_list))))]
+    return cache.run_many(stage, fn, inputs_list, params, models)
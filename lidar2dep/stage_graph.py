@@ -0,0 +1,258 @@
+"""
+    Stage graph scheduler
+    ======================================================================
+
+    Runs a pipeline declared as a small DAG of stages over a stream of
+    items (e.g. cooperative pairs). Each stage reads named values of the
+    item's context and writes named values back; a stage is ready for an
+    item once all of its inputs are there.
+
+        cpu stages:  decoding, projection, artifact writes, run by a pool
+                     of worker threads (numpy / cv2 / PIL / zlib release
+                     the GIL)
+        gpu stages:  model inference, run one at a time by a single
+                     thread so the models never compete for the device
+
+    Every stage has a bounded ready queue: a stage is not started for an
+    item while one of its consumers already has `queue_size` items
+    waiting, and at most `max_inflight` items are in the graph at once.
+    `report()` gives the per-stage wall time, the time spent queued and
+    the queue occupancy (time-weighted mean / max), plus the busy share of
+    each device, to see where the pipeline is bound. Every stage call is
+    also a telemetry span (lidar2dep/telemetry.py) of category 'stage'.
+"""
+import time
+from collections import deque, defaultdict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from lidar2dep import telemetry
+
+DEVICES = ['cpu', 'gpu']
+
+
+class Stage:
+    """
+        name:       unique stage name
+        fn:         fn(**inputs) -> {output name: value} (None when there are no outputs)
+        inputs:     context names the stage reads
+        outputs:    context names the stage writes
+        device:     'cpu' | 'gpu'
+    """
+    def __init__(self, name: str, fn, inputs=(), outputs=(), device: str = 'cpu'):
+        assert device in DEVICES, device
+        self.name, self.fn, self.device = name, fn, device
+        self.inputs, self.outputs = list(inputs), list(outputs)
+
+    def __repr__(self):
+        return f'Stage({self.name}: {self.inputs} -> {self.outputs}, {self.device})'
+
+
+class _Queue:
+    # ready queue of one stage: item indices, with time-weighted occupancy
+    def __init__(self):
+        self.items = deque()
+        self.area, self.max, self.last = 0., 0, None
+
+    def _tick(self, now):
+        if self.last is not None: self.area += len(self.items) * (now - self.last)
+        self.last = now
+
+    def push(self, i, now):
+        self._tick(now)
+        self.items.append((i, now))
+        self.max = max(self.max, len(self.items))
+
+    def pop(self, now):
+        self._tick(now)
+        return self.items.popleft()
+
+    def drop(self, i, now):
+        self._tick(now)
+        self.items = deque(q for q in self.items if q[0] != i)
+
+    def __len__(self):
+        return len(self.items)
+
+
+class StageGraph:
+    """
+        stages:     list of Stage, any order
+        sources:    context names every item provides, e.g. ['opt', 'pair']
+    Raises ValueError on a duplicate name / output, an unproduced input or a cycle.
+    """
+    def __init__(self, stages: list, sources=()):
+        self.sources = set(sources)
+        producer = {name: None for name in self.sources}
+        names = set()
+        for stage in stages:
+            if stage.name in names: raise ValueError(f'duplicate stage {stage.name}')
+            names.add(stage.name)
+            for output in stage.outputs:
+                if output in producer: raise ValueError(f'{output} written by {stage.name} and {producer[output] or "the item"}')
+                producer[output] = stage.name
+        self.deps, self.consumers = {}, defaultdict(list)
+        for stage in stages:
+            missing = [name for name in stage.inputs if name not in producer]
+            if missing: raise ValueError(f'{stage.name} reads {missing}, produced by no stage')
+            self.deps[stage.name] = {producer[name] for name in stage.inputs if producer[name] is not None}
+            for dep in self.deps[stage.name]: self.consumers[dep].append(stage.name)
+
+        # Kahn: topological order, also the dispatch priority among ready stages
+        by_name, order = {stage.name: stage for stage in stages}, []
+        pending = {name: set(deps) for name, deps in self.deps.items()}
+        while pending:
+            ready = [stage.name for stage in stages if stage.name in pending and not pending[stage.name]]
+            if not ready: raise ValueError(f'cycle among stages {sorted(pending)}')
+            for name in ready:
+                order.append(by_name[name])
+                del pending[name]
+            for deps in pending.values(): deps.difference_update(ready)
+        self.stages = order
+        self.stats, self.busy, self.elapsed = {}, {}, 0.
+
+    def run(self, items, cpu_workers: int = 4, max_inflight: int = 2, queue_size: int = 2, on_error=None):
+        """
+        items: iterable of dicts holding the `sources` of one item each.
+        on_error: on_error(index, stage name, err) drops an item whose stage raised
+                  (its other stages are abandoned), None re-raises.
+        Yields (index, context) in item order once every stage ran on it.
+        """
+        items = iter(items)
+        pools = {
+            'cpu': ThreadPoolExecutor(max(cpu_workers, 1), thread_name_prefix='stage-cpu'),
+            'gpu': ThreadPoolExecutor(1, thread_name_prefix='stage-gpu'),
+        }
+        slots = {'cpu': max(cpu_workers, 1), 'gpu': 1}
+        queues = {stage.name: _Queue() for stage in self.stages}
+        incoming = {stage.name: 0 for stage in self.stages}  # running producer calls that may push to the queue
+        stats = {stage.name: {'device': stage.device, 'calls': 0, 'wall': 0., 'wait': 0.} for stage in self.stages}
+        busy = {device: 0. for device in DEVICES}
+        contexts, done, running, finished = {}, {}, {}, {}  # finished[i] is None for a dropped item
+        next_item, next_yield, exhausted = 0, 0, False
+        futures = {}  # future -> (item index, stage)
+        t0 = time.perf_counter()
+
+        def enqueue(i, now):
+            # stages of item i whose producers all finished
+            for stage in self.stages:
+                name = stage.name
+                if name not in done[i] and name not in running[i] and self.deps[name] <= done[i] \
+                        and all(q[0] != i for q in queues[name].items):
+                    queues[name].push(i, now)
+
+        def call(i, stage, context):
+            start = time.perf_counter()
+            with telemetry.span(stage.name, 'stage', cuda=stage.device == 'gpu', item=i, device=stage.device):
+                outputs = stage.fn(**{name: context[name] for name in stage.inputs}) or {}
+            return outputs, start, time.perf_counter()
+
+        try:
+            while True:
+                now = time.perf_counter()
+                while not exhausted and len(contexts) < max(max_inflight, 1):
+                    try:
+                        context = dict(next(items))
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    missing = self.sources - set(context)
+                    assert not missing, f'item {next_item} lacks {missing}'
+                    contexts[next_item], done[next_item], running[next_item] = context, set(), set()
+                    enqueue(next_item, now)
+                    next_item += 1
+
+                # dispatch: stages in topological order, oldest item first, while the device has a free slot
+                # and no consumer of the stage is backed up (its queued items plus the producer calls running
+                # for it stay within queue_size)
+                for stage in self.stages:
+                    queue, consumers = queues[stage.name], self.consumers[stage.name]
+                    while len(queue) and slots[stage.device] > 0 \
+                            and all(len(queues[c]) + incoming[c] < queue_size for c in consumers):
+                        i, since = queue.pop(now)
+                        stats[stage.name]['wait'] += now - since
+                        slots[stage.device] -= 1
+                        for c in consumers: incoming[c] += 1
+                        running[i].add(stage.name)
+                        futures[pools[stage.device].submit(call, i, stage, contexts[i])] = (i, stage)
+
+                while next_yield in finished:
+                    context = finished.pop(next_yield)
+                    if context is not None: yield next_yield, context
+                    next_yield += 1
+                if not futures:
+                    # nothing running after the dispatch: every item is done, or no stage can ever run
+                    if exhausted and not contexts: break
+                    raise RuntimeError(f'stage graph stalled on items {sorted(contexts)}')
+
+                completed, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+                now = time.perf_counter()
+                for future in completed:
+                    i, stage = futures.pop(future)
+                    slots[stage.device] += 1
+                    for c in self.consumers[stage.name]: incoming[c] -= 1
+                    if i not in contexts: continue  # dropped while this stage ran
+                    try:
+                        outputs, start, end = future.result()
+                    except Exception as err:
+                        print(f'[INFO] stage graph: {stage.name} failed on item {i}: {err!r}')
+                        if on_error is None: raise
+                        on_error(i, stage.name, err)
+                        for queue in queues.values(): queue.drop(i, now)
+                        finished[i] = None
+                        del contexts[i], done[i], running[i]
+                        continue
+                    missing = [name for name in stage.outputs if name not in outputs]
+                    assert not missing, f'{stage.name} did not return {missing}'
+                    contexts[i].update({name: outputs[name] for name in stage.outputs})
+                    stats[stage.name]['calls'] += 1
+                    stats[stage.name]['wall'] += end - start
+                    busy[stage.device] += end - start
+                    running[i].discard(stage.name)
+                    done[i].add(stage.name)
+                    if len(done[i]) == len(self.stages):
+                        finished[i] = contexts.pop(i)
+                        del done[i], running[i]
+                    else:
+                        enqueue(i, now)
+        finally:
+            for future in futures:
+                future.cancel()
+            for pool in pools.values():
+                pool.shutdown(wait=True)
+            end = time.perf_counter()
+            self.elapsed = max(end - t0, 1e-9)
+            for name, queue in queues.items():
+                queue._tick(end)
+                stats[name]['queue_mean'] = queue.area / self.elapsed
+                stats[name]['queue_max'] = queue.max
+            self.stats = stats
+            # share of the elapsed time the device's threads spent inside stages
+            self.busy = {'cpu': busy['cpu'] / (self.elapsed * max(cpu_workers, 1)), 'gpu': busy['gpu'] / self.elapsed}
+
+    def run_one(self, item: dict, **kwargs):
+        # context of a single item after the whole graph ran on it
+        for _, context in self.run([item], **kwargs):
+            return context
+
+    def report(self):
+        """
+        -> rows [stage, device, calls, wall s, mean ms, queued ms, queue mean, queue max]
+        """
+        rows = []
+        for stage in self.stages:
+            s = self.stats.get(stage.name)
+            if s is None: continue
+            calls = max(s['calls'], 1)
+            rows.append([
+                stage.name, s['device'], s['calls'], f'{s["wall"]:.2f}', f'{s["wall"] / calls * 1e3:.1f}',
+                f'{s["wait"] / calls * 1e3:.1f}', f'{s["queue_mean"]:.2f}', s['queue_max']
+            ])
+        return rows
+
+    def print_report(self):
+        header = ['stage', 'device', 'calls', 'wall s', 'mean ms', 'queued ms', 'queue mean', 'queue max']
+        rows = [header] + [[str(v) for v in row] for row in self.report()]
+        widths = [max(len(row[k]) for row in rows) for k in range(len(header))]
+        print(f'[INFO] stage graph: {self.elapsed:.2f}s elapsed, busy ' +
+              ', '.join(f'{device} {share:.0%}' for device, share in self.busy.items()))
+        for row in rows:
+            print('  ' + '  '.join(v.ljust(w) for v, w in zip(row, widths)))
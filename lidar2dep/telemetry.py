@@ -0,0 +1,248 @@
+"""
+    Stage telemetry
+    ======================================================================
+
+    Lightweight tracing of named spans: the stages of the preprocessing
+    graph, model builds, DRGS training iterations and Flash3D inference.
+    Every span records
+
+        wall        seconds between enter and exit
+        cpu         CPU seconds of the calling thread (time.thread_time)
+        rss         resident set size at exit, bytes (/proc/self/statm)
+        peak_rss    high-water mark of the process at exit, bytes
+        cuda_peak   peak CUDA memory allocated inside the span, bytes (cuda only)
+
+    CUDA kernels run asynchronously, so the wall time of a gpu span is the
+    time to queue its work unless `sync` synchronizes at its boundaries.
+
+    Off by default: `span` is then a no-op. `configure(root=...)` (process.py
+    --telemetry / --telemetry_dir, or the TELEMETRY_DIR environment
+    variable) turns it on and appends one JSON line per finished span to
+    <root>/telemetry-<pid>.jsonl
+        {"name": "complete", "cat": "stage", "start": ..., "wall": 0.41, "cpu": 0.38, ..., "args": {"item": 3}}
+    `print_summary()` gives per-span totals and throughput, and
+    `export_chrome_trace()` writes <root>/trace-<pid>.json for
+    chrome://tracing / Perfetto.
+"""
+import os, json, time, threading, resource
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+import torch
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+_lock = threading.Lock()
+_local = threading.local()  # per thread: stack of open spans
+_state = {'enabled': False, 'root': None, 'cuda': False, 'sync': False, 'file': None, 't0': time.perf_counter(), 'epoch': time.time()}
+_records = []
+
+
+try:
+    _statm = os.open('/proc/self/statm', os.O_RDONLY)  # kept open: a pread is ~10x cheaper than an open / read
+except OSError:
+    _statm = None
+
+
+def _rss():
+    if _statm is None: return None
+    return int(os.pread(_statm, 128, 0).split()[1]) * _PAGE_SIZE
+
+
+def _peak_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # KiB on Linux
+
+
+def configure(enabled: bool = True, root: str = None, cuda: bool = None, sync: bool = False):
+    """
+    enabled:    record spans from now on
+    root:       directory of the JSON-lines log and the Chrome trace, None keeps the records in memory only
+    cuda:       also record the CUDA memory peak of every span, default when cuda is available
+    sync:       torch.cuda.synchronize() around the cuda spans, to time their kernels
+    Records of an earlier configuration are dropped.
+    """
+    with _lock:
+        if _state['file'] is not None:
+            _state['file'].close()
+        _records.clear()
+        cuda = torch.cuda.is_available() if cuda is None else cuda and torch.cuda.is_available()
+        _state.update(enabled=enabled, root=root, file=None, t0=time.perf_counter(), epoch=time.time(),
+                      cuda=cuda, sync=sync and cuda)
+        if enabled and root is not None:
+            os.makedirs(root, exist_ok=True)
+            _state['file'] = open(os.path.join(root, f'telemetry-{os.getpid()}.jsonl'), 'a', buffering=1)
+
+
+def enabled() -> bool:
+    return _state['enabled']
+
+
+def records() -> list:
+    with _lock:
+        return list(_records)
+
+
+class Span:
+    # one open span, closed by end(); see `span` / `begin`
+    def __init__(self, name: str, cat: str, args: dict, cuda: bool = None):
+        self.name, self.cat, self.args, self.open = name, cat, args, True
+        self.cuda, self.cuda_peak = _state['cuda'] and cuda is not False, 0
+        stack = _local.__dict__.setdefault('stack', [])
+        self.parent = stack[-1] if stack else None
+        stack.append(self)
+        if self.cuda:
+            if _state['sync']: torch.cuda.synchronize()
+            torch.cuda.reset_peak_memory_stats()
+        self.rss0 = _rss()
+        self.cpu0, self.t0 = time.thread_time(), time.perf_counter()
+
+    def end(self, **args):
+        # -> the record, None when already ended; `args` are added to the span's args
+        if not self.open: return None
+        if self.cuda and _state['sync']: torch.cuda.synchronize()
+        end, cpu = time.perf_counter(), time.thread_time()
+        self.open = False
+        stack = _local.stack
+        if self in stack: del stack[stack.index(self):]  # with the spans left open inside it
+        rss = _rss()
+        record = {
+            'name': self.name, 'cat': self.cat, 'start': _state['epoch'] + self.t0 - _state['t0'],
+            'wall': end - self.t0, 'cpu': cpu - self.cpu0, 'rss': rss,
+            'rss_delta': rss - self.rss0 if rss is not None and self.rss0 is not None else None,
+            'peak_rss': max(_peak_rss(), rss or 0), 'pid': os.getpid(), 'tid': threading.get_ident(),
+            'thread': threading.current_thread().name, 'args': {**self.args, **args},
+        }
+        if self.cuda:
+            # the allocator peak is reset by every nested span: the children's peaks count as well
+            self.cuda_peak = max(self.cuda_peak, torch.cuda.max_memory_allocated())
+            if self.parent is not None: self.parent.cuda_peak = max(self.parent.cuda_peak, self.cuda_peak)
+            record['cuda_peak'] = self.cuda_peak
+        with _lock:
+            _records.append(record)
+            if _state['file'] is not None:
+                _state['file'].write(json.dumps(record, default=str) + '\n')
+        return record
+
+
+class _NoSpan:
+    # stands for a Span while telemetry is off
+    def end(self, **args):
+        return None
+
+
+def begin(name: str, cat: str = 'stage', cuda: bool = None, **args):
+    """
+    Opens a span closed by `.end()`, for boundaries a `with` block does not fit
+    (e.g. inside a training loop with continue / break).
+    """
+    return Span(name, cat, args, cuda) if _state['enabled'] else _NoSpan()
+
+
+@contextmanager
+def span(name: str, cat: str = 'stage', cuda: bool = None, **args):
+    """
+    with span('complete', item=3): ...
+    cuda:   False skips the CUDA peak of a span running beside the gpu work
+            (resetting the allocator peak there would blur the gpu spans')
+    `args` go to the record, e.g. the item index or `items=n` for the
+    throughput of a span handling n items.
+    """
+    if not _state['enabled']:
+        yield None
+        return
+    handle = Span(name, cat, args, cuda)
+    try:
+        yield handle
+    finally:
+        handle.end()
+
+
+def traced(name: str = None, cat: str = 'stage'):
+    # decorator: every call of the function is a span, named after the function by default
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name or fn.__name__, cat):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def summary(recorded: list = None):
+    """
+    -> rows [cat, name, calls, wall s, mean ms, max ms, cpu %, items / s, peak rss MiB, cuda peak MiB]
+       in order of first appearance; cpu % is cpu / wall of the calling threads, items / s counts
+       the spans' `items` arg (1 per call without it) over their total wall time
+    """
+    groups = defaultdict(list)
+    for record in records() if recorded is None else recorded:
+        groups[(record['cat'], record['name'])].append(record)
+    rows = []
+    for (cat, name), group in groups.items():
+        wall = sum(r['wall'] for r in group)
+        items = sum(r['args'].get('items', 1) for r in group)
+        cuda = [r['cuda_peak'] for r in group if r.get('cuda_peak') is not None]
+        rows.append([
+            cat, name, len(group), f'{wall:.2f}', f'{wall / len(group) * 1e3:.1f}',
+            f'{max(r["wall"] for r in group) * 1e3:.1f}', f'{sum(r["cpu"] for r in group) / max(wall, 1e-9):.0%}',
+            f'{items / max(wall, 1e-9):.2f}', f'{max(r["peak_rss"] for r in group) / 2 ** 20:.0f}',
+            f'{max(cuda) / 2 ** 20:.0f}' if cuda else '-'
+        ])
+    return rows
+
+
+def print_summary():
+    # telemetry table in the layout of StageGraph.print_report; nothing while telemetry is off
+    rows = summary()
+    if not rows: return
+    header = ['cat', 'span', 'calls', 'wall s', 'mean ms', 'max ms', 'cpu', 'items/s', 'peak rss MiB', 'cuda peak MiB']
+    rows = [header] + [[str(v) for v in row] for row in rows]
+    widths = [max(len(row[k]) for row in rows) for k in range(len(header))]
+    print(f'[INFO] telemetry: {time.perf_counter() - _state["t0"]:.2f}s since configured' +
+          (f', log {_state["file"].name}' if _state['file'] is not None else ''))
+    for row in rows:
+        print('  ' + '  '.join(v.ljust(w) for v, w in zip(row, widths)))
+
+
+def chrome_trace(recorded: list = None) -> dict:
+    # Trace Event Format: one complete ('X') event per span, thread names as metadata
+    recorded = records() if recorded is None else recorded
+    t0 = min((r['start'] for r in recorded), default=0.)
+    events, threads = [], {}
+    for r in recorded:
+        threads[(r['pid'], r['tid'])] = r['thread']
+        args = {**r['args'], 'cpu_ms': round(r['cpu'] * 1e3, 3), 'rss_mib': round((r['rss'] or 0) / 2 ** 20, 1)}
+        if r.get('cuda_peak') is not None: args['cuda_peak_mib'] = round(r['cuda_peak'] / 2 ** 20, 1)
+        events.append({
+            'name': r['name'], 'cat': r['cat'], 'ph': 'X', 'pid': r['pid'], 'tid': r['tid'],
+            'ts': round((r['start'] - t0) * 1e6, 3), 'dur': round(r['wall'] * 1e6, 3), 'args': args
+        })
+    events += [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+               for (pid, tid), name in threads.items()]
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def export_chrome_trace(path: str = None):
+    """
+    path: default <root>/trace-<pid>.json, nothing without a root
+    -> the path written, or None
+    """
+    if path is None:
+        if _state['root'] is None: return None
+        path = os.path.join(_state['root'], f'trace-{os.getpid()}.json')
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(chrome_trace(), f, default=str)
+    os.replace(tmp, path)  # a viewer never opens a half written trace
+    print(f'[INFO] telemetry: chrome trace {path}')
+    return path
+
+
+def report():
+    # summary table + chrome trace of what was recorded so far, at the end of a run
+    if not _state['enabled']: return
+    print_summary()
+    export_chrome_trace()
+
+
+if os.environ.get('TELEMETRY_DIR'):
+    configure(root=os.environ['TELEMETRY_DIR'])
@@ -0,0 +1,75 @@
+"""
+    Dataset-scale preprocessing of DAIR-V2X-C
+    ======================================================================
+
+    Runs the preprocessing stage graph of `process.py` over a range / shard
+    of the cooperative pairs, each pair writing under <results>/<idx:06d>/.
+    A manifest in <results> records every finished pair, so rerunning the
+    same command resumes where a killed run stopped; a failing pair is
+    recorded and skipped instead of aborting the run.
+
+        python preprocess_dair.py --base_dir ../dair-test --indices 0:600 --shard 0/4 --results ../v2x-outputs/pre-process/
+
+    The other options of `process.py` / `lidar2dep/config.py` apply as well.
+"""
+import argparse
+from lidar2dep.batch_runner import parse_indices, parse_shard, Manifest, select_pairs, run_batch
+from lidar2dep.sharding import env_shard, shard_indices
+from lidar2dep import model_registry
+# process.py, the dataset and the loader bring in the model stack: imported where used, so the runner
+# works with a stub `process` and `dair` (tests/test_batch_runner.py)
+
+
+def get_batch_parser(parser = None):
+    from process import str2bool
+    if parser is None:
+        parser = argparse.ArgumentParser()
+    parser.add_argument('--base_dir', type=str, default='../dair-test', help='DAIR-V2X-C root')
+    parser.add_argument('--indices', type=str, default=None, help="pairs to process: '0:600', '3,7,10:20', default all")
+    parser.add_argument('--shard', type=str, default=None, help="'i/n': the i-th of n shards of --indices, default RANK/WORLD_SIZE")
+    parser.add_argument('--skip_done', type=str2bool, default=True, help='skip the pairs the manifest records as done')
+    parser.add_argument('--retry_failed', type=str2bool, default=True, help='process the pairs recorded as failed again')
+    parser.add_argument('--load_workers', type=int, default=2, help='threads decoding pairs ahead of the stage graph')
+    parser.add_argument('--prefetch', type=int, default=2, help='pairs decoded ahead')
+    return parser
+
+
+def preprocess_dataset(opt, dair = None, process = None):
+    """
+    Processes the pairs of opt.indices / opt.shard that the manifest does not
+    record as done. `process(todo, on_error)` defaults to the stage graph of
+    process.py over a PairLoader of `dair`.
+    -> Counter of 'done' / 'failed'
+    """
+    if opt.shard is not None:
+        rank, world_size = parse_shard(opt.shard)
+    else:
+        rank, world_size = env_shard()
+    if dair is None:
+        from lidar2dep.dair import DAIR_V2X_C
+        dair = DAIR_V2X_C(opt.base_dir)
+    indices = shard_indices(parse_indices(opt.indices, len(dair)), rank, world_size)
+    manifest = Manifest(opt.results, rank, world_size)
+    todo = select_pairs(indices, manifest, resume=opt.skip_done, retry_failed=opt.retry_failed)
+    print(f'[INFO] shard {rank}/{world_size}: {len(indices)} pairs, {len(indices) - len(todo)} already done, {len(todo)} to process')
+
+    if process is None:
+        from process import process_pairs
+        from lidar2dep.pair_loader import PairLoader
+
+        def process(todo, on_error):
+            pairs = PairLoader(
+                dair, indices=todo, num_workers=opt.load_workers, prefetch=opt.prefetch, rank=0, world_size=1,
+                load_pcd=True, on_error=lambda idx, err: on_error(idx, 'load', err)
+            )
+            return process_pairs(pairs, opt=opt, on_error=on_error, pair_dirs=True, debug_writes=False)
+
+    summary = run_batch(todo, process, manifest)
+    print(f'[INFO] model constructions: {dict(model_registry.build_counts)}')
+    return summary
+
+
+if __name__ == '__main__':
+    from process import get_options
+    opt, _ = get_options(get_batch_parser())
+    preprocess_dataset(opt)
@@ -1,15 +1,20 @@
-import os, glob, cv2, argparse, torch, rembg, sys, pdb
+import os, glob, cv2, argparse, torch, rembg, sys, pdb, copy
 import numpy as np
-import open3d as o3d
 from PIL import Image
 from cam_utils import downsampler, list_downsampler
 from lidar2dep.config import Get_Merged_Args, get_args_parser
-from lidar2dep.main import Args2Results, Direct_Renderring,colorize
+from lidar2dep.main import Args2Results, Args2Results_batch, write_depth_results, Direct_Renderring,colorize
 from seem.utils.constants import COCO_PANOPTIC_CLASSES
-from seem.masks import FG_remove, FG_remove_All, preload_seem_detector, preload_lama_remover
+from seem.masks import FG_remove, FG_remove_All, FG_segment_batch, FG_inpaint_batch, preload_seem_detector, preload_lama_remover
 from lidar2dep.dair import DAIR_V2X_C, CooperativeData
-from lidar2dep.main import get_CompletionFormer
-from transformers import pipeline
+from lidar2dep import model_registry, telemetry
+from lidar2dep.stage_cache import StageCache, run_stage, run_stage_many
+from lidar2dep.stage_graph import Stage, StageGraph
+from lidar2dep.data.projector import project_points_multi
+from lidar2dep.data.frustum import cull_point_cloud
+from lidar2dep.data.lidar import beam_rings, ring_map_from_index
+from lidar2dep.data.artifacts import save_frame_artifacts, load_frame_artifacts, frame_artifact_path, \
+    ARTIFACT_LEVELS, artifact_level, set_artifact_level, writes
 
 
 def str2bool(v):
@@ -33,6 +38,7 @@ def wirte_pred_depth(pred_item: dict = None, idx: int = None):
                 }, 'pcd': pcd_file
     }
     """
+    if not writes('debug'): return
     dd = './debug'
 
 
@@ -54,16 +60,22 @@ def wirte_pred_depth(pred_item: dict = None, idx: int = None):
         cv2.imwrite(f'{dd}/fg_mask.jpg', pred_item['mask'])
         named = ['colored_pred_all', 'colored_init', 'pred']
         for i in range(3):
-            cv2.imwrite(f'{depth_path}/{named[i]}.jpg', pred_item['depth']['panoptic'][i])
+            cv2.imwrite(f'{depth_path}/{named[i]}.jpg', np.clip(pred_item['depth']['panoptic'][i], 0, 255).astype(np.uint8))
 
 
+def read_depth_results(results: str, name: str):
+    # (colored_pred, colored_init, pred) of Args2Results, rebuilt from the float artifact of frame `name`
+    arrays, meta = load_frame_artifacts(frame_artifact_path(results, name), keys=['depth', 'depth_init'])
+    print(f'[INFO] loaded depth artifact {name}: units = {meta["units"]}, shape = {arrays["depth"].shape}')
+    colored_pred = colored_init = None  # visualizations, only rebuilt at artifact level debug
+    if writes('debug'):
+        colored_pred = colorize(np.clip(arrays['depth'], 0, 255).astype(np.uint8))
+        colored_init = colorize(np.clip(arrays['depth_init'], 0, 255).astype(np.uint8))
+    return colored_pred, colored_init, arrays['depth']
 
-def process_first(
-        parser = None, dair_item: CooperativeData = None, debug_part: bool = False, read_only: bool = False
-        # rgb_file_path: list[str] = None, pcd_file_path: list[str] = None,
-        # intrinsic_path: list[str] = None, extrinsic_path: list[str] = None
-):
-    # assert dair_item is not None
+
+
+def get_options(parser = None, debug_part: bool = False):
     if parser is None:
         parser = argparse.ArgumentParser()
 
@@ -77,17 +89,44 @@ def process_first(
     # SEEM
     parser.add_argument('--seem_ckpt', type=str, default="../Tools/SEEM/seem_focall_v0.pt", help='restore where the SEEM & LaMa model locates')
     parser.add_argument('--seem_cfg', type=str, default="seem/configs/seem/focall_unicl_lang_demo.yaml")
+    parser.add_argument('--seem_vocab', type=str, default='coco', help="panoptic classes: 'coco', 'driving' or comma separated COCO names, text embeddings cached per vocabulary")
     # LaMa
     parser.add_argument('--lama_ckpt', type=str, default='../Tools/LaMa/', help='actually path to lama ckpt base folder, ckpt specified in config files')
     parser.add_argument('--lama_cfg', type=str, default='./configs/lama_default.yaml', help='path to lama inpainting config path')
+    parser.add_argument('--lama_roi', type=str2bool, default=False, help='opt-in: inpaint tiles around the vehicle masks instead of whole frames (faster, inpainted pixels differ slightly)')
+    parser.add_argument('--lama_context', type=int, default=96, help='pixels of context around every masked region of a tile')
+    parser.add_argument('--lama_roi_fraction', type=float, default=0.5, help='tiles covering more of the frame fall back to the whole frame')
+    # Inference precision
+    parser.add_argument('--precision', type=str, default='fp32',
+                        help="'fp32' | 'bf16' | 'fp16', '+cl' for channels_last, per model: 'seem=fp16,lama=fp16+cl,bf16' (lidar2dep/precision.py)")
     # LLM
     parser.add_argument('--use_llm', type=str2bool, default=False, help='whether to use Claude or not')
+    # LiDAR frustum culling
+    parser.add_argument('--frustum_cull', type=str2bool, default=True, help='keep only points inside the pair\'s camera frusta')
+    parser.add_argument('--cull_margin', type=float, default=32, help='pixels kept around the image border')
+    parser.add_argument('--cull_near', type=float, default=1e-3, help='near plane in metres')
+    parser.add_argument('--cull_far', type=float, default=None, help='far plane in metres, None keeps all')
+    # Stage cache
+    parser.add_argument('--stage_cache', type=str2bool, default=True, help='reuse stage outputs of unchanged inputs / models')
+    parser.add_argument('--stage_cache_dir', type=str, default=None, help='default: <results>/stage_cache')
+    # Stage scheduling
+    parser.add_argument('--cpu_workers', type=int, default=4, help='threads running the cpu stages (decode, projection, writes)')
+    parser.add_argument('--max_inflight', type=int, default=2, help='pairs in the stage graph at once')
+    parser.add_argument('--queue_size', type=int, default=2, help='bound of every stage\'s ready queue')
     #Outputs
     parser.add_argument('--results', type=str, default='../v2x-outputs/pre-process/', help='result direction')
+    parser.add_argument('--artifact_level', type=str, default=artifact_level(), choices=ARTIFACT_LEVELS,
+                        help="'essential': only what is read downstream, 'debug': + visualizations, 'none': nothing")
+    # Telemetry
+    parser.add_argument('--telemetry', type=str2bool, default=telemetry.enabled(), help='per-stage timing / memory spans (lidar2dep/telemetry.py)')
+    parser.add_argument('--telemetry_dir', type=str, default=os.environ.get('TELEMETRY_DIR'), help='JSON-lines log and chrome trace, default: <results>/telemetry')
+    parser.add_argument('--telemetry_sync', type=str2bool, default=False, help='synchronize cuda around the gpu spans to time their kernels')
     print(f'parser = {parser}')
     opt = get_args_parser(parser=parser)
     opt.debug_mode = debug_part
-    dair_item.set_downsample(opt.downsample)
+    set_artifact_level(opt.artifact_level)
+    if opt.telemetry and not telemetry.enabled():  # configured once per process, later pairs add to the same log
+        telemetry.configure(root=opt.telemetry_dir or os.path.join(opt.results, 'telemetry'), sync=opt.telemetry_sync)
 
     # if dair_item is not None:
     #     opt.rgb_file_path = rgb_file_path
@@ -95,7 +134,6 @@ def process_first(
     #     opt.intrinsic_path = intrinsic_path
     #     opt.extrinsic_path = extrinsic_path
 
-    print('Start...')
     """
         create results directions here ↓
         MASK: os.path.join(opt.results, 'masks')
@@ -107,17 +145,10 @@ def process_first(
         os.mkdir(os.path.join(opt.results, 'remove'))
 
     setattr(opt, "device", "cuda" if torch.cuda.is_available() else "cpu")
-    if not read_only:
-        print('[INFO] Loading SEEM...')
-        preloaded_seem_detector = preload_seem_detector(opt)
-        print('[INFO] Loading LaMA...')
-        preloaded_lama_dict = preload_lama_remover(opt)
-        print('[INFO] Loading CompletionFormer...')
-        CompletionModel = get_CompletionFormer(opt)
+    return opt, parser
 
-        # monocular depth estimation with ZoeDepth
-        ZoeDepth = pipeline(task="depth-estimation", model="../Intel/zoedepth-kitti")
 
+def pair_files(dair_item: CooperativeData):
     files = [
         {
             'rgb': dair_item.inf_img_path, 'pcd': dair_item.inf_pcd_path,
@@ -127,166 +158,257 @@ def process_first(
             'rgb': dair_item.veh_img_path, 'pcd': dair_item.veh_pcd_path,
             'camera': dair_item.load4pcd_render(type='veh'), 'extra': 'veh'
         },
-        # mapping depth from veh-pcd to infrastructure view
+        # cross view: the inf cloud seen by the vehicle camera
         {
             'rgb': None, 'pcd': dair_item.inf_pcd_path,
             'camera': dair_item.load4pcd_render(type='veh'), 'extra': 'inf-side-veh'
         },
-        # mapping depth from inf-pcd to vehicle view
+        # cross view: the veh cloud seen by the infrastructure camera
         {
             'rgb': None, 'pcd': dair_item.veh_pcd_path,
             'camera': dair_item.load4pcd_render(type='inf'), 'extra': 'veh-side-inf'
         }
     ]
 
-    pred_depth = []
+    # extrinsics of the cross views: the cloud's lidar -> world -> the other lidar -> the other camera,
+    # composed for column vectors like the projector and the frustum culling (lidar2dep.dair.cross_view_columns)
+    files[2]['extrinsic'] = dair_item.inf_lidar2veh_cam()
+    files[3]['extrinsic'] = dair_item.veh_lidar2inf_cam()
+    for file in files[0:2]:
+        file['extrinsic'] = file['camera']['extrinsic']
+    return files
+
+
+# stages of process_first, run by lidar2dep.stage_graph: each reads the named values of the
+# pair's context and returns the ones it writes
+#   cpu: decode, project, render, write_removal, write_depth, read_results, assemble
+#   gpu: segment, inpaint, complete
+def stage_decode(opt, files, pair):
+    # the pair's images, decoded by the PairLoader workers (or here, on first access, for a lazy pair)
+    images = {}
+    for file in files:
+        if file['rgb'] is None: continue
+        print(f'[INFO] loading image {file["rgb"]}...')
+        images[file['extra']] = pair.side_image(file['extra'], opt.downsample) # RGB Image
+    return {'images': images}
+
+
+def stage_project(opt, files, pair, cache, read_only):
+    # every cloud of the pair once, keep what the pair's cameras see and project it into all of them in one pass
+    pcd_files, projected, ring_maps = {}, {}, {}
+    sides = {pair.inf_pcd_path: 'inf', pair.veh_pcd_path: 'veh'}
+    for pcd_file_path in dict.fromkeys(file['pcd'] for file in files):
+        # decoded by the PairLoader with load_pcd; a shallow copy, so culling leaves the pair's cloud whole
+        pcd_files[pcd_file_path] = copy.copy(getattr(pair, f'{sides[pcd_file_path]}_side_pcd'))
+        if opt.frustum_cull:
+            cameras = [file for file in files if file['pcd'] == pcd_file_path]
+            cull_point_cloud(
+                pcd_files[pcd_file_path],
+                np.stack([file['camera']['intrinsic']['matrix'] for file in cameras]),
+                np.stack([file['extrinsic'] for file in cameras]),
+                [(file['camera']['intrinsic']['dict']['height'], file['camera']['intrinsic']['dict']['width']) for file in cameras],
+                margin=max(opt.cull_margin, 2), near=opt.cull_near, far=opt.cull_far, name=pcd_file_path
+            )  # margin >= splat radius: the depth maps are unchanged
+        group = [file for file in files if file['pcd'] == pcd_file_path and (file['rgb'] is None or not read_only)]
+        if len(group) == 0: continue
+        Ks = np.stack([file['camera']['intrinsic']['matrix'] for file in group])
+        extrinsics = np.stack([file['extrinsic'] for file in group])
+        sizes = [(file['camera']['intrinsic']['dict']['height'], file['camera']['intrinsic']['dict']['width']) for file in group]
+
+        def project(points=pcd_files[pcd_file_path].points, Ks=Ks, extrinsics=extrinsics, sizes=sizes, group=group):
+            depth_maps, point_index = project_points_multi(
+                np.asarray(points), Ks, extrinsics, sizes, point_size=5, return_index=True
+            )
+            # beam rings of the raw points, carried into every view for lidar line sampling
+            rings = beam_rings(points)
+            outputs = {}
+            for file, depth_map, index in zip(group, depth_maps, point_index):
+                outputs[f'depth-{file["extra"]}'] = depth_map
+                outputs[f'ring-{file["extra"]}'] = ring_map_from_index(rings, index)
+            return outputs
+        outputs = run_stage(
+            cache, 'projection', project, inputs=[pcd_files[pcd_file_path].points, Ks, extrinsics, sizes],
+            params={'point_size': 5, 'views': [file['extra'] for file in group]}
+        )
+        for file in group:
+            projected[file['extra']] = outputs[f'depth-{file["extra"]}']
+            ring_maps[file['extra']] = outputs[f'ring-{file["extra"]}']
+    return {'pcd_files': pcd_files, 'projected': projected, 'ring_maps': ring_maps}
 
-    print(f'files: {files}')
-    idxxx = 0
+
+def stage_render(opt, files, pcd_files, projected):
+    side_depths = {}
+    for file in files:
+        if file['rgb'] is not None: continue
+        side_depths[file['extra']] = Direct_Renderring(
+            pcd_files[file['pcd']], opt.depth_path, file['extra'], file['camera']['intrinsic'], file['extrinsic'],
+            pcd_img=projected[file['extra']]
+        )  # {"side-depth": depth}
+    return {'side_depths': side_depths}
+
+
+def stage_segment(opt, images, cache, models):
+    # TODO: use seem to remove foreground
+    print(f'[INFO] background removal...')
+    # segmentation + mask merge of both sides in one SEEM batch, cached by content
+    seg_params = {'reftxt': 'Car', 'dilate_kernel_size': 30, 'use_llm': opt.use_llm, 'visualize': writes('debug')}
+    extras = list(images)
+    segs = run_stage_many(
+        cache, 'segment',
+        lambda idx: FG_segment_batch(opt, [images[extras[i]] for i in idx], preloaded_seem_detector=models['seem'].get(), **seg_params),
+        inputs_list=[[images[extra]] for extra in extras], params=dict(seg_params, vocab=opt.seem_vocab), models=[models['seem']]
+    )
+    return {'segs': dict(zip(extras, segs))}
+
+
+def stage_inpaint(opt, images, segs, cache, models):
+    # LaMa on the vehicles (bg) and on the rest (fg) of every side, the pair's four passes as one batch
+    removal = {extra: {'image': images[extra], 'res': seg.get('res'), 'mask': seg['mask']} for extra, seg in segs.items()}
+    passes = [(extra, part, mask_hw) for extra, removed in removal.items()
+              for part, mask_hw in [('bg', removed['mask']), ('fg', 1. - removed['mask'])]]
+    inpainted = run_stage_many(
+        cache, 'inpaint',
+        lambda idx: [dict(zip(['mask', 'image'], out)) for out in FG_inpaint_batch(
+            opt, [(removal[passes[i][0]]['image'], passes[i][2]) for i in idx], models['lama'].get())],
+        inputs_list=[[removal[extra]['image'], mask_hw] for extra, _, mask_hw in passes], models=[models['lama']],
+        params={'roi': opt.lama_roi, 'context': opt.lama_context, 'fraction': opt.lama_roi_fraction}
+    )
+    for (extra, part, _), out in zip(passes, inpainted):
+        removal[extra][part] = out
+    return {'removal': removal, 'masks': {extra: np.uint8(removed['bg']['mask']) for extra, removed in removal.items()}}
+
+
+def stage_complete(opt, files, removal, pcd_files, projected, ring_maps, cache, models):
+    # depth completion of the background / foreground / panoptic variants of every side in one batch:
+    # a side's three variants share its projected sparse depth, ZoeDepth and CompletionFormer run once per resolution
+    requests = []
+    for file in files:
+        if file['rgb'] is None: continue
+        extra, removed = file['extra'], removal[file['extra']]
+        mask = np.uint8(removed['bg']['mask'])
+        common = {
+            'pcd_file_path': pcd_files[file['pcd']], 'intrinsics': file['camera']['intrinsic'],
+            'extrinsics': file['camera']['extrinsic'], 'pcd_img': projected[extra], 'ring_img': ring_maps[extra]
+        }
+        requests += [
+            # BackGround
+            dict(common, rgb_file=np.uint8(removed['bg']['image']), fg_mask=mask, extra_name=f'{extra}-bg'),
+            # ForeGround: 前景使用lama填充背景
+            dict(common, rgb_file=np.uint8(removed['fg']['image']), fg_mask=1.-mask, extra_name=f'{extra}-fg'),
+            # 全景用img+pcd估计深度后，前背景分离监督
+            dict(common, rgb_file=np.array(removed['image']), fg_mask=None, extra_name=f'{extra}-panoptic'),
+        ]
+    # the artifact / JPG writes are left to the write_depth stage
+    completed, depth_writes = Args2Results_batch(
+        opt, requests, CompletionModel=models['completionformer'], depth_estimater=models['zoedepth'],
+        new_path=False, cache=cache, write=False
+    )
+    depth_results = {request['extra_name']: out for request, out in zip(requests, completed)}
+    return {'depth_results': depth_results, 'depth_writes': depth_writes}
+
+
+def stage_write_removal(opt, removal):
+    for extra_name, removed in removal.items():
+        mask = np.uint8(removed['bg']['mask'])
+        if writes('debug'):
+            carved_image, carved_image_fg = np.uint8(removed['bg']['image']), np.uint8(removed['fg']['image'])
+            # TODO: save intermediate results
+            cv2.imwrite(os.path.join(opt.results, f'remove/mask-{extra_name}.jpg'), cv2.cvtColor(mask, cv2.COLOR_RGB2BGR))
+            if removed['res'] is not None:
+                cv2.imwrite(os.path.join(opt.results, f'remove/res-{extra_name}.jpg'), cv2.cvtColor(np.uint8(removed['res']), cv2.COLOR_RGB2BGR))
+            cv2.imwrite(os.path.join(opt.results, f'remove/removed-{extra_name}-bg.jpg'), cv2.cvtColor(carved_image, cv2.COLOR_RGB2BGR))
+            cv2.imwrite(os.path.join(opt.results, f'remove/removed-{extra_name}-fg.jpg'), cv2.cvtColor(carved_image_fg, cv2.COLOR_RGB2BGR))
+        if writes('essential'):
+            save_frame_artifacts(frame_artifact_path(opt.results, f'{extra_name}-remove'), mask=mask) # lossless fg-mask
+
+
+def stage_write_depth(depth_writes):
+    write_depth_results(depth_writes)
+
+
+def stage_read_results(opt, files):
+    # read_only: fg-masks and depth of an earlier run
+    masks, depth_results = {}, {}
     for file in files:
-        # print(f'[Debug] <now> idxxx = {idxxx}')
-        idxxx += 1
-        rgb_file = file['rgb'] # pil
-        pcd_file_path = file['pcd']
-        pcd_file = o3d.io.read_point_cloud(pcd_file_path)
-
-        # pdb.set_trace()
-        camera = file['camera']
+        if file['rgb'] is None: continue
         extra_name = file['extra']
+        masks[extra_name] = load_frame_artifacts(frame_artifact_path(opt.results, f'{extra_name}-remove'), keys=['mask'])[0]['mask']
+        for part in ['fg', 'bg', 'panoptic']:
+            depth_results[f'{extra_name}-{part}'] = read_depth_results(opt.results, f'{extra_name}-{part}')
+    return {'masks': masks, 'depth_results': depth_results}
 
-        if rgb_file is None:
-            # 算变换矩阵
-            if 'inf' in extra_name: # inf view veh: veh_lidar 2 world 2 inf_lidar 2 inf_cam
-                veh_lidar2world = dair_item.veh_lidar2world()
-                world2inf_cam = dair_item.world2inf_cam()
-                cam_extrinsics = veh_lidar2world @ world2inf_cam
-
-            else:
-                inf_lidar2world = dair_item.inf_lidar2world()
-                world2veh_cam = dair_item.world2veh_cam()
-                cam_extrinsics = inf_lidar2world @ world2veh_cam
-
-            direct_result = Direct_Renderring(pcd_file, opt.depth_path, extra_name, camera['intrinsic'], cam_extrinsics)
-            # {"side-depth": depth}
-            pred_depth.append(direct_result)
-            continue
 
-        # pdb.set_trace()
-        if read_only:
-            image = Image.open(rgb_file)  # RGB Image
-            image = downsampler(image, opt.downsample)
-            mask = cv2.imread(os.path.join(opt.results, f'remove/mask-{extra_name}.jpg'))
-
-            colored_pred_fg, colored_init_fg, pred_fg = cv2.imread(os.path.join(opt.results, f'pred_depth-{extra_name}-fg.jpg')), cv2.imread(os.path.join(opt.results, f'colored_pred_depth-{extra_name}-fg.jpg')), cv2.imread(os.path.join(opt.results, f'colored_pred_init-{extra_name}-fg.jpg'))
-            colored_pred_bg, colored_init_bg, pred_bg = cv2.imread(os.path.join(opt.results, f'pred_depth-{extra_name}-bg.jpg')), cv2.imread(os.path.join(opt.results, f'colored_pred_depth-{extra_name}-bg.jpg')), cv2.imread(os.path.join(opt.results, f'colored_pred_init-{extra_name}-bg.jpg'))
-            colored_pred_all, colored_init, pred = cv2.imread(os.path.join(opt.results, f'pred_depth-{extra_name}-panoptic.jpg')), cv2.imread(os.path.join(opt.results, f'colored_pred_depth-{extra_name}-panoptic.jpg')), cv2.imread(os.path.join(opt.results, f'colored_pred_init-{extra_name}-panoptic.jpg'))
-
-            # colored_pred_fg, colored_init_fg, pred_fg, \
-            #     colored_pred_bg, colored_init_bg, pred_bg, \
-            #     colored_pred_all, colored_init, pred = \
-            #     list_downsampler([
-            #         colored_pred_fg, colored_init_fg, pred_fg,
-            #         colored_pred_bg, colored_init_bg, pred_bg,
-            #         colored_pred_all, colored_init, pred
-            #     ], opt.downsample)
-
-
-            pred_depth.append({
-                'rgb': image,  # pil
-                'mask': mask,  # fg-mask
-                'depth': {
-                    'fg': (colored_pred_fg, colored_init_fg, pred_fg),
-                    'bg': (colored_pred_bg, colored_init_bg, pred_bg),
-                    'panoptic': (colored_pred_all, colored_init, pred)  # TODO: adjust it onto PointCloud again ?
-                }, 'pcd': pcd_file
-            })
+def stage_assemble(opt, files, images, masks, depth_results, side_depths, pcd_files):
+    pred_depth = []
+    print(f'files: {files}')
+    for file in files:
+        extra_name = file['extra']
+        if file['rgb'] is None:
+            pred_depth.append(side_depths[extra_name])
             continue
 
-
-        # load image
-        print(f'[INFO] loading image {rgb_file}...')
-        image = Image.open(rgb_file) # RGB Image
-        image = downsampler(image, opt.downsample)
-
-        # TODO: use seem to remove foreground
-        print(f'[INFO] background removal...')
-        res, mask, carved_image = FG_remove_All(
-            opt = opt, img = image,
-            preloaded_seem_detector=preloaded_seem_detector, preloaded_lama_dict=preloaded_lama_dict,
-            use_llm=opt.use_llm
-        )
-
-        _, _, carved_image_fg = FG_remove_All(
-            opt=opt, img=image, mask = 1.-mask,
-            preloaded_seem_detector=preloaded_seem_detector, preloaded_lama_dict=preloaded_lama_dict,
-            use_llm=opt.use_llm
-        )
-
-        mask, res, carved_image, carved_image_fg = np.uint8(mask), np.uint8(res), np.uint8(carved_image), np.uint8(carved_image_fg)
-        # TODO: save intermediate results
-        cv2.imwrite(os.path.join(opt.results, f'remove/mask-{extra_name}.jpg'), cv2.cvtColor(mask, cv2.COLOR_RGB2BGR))
-        cv2.imwrite(os.path.join(opt.results, f'remove/res-{extra_name}.jpg'), cv2.cvtColor(res, cv2.COLOR_RGB2BGR))
-        cv2.imwrite(os.path.join(opt.results, f'remove/removed-{extra_name}-bg.jpg'), cv2.cvtColor(carved_image, cv2.COLOR_RGB2BGR))
-        cv2.imwrite(os.path.join(opt.results, f'remove/removed-{extra_name}-fg.jpg'), cv2.cvtColor(carved_image_fg, cv2.COLOR_RGB2BGR))
-
         if opt.debug_mode:
             pdb.set_trace()
 
-        # BackGround
-        colored_pred_bg, colored_init_bg, pred_bg = \
-            Args2Results(
-                opt, rgb_file=carved_image, pcd_file_path=pcd_file,
-                intrinsics=camera['intrinsic'], extrinsics=camera['extrinsic'],
-                CompletionModel = CompletionModel,
-                fg_mask=mask, new_path=False, extra_name=f'{extra_name}-bg', depth_estimater=ZoeDepth
-            )
-        # ForeGround
-        # colored_pred_fg, colored_init_fg, pred_fg = \
-        #   Args2Results(opt, rgb_file=np.array(image)*mask, fg_mask=1.-mask, new_path=False, extra_name='fg')
-        #   前景没有背景
-        colored_pred_fg, colored_init_fg, pred_fg = \
-            Args2Results(
-                opt, rgb_file=carved_image_fg, pcd_file_path=pcd_file,
-                intrinsics=camera['intrinsic'], extrinsics=camera['extrinsic'],
-                CompletionModel=CompletionModel,
-                fg_mask=1.-mask, new_path=False, extra_name=f'{extra_name}-fg', depth_estimater=ZoeDepth
-            )
-        #   前景使用lama填充背景
-
-        # 全景用img+pcd估计深度后，前背景分离监督
-        colored_pred_all, colored_init, pred = \
-            Args2Results(
-                opt, rgb_file=np.array(image), pcd_file_path=pcd_file,
-                intrinsics=camera['intrinsic'], extrinsics=camera['extrinsic'],
-                CompletionModel=CompletionModel,
-                fg_mask=None, new_path=False, extra_name=f'{extra_name}-panoptic', depth_estimater=ZoeDepth
-            )
+        colored_pred_bg, colored_init_bg, pred_bg = depth_results[f'{extra_name}-bg']
+        colored_pred_fg, colored_init_fg, pred_fg = depth_results[f'{extra_name}-fg']
+        colored_pred_all, colored_init, pred = depth_results[f'{extra_name}-panoptic']
         # 不分前背景
-        print(colored_pred_bg, colored_pred_fg)
-        print(colored_init_bg, colored_init_fg)
-        print(pred_bg, pred_fg)
+        if writes('debug'):
+            print(colored_pred_bg, colored_pred_fg)
+            print(colored_init_bg, colored_init_fg)
+            print(pred_bg, pred_fg)
         # np.array - [H W 3]
 
-        if opt.debug_mode:
-            pdb.set_trace()
-
         pred_depth.append({
-                'rgb': image, # pil
-                'mask': mask, # fg-mask
+                'rgb': images[extra_name], # pil
+                'mask': masks[extra_name], # fg-mask
                 'depth': {
                 'fg': (colored_pred_fg, colored_init_fg, pred_fg),
                 'bg': (colored_pred_bg, colored_init_bg, pred_bg),
                 'panoptic': (colored_pred_all, colored_init, pred) # TODO: adjust it onto PointCloud again ?
-                }, 'pcd': pcd_file
+                }, 'pcd': pcd_files[file['pcd']]
             })
+    assert len(pred_depth) == 4, f'len(pred_depth) = {len(pred_depth)}'
+    return {'pred_depth': pred_depth}
 
-    print('\nDone.')
 
+SOURCES = ['opt', 'pair', 'files', 'cache', 'models', 'read_only']
 
-    assert len(pred_depth) == 4, f'len(pred_depth) = {len(pred_depth)}'
 
-    for i in range(len(pred_depth)):
-        wirte_pred_depth(pred_depth[i], i)
+def preprocess_graph(read_only: bool = False):
+    # decode / projection / writes on cpu threads overlap SEEM, LaMa and depth completion on the gpu thread
+    stages = [
+        Stage('decode', stage_decode, ['opt', 'files', 'pair'], ['images']),
+        Stage('project', stage_project, ['opt', 'files', 'pair', 'cache', 'read_only'], ['pcd_files', 'projected', 'ring_maps']),
+        Stage('render', stage_render, ['opt', 'files', 'pcd_files', 'projected'], ['side_depths']),
+        Stage('assemble', stage_assemble, ['opt', 'files', 'images', 'masks', 'depth_results', 'side_depths', 'pcd_files'], ['pred_depth']),
+    ]
+    if read_only:
+        stages.append(Stage('read_results', stage_read_results, ['opt', 'files'], ['masks', 'depth_results']))
+    else:
+        stages += [
+            Stage('segment', stage_segment, ['opt', 'images', 'cache', 'models'], ['segs'], device='gpu'),
+            Stage('inpaint', stage_inpaint, ['opt', 'images', 'segs', 'cache', 'models'], ['removal', 'masks'], device='gpu'),
+            Stage('complete', stage_complete, ['opt', 'files', 'removal', 'pcd_files', 'projected', 'ring_maps', 'cache', 'models'],
+                  ['depth_results', 'depth_writes'], device='gpu'),
+            Stage('write_removal', stage_write_removal, ['opt', 'removal']),
+            Stage('write_depth', stage_write_depth, ['depth_writes']),
+        ]
+    return StageGraph(stages, sources=SOURCES)
+
+
+def preprocess_models(opt):
+    # built once per process by the registry on first use: stages served by the cache never load them
+    # monocular depth estimation with ZoeDepth
+    return {name: model_registry.LazyModel(name, opt) for name in ['seem', 'lama', 'completionformer', 'zoedepth']}
+
+
+def pair_results(context: dict, parser = None, debug_writes: bool = True):
+    pred_depth, opt = context['pred_depth'], context['opt']
+    if debug_writes:
+        for i in range(len(pred_depth)):
+            wirte_pred_depth(pred_depth[i], i)
 
     return {
         'inf-side': pred_depth[0],
@@ -298,15 +420,93 @@ def process_first(
     }
 
 
+def pair_options(opt, idx: int):
+    # opt of one pair writing under <results>/<idx:06d>/ (artifacts, remove/, projected views)
+    pair_opt = copy.copy(opt)
+    pair_opt.results = pair_opt.depth_path = os.path.join(opt.results, f'{idx:06d}')
+    os.makedirs(os.path.join(pair_opt.results, 'remove'), exist_ok=True)
+    return pair_opt
+
+
+def process_first(
+        parser = None, dair_item: CooperativeData = None, debug_part: bool = False, read_only: bool = False
+        # rgb_file_path: list[str] = None, pcd_file_path: list[str] = None,
+        # intrinsic_path: list[str] = None, extrinsic_path: list[str] = None
+):
+    # assert dair_item is not None
+    opt, parser = get_options(parser, debug_part)
+    dair_item.set_downsample(opt.downsample)
+
+    print('Start...')
+    cache = StageCache(opt.stage_cache_dir or os.path.join(opt.results, 'stage_cache'), enabled=opt.stage_cache)
+    graph = preprocess_graph(read_only)
+    context = graph.run_one(
+        {'opt': opt, 'pair': dair_item, 'files': pair_files(dair_item), 'cache': cache, 'models': preprocess_models(opt), 'read_only': read_only},
+        cpu_workers=opt.cpu_workers, max_inflight=1, queue_size=opt.queue_size
+    )
+
+    print('\nDone.')
+    print(f'[INFO] stage cache: {dict(cache.stats)}')
+    graph.print_report()
+    telemetry.report()
+    return pair_results(context, parser)
+
+
+def process_pairs(
+        pairs, parser = None, debug_part: bool = False, read_only: bool = False,
+        opt = None, on_error = None, pair_dirs: bool = False, debug_writes: bool = True
+):
+    """
+    process_first over a stream of (idx, CooperativeData), e.g. a PairLoader:
+    options, cache and models are set up once and up to `--max_inflight` pairs
+    share the stage graph, so the decoding / projection / writes of one pair
+    overlap the gpu stages of another. Yields (idx, process_first result) in order.
+        opt:        parsed options, default parsed from `parser`
+        on_error:   on_error(idx, stage, err) skips a failing pair instead of raising
+        pair_dirs:  every pair writes under <results>/<idx:06d>/ instead of overwriting <results>
+    """
+    if opt is None:
+        opt, parser = get_options(parser, debug_part)
+    cache = StageCache(opt.stage_cache_dir or os.path.join(opt.results, 'stage_cache'), enabled=opt.stage_cache)
+    models = preprocess_models(opt)
+    graph = preprocess_graph(read_only)
+    indices = []
+
+    def contexts():
+        for idx, pair in pairs:
+            try:
+                pair.set_downsample(opt.downsample)
+                files = pair_files(pair)
+                pair_opt = pair_options(opt, idx) if pair_dirs else opt
+            except Exception as err:
+                if on_error is None: raise
+                on_error(idx, 'files', err)
+                continue
+            indices.append(idx)
+            yield {'opt': pair_opt, 'pair': pair, 'files': files, 'cache': cache, 'models': models, 'read_only': read_only}
+
+    failed = None if on_error is None else lambda i, stage, err: on_error(indices[i], stage, err)
+    for i, context in graph.run(
+            contexts(), cpu_workers=opt.cpu_workers, max_inflight=opt.max_inflight, queue_size=opt.queue_size, on_error=failed
+    ):
+        yield indices[i], pair_results(context, parser, debug_writes)
+    print(f'[INFO] stage cache: {dict(cache.stats)}')
+    graph.print_report()
+    telemetry.report()
+
+
 
 
 if __name__ == '__main__':
     base_dir = '../dair-test'
     dair = DAIR_V2X_C(base_dir)
     from random import randint
+    from lidar2dep.pair_loader import PairLoader
 
     # prepared_idx = randint(0, 1000) % 600  # random
-    prepared_idx = 0 # TEST
-    pair = CooperativeData(dair[prepared_idx], base_dir)  # dair_item
-
-    processed_dict = process_first(parser=None, dair_item=pair)
+    # PAIR_INDICES: comma separated pair indices, e.g. PAIR_INDICES=0,1,2
+    prepared_idx = [int(i) for i in os.environ.get('PAIR_INDICES', '0').split(',')] # TEST
+    pairs = PairLoader(dair, indices=prepared_idx, num_workers=2, prefetch=2, load_pcd=True)
+    for idx, processed_dict in process_pairs(pairs, parser=None):
+        print(f'[INFO] pair {idx} preprocessed')
+    print(f'[INFO] model constructions over {len(prepared_idx)} pairs: {dict(model_registry.build_counts)}')
@@ -0,0 +1,93 @@
+import argparse, os, io, tempfile, contextlib
+import numpy as np
+import torch
+from PIL import Image
+from bench_utils import timed, print_table
+
+from lidar2dep.data.artifacts import ARTIFACT_LEVELS, set_artifact_level, writes
+from process import stage_render, stage_complete, stage_write_removal, stage_write_depth, stage_assemble, pair_results
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--height', default=270, type=int, help='default: 1080p DAIR-V2X image, downsample 4')
+parser.add_argument('--width', default=480, type=int)
+parser.add_argument('--levels', nargs='+', default=ARTIFACT_LEVELS[::-1], choices=ARTIFACT_LEVELS)
+parser.add_argument('--repeat', default=3, type=int)
+args = parser.parse_args()
+
+
+class StubCompletion(torch.nn.Module):
+    # CPU stand-in for CompletionFormer: same batch contract, the sparse depth smoothed as prediction
+    def forward(self, sample):
+        pred = torch.nn.functional.avg_pool2d(sample['dep'], 9, 1, 4) * 4.
+        return {'pred': pred, 'pred_init': sample['dep'], 'confidence': None}
+
+
+# the model outputs of one cooperative pair: segmentation / inpainting of both sides, projected LiDAR of all 4 views
+rng = np.random.default_rng(0)
+h, w = args.height, args.width
+K = np.array([[w, 0, w / 2], [0, w, h / 2], [0, 0, 1.]])
+camera = {'intrinsic': {'matrix': K, 'dict': {'height': h, 'width': w}}, 'extrinsic': np.eye(4)}
+extras = ['inf', 'veh', 'inf-side-veh', 'veh-side-inf']
+files = [{'rgb': f'{extra}.jpg' if i < 2 else None, 'pcd': f'{extra}.pcd', 'camera': camera, 'extra': extra, 'extrinsic': np.eye(4)}
+         for i, extra in enumerate(extras)]
+images = {extra: Image.fromarray(rng.integers(0, 255, (h, w, 3), dtype=np.uint8)) for extra in extras[0:2]}
+projected = {extra: np.where(rng.random((h, w)) < 0.05, rng.uniform(2, 120, (h, w)), 0) for extra in extras}
+ring_maps = {extra: rng.integers(-1, 64, (h, w)) for extra in extras}
+pcd_files = {file['pcd']: None for file in files}
+mask = np.zeros((h, w), dtype=np.uint8)
+mask[h // 3:h // 2, w // 4:w // 2] = 255
+
+
+def removal_of(extra):
+    # stage_inpaint output, 'res' (the SEEM overlay) only drawn at artifact level debug
+    mask_3 = np.repeat(mask[..., None], 3, -1)
+    image = np.asarray(images[extra])
+    return {
+        'image': images[extra], 'res': image.copy() if writes('debug') else None, 'mask': mask,
+        'bg': {'mask': mask_3, 'image': image}, 'fg': {'mask': 255 - mask_3, 'image': image}
+    }
+
+
+def frame(level, root):
+    # the cpu side of one pair after the models: colorizing, projected views, artifact writes, assembly
+    set_artifact_level(level)
+    opt = argparse.Namespace(results=root, depth_path=root, device='cpu', debug_mode=False, rgb_file_path=None, pcd_file_path=None,
+                             intrinsic_path=None, extrinsic_path=None)
+    os.makedirs(os.path.join(root, 'remove'), exist_ok=True)
+    cwd = os.getcwd()
+    os.chdir(root)  # wirte_pred_depth dumps under ./debug
+    try:
+        os.makedirs('debug', exist_ok=True)
+        with contextlib.redirect_stdout(io.StringIO()):
+            context = {'opt': opt, 'images': images, 'pcd_files': pcd_files}
+            context.update(stage_render(opt, files, pcd_files, projected))
+            removal = {extra: removal_of(extra) for extra in extras[0:2]}
+            context.update(stage_complete(opt, files, removal, pcd_files, projected, ring_maps, None,
+                                          {'completionformer': StubCompletion(), 'zoedepth': None}))
+            stage_write_removal(opt, removal)
+            stage_write_depth(context['depth_writes'])
+            masks = {extra: np.uint8(removed['bg']['mask']) for extra, removed in removal.items()}
+            context.update(stage_assemble(opt, files, images, masks, context['depth_results'], context['side_depths'], pcd_files))
+            pair_results(context)
+    finally:
+        os.chdir(cwd)
+
+
+def written(root):
+    sizes = [os.path.getsize(os.path.join(d, f)) for d, _, names in os.walk(root) for f in names]
+    return len(sizes), sum(sizes)
+
+
+rows, base = [], None
+for level in args.levels:
+    roots = []
+    def run():
+        roots.append(tempfile.mkdtemp())
+        frame(level, roots[-1])
+    cost, _ = timed(run, args.repeat)
+    count, size = written(roots[-1])
+    base = base or cost
+    rows.append([level, f'{cost * 1e3:.1f}', f'{base / cost:.2f}x', count, f'{size / 2 ** 20:.2f}'])
+
+print(f'one cooperative pair ({h} x {w}) after the models: render, completion outputs, writes, assembly')
+print_table(rows, ['artifact level', 'ms / frame', 'speedup', 'files', 'MiB written'])
@@ -0,0 +1,59 @@
+import argparse, os, tempfile
+import cv2
+import numpy as np
+from bench_utils import timed, print_table
+
+from lidar2dep.data.artifacts import save_frame_artifacts, load_frame_artifacts
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--height', default=1080, type=int)
+parser.add_argument('--width', default=1920, type=int)
+parser.add_argument('--repeat', default=5, type=int)
+args = parser.parse_args()
+
+# dense completion-like depth on the 0-255 scale, smooth ramp + texture, plus a sparse LiDAR map in metres
+rng = np.random.default_rng(0)
+h, w = args.height, args.width
+ramp = np.linspace(20, 250, h, dtype=np.float32)[:, None] + 5 * np.sin(np.arange(w, dtype=np.float32) / 40.)[None]
+depth = (ramp + rng.normal(0, 1.5, (h, w))).clip(0, 255).astype(np.float32)
+depth_init = (depth + rng.normal(0, 3, (h, w))).clip(0, 255).astype(np.float32)
+sparse = np.where(rng.random((h, w)) < 0.05, rng.uniform(2, 120, (h, w)), 0).astype(np.float32)
+mask = np.repeat((rng.random((h, w)) < 0.2).astype(np.uint8)[..., None], 3, -1)
+root = tempfile.mkdtemp()
+
+
+def jpg_write():
+    # previous outputs: uint8 pred depth + mask JPGs
+    cv2.imwrite(os.path.join(root, 'pred_depth.jpg'), depth.astype(np.uint8))
+    cv2.imwrite(os.path.join(root, 'pred_init.jpg'), depth_init.astype(np.uint8))
+    cv2.imwrite(os.path.join(root, 'mask.jpg'), mask)
+    return [os.path.join(root, f'{n}.jpg') for n in ['pred_depth', 'pred_init', 'mask']]
+
+
+def jpg_read(paths):
+    return [cv2.imread(p) for p in paths]
+
+
+def npz_write(dtype, level):
+    path = os.path.join(root, f'frame-{dtype}-{level}.npz')
+    save_frame_artifacts(path, units='normalized', dtype=dtype, meta={'depth_range': [2., 120.]}, compress_level=level,
+                         depth=depth, depth_init=depth_init, sparse_depth=sparse, mask=mask)
+    return [path]
+
+
+rows = []
+cost_w, paths = timed(jpg_write, args.repeat)
+cost_r, out = timed(lambda: jpg_read(paths), args.repeat)
+err = np.abs(out[0][..., 0].astype(np.float32) - depth).max()
+rows.append(['uint8 JPG (depth, init, mask)', f'{sum(os.path.getsize(p) for p in paths) / 2 ** 20:.2f}',
+             f'{cost_w * 1e3:.1f}', f'{cost_r * 1e3:.1f}', f'{err:.3f}', 'no'])
+for dtype, level in [('float16', 1), ('float16', 6), ('float32', 1), ('float32', 0)]:
+    cost_w, paths = timed(lambda: npz_write(dtype, level), args.repeat)
+    cost_r, (arrays, _) = timed(lambda: load_frame_artifacts(paths[0]), args.repeat)
+    err = np.abs(arrays['depth'] - depth).max()
+    rows.append([f'{dtype} npz, zlib {level} (+ sparse metric depth)', f'{os.path.getsize(paths[0]) / 2 ** 20:.2f}',
+                 f'{cost_w * 1e3:.1f}', f'{cost_r * 1e3:.1f}', f'{err:.3f}',
+                 'yes' if np.array_equal(arrays['mask'], mask) else 'no'])
+
+print(f'{h} x {w} frame')
+print_table(rows, ['format', 'MiB', 'write ms', 'read ms', 'max depth err', 'mask lossless'])
@@ -0,0 +1,44 @@
+import argparse, glob
+import numpy as np
+import torch
+from PIL import Image
+from bench_utils import timed, print_table
+
+from cam_utils import downsampler
+from seem.masks import preload_lama_remover, inpaint_img_with_lama, inpaint_imgs_with_lama
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--images', nargs='+', default=None, help='default: first two of ./data/image')
+parser.add_argument('--downsample', default=4, type=int)
+parser.add_argument('--lama_ckpt', type=str, default='../Tools/LaMa/')
+parser.add_argument('--lama_cfg', type=str, default='./configs/lama_default.yaml')
+parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+parser.add_argument('--repeat', default=3, type=int)
+args = parser.parse_args()
+
+paths = args.images or sorted(glob.glob('./data/image/*'))[0:2]
+rng = np.random.default_rng(0)
+items = []
+for path in paths:
+    image = np.asarray(downsampler(Image.open(path).convert('RGB'), args.downsample))
+    # a vehicle-like box mask and its complement: the bg / fg passes of process_first
+    mask = np.zeros(image.shape[0:2], dtype=np.uint8)
+    h, w = mask.shape
+    y, x = rng.integers(0, h // 2), rng.integers(0, w // 2)
+    mask[y:y + h // 3, x:x + w // 3] = 255
+    items += [(image, mask), (image, 1. - mask)]
+
+lama = preload_lama_remover(argparse.Namespace(lama_cfg=args.lama_cfg, lama_ckpt=args.lama_ckpt, device=args.device))
+sync = torch.cuda.synchronize if args.device.startswith('cuda') else None
+
+cost_loop, ref = timed(lambda: [inpaint_img_with_lama(img, mask, device=args.device, preloaded_lama_remover=lama)
+                                for img, mask in items], args.repeat, sync=sync)
+cost_batch, out = timed(lambda: inpaint_imgs_with_lama(items, device=args.device, preloaded_lama_remover=lama),
+                        args.repeat, sync=sync)
+err = max(np.abs(a.astype(np.int16) - b).max() for a, b in zip(ref, out))
+
+print(f'{len(items)} LaMa passes from {len(paths)} images on {args.device}, max abs diff {err}')
+print_table([
+    ['per-image loop', f'{cost_loop * 1e3:.1f}', f'{cost_loop / len(items) * 1e3:.1f}', '1.0x'],
+    ['batched', f'{cost_batch * 1e3:.1f}', f'{cost_batch / len(items) * 1e3:.1f}', f'{cost_loop / cost_batch:.2f}x'],
+], ['mode', 'total ms', 'ms / image', 'speedup'])
@@ -0,0 +1,55 @@
+import argparse, glob
+import numpy as np
+import torch
+from PIL import Image
+from bench_utils import timed, print_table
+
+from cam_utils import downsampler
+from seem.masks import preload_lama_remover, inpaint_imgs_with_lama, inpaint_imgs_with_lama_roi, mask_rois
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--images', nargs='+', default=None, help='default: first two of ./data/image')
+parser.add_argument('--downsample', default=1, type=int, help='default: full 1920 x 1080 DAIR-V2X frames')
+parser.add_argument('--vehicles', default=4, type=int, help='vehicle-like boxes per image')
+parser.add_argument('--context', default=96, type=int)
+parser.add_argument('--lama_ckpt', type=str, default='../Tools/LaMa/')
+parser.add_argument('--lama_cfg', type=str, default='./configs/lama_default.yaml')
+parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+parser.add_argument('--repeat', default=3, type=int)
+args = parser.parse_args()
+
+paths = args.images or sorted(glob.glob('./data/image/*'))[0:2]
+rng = np.random.default_rng(0)
+items = []
+for path in paths:
+    image = np.asarray(downsampler(Image.open(path).convert('RGB'), args.downsample))
+    # a few dilated vehicle boxes, the bg pass of process_first: typically a few percent of a DAIR frame
+    mask = np.zeros(image.shape[0:2], dtype=np.uint8)
+    h, w = mask.shape
+    for _ in range(args.vehicles):
+        bh, bw = rng.integers(h // 20, h // 8), rng.integers(w // 20, w // 8)
+        y, x = rng.integers(h // 3, h - bh), rng.integers(0, w - bw)
+        mask[y:y + bh, x:x + bw] = 255
+    items.append((image, mask))
+
+masked = sum((mask > 0).sum() for _, mask in items) / sum(mask.size for _, mask in items)
+# LaMa cost grows with the pixels it sees: the tiles, or the whole frame when they cover more than half of it
+tiled = [sum((y1 - y0) * (x1 - x0) for y0, y1, x0, x1 in mask_rois(mask, context=args.context)) for _, mask in items]
+tiled = sum(t if t <= 0.5 * mask.size else mask.size for t, (_, mask) in zip(tiled, items)) / sum(mask.size for _, mask in items)
+
+lama = preload_lama_remover(argparse.Namespace(lama_cfg=args.lama_cfg, lama_ckpt=args.lama_ckpt, device=args.device))
+sync = torch.cuda.synchronize if args.device.startswith('cuda') else None
+
+cost_full, ref = timed(lambda: inpaint_imgs_with_lama(items, device=args.device, preloaded_lama_remover=lama),
+                       args.repeat, sync=sync)
+cost_roi, out = timed(lambda: inpaint_imgs_with_lama_roi(items, device=args.device, preloaded_lama_remover=lama,
+                                                         context=args.context), args.repeat, sync=sync)
+# outside the masks both keep the input, inside the tiles see less of the frame than the whole-frame pass
+diff = np.mean([np.abs(a.astype(np.int16) - b)[mask > 0].mean() for a, b, (_, mask) in zip(ref, out, items)])
+
+print(f'{len(items)} LaMa bg passes of {items[0][0].shape[1]} x {items[0][0].shape[0]} on {args.device}, '
+      f'{masked:.1%} masked, mean abs diff in the masks {diff:.1f}')
+print_table([
+    ['whole frames', '100%', f'{cost_full * 1e3:.1f}', '1.0x'],
+    [f'ROI tiles (context {args.context})', f'{tiled:.0%}', f'{cost_roi * 1e3:.1f}', f'{cost_full / cost_roi:.2f}x'],
+], ['mode', 'pixels inpainted', 'total ms', 'speedup'])
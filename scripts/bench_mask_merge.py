@@ -0,0 +1,54 @@
+import argparse
+import numpy as np
+import torch
+from bench_utils import timed, print_table
+
+from seem.masks import dilate_mask, merge_vehicle_masks
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--height', default=1080, type=int, help='default: full DAIR-V2X image')
+parser.add_argument('--width', default=1920, type=int)
+parser.add_argument('--segments', default=60, type=int)
+parser.add_argument('--kernels', nargs='+', default=[15, 30, 31], type=int)
+parser.add_argument('--repeat', default=5, type=int)
+args = parser.parse_args()
+
+
+def reference_merge(masks_list, dilate_kernel_size):
+    # previous FG_segment_batch path: per-segment masks on the host, Python union loop, cv2.dilate
+    mask_merged, comp = torch.zeros_like(masks_list[0], dtype=torch.float32), torch.full(masks_list[0].shape, 255.)
+    for mm in masks_list:
+        uu = mask_merged + mm * 255.
+        uu[uu > comp] = 255.
+        mask_merged = uu
+    return dilate_mask(mask_merged.numpy(), dilate_kernel_size)
+
+
+# panoptic map of boxes drawn over each other, a third of the segments are vehicles
+rng = np.random.default_rng(0)
+h, w = args.height, args.width
+panoptic_seg = np.zeros((h, w), dtype=np.int32)
+for i in range(1, args.segments + 1):
+    y, x = rng.integers(0, h), rng.integers(0, w)
+    panoptic_seg[y:y + rng.integers(8, h // 4), x:x + rng.integers(8, w // 4)] = i
+ids = [i for i in np.unique(panoptic_seg).tolist() if i > 0]
+sure_ids = ids[::3]
+panoptic_cpu = torch.from_numpy(panoptic_seg)
+masks_list = [panoptic_cpu == i for i in sure_ids]  # SEEM hands these over on the cpu
+
+devices = ['cpu'] + (['cuda'] if torch.cuda.is_available() else [])
+rows = []
+for k in args.kernels:
+    cost_ref, ref = timed(lambda: reference_merge(masks_list, k), args.repeat)
+    rows.append([k, 'loop + cv2 (cpu)', f'{cost_ref * 1e3:.1f}', '1.00x', '-'])
+    # default: cv2 dilation of cpu tensors, max-pool on the gpu; the max-pool forced on cpu checks its exactness
+    for device, max_pool in [('cpu', None), ('cpu', True)] + [(device, None) for device in devices[1:]]:
+        seg = panoptic_cpu.to(device)
+        sync = torch.cuda.synchronize if device == 'cuda' else None
+        cost, out = timed(lambda: merge_vehicle_masks(seg, sure_ids, k, max_pool).cpu().numpy(), args.repeat, sync=sync)
+        dilation = 'max-pool' if max_pool or device != 'cpu' else 'cv2'
+        rows.append([k, f'isin + {dilation} ({device})', f'{cost * 1e3:.1f}', f'{cost_ref / cost:.2f}x',
+                     'yes' if np.array_equal(out, ref) else 'NO'])
+
+print(f'{h} x {w} panoptic map, {len(ids)} segments, {len(sure_ids)} merged')
+print_table(rows, ['kernel', 'merge + dilate', 'ms', 'speedup', 'equal to cv2'])
@@ -0,0 +1,43 @@
+import argparse, glob, shutil, tempfile
+import numpy as np
+from bench_utils import timed, print_table
+
+from lidar2dep.data import pcd_io
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--pcd_dir', default='./data/pcd', type=str, help='directory of DAIR-V2X .pcd files')
+parser.add_argument('--repeat', default=5, type=int)
+args = parser.parse_args()
+
+try:
+    import open3d as o3d
+except ImportError:
+    o3d = None
+    print('[INFO] open3d not installed, skipping the Open3D reader')
+
+files = sorted(glob.glob(f'{args.pcd_dir}/*.pcd'))
+cache_dir = tempfile.mkdtemp()
+rows, totals = [], {'points': 0, 'open3d': 0., 'decode': 0., 'cached': 0.}
+for path in files:
+    cost_decode, points = timed(lambda: pcd_io.read_pcd(path, use_cache=False), args.repeat)
+    pcd_io.read_pcd(path, cache_dir=cache_dir)  # populate the sidecar
+    cost_cached, cached = timed(lambda: pcd_io.read_pcd(path, cache_dir=cache_dir), args.repeat)
+    assert all(np.array_equal(points[name], cached[name]) for name in points.dtype.names)
+
+    row = [path.split('/')[-1], len(points), f'{cost_decode * 1e3:.2f}', f'{cost_cached * 1e3:.3f}']
+    totals['points'] += len(points)
+    totals['decode'] += cost_decode
+    totals['cached'] += cost_cached
+    if o3d is not None:
+        cost_o3d, pcd = timed(lambda: o3d.io.read_point_cloud(path), args.repeat)
+        assert np.allclose(np.asarray(pcd.points), pcd_io.LidarPointCloud(cached).points, atol=1e-5)
+        row.append(f'{cost_o3d * 1e3:.2f}')
+        totals['open3d'] += cost_o3d
+    rows.append(row)
+shutil.rmtree(cache_dir)
+
+header = ['file', 'points', 'decode ms', 'memmap ms'] + (['open3d ms'] if o3d is not None else [])
+print(f'LZF backend: {"python-lzf" if pcd_io.lzf is not None else "pure python"}')
+print_table(rows, header)
+for key in ['decode', 'cached'] + (['open3d'] if o3d is not None else []):
+    print(f'{key:>8}: {totals["points"] / totals[key] / 1e6:.2f} M points / s')
@@ -0,0 +1,47 @@
+import argparse, glob
+from random import randint
+import numpy as np
+import torch
+from bench_utils import timed, print_table
+
+from lidar2dep.data.pcd_io import load_point_cloud
+from lidar2dep.data.point_reduce import reduce_points
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--pcd', default=None, type=str, help='.pcd file, default: first of ./data/pcd')
+parser.add_argument('--ratio', default=0.25, type=float, help='kept fraction (1 / downsample)')
+parser.add_argument('--voxel_size', default=0.1, type=float)
+parser.add_argument('--repeat', default=5, type=int)
+args = parser.parse_args()
+
+path = args.pcd or sorted(glob.glob('./data/pcd/*.pcd'))[0]
+points = np.ascontiguousarray(load_point_cloud(path).points, dtype=np.float64)
+
+
+def legacy(x, pro):
+    # drgs.py::cut_down_points before the point_reduce module
+    return np.concatenate([x[i].reshape((1, 3)) for i in range(x.shape[0]) if (randint(0, 999) < 1e3 * pro)], axis=0)
+
+
+cases = [
+    ('legacy randint loop', lambda: legacy(points, args.ratio), None),
+    ('random (seeded)', lambda: reduce_points(points, 'random', args.ratio), None),
+    ('stride', lambda: reduce_points(points, 'stride', args.ratio), None),
+    ('voxel first', lambda: reduce_points(points, 'voxel', voxel_size=args.voxel_size), None),
+    ('voxel centroid', lambda: reduce_points(points, 'voxel', voxel_size=args.voxel_size, voxel_mode='centroid'), None),
+]
+tensor = torch.from_numpy(points)
+cases.append(('voxel first, torch cpu', lambda: reduce_points(tensor, 'voxel', voxel_size=args.voxel_size), None))
+if torch.cuda.is_available():
+    cuda = tensor.cuda()
+    cases.append(('voxel first, cuda', lambda: reduce_points(cuda, 'voxel', voxel_size=args.voxel_size),
+                  torch.cuda.synchronize))
+
+rows, base = [], None
+for name, fn, sync in cases:
+    cost, out = timed(fn, args.repeat, sync=sync)
+    base = base or cost
+    rows.append([name, len(out), f'{cost * 1e3:.2f}', f'{base / cost:.1f}x'])
+
+print(f'{path}: {len(points)} points, ratio {args.ratio}, voxel {args.voxel_size} m')
+print_table(rows, ['mode', 'kept', 'ms', 'speedup'])
@@ -0,0 +1,126 @@
+import argparse, glob, os, threading, time
+import numpy as np
+import torch
+from PIL import Image
+from bench_utils import timed, print_table
+
+from cam_utils import downsampler
+from lidar2dep import model_registry
+from lidar2dep.config import get_args_parser
+from lidar2dep.metric.cfmetric import CompletionFormerMetric
+from lidar2dep.precision import Policy, MODELS
+from seem.masks import FG_segment_batch
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--models', nargs='+', default=['seem', 'lama', 'completionformer', 'zoedepth'], choices=MODELS[:-1])
+parser.add_argument('--modes', nargs='+', default=['bf16', 'bf16+cl'], help="policies compared with fp32, e.g. 'fp16+cl'")
+parser.add_argument('--image', type=str, default=None, help='default: first of ./data/image')
+parser.add_argument('--downsample', default=4, type=int)
+parser.add_argument('--seem_ckpt', type=str, default="../Tools/SEEM/seem_focall_v0.pt")
+parser.add_argument('--seem_cfg', type=str, default="seem/configs/seem/focall_unicl_lang_demo.yaml")
+parser.add_argument('--seem_vocab', type=str, default='coco')
+parser.add_argument('--lama_ckpt', type=str, default='../Tools/LaMa/')
+parser.add_argument('--lama_cfg', type=str, default='./configs/lama_default.yaml')
+parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+parser.add_argument('--bench_repeat', default=3, type=int)
+opt = get_args_parser(parser)  # + the CompletionFormer options (model_name, pretrain, ...)
+opt.use_llm = False
+
+# fixed inputs: one DAIR frame, a sparse depth on the 0-255 scale of pre_read, a vehicle-like mask
+rng = np.random.default_rng(0)
+image = downsampler(Image.open(opt.image or sorted(glob.glob('./data/image/*'))[0]).convert('RGB'), opt.downsample)
+rgb = np.asarray(image)
+h, w = rgb.shape[0:2]
+sparse = np.where(rng.random((h, w)) < 0.05, rng.uniform(0, 255, (h, w)), 0).astype(np.float32)
+mask = np.zeros((h, w), dtype=np.float32)
+mask[h // 2:h // 2 + h // 5, w // 3:w // 3 + w // 5] = 1.
+mean, std = torch.tensor([0.485, 0.456, 0.406])[:, None, None], torch.tensor([0.229, 0.224, 0.225])[:, None, None]
+
+
+def run_seem(model):
+    # merged vehicle mask of FG_segment_batch -> [H W] bool
+    return FG_segment_batch(opt, [image], preloaded_seem_detector=model, visualize=False)[0]['mask'] > 0
+
+
+def run_lama(model):
+    batch = {'image': torch.from_numpy(rgb).float().div(255.).permute(2, 0, 1)[None],
+             'mask': torch.from_numpy(mask)[None, None]}
+    batch = {key: value.to(opt.device) for key, value in batch.items()}
+    with torch.no_grad():
+        return model['model'](batch)[model['config'].out_key][0].permute(1, 2, 0).cpu() * 255.
+
+
+def run_completionformer(model):
+    batch = {'rgb': ((torch.from_numpy(rgb).float().div(255.).permute(2, 0, 1) - mean) / std)[None].to(opt.device),
+             'dep': torch.from_numpy(sparse)[None, None].to(opt.device)}
+    with torch.no_grad():
+        return model(batch)['pred'][0, 0].cpu()
+
+
+def run_zoedepth(model):
+    return model(image)['predicted_depth'].squeeze().float().cpu()
+
+
+RUNNERS = {'seem': run_seem, 'lama': run_lama, 'completionformer': run_completionformer, 'zoedepth': run_zoedepth}
+
+
+def rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def peak_memory(fn):
+    # -> peak bytes allocated during fn(): CUDA allocator stats, or the sampled resident set growth on cpu
+    if opt.device.startswith('cuda'):
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        base = torch.cuda.memory_allocated()
+        fn()
+        torch.cuda.synchronize()
+        return torch.cuda.max_memory_allocated() - base
+    base, peak, running = rss(), [0], [True]
+    def sample():
+        while running[0]:
+            peak[0] = max(peak[0], rss())
+            time.sleep(1e-3)
+    sampler = threading.Thread(target=sample)
+    sampler.start()
+    try:
+        fn()
+    finally:
+        running[0] = False
+        sampler.join()
+    return max(peak[0], rss()) - base
+
+
+def deviation(name, ref, out):
+    # -> (RMSE, MAE, mask IoU) of `out` against the fp32 output
+    if name == 'seem':
+        union = (ref | out).sum()
+        return '-', '-', f'{(ref & out).sum() / union if union else 1.:.4f}'
+    if name in ['completionformer', 'zoedepth']:
+        metric = CompletionFormerMetric(opt).evaluate({'gt': ref[None, None]}, {'pred': out[None, None]})[0]
+        return f'{metric[0]:.4f}', f'{metric[1]:.4f}', '-'
+    diff = (out.float() - ref.float())
+    return f'{diff.pow(2).mean().sqrt():.4f}', f'{diff.abs().mean():.4f}', '-'
+
+
+sync = torch.cuda.synchronize if opt.device.startswith('cuda') else None
+rows = []
+for name in opt.models:
+    ref, base = None, None
+    for mode in ['fp32'] + opt.modes:
+        opt.precision = f'{name}={Policy.parse(mode)}'
+        model = model_registry.GETTERS[name](opt)
+        run = RUNNERS[name]
+        cost, out = timed(lambda: run(model), opt.bench_repeat, sync=sync)
+        peak = peak_memory(lambda: run(model))
+        model_registry.evict(name)  # channels_last converts the weights in place: a fresh build per mode
+        if ref is None:
+            ref, base = out, cost
+            rows.append([name, mode, f'{cost * 1e3:.1f}', '1.00x', f'{peak / 2 ** 20:.0f}', '-', '-', '-'])
+            continue
+        rows.append([name, mode, f'{cost * 1e3:.1f}', f'{base / cost:.2f}x', f'{peak / 2 ** 20:.0f}', *deviation(name, ref, out)])
+
+print(f'{w} x {h} inputs on {opt.device}, deviation against fp32')
+print_table(rows, ['model', 'mode', 'ms', 'speedup', 'peak MiB', 'RMSE', 'MAE', 'mask IoU'])
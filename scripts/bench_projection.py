@@ -0,0 +1,80 @@
+import argparse, json
+import numpy as np
+from bench_utils import timed, print_table
+
+import torch
+from lidar2dep.data.projector import project_points, project_points_multi
+from lidar2dep.data.pcd_io import load_point_cloud
+
+try:
+    import open3d as o3d
+except ImportError:
+    o3d = None
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--pcd', default='./data/pcd/007489.pcd', type=str, help='infrastructure side pcd file')
+parser.add_argument('--intrinsic', default='./data/camera/007489-intrinsic.json', type=str)
+parser.add_argument('--extrinsic', default='./data/camera/007489-extrinsic.json', type=str)
+parser.add_argument('--downsample', default=1, type=int, help='image downsample scale')
+parser.add_argument('--point_size', default=5, type=int)
+parser.add_argument('--repeat', default=10, type=int)
+args = parser.parse_args()
+
+with open(args.intrinsic) as f:
+    intrinsics = json.load(f)
+with open(args.extrinsic) as f:
+    extrinsics = json.load(f)
+H, W = intrinsics['height'] // args.downsample, intrinsics['width'] // args.downsample
+K = np.array(intrinsics['cam_K']).reshape((3, 3))
+K[0:2] /= args.downsample
+A = np.eye(4)
+A[0:3, 0:3], A[0:3, 3] = np.array(extrinsics['rotation']), np.squeeze(extrinsics['translation'])
+
+points = np.asarray(load_point_cloud(args.pcd).points, dtype=np.float64)
+print(f'{points.shape[0]} points -> [{H} {W}], point_size = {args.point_size}')
+
+rows = []
+cost, ref = timed(lambda: project_points(points, K, A, H, W, point_size=args.point_size), args.repeat)
+rows.append(['numpy', f'{cost * 1e3:.2f}', int((ref > 0).sum())])
+
+cost, out = timed(lambda: project_points(points, K, A, H, W, point_size=args.point_size, device='cpu'), args.repeat)
+assert np.allclose(out.numpy(), ref, atol=1e-4), 'torch-cpu and numpy projections disagree'
+rows.append(['torch-cpu', f'{cost * 1e3:.2f}', int((out > 0).sum())])
+
+if torch.cuda.is_available():
+    pts_cuda = torch.tensor(points, device='cuda')
+    cost, out = timed(lambda: project_points(pts_cuda, K, A, H, W, point_size=args.point_size),
+                      args.repeat, sync=torch.cuda.synchronize)
+    rows.append(['torch-cuda', f'{cost * 1e3:.2f}', int((out > 0).sum())])
+
+
+def open3d_render():
+    # the previous `pre_read` path: a fresh GL context per projection
+    pcd = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(points))
+    renderer = o3d.visualization.rendering.OffscreenRenderer(W, H)
+    material = o3d.visualization.rendering.MaterialRecord()
+    material.point_size = args.point_size
+    material.shader = 'unlit'
+    renderer.scene.add_geometry("point_cloud", pcd, material)
+    renderer.setup_camera(K, A, W, H)
+    return np.asarray(renderer.render_to_depth_image(z_in_view_space=True))
+
+try:
+    assert o3d is not None, 'open3d not installed'
+    cost, out = timed(open3d_render, args.repeat)
+    rows.append(['open3d-offscreen', f'{cost * 1e3:.2f}', int(np.isfinite(out).sum())])
+except Exception as err:
+    print(f'[INFO] Open3D OffscreenRenderer unavailable: {err}')
+
+print_table(rows, ['backend', 'ms / projection', 'valid pixels'])
+
+# cooperative pair: one cloud rendered into its own view and the cross view
+shift = np.eye(4)
+shift[0, 3] = 2.  # second camera 2m to the side
+Ks, As = np.stack([K, K]), np.stack([A, shift @ A])
+cost_single, _ = timed(lambda: [project_points(points, Ks[i], As[i], H, W, point_size=args.point_size) for i in range(2)], args.repeat)
+cost_multi, _ = timed(lambda: project_points_multi(points, Ks, As, [(H, W)] * 2, point_size=args.point_size), args.repeat)
+print_table([
+    ['2 x project_points', f'{cost_single * 1e3:.2f}'],
+    ['project_points_multi (C=2)', f'{cost_multi * 1e3:.2f}'],
+], ['2 cameras', 'ms'])
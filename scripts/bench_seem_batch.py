@@ -0,0 +1,66 @@
+import argparse
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+from bench_utils import timed, print_table
+
+from seem.masks import seem_panoptic_batch
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--height', default=270, type=int, help='default: 1080p DAIR-V2X image, downsample 4')
+parser.add_argument('--width', default=480, type=int)
+parser.add_argument('--batch_sizes', nargs='+', default=[1, 2, 8], type=int)
+parser.add_argument('--repeat', default=3, type=int)
+args = parser.parse_args()
+
+
+class StubSEEM(torch.nn.Module):
+    """
+        CPU stand-in for `seem_model.model`: same `evaluate_all` contract
+        (padded ImageList batch -> per-image panoptic_seg), with a small conv
+        backbone / pixel decoder in place of FocalNet + the SEEM decoder.
+    """
+    def __init__(self, num_queries: int = 16, num_classes: int = 8, size_divisibility: int = 32):
+        super().__init__()
+        self.size_divisibility, self.num_classes = size_divisibility, num_classes
+        self.backbone = torch.nn.Sequential(
+            torch.nn.Conv2d(3, 32, 3, 2, 1), torch.nn.ReLU(), torch.nn.Conv2d(32, 64, 3, 2, 1), torch.nn.ReLU(),
+            torch.nn.Conv2d(64, 64, 3, 2, 1), torch.nn.ReLU()
+        )
+        self.pixel_decoder = torch.nn.Conv2d(64, num_queries, 1)
+        self.class_head = torch.nn.Linear(64, num_classes + 1)
+        self.metadata = None
+        self.device = torch.device('cpu')
+
+    def evaluate_all(self, batched_inputs):
+        images = [x['image'].float() / 255. for x in batched_inputs]
+        h = max(x.shape[-2] for x in images); w = max(x.shape[-1] for x in images)
+        h, w = [-(-s // self.size_divisibility) * self.size_divisibility for s in (h, w)]
+        batch = torch.stack([F.pad(x, (0, w - x.shape[-1], 0, h - x.shape[-2])) for x in images])
+        features = self.backbone(batch)
+        masks = F.interpolate(self.pixel_decoder(features), size=(h, w), mode='bilinear', align_corners=False)
+        logits = self.class_head(features.mean((2, 3)))  # [B C+1], one class per image is enough for timing
+        results = []
+        for x, mask, logit in zip(batched_inputs, masks, logits):
+            mask = mask[:, :x['height'], :x['width']].sigmoid()
+            panoptic_seg = mask.argmax(0).to(torch.int32) + 1
+            ids = panoptic_seg.unique().tolist()
+            category = [{'id': i, 'category_id': int(logit[:-1].argmax()), 'isthing': True} for i in ids]
+            results.append({'panoptic_seg': (panoptic_seg, category, [(panoptic_seg == i).float() for i in ids])})
+        return results, {}
+
+
+stub = argparse.Namespace(model=StubSEEM().eval())
+rng = np.random.default_rng(0)
+images = [Image.fromarray(rng.integers(0, 255, (args.height, args.width, 3), dtype=np.uint8)) for _ in range(max(args.batch_sizes))]
+
+rows, base = [], None
+for bs in args.batch_sizes:
+    cost, _ = timed(lambda: seem_panoptic_batch(stub, images[0:bs], device='cpu', max_batch=bs), args.repeat)
+    per_image = cost / bs
+    base = base or per_image
+    rows.append([bs, f'{cost * 1e3:.1f}', f'{per_image * 1e3:.1f}', f'{base / per_image:.2f}x'])
+
+print(f'stub SEEM on cpu, {args.height} x {args.width} images')
+print_table(rows, ['batch size', 'ms / batch', 'ms / image', 'speedup'])
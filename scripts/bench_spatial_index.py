@@ -0,0 +1,57 @@
+import argparse, glob
+import numpy as np
+from bench_utils import timed, print_table
+
+from lidar2dep.data.pcd_io import load_point_cloud
+from lidar2dep.data.voxel_hash import VoxelHashIndex
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+    print('[INFO] scipy not installed, skipping cKDTree')
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--pcd', nargs='+', default=None, help='.pcd files fused into one cloud, default: ./data/pcd/*.pcd')
+parser.add_argument('--cell_size', default=0.2, type=float)
+parser.add_argument('--radius', default=0.2, type=float)
+parser.add_argument('--k', default=8, type=int)
+parser.add_argument('--repeat', default=3, type=int)
+args = parser.parse_args()
+
+paths = args.pcd or sorted(glob.glob('./data/pcd/*.pcd'))
+points = np.concatenate([np.asarray(load_point_cloud(path).points, dtype=np.float64) for path in paths])
+queries = points[::4]
+
+rows = []
+cost, index = timed(lambda: VoxelHashIndex(points, args.cell_size), args.repeat)
+row_build = ['build', f'{cost * 1e3:.1f}']
+cost, (offsets, _, _) = timed(lambda: index.radius_query(queries, args.radius, sort=False), args.repeat)
+row_radius = [f'radius {args.radius} m ({offsets[-1]} pairs)', f'{cost * 1e3:.1f}']
+cost, counts = timed(lambda: index.count_within(queries, args.radius), args.repeat)
+row_count = ['count_within', f'{cost * 1e3:.1f}']
+cost, hit = timed(lambda: index.any_within(queries, args.radius), args.repeat)
+row_dedup = ['any_within (dedup)', f'{cost * 1e3:.1f}']
+cost, (_, knn_dist) = timed(lambda: index.knn(queries, args.k, args.radius), args.repeat)
+row_knn = [f'knn k={args.k} within {args.radius} m', f'{cost * 1e3:.1f}']
+
+if cKDTree is not None:
+    cost, tree = timed(lambda: cKDTree(points), args.repeat)
+    row_build.append(f'{cost * 1e3:.1f}')
+    cost, ref = timed(lambda: tree.query_ball_point(queries, args.radius, return_sorted=False), args.repeat)
+    assert np.array_equal(np.diff(offsets), [len(r) for r in ref])
+    row_radius.append(f'{cost * 1e3:.1f}')
+    cost, ref = timed(lambda: tree.query_ball_point(queries, args.radius, return_length=True), args.repeat)
+    assert np.array_equal(counts, ref)
+    row_count.append(f'{cost * 1e3:.1f}')
+    cost, (ref, _) = timed(lambda: tree.query(queries, 1, distance_upper_bound=args.radius), args.repeat)
+    assert np.array_equal(hit, np.isfinite(ref))
+    row_dedup.append(f'{cost * 1e3:.1f}')
+    cost, (ref, _) = timed(lambda: tree.query(queries, args.k, distance_upper_bound=args.radius), args.repeat)
+    assert np.allclose(knn_dist, ref)
+    row_knn.append(f'{cost * 1e3:.1f}')
+
+print(f'{len(points)} points from {len(paths)} clouds, {len(queries)} queries, '
+      f'{len(index.cell_keys)} occupied {args.cell_size} m cells')
+print_table([row_build, row_radius, row_count, row_dedup, row_knn],
+            ['query', 'voxel hash ms'] + (['cKDTree ms'] if cKDTree is not None else []))
@@ -0,0 +1,52 @@
+import argparse, os, tempfile
+import numpy as np
+from bench_utils import timed, print_table
+
+from lidar2dep import telemetry
+from lidar2dep.stage_graph import Stage, StageGraph
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--spans', default=10000, type=int, help='empty spans per measurement')
+parser.add_argument('--items', default=16, type=int, help='items through the stage graph')
+parser.add_argument('--size', default=512, type=int, help='side of the arrays the stub stages work on')
+parser.add_argument('--repeat', default=3, type=int)
+args = parser.parse_args()
+
+
+def empty_spans():
+    for i in range(args.spans):
+        with telemetry.span('empty', 'bench', item=i):
+            pass
+
+
+# stub of the preprocessing graph: decode / project on the cpu pool, one "model" stage, a write
+rng = np.random.default_rng(0)
+image = rng.random((args.size, args.size)).astype(np.float32)
+graph = StageGraph([
+    Stage('decode', lambda x: {'image': image * x}, ['x'], ['image']),
+    Stage('project', lambda image: {'depth': np.sqrt(image) + 1.}, ['image'], ['depth']),
+    Stage('infer', lambda image, depth: {'pred': np.fft.rfft2(image * depth).real}, ['image', 'depth'], ['pred'], device='gpu'),
+    Stage('write', lambda pred: {'size': len(pred.astype(np.float32).tobytes())}, ['pred'], ['size']),
+], sources=['x'])
+
+
+def run_graph():
+    return list(graph.run([{'x': float(i)} for i in range(args.items)], cpu_workers=4, max_inflight=4))
+
+
+rows = []
+modes = [('off', None), ('in memory', False), ('JSON-lines log', True)]
+base_span, base_graph = None, None
+for mode, log in modes:
+    if log is None:
+        telemetry.configure(enabled=False)
+    else:
+        telemetry.configure(root=tempfile.mkdtemp() if log else None)
+    cost_span, _ = timed(empty_spans, args.repeat)
+    cost_graph, _ = timed(run_graph, args.repeat)
+    base_span, base_graph = base_span or cost_span, base_graph or cost_graph
+    rows.append([mode, f'{cost_span / args.spans * 1e6:.2f}', f'{cost_graph * 1e3:.1f}', f'{cost_graph / base_graph:.3f}x'])
+telemetry.configure(enabled=False)
+
+print(f'{args.spans} empty spans, {args.items} items through a 4 stage graph ({args.size} x {args.size} arrays)')
+print_table(rows, ['telemetry', 'us / span', 'graph ms', 'graph time'])
@@ -0,0 +1,29 @@
+import os, sys, time
+import numpy as np
+
+# benchmarks are launched from the repo root: `python scripts/bench_xxx.py`
+sys.path.append(os.getcwd())
+
+
+def timed(fn, repeat: int = 5, warmup: int = 1, sync=None):
+    # -> (median seconds, last result)
+    out = None
+    for _ in range(warmup):
+        out = fn()
+    costs = []
+    for _ in range(repeat):
+        if sync is not None: sync()
+        t0 = time.perf_counter()
+        out = fn()
+        if sync is not None: sync()
+        costs.append(time.perf_counter() - t0)
+    return float(np.median(costs)), out
+
+
+def print_table(rows: list, header: list):
+    widths = [max(len(str(r[i])) for r in [header] + rows) for i in range(len(header))]
+    line = ' | '.join(f'{{:<{w}}}' for w in widths)
+    print(line.format(*header))
+    print('-+-'.join('-' * w for w in widths))
+    for r in rows:
+        print(line.format(*[str(x) for x in r]))
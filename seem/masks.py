@@ -1,4 +1,4 @@
-import torch, cv2, os, yaml, pdb
+import torch, cv2, os, yaml, pdb, json, hashlib
 import numpy as np
 import torch.nn.functional as F
 from PIL import Image
@@ -11,13 +11,15 @@ from .modeling.language.loss import vl_similarity
 from detectron2.data.datasets.builtin_meta import COCO_CATEGORIES
 from lama.saicinpainting.evaluation.utils import move_to_device
 from lama.saicinpainting.training.trainers import load_checkpoint
-from lama.saicinpainting.evaluation.data import pad_tensor_to_modulo
+from lama.saicinpainting.evaluation.data import pad_tensor_to_modulo, ceil_modulo
 
 from seem.utils.arguments import load_opt_from_config_files
 from seem.modeling.BaseModel import BaseModel
 from seem.modeling import build_model
 from seem.utils.constants import COCO_PANOPTIC_CLASSES
 from guidance.llm_util import get_vehicle_agent
+from lidar2dep.model_registry import checkpoint_fingerprint
+from lidar2dep.data.artifacts import save_frame_artifacts, load_frame_artifacts, writes
 
 
 
@@ -27,12 +29,80 @@ colors_list = [(np.array(color['color'])/255).tolist() for color in COCO_CATEGOR
 
 
 
+# reduced panoptic vocabulary of road scenes: fewer class embeddings to score per query
+DRIVING_CLASSES = [
+    'person', 'bicycle', 'car', 'motorcycle', 'bus', 'train', 'truck', 'traffic light', 'fire hydrant', 'stop sign',
+    'parking meter', 'bench', 'bridge', 'house', 'light', 'railroad', 'road', 'tent', 'wall-brick', 'wall-stone',
+    'tree-merged', 'fence-merged', 'sky-other-merged', 'pavement-merged', 'mountain-merged', 'grass-merged',
+    'dirt-merged', 'building-other-merged', 'rock-merged', 'wall-other-merged'
+]
+VOCABULARIES = {'coco': COCO_PANOPTIC_CLASSES, 'driving': DRIVING_CLASSES}
+TEXT_EMBEDDING_DIR = os.environ.get('SEEM_TEXT_EMBEDDINGS', './cache/seem_text_embeddings')
+
+
+def vocabulary_classes(vocab = 'coco'):
+    # 'coco' | 'driving' | 'car,road,...' (COCO panoptic names) | list -> class names
+    if isinstance(vocab, (list, tuple)): classes = list(vocab)
+    elif vocab in VOCABULARIES: classes = list(VOCABULARIES[vocab])
+    else: classes = [name.strip() for name in vocab.split(',') if name.strip()]
+    assert len(classes) > 0, f'empty vocabulary {vocab!r}'
+    return classes
+
+
+def vocabulary_metadata(classes: list):
+    # metadata of a vocabulary, category ids index `classes`; COCO keeps the dataset's own
+    if classes == list(COCO_PANOPTIC_CLASSES): return metadata
+    coco_things = set(metadata.thing_classes)
+    colors = [list(COCO_CATEGORIES[COCO_PANOPTIC_CLASSES.index(name)]['color']) if name in COCO_PANOPTIC_CLASSES
+              else [255, 255, 255] for name in classes]
+    key = hashlib.sha1(json.dumps(classes).encode()).hexdigest()[:12]
+    vocab_metadata = MetadataCatalog.get(f'seem_vocabulary_{key}')
+    if not hasattr(vocab_metadata, 'stuff_classes'):
+        vocab_metadata.set(
+            stuff_classes=classes, thing_classes=classes, stuff_colors=colors, thing_colors=colors,
+            thing_dataset_id_to_contiguous_id={i: i for i, name in enumerate(classes) if name in coco_things}
+        )
+    return vocab_metadata
+
+
+def text_embedding_path(ckpt: str, cfg_path: str, classes: list, root: str = TEXT_EMBEDDING_DIR):
+    # class text embeddings depend on the weights (checkpoint), the language model config and the class list
+    key = hashlib.sha1(json.dumps([checkpoint_fingerprint(ckpt), cfg_path, classes]).encode()).hexdigest()
+    return os.path.join(root, f'{key}.npz')
+
+
+def install_vocabulary(seem_model, classes: list, ckpt: str = None, cfg_path: str = None, root: str = TEXT_EMBEDDING_DIR):
+    """
+    Sets the panoptic vocabulary of `seem_model`: the class text embeddings
+    (+ background) are read from <root>/<key>.npz, computed by the language
+    encoder and written there on the first use of a (checkpoint, vocabulary).
+    """
+    lang_encoder = seem_model.model.sem_seg_head.predictor.lang_encoder
+    path = text_embedding_path(ckpt, cfg_path, classes, root)
+    if getattr(lang_encoder, 'vocabulary_path', None) == path: return  # already installed
+    device = lang_encoder.logit_scale.device
+    if os.path.exists(path):
+        arrays, _ = load_frame_artifacts(path, keys=['text_embeddings'])
+        lang_encoder.default_text_embeddings = torch.from_numpy(arrays['text_embeddings']).to(device)
+        print(f'[INFO] SEEM text embeddings of {len(classes)} classes loaded from {path}')
+    else:
+        with torch.no_grad():
+            lang_encoder.get_text_embeddings(classes + ["background"], is_eval=True)
+        save_frame_artifacts(
+            path, meta={'classes': classes, 'checkpoint': ckpt},
+            text_embeddings=lang_encoder.default_text_embeddings.detach().float().cpu().numpy()
+        )
+        print(f'[INFO] SEEM text embeddings of {len(classes)} classes written to {path}')
+    lang_encoder.vocabulary_path = path
+    seem_model.model.sem_seg_head.num_classes = len(classes)  # the no-object logit follows the classes
+
+
 def preload_seem_detector(opt, preloaded_seem_detector = None):
     if preloaded_seem_detector is None:
         cfg = load_opt_from_config_files([opt.seem_cfg])
         cfg['device'] = opt.device
         try:
-            seem_model = BaseModel(cfg, build_model(cfg)).from_pretrained(opt.seem_ckpt).eval().cuda() # remember to compile SEEM
+            seem_model = BaseModel(cfg, build_model(cfg)).from_pretrained(opt.seem_ckpt).eval().to(opt.device) # remember to compile SEEM
         except Exception as err:
             print('debug')
             print(f'[INFO]: {err}')
@@ -41,9 +111,8 @@ def preload_seem_detector(opt, preloaded_seem_detector = None):
         cfg = preloaded_seem_detector['cfg']
         seem_model = preloaded_seem_detector['seem_model']
 
-    with torch.no_grad():
-        seem_model.model.sem_seg_head.predictor.lang_encoder.get_text_embeddings(COCO_PANOPTIC_CLASSES + ["background"],
-                                                                                 is_eval=True)
+    classes = vocabulary_classes(getattr(opt, 'seem_vocab', 'coco'))
+    install_vocabulary(seem_model, classes, ckpt=opt.seem_ckpt, cfg_path=opt.seem_cfg)
     seem_model.model.task_switch['spatial'] = False
     seem_model.model.task_switch['visual'] = False
     seem_model.model.task_switch['grounding'] = False
@@ -51,7 +120,7 @@ def preload_seem_detector(opt, preloaded_seem_detector = None):
     seem_model.model.task_switch['grounding'] = True
 
     preloaded_seem_detector = seem_model
-    return {'seem_model': preloaded_seem_detector.to(opt.device), 'cfg': cfg}
+    return {'seem_model': preloaded_seem_detector.to(opt.device), 'cfg': cfg, 'metadata': vocabulary_metadata(classes)}
 
 def preload_lama_remover(opt, preloaded_lama_dict = None):
     if preloaded_lama_dict is not None: return preloaded_lama_dict
@@ -99,6 +168,23 @@ def dilate_mask(mask, dilate_factor=15):
     return mask
 
 
+def dilate_mask_tensor(mask: torch.Tensor, dilate_factor=15, max_pool=None):
+    """
+    `dilate_mask` on the mask's device: cv2.dilate with a dilate_factor x dilate_factor
+    square (anchor at its center, border ignored) as a row and a column max-pool.
+        mask: [H W], truncated to uint8 like `dilate_mask` -> [H W] uint8
+        max_pool: None pools on accelerators only, cv2 is much faster on cpu tensors
+    """
+    if max_pool is None: max_pool = mask.device.type != 'cpu'
+    if not max_pool:
+        return torch.from_numpy(dilate_mask(mask.numpy(), dilate_factor))
+    mask = mask.to(torch.uint8)[None, None].float()  # max_pool2d has no uint8 kernels
+    lo, hi = dilate_factor // 2, dilate_factor - 1 - dilate_factor // 2  # cv2 anchor of an even kernel: k // 2
+    mask = F.max_pool2d(F.pad(mask, (lo, hi, 0, 0)), (1, dilate_factor), stride=1)  # 0 padding == ignored border, mask >= 0
+    mask = F.max_pool2d(F.pad(mask, (0, 0, lo, hi)), (dilate_factor, 1), stride=1)
+    return mask[0, 0].to(torch.uint8)
+
+
 @torch.no_grad()
 def inpaint_img_with_lama(
         img: np.ndarray,
@@ -151,6 +237,131 @@ def inpaint_img_with_lama(
 
 
 
+@torch.no_grad()
+def inpaint_imgs_with_lama(
+        items: list,
+        mod=8,
+        device="cuda",
+        preloaded_lama_remover=None,
+        max_batch=8
+):
+    """
+    Batched `inpaint_img_with_lama`.
+        items:  [(img [H W 3] uint8, mask [H W] or [H W 1], > 0 inpainted), ...]
+    Pairs whose sizes pad (to a multiple of `mod`) to the same shape share one
+    forward, `max_batch` at most. Returns the [H W 3] uint8 results in input order.
+    """
+    model = preloaded_lama_remover['model']
+    predict_config = preloaded_lama_remover['config']
+    device = torch.device(device)
+
+    buckets = {}
+    for i, (img, mask) in enumerate(items):
+        h, w = np.asarray(img).shape[:2]
+        buckets.setdefault((ceil_modulo(h, mod), ceil_modulo(w, mod)), []).append(i)
+
+    results = [None] * len(items)
+    for size, bucket in buckets.items():
+        for start in range(0, len(bucket), max_batch):
+            chunk = bucket[start:start + max_batch]
+            print(f'[INFO] LaMa: {len(chunk)} image(s) padded to {size}')
+            batch = {
+                # padded one by one (reflect), exactly like the single image path
+                'image': torch.cat([pad_tensor_to_modulo(
+                    torch.from_numpy(np.asarray(items[i][0])).float().div(255.).permute(2, 0, 1)[None], mod) for i in chunk]),
+                'mask': torch.cat([pad_tensor_to_modulo(
+                    torch.from_numpy(np.asarray(items[i][1]).squeeze()).float()[None, None], mod) for i in chunk])
+            }
+            batch = move_to_device(batch, device)
+            batch['mask'] = (batch['mask'] > 0) * 1
+
+            batch = model(batch)
+            cur_res = batch[predict_config.out_key].permute(0, 2, 3, 1).detach().cpu().numpy()
+            for j, i in enumerate(chunk):
+                h, w = np.asarray(items[i][0]).shape[:2]
+                results[i] = np.clip(cur_res[j, :h, :w] * 255, 0, 255).astype('uint8')
+    return results
+
+
+def _fit_span(lo, hi, size, min_size, quantum):
+    # [lo, hi) grown to at least min_size, rounded up to quantum, kept inside [0, size)
+    side = min(-(-max(hi - lo, min_size) // quantum) * quantum, size)
+    lo = min(max(lo - (side - (hi - lo)) // 2, 0), size - side)
+    return lo, lo + side
+
+
+def mask_rois(mask, context = 96, min_size = 256, quantum = 64):
+    """
+    Tiles around the connected regions of mask [H W] (> 0 inpainted): each
+    region's box grown by `context` pixels per side for LaMa to see the
+    surroundings, at least `min_size` (LaMa's training crops) and rounded up
+    to `quantum` so that tiles share a batch; overlapping tiles are merged.
+    -> [(y0, y1, x0, x1), ...]
+    """
+    mask = (np.asarray(mask).squeeze() > 0).astype(np.uint8)
+    H, W = mask.shape
+    _, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    fit = lambda y0, y1, x0, x1: _fit_span(y0, y1, H, min_size, quantum) + _fit_span(x0, x1, W, min_size, quantum)
+    tiles = [fit(y - context, y + h + context, x - context, x + w + context) for x, y, w, h, _ in stats[1:].tolist()]
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(tiles)):
+            for j in range(i + 1, len(tiles)):
+                (a0, a1, b0, b1), (c0, c1, d0, d1) = tiles[i], tiles[j]
+                if a0 < c1 and c0 < a1 and b0 < d1 and d0 < b1:
+                    tiles[i] = fit(min(a0, c0), max(a1, c1), min(b0, d0), max(b1, d1))
+                    del tiles[j]
+                    merged = True
+                    break
+            if merged: break
+    return tiles
+
+
+@torch.no_grad()
+def inpaint_imgs_with_lama_roi(
+        items: list,
+        mod=8,
+        device="cuda",
+        preloaded_lama_remover=None,
+        max_batch=8,
+        context=96,
+        max_fraction=0.5
+):
+    """
+    `inpaint_imgs_with_lama` on tiles around the masked regions (see
+    `mask_rois`) instead of the whole frames: the tiles of all items are
+    batched, the inpainted pixels pasted back. Items whose tiles cover more
+    than `max_fraction` of the frame (e.g. the fg pass, everything but the
+    vehicles) and empty masks are inpainted whole / returned unchanged.
+    """
+    crops, places = [], []  # places[k]: (item, tile or None for the whole frame)
+    results = [None] * len(items)
+    for i, (img, mask) in enumerate(items):
+        img = np.asarray(img)
+        mask = np.asarray(mask).squeeze()
+        tiles = mask_rois(mask, context=context)
+        if len(tiles) == 0:
+            results[i] = img.copy()
+        elif sum((y1 - y0) * (x1 - x0) for y0, y1, x0, x1 in tiles) > max_fraction * mask.size:
+            crops.append((img, mask)); places.append((i, None))
+        else:
+            results[i] = img.copy()
+            for y0, y1, x0, x1 in tiles:
+                crops.append((img[y0:y1, x0:x1], mask[y0:y1, x0:x1])); places.append((i, (y0, y1, x0, x1)))
+    print(f'[INFO] LaMa ROI: {len(crops)} crop(s) of {len(items)} image(s), '
+          f'{sum(c[1].size for c in crops) / max(sum(np.asarray(m).squeeze().size for _, m in items), 1):.0%} of the pixels')
+
+    inpainted = inpaint_imgs_with_lama(crops, mod=mod, device=device, preloaded_lama_remover=preloaded_lama_remover, max_batch=max_batch)
+    for (i, tile), (_, mask), out in zip(places, crops, inpainted):
+        if tile is None:
+            results[i] = out
+            continue
+        y0, y1, x0, x1 = tile
+        region = results[i][y0:y1, x0:x1]
+        region[mask > 0] = out[mask > 0]  # LaMa keeps the unmasked pixels, only the inpainted ones are pasted
+    return results
+
 
 def process_seem_outputs(temperature, results, extra):
 
@@ -179,7 +390,6 @@ def FG_remove(opt, img, reftxt = 'Car', preloaded_seem_detector = None, preloade
     img_ori = np.asarray(img).copy()
     img = torch.from_numpy(img_ori).permute(2, 0, 1).cuda()
     # print(f'img.size = {img.size}')
-    visual = Visualizer(img_ori, metadata=metadata)
 
     data = {"image": img, "height": height, "width": width}
     data['text'] = reftxt # flexible targets
@@ -190,13 +400,17 @@ def FG_remove(opt, img, reftxt = 'Car', preloaded_seem_detector = None, preloade
     *_, pred_masks_pos = process_seem_outputs(temperature, results, extra)
 
     pred_masks_pos = (F.interpolate(pred_masks_pos[None,], image_size[-2:], mode='bilinear')[0, :, :data['height'],
-                      :data['width']] > 0.0).float().cpu().numpy() # np.ndarray -> [3 H w]
+                      :data['width']] > 0.0).float() # torch.Tensor -> [3 H w], on the device
+    # dilated on the device, one download of the result
+    target_mask_list = [dilate_mask_tensor(a_mask, dilate_kernel_size).cpu().numpy() for a_mask in pred_masks_pos]
+    pred_masks_pos = pred_masks_pos.cpu().numpy()
     # mask queried from text
     # pred_box_pos = None
-    demo = visual.draw_binary_mask(pred_masks_pos.squeeze(), text=reftxt)  # rgb Image
-    res = demo.get_image() # visualized with [id2name]
-
-    target_mask_list = [dilate_mask(a_mask, dilate_kernel_size) for a_mask in pred_masks_pos]
+    res = None
+    if writes('debug'):
+        visual = Visualizer(img_ori, metadata=metadata)
+        demo = visual.draw_binary_mask(pred_masks_pos.squeeze(), text=reftxt)  # rgb Image
+        res = demo.get_image() # visualized with [id2name]
 
     # remove forground <CAR>
     img_inpainted = inpaint_img_with_lama(
@@ -207,61 +421,151 @@ def FG_remove(opt, img, reftxt = 'Car', preloaded_seem_detector = None, preloade
     print(f'seg_mask = {seg_mask.shape}')
     seg_mask = rearrange(repeat(seg_mask, '1 h w -> c h w', c = 3), 'c h w -> h w c')
 
-    return Image.fromarray(res), seg_mask, img_inpainted
+    return Image.fromarray(res) if res is not None else None, seg_mask, img_inpainted
 
-def FG_remove_All(
-        opt, img, reftxt = 'Car', mask = None,
-        preloaded_seem_detector = None, preloaded_lama_dict = None,
-        dilate_kernel_size = 30, use_llm=False # dilate with kernel=30 the best
+@torch.no_grad()
+def seem_panoptic_batch(seem_model, imgs: list, reftxt = 'Car', device = 'cuda', max_batch = 8, vocab_metadata = None):
+    """
+    Panoptic SEEM inference of several images, one `evaluate_all` per chunk of
+    `max_batch` (SEEM's ImageList pads the chunk to a shared size).
+        imgs: [PIL.Image] -> [(panoptic_seg [H W], segments_info, masks_list), ...] in input order
+        vocab_metadata: metadata of the installed vocabulary (preload_seem_detector), default COCO
+    """
+    outputs = []
+    seem_model.model.metadata = metadata if vocab_metadata is None else vocab_metadata
+    for start in range(0, len(imgs), max_batch):
+        batch_inputs = []
+        for img in imgs[start:start + max_batch]:
+            width, height = img.size
+            img_ori = np.asarray(img).copy()
+            data = {"image": torch.from_numpy(img_ori).permute(2, 0, 1).to(device), "height": height, "width": width}
+            data['text'] = reftxt # flexible targets
+            batch_inputs.append(data)
+        # predict
+        results, mask_box_dict = seem_model.model.evaluate_all(batch_inputs)
+        for result in results:
+            mask_all, category, masks_list = result['panoptic_seg']
+            assert len(category) == len(masks_list), f'len(category) = {len(category)}, len(masks_list) = {len(masks_list)}'
+            outputs.append((mask_all, category, masks_list))
+    return outputs
+
+
+def merge_vehicle_masks(panoptic_seg: torch.Tensor, segment_ids: list, dilate_kernel_size = 30, max_pool = None, masks = ()):
+    """
+    Union of the segments `segment_ids` of panoptic_seg [H W] and of `masks`, dilated,
+    on panoptic_seg's device (no per-segment host copies) -> [H W] uint8 0/255
+        segment_ids:    thing segments, selected by id in the panoptic map
+        masks:          [H W] bool masks of stuff segments: panoptic_inference writes later
+                        regions of a stuff class under the id of its first segment without
+                        listing them in masks_list, an id would select those regions as well
+    """
+    mask_merged = torch.zeros(panoptic_seg.shape[-2:], dtype=torch.bool, device=panoptic_seg.device)
+    if len(segment_ids) > 0:
+        ids = torch.as_tensor(segment_ids, dtype=panoptic_seg.dtype, device=panoptic_seg.device)
+        mask_merged = torch.isin(panoptic_seg, ids)
+    for mask in masks:
+        mask_merged |= mask.to(mask_merged.device, torch.bool)
+    if len(segment_ids) == 0 and len(masks) == 0:
+        return mask_merged.to(torch.uint8)
+    return dilate_mask_tensor(mask_merged.to(torch.uint8) * 255, dilate_kernel_size, max_pool)
+
+
+def FG_segment_batch(
+        opt, imgs: list, reftxt = 'Car', preloaded_seem_detector = None,
+        dilate_kernel_size = 30, use_llm=False, max_batch = 8, visualize = None
     ):
-    # img: PIL.Image
+    # SEEM panoptic segmentation of several images in one batch, merge of the vehicle masks and dilation
+    # imgs: [PIL.Image] -> [{'res': visualized panoptic seg [H W 3], 'mask': [H W] uint8 0/255,
+    #                        'panoptic_seg': [H W] segment ids, 'category_ids': [n] per segment}, ...]
+    # visualize: draw 'res' (None otherwise), default: at artifact level debug
+    if visualize is None: visualize = writes('debug')
     uu = preload_seem_detector(opt, preloaded_seem_detector)
-    seem_model, seem_cfg = uu['seem_model'], uu['cfg']
-    # sys.exit(-1)
-    preloaded_lama_dict = preload_lama_remover(opt, preloaded_lama_dict)
+    seem_model, seem_cfg, vocab_metadata = uu['seem_model'], uu['cfg'], uu['metadata']
+    agent = get_vehicle_agent(engine='claude-3-haiku-20240307') if use_llm else None
 
-    width, height = img.size
-    img_ori = np.asarray(img).copy()
-    img = torch.from_numpy(img_ori).permute(2, 0, 1).cuda()
-    # print(f'img.size = {img.size}')
-
-    if mask is None:
-        visual = Visualizer(img_ori, metadata=metadata)
-        data = {"image": img, "height": height, "width": width}
-        data['text'] = reftxt # flexible targets
-        batch_inputs = [data]
-        # predict
-        seem_model.model.metadata = metadata
-        results, mask_box_dict = seem_model.model.evaluate_all(batch_inputs)
-        mask_all, category, masks_list = results[-1]['panoptic_seg']
-        assert len(category) == len(masks_list), f'len(category) = {len(category)}, len(masks_list) = {len(masks_list)}'
-        # TODO: merge masks
+    panoptic = seem_panoptic_batch(
+        seem_model, imgs, reftxt=reftxt, device=opt.device, max_batch=max_batch, vocab_metadata=vocab_metadata
+    )
+    outputs = []
+    for img, (mask_all, category, masks_list) in zip(imgs, panoptic):
         object_mask_list = [{
-            'name': metadata.stuff_classes[category[i]['category_id']],
+            'name': vocab_metadata.stuff_classes[category[i]['category_id']],
             'mask': masks_list[i]
         } for i in range(len(category))]
         for x in object_mask_list:
             k, v = x['name'], x['mask']
             print(f'name = <{k}>, mask.shape = <{v.shape}>')
             # mask -> torch.Tensor
-        if use_llm:
-            agent = get_vehicle_agent(engine='claude-3-haiku-20240307')
-        sure_mask_list = [
-            (x['mask'] * (255. if torch.max(x['mask']) <= 1. else 1.)) for x in object_mask_list if (agent.vehicle_judge_ask(x['name']) if use_llm else reftxt.lower() in x['name'].lower())
+        # segments of the `reftxt` (or LLM judged) classes: things by id in the panoptic map,
+        # stuff by their own mask, the same union as the masks_list loop before
+        sure = [
+            i for i, x in enumerate(object_mask_list)
+            if (agent.vehicle_judge_ask(x['name']) if agent is not None else reftxt.lower() in x['name'].lower())
         ]
-        for i in range(len(sure_mask_list)):
-            print(f'mask-i.shape = {sure_mask_list[i].shape}')
-        mm = sure_mask_list[0]
-        print(type(mm))
-        mask_merged, comp = torch.zeros_like(mm), torch.ones_like(mm) * 255.
-        # limit in range [0, 255]
-        for mm in sure_mask_list:
-            uu = mask_merged + mm
-            uu[uu > comp] = 255.
-            mask_merged = uu
-        mask_merged = dilate_mask(mask_merged.detach().cpu().numpy(), dilate_kernel_size)
-        demo = visual.draw_panoptic_seg(mask_all.cpu(), category)  # rgb Image
-        res = demo.get_image()
+        if len(sure) == 0:
+            print(f'[INFO] no <{reftxt}> found')
+        sure_ids = [category[i]['id'] for i in sure if category[i]['isthing']]
+        stuff_masks = [masks_list[i] for i in sure if not category[i]['isthing']]
+        mask_merged = merge_vehicle_masks(mask_all, sure_ids, dilate_kernel_size, masks=stuff_masks).cpu().numpy()
+        mask_all = mask_all.cpu()
+        res = None
+        if visualize:
+            visual = Visualizer(np.asarray(img).copy(), metadata=vocab_metadata)
+            res = visual.draw_panoptic_seg(mask_all, category).get_image()  # rgb Image
+        outputs.append({
+            'res': res, 'mask': mask_merged,
+            'panoptic_seg': mask_all.numpy(), 'category_ids': np.array([c['category_id'] for c in category], dtype=np.int64)
+        })
+    return outputs
+
+
+def FG_segment(
+        opt, img, reftxt = 'Car', preloaded_seem_detector = None,
+        dilate_kernel_size = 30, use_llm=False
+    ):
+    # SEEM panoptic segmentation, merge of the vehicle masks and dilation
+    # img: PIL.Image -> (res: visualized panoptic seg [H W 3], mask_merged: [H W] uint8 0/255)
+    out = FG_segment_batch(opt, [img], reftxt, preloaded_seem_detector, dilate_kernel_size, use_llm)[0]
+    return out['res'], out['mask']
+
+
+def FG_inpaint_batch(opt, items: list, preloaded_lama_dict = None):
+    # LaMa inpainting of [(img: PIL.Image, mask_merged: [H W]), ...] in batches -> [(mask_merged [H W 3], img_inpainted [H W 3]), ...]
+    # opt.lama_roi: inpaint tiles around the masked regions only (inpaint_imgs_with_lama_roi)
+    preloaded_lama_dict = preload_lama_remover(opt, preloaded_lama_dict)
+    pairs = [(np.asarray(img), mask_merged) for img, mask_merged in items]
+    if getattr(opt, 'lama_roi', False):
+        inpainted = inpaint_imgs_with_lama_roi(
+            pairs, mod=8, device=opt.device, preloaded_lama_remover=preloaded_lama_dict,
+            context=opt.lama_context, max_fraction=opt.lama_roi_fraction
+        )
+    else:
+        inpainted = inpaint_imgs_with_lama(pairs, mod=8, device=opt.device, preloaded_lama_remover=preloaded_lama_dict)
+    # -> [np.array([H W 3])] | cv2.imwrite: cv2.cvtColor(np.uint8(img_inpainted), cv2.COLOR_RGB2BGR)
+    outputs = []
+    for (_, mask_merged), img_inpainted in zip(items, inpainted):
+        mask_merged = repeat(rearrange(mask_merged, 'h w -> h w 1'), 'h w 1 -> h w c', c=3)
+        print(f'mask_merged.shape = {mask_merged.shape}, img_inpainted.shape = {img_inpainted.shape}')
+        outputs.append((mask_merged, img_inpainted))
+    return outputs
+
+
+def FG_inpaint(opt, img, mask_merged, preloaded_lama_dict = None):
+    # LaMa inpainting of mask_merged: [H W] -> (mask_merged [H W 3], img_inpainted [H W 3])
+    return FG_inpaint_batch(opt, [(img, mask_merged)], preloaded_lama_dict)[0]
+
+
+def FG_remove_All(
+        opt, img, reftxt = 'Car', mask = None,
+        preloaded_seem_detector = None, preloaded_lama_dict = None,
+        dilate_kernel_size = 30, use_llm=False # dilate with kernel=30 the best
+    ):
+    # img: PIL.Image
+    if mask is None:
+        res, mask_merged = FG_segment(
+            opt, img, reftxt=reftxt, preloaded_seem_detector=preloaded_seem_detector,
+            dilate_kernel_size=dilate_kernel_size, use_llm=use_llm
+        )
     else:
         # pdb.set_trace()
         res = None
@@ -269,24 +573,11 @@ def FG_remove_All(
         print(mask_merged.shape, mask.shape)
 
     # mask_merged: [H W]
-    img_inpainted = inpaint_img_with_lama(
-        img=img_ori, mask=mask_merged, mod=8, device=opt.device, preloaded_lama_remover=preloaded_lama_dict
-    )  # -> np.array([H W 3]) | cv2.imwrite: cv2.cvtColor(np.uint8(img_inpainted), cv2.COLOR_RGB2BGR)
-    mask_merged = repeat(rearrange(mask_merged, 'h w -> h w 1'), 'h w 1 -> h w c', c=3)
+    mask_merged, img_inpainted = FG_inpaint(opt, img, mask_merged, preloaded_lama_dict)
     if res is not None:
         print(f'res.shape = {res.shape}, type(res) = {type(res)}')
-    print(f'mask_merged.shape = {mask_merged.shape}, type(mask_merged) = {type(mask_merged)}')
-    print(f'img_inpainted.shape = {img_inpainted.shape}, type(img_inpainted) = {type(img_inpainted)}')
 
     # (F.interpolate(pred_masks_pos[None,], image_size[-2:], mode='bilinear')[0, :, :data['height'],
     #  :data['width']] > 0.0)
 
     return res, mask_merged, img_inpainted
-
-
-
-
-
-
-
-
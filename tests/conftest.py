@@ -0,0 +1,6 @@
+import os, sys
+
+# the modules import each other from the repo root (`from lidar2dep...`, `import process`), like the scripts run there
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
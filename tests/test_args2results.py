@@ -0,0 +1,97 @@
+import argparse
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+main = pytest.importorskip('lidar2dep.main')  # needs basicsr and the CompletionFormer package
+from lidar2dep.data.artifacts import artifact_level, set_artifact_level
+from PIL import Image
+
+H, W = 32, 48
+
+
+class StubNet(torch.nn.Module):
+    # CompletionFormer stand-in: per-sample outputs, independent of the batch they run in
+    def forward(self, batch):
+        rgb, dep = batch['rgb'], batch['dep']
+        pred = dep * 0.5 + rgb.mean(1, keepdim=True) * 10.
+        return {'pred': pred, 'pred_init': dep, 'confidence': [torch.sigmoid(pred)]}
+
+
+class StubZoe:
+    # depth-estimation pipeline stand-in: 'L' image of the red channel
+    def __init__(self, fail=False):
+        self.fail, self.calls = fail, []
+
+    def __call__(self, images, batch_size=1):
+        self.calls.append(len(images))
+        if self.fail: raise ValueError('out of memory')
+        return [{'depth': Image.fromarray(np.asarray(img)[..., 0])} for img in images]
+
+
+@pytest.fixture(autouse=True)
+def essential():
+    level = artifact_level()
+    set_artifact_level('essential')
+    yield
+    set_artifact_level(level)
+
+
+def requests(sides=2):
+    rng = np.random.default_rng(0)
+    K = np.array([[50., 0., W / 2], [0., 50., H / 2], [0., 0., 1.]])
+    out = []
+    for side in range(sides):
+        pcd_img = rng.uniform(1., 60., (H, W)) * (rng.random((H, W)) < 0.2)
+        mask = (rng.random((H, W, 3)) < 0.1).astype(np.uint8)
+        common = {
+            'pcd_file_path': None, 'intrinsics': {'dict': {'height': H, 'width': W}, 'matrix': K},
+            'extrinsics': np.eye(4), 'pcd_img': pcd_img, 'ring_img': np.zeros((H, W), dtype=np.int16)
+        }
+        for part, fg_mask in [('bg', mask), ('fg', 1 - mask), ('panoptic', None)]:
+            rgb = rng.integers(0, 255, (H, W, 3), dtype=np.uint8)
+            out.append(dict(common, rgb_file=rgb, fg_mask=fg_mask, extra_name=f'side{side}-{part}'))
+    return out
+
+
+def options(tmp_path):
+    return argparse.Namespace(depth_path=str(tmp_path), results=str(tmp_path), device='cpu',
+                              rgb_file_path=None, pcd_file_path=None, intrinsic_path=None, extrinsic_path=None)
+
+
+@pytest.mark.parametrize('zoe', [False, True])
+def test_batch_equals_per_request(tmp_path, zoe):
+    opt, batch = options(tmp_path), requests()
+    batched = main.Args2Results_batch(opt, batch, StubNet(), StubZoe() if zoe else None, max_batch=4)
+    assert len(batched) == len(batch)
+    for request, (_, _, pred) in zip(batch, batched):
+        kwargs = {k: v for k, v in request.items() if k != 'rgb_file'}
+        _, _, single = main.Args2Results(opt, request['rgb_file'], CompletionModel=StubNet(),
+                                         depth_estimater=StubZoe() if zoe else None, **kwargs)
+        np.testing.assert_allclose(pred, single, rtol=1e-6)
+
+
+def test_variants_share_one_sparse(tmp_path, monkeypatch):
+    seen = []
+    pre_read = main.pre_read
+
+    def spy(*args, **kwargs):
+        out = pre_read(*args, **kwargs)
+        seen.append((id(kwargs['pcd_img']), kwargs['sparse'], out['sparse']))
+        return out
+    monkeypatch.setattr(main, 'pre_read', spy)
+    main.Args2Results_batch(options(tmp_path), requests(), StubNet(), write=False)
+    for side in range(2):
+        first, *rest = seen[3 * side:3 * side + 3]
+        assert first[1] is None  # normalized and line-sampled once per side
+        for pcd, sparse, out in rest:
+            assert pcd == first[0] and sparse['depth'] is first[2]['depth']
+            assert out['depth'] is first[2]['depth'] and out['pcd_img'] is first[2]['pcd_img']
+    assert seen[0][2]['depth'] is not seen[3][2]['depth']
+
+
+def test_zoedepth_failure_raises(tmp_path):
+    # a failure must reach the batch runner (pair recorded as failed), not stop on a debugger prompt
+    with pytest.raises(RuntimeError, match='ZoeDepth failed') as info:
+        main.Args2Results_batch(options(tmp_path), requests(1), StubNet(), StubZoe(fail=True))
+    assert isinstance(info.value.__cause__, ValueError)
@@ -0,0 +1,114 @@
+import os
+import numpy as np
+import pytest
+
+from lidar2dep.data.artifacts import (
+    save_frame_artifacts, load_frame_artifacts, frame_artifact_path, to_metric, set_artifact_level, artifact_level,
+    writes
+)
+
+H, W = 24, 32
+
+
+def frame(seed=0):
+    rng = np.random.default_rng(seed)
+    return {
+        'depth': rng.uniform(0, 255, (H, W)).astype(np.float32),
+        'depth_init': rng.uniform(0, 255, (H, W)).astype(np.float32),
+        'confidence': rng.uniform(0, 1, (H, W)).astype(np.float32),
+        'mask': rng.integers(0, 2, (H, W), dtype=np.uint8) * 255,
+    }
+
+
+@pytest.fixture
+def artifact_level_debug():
+    level = artifact_level()
+    set_artifact_level('debug')
+    yield
+    set_artifact_level(level)
+
+
+@pytest.mark.parametrize('dtype, atol', [('float32', 0.), ('float16', 0.25)])
+def test_round_trip(tmp_path, dtype, atol):
+    arrays = frame()
+    path = save_frame_artifacts(str(tmp_path / 'a' / 'inf-fg.npz'), units='normalized', dtype=dtype,
+                                meta={'depth_range': [2., 120.]}, **arrays)
+    assert os.path.exists(path) and not [name for name in os.listdir(tmp_path / 'a') if name.endswith('.tmp')]
+    loaded, meta = load_frame_artifacts(path)
+    assert set(loaded) == set(arrays)
+    for name in ['depth', 'depth_init', 'confidence']:
+        assert loaded[name].dtype == np.float32 and loaded[name].shape == (H, W)
+        np.testing.assert_allclose(loaded[name], arrays[name], rtol=1e-3 if atol else 0, atol=atol)
+    assert loaded['mask'].dtype == np.uint8
+    np.testing.assert_array_equal(loaded['mask'], arrays['mask'])  # masks are lossless at any dtype
+    assert meta['dtype'] == dtype and meta['units'] == 'normalized' and meta['depth_range'] == [2., 120.]
+    assert meta['shapes']['depth'] == [H, W]
+
+
+def test_stored_dtype_and_tensors(tmp_path):
+    torch = pytest.importorskip('torch')
+    path = save_frame_artifacts(str(tmp_path / 'f.npz'), units='m', dtype='float16',
+                                depth=torch.ones(H, W, dtype=torch.float64), mask=torch.zeros(H, W, dtype=torch.bool), skipped=None)
+    loaded, meta = load_frame_artifacts(path, dtype=None)
+    assert loaded['depth'].dtype == np.float16 and loaded['mask'].dtype == np.bool_
+    assert 'skipped' not in loaded and set(meta['shapes']) == {'depth', 'mask'}
+
+
+def test_keys_subset(tmp_path):
+    path = save_frame_artifacts(str(tmp_path / 'f.npz'), units='m', **frame())
+    loaded, _ = load_frame_artifacts(path, keys=['mask'])
+    assert list(loaded) == ['mask']
+    with pytest.raises(KeyError):
+        load_frame_artifacts(path, keys=['missing'])
+
+
+def test_units_and_to_metric(tmp_path):
+    depth = np.array([[0., 127.5, 255.]], dtype=np.float32)
+    _, meta = load_frame_artifacts(save_frame_artifacts(str(tmp_path / 'n.npz'), units='normalized', meta={'depth_range': [2., 120.]}, depth=depth))
+    np.testing.assert_allclose(to_metric(depth, meta), [[2., 61., 120.]])
+    _, meta = load_frame_artifacts(save_frame_artifacts(str(tmp_path / 'm.npz'), units='m', depth=depth))
+    assert to_metric(depth, meta) is depth
+    _, meta = load_frame_artifacts(save_frame_artifacts(str(tmp_path / 'r.npz'), units='relative', depth=depth))
+    assert to_metric(depth, meta) is None  # monocular scale
+    _, meta = load_frame_artifacts(save_frame_artifacts(str(tmp_path / 'x.npz'), units='normalized', depth=depth))
+    assert to_metric(depth, meta) is None  # no range recorded
+    with pytest.raises(AssertionError):
+        save_frame_artifacts(str(tmp_path / 'bad.npz'), units='mm', depth=depth)
+
+
+def test_read_only_rebuilds_depth_tuples(tmp_path, artifact_level_debug):
+    # the read_only path of process.py: masks and (colored_pred, colored_init, pred) of an earlier run
+    process = pytest.importorskip('process')
+    results = str(tmp_path)
+    files = [{'rgb': 'inf.jpg', 'extra': 'inf-side'}, {'rgb': None, 'extra': 'veh-inf'}]
+    written = {}
+    for part in ['fg', 'bg', 'panoptic']:
+        written[part] = frame(seed=len(written))
+        save_frame_artifacts(frame_artifact_path(results, f'inf-side-{part}'), units='normalized',
+                             meta={'depth_range': [2., 120.]}, **written[part])
+    save_frame_artifacts(frame_artifact_path(results, 'inf-side-remove'), mask=written['fg']['mask'])
+
+    out = process.stage_read_results(type('Opt', (), {'results': results}), files)
+    assert list(out['masks']) == ['inf-side']  # frames without rgb have nothing to read
+    np.testing.assert_array_equal(out['masks']['inf-side'], written['fg']['mask'])
+    assert set(out['depth_results']) == {'inf-side-fg', 'inf-side-bg', 'inf-side-panoptic'}
+    for part, arrays in written.items():
+        colored_pred, colored_init, pred = out['depth_results'][f'inf-side-{part}']
+        np.testing.assert_array_equal(pred, arrays['depth'])
+        assert colored_pred.shape[:2] == colored_init.shape[:2] == (H, W) and colored_pred.dtype == np.uint8
+
+    set_artifact_level('essential')  # visualizations are not rebuilt below debug
+    out = process.stage_read_results(type('Opt', (), {'results': results}), files)
+    colored_pred, colored_init, pred = out['depth_results']['inf-side-bg']
+    assert colored_pred is None and colored_init is None and pred.shape == (H, W)
+
+
+def test_artifact_levels(artifact_level_debug):
+    assert writes('essential') and writes('debug')
+    set_artifact_level('essential')
+    assert writes('essential') and not writes('debug')
+    set_artifact_level('none')
+    assert not writes('essential') and not writes('debug')
+    with pytest.raises(ValueError, match='unknown artifact level'):
+        set_artifact_level('verbose')
+    assert artifact_level() == 'none'
@@ -0,0 +1,111 @@
+import argparse, json, os
+import pytest
+
+from lidar2dep.batch_runner import Manifest, format_duration, parse_indices, parse_shard
+from preprocess_dair import preprocess_dataset
+
+PAIRS = 10
+
+
+class FakeDair:
+    # a handful of synthetic cooperative pairs: preprocess_dataset only needs their number
+    def __len__(self):
+        return PAIRS
+
+
+class StubProcess:
+    """
+        process(todo, on_error) of the stub models: every pair "succeeds" except
+        those in `failing`, which fail in the complete stage.
+    """
+    def __init__(self, failing=()):
+        self.failing, self.seen = set(failing), []
+
+    def __call__(self, todo, on_error):
+        for idx in todo:
+            self.seen.append(idx)
+            if idx in self.failing:
+                on_error(idx, 'complete', RuntimeError(f'corrupt frame {idx}'))
+                continue
+            yield idx, {'inf-side': idx}
+
+
+def options(root, **kwargs):
+    opt = dict(results=str(root), indices=None, shard=None, skip_done=True, retry_failed=True, load_workers=0, prefetch=1)
+    opt.update(kwargs)
+    return argparse.Namespace(**opt)
+
+
+def test_all_pairs_processed_and_recorded(tmp_path):
+    process = StubProcess()
+    summary = preprocess_dataset(options(tmp_path), FakeDair(), process)
+    assert summary == {'done': PAIRS}
+    assert process.seen == list(range(PAIRS))
+    assert Manifest(str(tmp_path)).done() == set(range(PAIRS))
+
+
+def test_resume_after_partial_manifest(tmp_path):
+    manifest = Manifest(str(tmp_path))
+    for idx in [0, 1, 4]:
+        manifest.record(idx, 'done')
+    with open(manifest.path, 'a') as f:
+        f.write('{"idx": 5, "status": "do')  # last line cut by a kill
+    process = StubProcess()
+    summary = preprocess_dataset(options(tmp_path), FakeDair(), process)
+    assert process.seen == [2, 3, 5, 6, 7, 8, 9]
+    assert summary == {'done': 7}
+    # nothing left on a second resume
+    again = StubProcess()
+    assert preprocess_dataset(options(tmp_path), FakeDair(), again) == {}
+    assert again.seen == []
+
+
+def test_shards_are_disjoint_and_cover_the_range(tmp_path):
+    seen = []
+    for rank in range(3):
+        process = StubProcess()
+        preprocess_dataset(options(tmp_path, indices='0:9', shard=f'{rank}/3'), FakeDair(), process)
+        seen.append(set(process.seen))
+    assert all(not (a & b) for i, a in enumerate(seen) for b in seen[i + 1:])
+    assert set.union(*seen) == set(range(9))
+    assert len([name for name in os.listdir(tmp_path) if name.startswith('manifest-')]) == 3
+    # a resume with another shard layout reads every shard's manifest: only pair 9 is left, in shard 1/2
+    process = StubProcess()
+    preprocess_dataset(options(tmp_path, shard='0/2'), FakeDair(), process)
+    assert process.seen == []
+    process = StubProcess()
+    preprocess_dataset(options(tmp_path, shard='1/2'), FakeDair(), process)
+    assert process.seen == [9]
+
+
+def test_failing_pair_recorded_without_aborting(tmp_path):
+    process = StubProcess(failing=[3])
+    summary = preprocess_dataset(options(tmp_path), FakeDair(), process)
+    assert summary == {'done': PAIRS - 1, 'failed': 1}
+    assert process.seen == list(range(PAIRS))  # the pairs after the failure still ran
+    manifest = Manifest(str(tmp_path))
+    assert manifest.failed() == {3}
+    assert manifest.status[3]['stage'] == 'complete' and 'corrupt frame 3' in manifest.status[3]['error']
+
+    # failed pairs are retried by default, skipped with --retry_failed false
+    skipped = StubProcess()
+    preprocess_dataset(options(tmp_path, retry_failed=False), FakeDair(), skipped)
+    assert skipped.seen == []
+    retried = StubProcess()
+    assert preprocess_dataset(options(tmp_path), FakeDair(), retried) == {'done': 1}
+    assert retried.seen == [3] and Manifest(str(tmp_path)).done() == set(range(PAIRS))
+
+
+def test_index_and_shard_specs():
+    assert parse_indices('3,7,10:12', 20) == [3, 7, 10, 11]
+    assert parse_indices(None, 3) == [0, 1, 2]
+    with pytest.raises(ValueError):
+        parse_indices('20', 20)
+    assert parse_shard('1/4') == (1, 4)
+    with pytest.raises(ValueError):
+        parse_shard('4/4')
+
+
+def test_eta_past_a_day():
+    assert format_duration(66 * 3600) == '2d 18:00:00'
+    assert format_duration(59) == '00:00:59'
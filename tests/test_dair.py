@@ -0,0 +1,206 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+dair = pytest.importorskip('lidar2dep.dair')  # needs basicsr and the CompletionFormer package
+
+INF = 'cooperative-vehicle-infrastructure/infrastructure-side/calib'
+VEH = 'cooperative-vehicle-infrastructure/vehicle-side/calib'
+
+
+def rigid(rng):
+    # random rotation (QR of a gaussian matrix) and translation
+    q, r = np.linalg.qr(rng.normal(size=(3, 3)))
+    q *= np.sign(np.diag(r))
+    if np.linalg.det(q) < 0: q[:, 0] *= -1
+    T = np.eye(4)
+    T[0:3, 0:3], T[0:3, 3] = q, rng.uniform(-50, 50, 3)
+    return T
+
+
+def write_json(path, value):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(value, f)
+
+
+def write_extrinsic(path, T, nested=False):
+    value = {'rotation': T[0:3, 0:3].tolist(), 'translation': T[0:3, 3:4].tolist()}
+    write_json(path, {'transform': value} if nested else value)
+
+
+def make_tree(base, n=3, seed=0):
+    """
+    DAIR-V2X cooperative layout under `base` with `n` pairs of random calibrations.
+    -> data_info items, {(inf_id, veh_id): matrices written}
+    """
+    rng = np.random.default_rng(seed)
+    items, truth = [], {}
+    for k in range(n):
+        inf_id, veh_id = f'{k:06d}', f'{100 + k:06d}'
+        items.append({
+            'infrastructure_image_path': f'infrastructure-side/image/{inf_id}.jpg',
+            'vehicle_image_path': f'vehicle-side/image/{veh_id}.jpg',
+            'system_error_offset': {'delta_x': float(k) / 2, 'delta_y': -float(k)},
+        })
+        m = {name: rigid(rng) for name in ['inf_lidar2cam', 'veh_lidar2cam', 'inf_lidar2world',
+                                            'veh_lidar2novatel', 'veh_novatel2world']}
+        m['inf_K'] = np.array([[1000. + k, 0., 960.], [0., 1001. + k, 540.], [0., 0., 1.]])
+        m['veh_K'] = np.array([[2000. + k, 0., 950.], [0., 2002., 530.], [0., 0., 1.]])
+        write_json(f'{base}/{INF}/camera_intrinsic/{inf_id}.json',
+                   {'height': 1080, 'width': 1920, 'cam_K': m['inf_K'].ravel().tolist()})
+        write_json(f'{base}/{VEH}/camera_intrinsic/{veh_id}.json',
+                   {'height': 1080 + k, 'width': 1920, 'cam_K': m['veh_K'].ravel().tolist()})
+        write_extrinsic(f'{base}/{INF}/virtuallidar_to_camera/{inf_id}.json', m['inf_lidar2cam'])
+        write_extrinsic(f'{base}/{VEH}/lidar_to_camera/{veh_id}.json', m['veh_lidar2cam'])
+        write_extrinsic(f'{base}/{INF}/virtuallidar_to_world/{inf_id}.json', m['inf_lidar2world'])
+        write_extrinsic(f'{base}/{VEH}/lidar_to_novatel/{veh_id}.json', m['veh_lidar2novatel'], nested=True)
+        write_extrinsic(f'{base}/{VEH}/novatel_to_world/{veh_id}.json', m['veh_novatel2world'])
+        truth[(inf_id, veh_id)] = m
+    write_json(f'{base}/cooperative-vehicle-infrastructure/cooperative/data_info.json', items)
+    return items, truth
+
+
+def test_columns_match_the_per_pair_jsons(tmp_path):
+    items, truth = make_tree(str(tmp_path))
+    index = dair.CalibrationIndex.build(items, str(tmp_path))
+    assert len(index) == 3
+    inv = np.linalg.inv
+    for k, ((inf_id, veh_id), m) in enumerate(truth.items()):
+        row = index[k]
+        assert (str(row.inf_id), str(row.veh_id)) == (inf_id, veh_id)
+        assert tuple(row.inf_hw) == (1080, 1920) and tuple(row.veh_hw) == (1080 + k, 1920)
+        np.testing.assert_allclose(row.system_error_offset, [k / 2, -k])
+        for name in ['inf_K', 'veh_K', 'inf_lidar2cam', 'veh_lidar2cam', 'inf_lidar2world',
+                     'veh_lidar2novatel', 'veh_novatel2world']:
+            assert getattr(row, name).dtype == np.float64
+            np.testing.assert_allclose(getattr(row, name), m[name], atol=1e-12)
+
+        # veh_lidar2world keeps the row-order product of the former CooperativeData.veh_lidar2world
+        np.testing.assert_allclose(row.veh_lidar2world, m['veh_lidar2novatel'] @ m['veh_novatel2world'], atol=1e-9)
+        assert not np.allclose(row.veh_lidar2world, m['veh_novatel2world'] @ m['veh_lidar2novatel'])
+        np.testing.assert_allclose(row.world2inf_cam, inv(m['inf_lidar2world']) @ m['inf_lidar2cam'], atol=1e-9)
+        np.testing.assert_allclose(row.world2veh_cam, inv(row.veh_lidar2world) @ m['veh_lidar2cam'], atol=1e-9)
+        np.testing.assert_allclose(row.inf2veh, inv(m['inf_lidar2cam']) @ m['veh_lidar2cam'], atol=1e-9)
+
+        # the cross views use the column-order chain: p_cam = T @ p_lidar
+        veh_lidar2world = m['veh_novatel2world'] @ m['veh_lidar2novatel']
+        np.testing.assert_allclose(row.inf_lidar2veh_cam,
+                                   m['veh_lidar2cam'] @ inv(veh_lidar2world) @ m['inf_lidar2world'], atol=1e-9)
+        np.testing.assert_allclose(row.veh_lidar2inf_cam,
+                                   m['inf_lidar2cam'] @ inv(m['inf_lidar2world']) @ veh_lidar2world, atol=1e-9)
+        # a world point seen by the inf lidar lands where the veh camera sees it
+        p = np.array([3., -2., 10., 1.])
+        np.testing.assert_allclose(row.inf_lidar2veh_cam @ inv(m['inf_lidar2world']) @ p,
+                                   m['veh_lidar2cam'] @ inv(veh_lidar2world) @ p, atol=1e-9)
+
+    # a standalone pair: the same row as through the index
+    single = dair.CalibrationIndex.build([items[1]], str(tmp_path))[0]
+    detached = index[1].detach()
+    for name in index.columns:
+        np.testing.assert_array_equal(getattr(single, name), getattr(index[1], name))
+        np.testing.assert_array_equal(getattr(detached, name), getattr(index[1], name))
+
+
+def test_cross_view_columns_returns_a_new_dict(tmp_path):
+    items, _ = make_tree(str(tmp_path), n=2)
+    index = dair.CalibrationIndex.build(items, str(tmp_path))
+    columns = {k: v for k, v in index.columns.items() if k not in ['inf_lidar2veh_cam', 'veh_lidar2inf_cam']}
+    before = dict(columns)
+    out = dair.cross_view_columns(columns)
+    assert out is not columns and columns == before
+    np.testing.assert_array_equal(out['inf_lidar2veh_cam'], index.columns['inf_lidar2veh_cam'])
+    np.testing.assert_array_equal(out['veh_lidar2inf_cam'], index.columns['veh_lidar2inf_cam'])
+    again = dair.cross_view_columns(out)
+    assert again is not out and again.keys() == out.keys()
+
+
+def test_calib_cache_rebuilt_when_data_info_changes(tmp_path):
+    base = str(tmp_path)
+    _, truth = make_tree(base, n=3, seed=0)
+    dataset = dair.DAIR_V2X_C(base)
+    np.testing.assert_allclose(dataset.calib[0].inf_lidar2cam, truth[('000000', '000100')]['inf_lidar2cam'])
+    assert os.path.exists(dataset.calib_cache_path)
+
+    # same data_info.json: read back from calib_index.npz, the calib jsons are not read again
+    os.remove(f'{base}/{INF}/virtuallidar_to_camera/000000.json')
+    cached = dair.DAIR_V2X_C(base).calib
+    assert len(cached) == 3
+    for name in dataset.calib.columns:
+        np.testing.assert_array_equal(cached.columns[name], dataset.calib.columns[name])
+
+    # data_info.json rewritten (new pairs and calibrations): the cache is stale and rebuilt
+    _, truth = make_tree(base, n=2, seed=1)
+    rebuilt = dair.DAIR_V2X_C(base).calib
+    assert len(rebuilt) == 2
+    np.testing.assert_allclose(rebuilt[0].inf_lidar2cam, truth[('000000', '000100')]['inf_lidar2cam'])
+
+    # same size, new mtime only
+    config = dair.DAIR_V2X_C(base).config_path
+    _, truth = make_tree(base, n=2, seed=2)
+    st = os.stat(config)
+    os.utime(config, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    np.testing.assert_allclose(dair.DAIR_V2X_C(base).calib[1].veh_lidar2cam, truth[('000001', '000101')]['veh_lidar2cam'])
+
+    # without the cache
+    assert dair.DAIR_V2X_C(base, calib_cache=False).calib_cache_path is None
+
+
+def test_cache_without_cross_views(tmp_path):
+    # an index cached before the cross-view columns existed gets them on load
+    items, _ = make_tree(str(tmp_path), n=2)
+    index = dair.CalibrationIndex.build(items, str(tmp_path))
+    path = str(tmp_path / 'old.npz')
+    np.savez(path, **{k: v for k, v in index.columns.items() if k not in ['inf_lidar2veh_cam', 'veh_lidar2inf_cam']})
+    loaded = dair.CalibrationIndex.load_or_build(items, str(tmp_path), path)
+    np.testing.assert_allclose(loaded.columns['inf_lidar2veh_cam'], index.columns['inf_lidar2veh_cam'])
+
+
+def test_lazy_pair(tmp_path, monkeypatch):
+    from PIL import Image
+    base = str(tmp_path / 'dair')
+    items, _ = make_tree(base, n=1)
+    for side, pair_id, color in [('infrastructure', '000000', 'red'), ('vehicle', '000100', 'blue')]:
+        path = f'{base}/cooperative-vehicle-infrastructure-{side}-side-image/{pair_id}.jpg'
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        Image.new('RGB', (512, 256), color).save(path)
+
+    opened, downsampled = [], []
+    open_image, downsampler = dair.Image.open, dair.downsampler
+    monkeypatch.setattr(dair.Image, 'open', lambda path, *a, **k: opened.append(path) or open_image(path, *a, **k))
+    monkeypatch.setattr(dair, 'downsampler', lambda img, f: downsampled.append((img.size, f)) or downsampler(img, f))
+
+    pair = dair.DAIR_V2X_C(base).pair(0, downsample=2, lazy=True)
+    assert opened == [] and pair._images == {}
+    assert not os.path.exists(tmp_path / 'inf') and not os.path.exists(tmp_path / 'veh')
+    assert pair.camera_intrinsic['width'] == 960 and pair.camera_intrinsic['height'] == 512
+
+    # the default factor, then others: always from the 512 x 256 original, one resize per factor
+    assert pair.inf_side_img.size == (256, 128)
+    assert pair.side_image('inf', 4).size == (128, 64)
+    assert pair.side_image('inf', 2) is pair.inf_side_img
+    pair.set_downsample(4)
+    assert pair.inf_side_img is pair.side_image('inf', 4)
+    assert pair.veh_side_img.size == (128, 64)
+    assert downsampled == [((512, 256), 2), ((512, 256), 4), ((512, 256), 4)]
+    assert len(opened) == 2
+    assert not os.path.exists(tmp_path / 'inf')
+
+    # the ply directory is created on first access only
+    assert pair.inf_ply_store_path == os.path.join(f'{base}/../', 'inf', '000000', 'ply', '000000.ply')
+    assert os.path.isdir(tmp_path / 'inf' / '000000' / 'ply') and not os.path.exists(tmp_path / 'veh')
+
+    # eager construction does it all up front
+    eager = dair.DAIR_V2X_C(base).pair(0, downsample=2)
+    assert set(eager._images) == {'inf', 'veh', ('inf', 2), ('veh', 2)}
+    assert os.path.isdir(tmp_path / 'veh' / '000100' / 'ply')
+
+
+def test_lazy_pair_unreadable_image(tmp_path):
+    base = str(tmp_path / 'dair')
+    make_tree(base, n=1)
+    pair = dair.DAIR_V2X_C(base).pair(0, lazy=True)
+    with pytest.raises(OSError, match='cannot decode the inf side image'):
+        pair.inf_side_img
@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+import torch
+
+from lidar2dep.data.frustum import frustum_mask, cull_points, cull_point_cloud
+from lidar2dep.data.pcd_io import LidarPointCloud
+from lidar2dep.data.projector import project_points
+
+# two cameras back to back on the lidar: a 64 x 48 one looking along +x, a 40 x 30 one along -x
+KS = np.array([[[40., 0., 31.5], [0., 40., 23.5], [0., 0., 1.]],
+               [[25., 0., 20.], [0., 25., 15.], [0., 0., 1.]]])
+SIZES = [(48, 64), (30, 40)]
+LIDAR2CAM = np.array([[0., -1., 0.], [0., 0., -1.], [1., 0., 0.]])
+
+
+def extrinsics():
+    front, back = np.eye(4), np.eye(4)
+    front[0:3, 0:3] = LIDAR2CAM
+    back[0:3, 0:3] = LIDAR2CAM @ np.diag([-1., -1., 1.])  # turned around the up axis
+    back[0:3, 3] = [0.2, 0., 0.]
+    return np.stack([front, back])
+
+
+def lift(c, u, v, z):
+    # lidar point seen by camera c at pixel (u, v), depth z
+    cam = z * np.linalg.solve(KS[c], [u, v, 1.])
+    T = extrinsics()[c]
+    return np.linalg.solve(T[0:3, 0:3], cam - T[0:3, 3])
+
+
+EPS = 1e-6
+
+
+@pytest.mark.parametrize('margin', [0, 8, 32])
+def test_margin_over_two_cameras(margin):
+    points, expected = [], []
+    for c, (h, w) in enumerate(SIZES):
+        lo_u, hi_u, lo_v, hi_v = -margin - 0.5, w + margin - 0.5, -margin - 0.5, h + margin - 0.5
+        for u, v, inside in [
+            (w / 2, h / 2, True),
+            (lo_u + EPS, h / 2, True), (lo_u - EPS, h / 2, False),
+            (hi_u - EPS, h / 2, True), (hi_u + EPS, h / 2, False),
+            (w / 2, lo_v + EPS, True), (w / 2, lo_v - EPS, False),
+            (w / 2, hi_v - EPS, True), (w / 2, hi_v + EPS, False),
+            (lo_u + EPS, hi_v - EPS, True), (hi_u + 5, hi_v + 5, False),
+        ]:
+            points.append(lift(c, u, v, 7.))
+            expected.append(inside)
+    points, expected = np.array(points), np.array(expected)
+    mask = frustum_mask(points, KS, extrinsics(), SIZES, margin=margin)
+    assert mask.dtype == bool
+    np.testing.assert_array_equal(mask, expected)
+    # each camera on its own keeps only its half of the points: the two-camera mask is the union
+    front = frustum_mask(points, KS[0:1], extrinsics()[0:1], SIZES[0:1], margin=margin)
+    back = frustum_mask(points, KS[1:2], extrinsics()[1:2], SIZES[1:2], margin=margin)
+    np.testing.assert_array_equal(front | back, mask)
+    assert front[:11].any() and not front[11:].any() and back[11:].any() and not back[:11].any()
+    t_mask = frustum_mask(torch.from_numpy(points), KS, extrinsics(), SIZES, margin=margin)
+    assert isinstance(t_mask, torch.Tensor)
+    np.testing.assert_array_equal(t_mask.numpy(), expected)
+
+
+@pytest.mark.parametrize('c', [0, 1])
+def test_near_and_far(c):
+    # one camera at a time: a point behind one camera is in front of the other
+    Ks, T, sizes = KS[c:c + 1], extrinsics()[c:c + 1], SIZES[c:c + 1]
+    depths = [-3., 0., 0.5 - EPS, 0.5 + EPS, 10., 50. - EPS, 50. + EPS, 80.]
+    points = np.array([lift(c, 10., 10., z) for z in depths])
+    inside = [False, False, False, True, True, True, False, False]
+    np.testing.assert_array_equal(frustum_mask(points, Ks, T, sizes, margin=0, near=0.5, far=50.), inside)
+    np.testing.assert_array_equal(frustum_mask(torch.from_numpy(points), Ks, T, sizes, margin=0, near=0.5,
+                                               far=50.).numpy(), inside)
+    # no far limit by default, and the default near plane is just in front of the camera
+    np.testing.assert_array_equal(frustum_mask(points, Ks, T, sizes, margin=0, near=0.5),
+                                  [False, False, False, True, True, True, True, True])
+    np.testing.assert_array_equal(frustum_mask(points, Ks, T, sizes, margin=0), [False, False] + [True] * 6)
+    # over both cameras, the points behind this one land in the other's frustum
+    both = frustum_mask(points, KS, extrinsics(), SIZES, margin=0, near=0.5, far=50.)
+    assert both[0] and both[3:6].all() and not both[6:].any()
+
+
+def test_margin_zero_matches_the_projector():
+    # without a margin, a point is kept exactly when it lands on a pixel of one of the cameras
+    rng = np.random.default_rng(0)
+    points = np.column_stack([rng.uniform(-30, 30, 1500), rng.uniform(-30, 30, 1500), rng.uniform(-20, 20, 1500)])
+    mask = frustum_mask(points, KS, extrinsics(), SIZES, margin=0, near=0.5, far=40.)
+    lands = np.zeros(len(points), dtype=bool)
+    for K, T, (h, w) in zip(KS, extrinsics(), SIZES):
+        # hidden points lose the z-buffer: project the remaining ones again until none is left
+        todo = np.arange(len(points))
+        while len(todo):
+            _, index = project_points(points[todo], K, T, h, w, near=0.5, far=40., return_index=True)
+            won = todo[index[index >= 0]]
+            if not len(won): break
+            lands[won] = True
+            todo = np.setdiff1d(todo, won)
+    assert 0 < mask.sum() < len(points)
+    np.testing.assert_array_equal(mask, lands)
+
+
+def test_cull():
+    points = np.array([lift(0, 30., 20., 5.), lift(1, 500., 20., 5.), lift(1, 3., 3., 5.)])
+    kept, stats = cull_points(points, KS, extrinsics(), SIZES, margin=0)
+    np.testing.assert_array_equal(kept, points[[0, 2]])
+    assert stats == {'total': 3, 'kept': 2, 'dropped': 1}
+    data = np.zeros(3, dtype=[('x', 'f8'), ('y', 'f8'), ('z', 'f8'), ('intensity', 'f4')])
+    for k, name in enumerate('xyz'): data[name] = points[:, k]
+    data['intensity'] = [0.1, 0.2, 0.3]
+    pcd, stats = cull_point_cloud(LidarPointCloud(data), KS, extrinsics(), SIZES, margin=0, name='test')
+    assert stats['kept'] == 2 and pcd.intensity.tolist() == pytest.approx([0.1, 0.3])
@@ -0,0 +1,51 @@
+from types import SimpleNamespace
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+masks = pytest.importorskip('seem.masks')  # needs detectron2 and the LaMa package
+
+
+class StubLaMa(torch.nn.Module):
+    # LaMa stand-in: masked pixels replaced by a 5x5 box blur, per sample; records the batch shapes
+    def __init__(self):
+        super().__init__()
+        self.blur = torch.nn.Conv2d(3, 3, 5, padding=2, groups=3, bias=False, padding_mode='reflect')
+        self.blur.weight.data.fill_(1. / 25)
+        self.shapes = []
+
+    def forward(self, batch):
+        image, mask = batch['image'], batch['mask'].float()
+        self.shapes.append(tuple(image.shape))
+        return dict(batch, inpainted=image * (1 - mask) + self.blur(image) * mask)
+
+
+def remover():
+    return {'model': StubLaMa().eval(), 'config': SimpleNamespace(out_key='inpainted')}
+
+
+def item(h, w, seed):
+    rng = np.random.default_rng(seed)
+    img = rng.integers(0, 255, (h, w, 3), dtype=np.uint8)
+    mask = np.zeros((h, w), dtype=np.uint8)
+    mask[h // 4:h // 2, w // 3:w // 2] = 255
+    return img, mask if seed % 2 else mask[..., None] // 255  # [H W] 0/255 and [H W 1] 0/1 masks
+
+
+def test_batched_equals_single_in_input_order():
+    # 60x80 and 62x78 pad to the same 64x80, 33x47 to 40x48
+    sizes = [(60, 80), (33, 47), (62, 78), (60, 80), (33, 47), (64, 80), (60, 80)]
+    items = [item(h, w, seed) for seed, (h, w) in enumerate(sizes)]
+    lama = remover()
+    out = masks.inpaint_imgs_with_lama(items, mod=8, device='cpu', preloaded_lama_remover=lama, max_batch=2)
+    assert [o.shape for o in out] == [(h, w, 3) for h, w in sizes] and all(o.dtype == np.uint8 for o in out)
+    # buckets by padded shape, chunks of at most max_batch
+    assert sorted(lama['model'].shapes) == sorted([(2, 3, 64, 80), (2, 3, 64, 80), (1, 3, 64, 80), (2, 3, 40, 48)])
+    for (img, mask), o in zip(items, out):
+        np.testing.assert_array_equal(o, masks.inpaint_img_with_lama(img, mask, mod=8, device='cpu', preloaded_lama_remover=lama))
+        keep = np.asarray(mask).squeeze() == 0
+        np.testing.assert_allclose(o[keep].astype(int), img[keep].astype(int), atol=1)  # unmasked pixels kept
+
+
+def test_empty_list():
+    assert masks.inpaint_imgs_with_lama([], device='cpu', preloaded_lama_remover=remover()) == []
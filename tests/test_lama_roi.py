@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+masks = pytest.importorskip('seem.masks')  # needs detectron2 and the LaMa package
+from test_lama_batch import remover
+
+
+def test_fit_span_rounds_to_quantum_and_clips_to_the_frame():
+    assert masks._fit_span(100, 140, 1000, 64, 64) == (88, 152)     # grown to min_size, centered
+    assert masks._fit_span(100, 230, 1000, 64, 64) == (69, 261)     # 130 rounded up to 192
+    assert masks._fit_span(-50, 60, 1000, 256, 64) == (0, 256)      # shifted inside at the top / left border
+    assert masks._fit_span(950, 1040, 1000, 256, 64) == (744, 1000)  # and at the bottom / right border
+    assert masks._fit_span(10, 90, 200, 256, 64) == (0, 200)        # frames smaller than a tile: the whole side
+
+
+def region_mask(h, w, boxes):
+    mask = np.zeros((h, w), dtype=np.uint8)
+    for y0, y1, x0, x1 in boxes:
+        mask[y0:y1, x0:x1] = 255
+    return mask
+
+
+def test_mask_rois():
+    assert masks.mask_rois(np.zeros((300, 400), dtype=np.uint8)) == []
+    # one region: grown by the context, min_size / quantum sized, inside the frame
+    (y0, y1, x0, x1), = masks.mask_rois(region_mask(600, 800, [(290, 310, 5, 25)]), context=96, min_size=256, quantum=64)
+    assert y0 <= 290 - 96 and y1 >= 310 + 96 and x0 == 0 and x1 >= 25 + 96
+    assert (y1 - y0) % 64 == 0 and (x1 - x0) % 64 == 0 and y1 - y0 >= 256
+    # far regions keep their own tiles, overlapping tiles are merged into one covering both
+    far = masks.mask_rois(region_mask(600, 800, [(20, 40, 20, 40), (500, 520, 700, 720)]), context=32, min_size=64)
+    assert len(far) == 2
+    near = masks.mask_rois(region_mask(600, 800, [(100, 120, 100, 120), (100, 120, 200, 220)]), context=32, min_size=64)
+    (y0, y1, x0, x1), = near
+    assert y0 <= 100 - 32 and y1 >= 120 + 32 and x0 <= 100 - 32 and x1 >= 220 + 32
+    assert (y1 - y0) % 64 == 0 and (x1 - x0) % 64 == 0
+
+
+def frame(h, w, seed, boxes):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 255, (h, w, 3), dtype=np.uint8), region_mask(h, w, boxes)
+
+
+def test_roi_paste_back_matches_whole_frame():
+    items = [frame(480, 640, 0, [(200, 240, 300, 360)]), frame(480, 640, 1, [(10, 30, 600, 630), (400, 460, 20, 60)])]
+    lama = remover()
+    out = masks.inpaint_imgs_with_lama_roi(items, device='cpu', preloaded_lama_remover=lama, context=32)
+    assert all(shape[2:] != (480, 640) for shape in lama['model'].shapes)  # tiles only
+    whole = masks.inpaint_imgs_with_lama(items, device='cpu', preloaded_lama_remover=remover())
+    for (img, mask), o, w in zip(items, out, whole):
+        assert o.shape == img.shape and o.dtype == np.uint8
+        # the stub only looks 2 pixels around a masked pixel: inside the context the tile sees what the frame sees
+        np.testing.assert_array_equal(o[mask > 0], w[mask > 0])
+        np.testing.assert_array_equal(o[mask == 0], img[mask == 0])  # pasted back, the rest untouched
+
+
+def test_empty_mask_and_whole_frame_fallback():
+    empty = frame(120, 160, 0, [])
+    large = frame(120, 160, 1, [(10, 110, 10, 150)])  # its tile covers more than max_fraction
+    lama = remover()
+    out = masks.inpaint_imgs_with_lama_roi([empty, large], device='cpu', preloaded_lama_remover=lama, max_fraction=0.5)
+    np.testing.assert_array_equal(out[0], empty[0])
+    assert out[0] is not empty[0]
+    assert lama['model'].shapes == [(1, 3, 120, 160)]  # only the large mask, as a whole frame
+    np.testing.assert_array_equal(out[1], masks.inpaint_imgs_with_lama([large], device='cpu', preloaded_lama_remover=remover())[0])
+    assert masks.inpaint_imgs_with_lama_roi([empty], device='cpu', preloaded_lama_remover=remover())[0].shape == (120, 160, 3)
@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+from guidance import llm_util
+from guidance.llm_util import VehicleJudge, KEYWORD_RULES, offline_vehicle_judge, prompt_version, vehicle_prompt
+
+
+class FakeAgent:
+    # Claude as seen by VehicleJudge: vehicle_judge_request(name) -> bool or None
+    def __init__(self, answers):
+        self.answers, self.asked = answers, []
+
+    def vehicle_judge_request(self, name):
+        self.asked.append(name)
+        return self.answers.get(name)
+
+
+@pytest.mark.parametrize('name, vehicle', [
+    ('car', True), ('buses', True), ('motorcycle-other-merged', True), ('Fire_Truck', True), ('bicycles', True),
+    ('Traffic_Light', False), ('road', False), ('sky-other-merged', False), ('person', False), ('', False),
+])
+def test_offline_vehicle_judge(name, vehicle):
+    assert offline_vehicle_judge(name) is vehicle
+
+
+def test_table_is_seeded_and_keyed_by_prompt_version(tmp_path):
+    path = str(tmp_path / 'judgments.json')
+    VehicleJudge(agent=None, path=path)
+    with open(path) as f: tables = json.load(f)
+    version = prompt_version(vehicle_prompt)
+    assert list(tables) == [version]
+    assert tables[version] == {name: {'vehicle': value, 'source': 'rule'} for name, value in KEYWORD_RULES.items()}
+
+    # another prompt gets its own table next to the first one
+    other = VehicleJudge(agent=FakeAgent({'scooter': True}), path=path, prompt=vehicle_prompt + ' Be brief.')
+    assert other('Scooter') is True
+    with open(path) as f: tables = json.load(f)
+    assert set(tables) == {version, other.version} and other.version != version
+    assert tables[other.version]['scooter'] == {'vehicle': True, 'source': 'llm'}
+    assert 'scooter' not in tables[version]
+
+
+def test_llm_answers_are_stored_and_asked_once(tmp_path):
+    path = str(tmp_path / 'judgments.json')
+    agent = FakeAgent({'rickshaw': True, 'pole': False})
+    judge = VehicleJudge(agent=agent, path=path)
+    assert judge('Rickshaw') is True and judge('rickshaw') is True
+    assert judge('pole') is False
+    # keyword rules answer without the agent
+    assert judge('school bus') is True and judge('street light') is False
+    assert agent.asked == ['rickshaw', 'pole']
+
+    # a new judge on the same file, e.g. another process, reads the stored answers
+    agent = FakeAgent({})
+    judge = VehicleJudge(agent=agent, path=path)
+    assert judge('rickshaw') is True and judge('pole') is False and agent.asked == []
+    assert judge.table['school bus'] == {'vehicle': True, 'source': 'rule'}
+
+
+def test_offline_guesses_are_not_stored(tmp_path):
+    path = str(tmp_path / 'judgments.json')
+    agent = FakeAgent({})  # every request fails
+    judge = VehicleJudge(agent=agent, path=path)
+    assert judge('tram') is True and judge('fence') is False
+    assert judge('tram') is True and agent.asked == ['tram', 'fence', 'tram']
+    with open(path) as f: table = json.load(f)[judge.version]
+    assert 'tram' not in table and 'fence' not in table
+    assert VehicleJudge(agent=None, path=path)('tractor') is True
+
+
+def test_claude_needs_anthropic(monkeypatch):
+    monkeypatch.setattr(llm_util, 'anthropic', None)
+    with pytest.raises(ImportError, match='pip install anthropic'):
+        llm_util.Claude('claude-3-haiku-20240307', 'key', vehicle_prompt)
+    with pytest.raises(ImportError, match='pip install anthropic'):
+        llm_util.Vision_Claude('claude-3-haiku-20240307', 'key')
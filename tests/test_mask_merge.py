@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+cv2 = pytest.importorskip('cv2')
+masks = pytest.importorskip('seem.masks')  # needs detectron2 and the LaMa package
+
+H, W = 96, 128
+KERNELS = [1, 2, 15, 30, 31]
+DEVICES = ['cpu'] + (['cuda'] if torch.cuda.is_available() else [])
+
+
+def reference_merge(masks_list, dilate_kernel_size):
+    # previous FG_segment_batch path: union of the per-segment masks, cv2.dilate
+    mask_merged, comp = torch.zeros_like(masks_list[0], dtype=torch.float32), torch.full(masks_list[0].shape, 255.)
+    for mm in masks_list:
+        uu = mask_merged + mm * 255.
+        uu[uu > comp] = 255.
+        mask_merged = uu
+    return masks.dilate_mask(mask_merged.numpy(), dilate_kernel_size)
+
+
+def boxes(segments=12, seed=0):
+    # panoptic map of boxes drawn over each other -> (map, [(id, mask)] in drawing order)
+    rng = np.random.default_rng(seed)
+    panoptic_seg = np.zeros((H, W), dtype=np.int32)
+    for i in range(1, segments + 1):
+        y, x = rng.integers(0, H), rng.integers(0, W)
+        panoptic_seg[y:y + rng.integers(4, H // 3), x:x + rng.integers(4, W // 3)] = i
+    panoptic_seg = torch.from_numpy(panoptic_seg)
+    return panoptic_seg, [(i, panoptic_seg == i) for i in panoptic_seg.unique().tolist() if i > 0]
+
+
+@pytest.mark.parametrize('device', DEVICES)
+@pytest.mark.parametrize('max_pool', [None, True])
+@pytest.mark.parametrize('k', KERNELS)
+def test_dilation_matches_cv2(k, max_pool, device):
+    # arbitrary 0-255 float map (the FG_remove path), odd and even kernels: cv2 anchors an even kernel at k // 2
+    rng = np.random.default_rng(k)
+    noise = rng.integers(0, 255, (H, W)).astype(np.float32) * (rng.random((H, W)) < 0.02)
+    noise[0, 0] = noise[-1, -1] = 200.  # border pixels
+    if device == 'cpu' and max_pool is None: max_pool = False  # cv2 itself on cpu tensors
+    out = masks.dilate_mask_tensor(torch.from_numpy(noise).to(device), k, max_pool=max_pool)
+    assert out.dtype == torch.uint8 and out.device.type == device
+    np.testing.assert_array_equal(out.cpu().numpy(), masks.dilate_mask(noise.copy(), k))
+
+
+@pytest.mark.parametrize('device', DEVICES)
+@pytest.mark.parametrize('max_pool', [None, True])
+@pytest.mark.parametrize('k', KERNELS)
+def test_merge_matches_masks_list_union(k, max_pool, device):
+    panoptic_seg, segments = boxes()
+    chosen = segments[::3]
+    out = masks.merge_vehicle_masks(panoptic_seg.to(device), [i for i, _ in chosen], k, max_pool)
+    np.testing.assert_array_equal(out.cpu().numpy(), reference_merge([m for _, m in chosen], k))
+
+
+@pytest.mark.parametrize('max_pool', [None, True])
+def test_merge_without_segments(max_pool):
+    panoptic_seg, _ = boxes()
+    out = masks.merge_vehicle_masks(panoptic_seg, [], 30, max_pool)
+    assert out.dtype == torch.uint8 and out.shape == (H, W) and not out.any()
+    out = masks.merge_vehicle_masks(panoptic_seg, [], 30, max_pool, masks=[])
+    assert not out.any()
+
+
+def test_stuff_segments_merge_their_own_mask():
+    # panoptic_inference writes a later region of a stuff class under the id of the class' first
+    # segment without adding it to masks_list: only the listed mask of a stuff segment is merged
+    panoptic_seg = torch.zeros(H, W, dtype=torch.int32)
+    panoptic_seg[10:20, 10:20] = 1  # thing
+    panoptic_seg[40:50, 40:50] = 2  # stuff, first region
+    listed = panoptic_seg == 2
+    panoptic_seg[70:80, 90:100] = 2  # stuff, later region of the same class
+    thing = panoptic_seg == 1
+    out = masks.merge_vehicle_masks(panoptic_seg, [1], 5, masks=[listed])
+    np.testing.assert_array_equal(out.numpy(), reference_merge([thing, listed], 5))
+    assert not out[70:80, 90:100].any()
@@ -0,0 +1,95 @@
+import argparse, os
+from collections import OrderedDict, Counter
+import pytest
+import torch
+
+from lidar2dep import model_registry
+from lidar2dep.model_registry import LazyModel, get_model, _specs, COMPLETION_KEYS
+from lidar2dep.precision import model_policy, PrecisionModel
+
+NAMES = ['seem', 'lama', 'completionformer', 'zoedepth']
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    # empty registry, the four getters building small stub modules instead of the real checkpoints
+    monkeypatch.setattr(model_registry, '_models', OrderedDict())
+    monkeypatch.setattr(model_registry, 'build_counts', Counter())
+    monkeypatch.setattr(model_registry, 'max_models', None)
+    for name in NAMES:
+        def getter(opt, name=name):
+            return get_model(name, lambda: torch.nn.Linear(4, 2), *_specs(opt)[name], device=opt.device,
+                             policy=model_policy(opt, name))
+        monkeypatch.setitem(model_registry.GETTERS, name, getter)
+    return model_registry
+
+
+@pytest.fixture
+def opt(tmp_path):
+    ckpts = {}
+    for name in NAMES:
+        ckpts[name] = tmp_path / f'{name}.ckpt'
+        ckpts[name].write_bytes(b'weights')
+    return argparse.Namespace(
+        seem_cfg='seem.yaml', seem_ckpt=str(ckpts['seem']), lama_cfg='lama.yaml', lama_ckpt=str(ckpts['lama']),
+        pretrain=str(ckpts['completionformer']), zoedepth_path=str(ckpts['zoedepth']), device='cpu', precision='fp32',
+        **{k: 1 for k in COMPLETION_KEYS}
+    )
+
+
+def process_frames(opt, n):
+    # what preprocess_models + the gpu stages do per frame: lazy stand-ins, resolved and called
+    x = torch.ones(1, 4)
+    for _ in range(n):
+        models = {name: LazyModel(name, opt) for name in NAMES}
+        for model in models.values():
+            assert model(x).shape == (1, 2)
+
+
+def test_each_model_built_once_over_frames(registry, opt):
+    process_frames(opt, 5)
+    assert all(registry.build_counts[name] == 1 for name in NAMES), dict(registry.build_counts)
+    assert len(registry.registered()) == len(NAMES)
+
+
+def test_unused_model_never_built(registry, opt):
+    LazyModel('seem', opt)  # a stage served by the stage cache never calls it
+    assert registry.build_counts['seem'] == 0
+
+
+def test_changed_config_rebuilds(registry, opt):
+    process_frames(opt, 2)
+    opt.lama_cfg = 'lama_big.yaml'
+    process_frames(opt, 2)
+    assert registry.build_counts['lama'] == 2
+    assert all(registry.build_counts[name] == 1 for name in NAMES if name != 'lama')
+
+
+def test_changed_checkpoint_rebuilds(registry, opt):
+    process_frames(opt, 2)
+    with open(opt.pretrain, 'ab') as f:
+        f.write(b' retrained')  # size / mtime change the fingerprint
+    process_frames(opt, 2)
+    assert registry.build_counts['completionformer'] == 2
+    assert registry.build_counts['seem'] == 1
+
+
+def test_precision_policy_is_part_of_the_key(registry, opt):
+    process_frames(opt, 1)
+    key = registry.model_id('seem', opt)
+    opt.precision = 'seem=bf16'
+    assert registry.model_id('seem', opt) != key
+    assert isinstance(LazyModel('seem', opt).get(), PrecisionModel)
+    assert registry.build_counts['seem'] == 2 and registry.build_counts['lama'] == 1
+
+
+def test_evict_and_max_models(registry, opt, monkeypatch):
+    process_frames(opt, 1)
+    registry.evict('zoedepth')
+    process_frames(opt, 1)
+    assert registry.build_counts['zoedepth'] == 2
+
+    monkeypatch.setattr(registry, 'max_models', 2)  # applies from the next construction, least recently used out first
+    opt.lama_cfg = 'lama_big.yaml'
+    LazyModel('lama', opt).get()
+    assert [name for name, _ in registry.registered()] == ['zoedepth', 'lama']
@@ -0,0 +1,124 @@
+import threading
+import time
+
+import pytest
+
+from lidar2dep.sharding import shard_indices, env_shard
+
+
+class FakeCalib:
+    def __init__(self, idx):
+        self.idx = idx
+
+    def detach(self):
+        return self
+
+
+class FakeDair:
+    # DAIR_V2X_C as read by PairLoader: items, base_dir, calib rows
+    def __init__(self, n):
+        self.items = [{'idx': i} for i in range(n)]
+        self.base_dir = 'unused'
+        self.calib = [FakeCalib(i) for i in range(n)]
+
+    def __getitem__(self, idx):
+        return self.items[idx]
+
+    def __len__(self):
+        return len(self.items)
+
+
+class FakeLoad:
+    """
+        load_pair stand-in: sleeps `delay(idx)`, fails on `failing`, and tracks
+        how many loads run at once and how many started.
+    """
+    def __init__(self, delay=lambda idx: 0.01, failing=()):
+        self.delay, self.failing = delay, set(failing)
+        self.lock, self.running, self.max_running, self.started = threading.Lock(), 0, 0, []
+
+    def __call__(self, item, base_dir, downsample, calib, load_pcd):
+        idx = item['idx']
+        assert calib.idx == idx
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            self.started.append(idx)
+        try:
+            time.sleep(self.delay(idx))
+            if idx in self.failing: raise OSError(f'cannot decode pair {idx}')
+            return f'pair {idx}'
+        finally:
+            with self.lock:
+                self.running -= 1
+
+
+@pytest.fixture
+def pair_loader(monkeypatch):
+    module = pytest.importorskip('lidar2dep.pair_loader')  # imports lidar2dep.dair: needs basicsr
+    monkeypatch.delenv('RANK', raising=False)
+    monkeypatch.delenv('WORLD_SIZE', raising=False)
+    return module
+
+
+def test_disjoint_shards(monkeypatch):
+    indices = [7, 3, 9, 0, 12, 5, 8]
+    for world_size in [1, 2, 3, 8]:
+        shards = [shard_indices(indices, rank, world_size) for rank in range(world_size)]
+        assert sorted(i for shard in shards for i in shard) == sorted(indices)
+        assert max(map(len, shards)) - min(map(len, shards)) <= 1
+    with pytest.raises(AssertionError):
+        shard_indices(indices, 2, 2)
+    monkeypatch.setenv('RANK', '1')
+    monkeypatch.setenv('WORLD_SIZE', '4')
+    assert env_shard() == (1, 4)
+
+
+def test_loader_shards(pair_loader, monkeypatch):
+    monkeypatch.setattr(pair_loader, 'load_pair', FakeLoad())
+    dair = FakeDair(10)
+    seen = [[idx for idx, _ in pair_loader.PairLoader(dair, rank=rank, world_size=3, num_workers=2)] for rank in range(3)]
+    assert sorted(sum(seen, [])) == list(range(10)) and seen[1] == [1, 4, 7]
+    monkeypatch.setenv('RANK', '2')
+    monkeypatch.setenv('WORLD_SIZE', '3')
+    assert pair_loader.PairLoader(dair, indices=[5, 6, 7, 8]).indices == [7]
+
+
+@pytest.mark.parametrize('num_workers', [0, 3])
+def test_ordered(pair_loader, monkeypatch, num_workers):
+    # pair 0 is the slowest to load, it still comes first
+    monkeypatch.setattr(pair_loader, 'load_pair', FakeLoad(delay=lambda idx: 0.1 if idx == 0 else 0.005))
+    out = list(pair_loader.PairLoader(FakeDair(6), num_workers=num_workers, prefetch=4))
+    assert out == [(i, f'pair {i}') for i in range(6)]
+
+
+def test_unordered(pair_loader, monkeypatch):
+    monkeypatch.setattr(pair_loader, 'load_pair', FakeLoad(delay=lambda idx: 0.2 if idx == 0 else 0.005))
+    out = [idx for idx, _ in pair_loader.PairLoader(FakeDair(6), num_workers=3, prefetch=4, ordered=False)]
+    assert sorted(out) == list(range(6)) and out[0] != 0 and out.index(0) > 0
+
+
+@pytest.mark.parametrize('ordered', [True, False])
+def test_bounded_prefetch(pair_loader, monkeypatch, ordered):
+    load = FakeLoad(delay=lambda idx: 0.01)
+    monkeypatch.setattr(pair_loader, 'load_pair', load)
+    consumed = 0
+    for idx, pair in pair_loader.PairLoader(FakeDair(16), num_workers=8, prefetch=3, ordered=ordered):
+        consumed += 1
+        # a slow consumer: the loader gets ahead of it by `prefetch` pairs, no more
+        time.sleep(0.02)
+        assert len(load.started) <= consumed + 3
+    assert consumed == 16
+    assert load.max_running <= 3
+
+
+@pytest.mark.parametrize('num_workers', [0, 2])
+def test_on_error(pair_loader, monkeypatch, num_workers):
+    monkeypatch.setattr(pair_loader, 'load_pair', FakeLoad(failing=[1, 4]))
+    errors = []
+    out = [idx for idx, _ in pair_loader.PairLoader(FakeDair(6), num_workers=num_workers,
+                                                    on_error=lambda idx, err: errors.append((idx, err)))]
+    assert out == [0, 2, 3, 5]
+    assert [idx for idx, _ in errors] == [1, 4] and all(isinstance(err, OSError) for _, err in errors)
+    with pytest.raises(OSError, match='cannot decode pair 1'):
+        list(pair_loader.PairLoader(FakeDair(6), num_workers=num_workers))
@@ -0,0 +1,168 @@
+import glob
+import os
+
+import numpy as np
+import pytest
+
+from lidar2dep.data import pcd_io
+
+PCDS = sorted(glob.glob('data/pcd/*.pcd'))
+
+
+def lzf_compress(data: bytes) -> bytes:
+    # greedy LibLZF encoder: literal runs of <= 32 bytes, back references of 3 .. 264 bytes within 8 KiB
+    out, literal, last, i = bytearray(), bytearray(), {}, 0
+
+    def flush():
+        for k in range(0, len(literal), 32):
+            run = literal[k:k + 32]
+            out.append(len(run) - 1)
+            out.extend(run)
+        literal.clear()
+
+    while i < len(data):
+        ref = last.get(data[i:i + 3]) if i + 3 <= len(data) else None
+        if i + 3 <= len(data): last[data[i:i + 3]] = i
+        if ref is None or i - ref - 1 > 0x1fff:
+            literal.append(data[i])
+            i += 1
+            continue
+        length = 3
+        while length < 264 and i + length < len(data) and data[ref + length] == data[i + length]:
+            length += 1  # may overlap the bytes being matched, like the decoder's copy
+        flush()
+        off, n = i - ref - 1, length - 2
+        if n < 7:
+            out += bytes([(n << 5) | (off >> 8), off & 0xff])
+        else:
+            out += bytes([(7 << 5) | (off >> 8), n - 7, off & 0xff])
+        i += length
+    flush()
+    return bytes(out)
+
+
+@pytest.fixture(params=['python', 'python-lzf'])
+def decoder(request, monkeypatch):
+    if request.param == 'python':
+        monkeypatch.setattr(pcd_io, 'lzf', None)
+    elif pcd_io.lzf is None:
+        pytest.skip('python-lzf not installed')
+    return request.param
+
+
+def test_lzf_hand_encoded(decoder):
+    # 'abc', then a 9 byte reference 3 back (overlapping its own output), then 'X'
+    assert pcd_io.lzf_decompress(bytes([2, 97, 98, 99, 0xe0, 0, 2, 0, 88]), 13) == b'abcabcabcabcX'
+    # a short reference (length 4, offset 5) and a 40 byte literal split in two runs
+    stream = bytes([4]) + b'hello' + bytes([(2 << 5), 4]) + bytes([31]) + b'x' * 32 + bytes([7]) + b'y' * 8
+    assert pcd_io.lzf_decompress(stream, 49) == b'hello' + b'hell' + b'x' * 32 + b'y' * 8
+
+
+def test_lzf_round_trip(decoder):
+    rng = np.random.default_rng(0)
+    points = np.round(rng.normal(0, 20, (3000, 4)), 2).astype(np.float32)
+    for data in [points.T.tobytes(), bytes(1000), b'ab' * 700, rng.integers(0, 256, 5000, dtype=np.uint8).tobytes()]:
+        assert pcd_io.lzf_decompress(lzf_compress(data), len(data)) == data
+
+
+def write_pcd(path, points: np.ndarray, data: str = 'binary_compressed'):
+    # PCL-style writer of a structured array with 1-count fields
+    kinds = {'f': 'F', 'u': 'U', 'i': 'I'}
+    names = points.dtype.names
+    header = ['VERSION 0.7', 'FIELDS ' + ' '.join(names),
+              'SIZE ' + ' '.join(str(points.dtype[n].itemsize) for n in names),
+              'TYPE ' + ' '.join(kinds[points.dtype[n].kind] for n in names),
+              'COUNT ' + ' '.join('1' for _ in names), f'WIDTH {len(points)}', 'HEIGHT 1',
+              'VIEWPOINT 0 0 0 1 0 0 0', f'POINTS {len(points)}', f'DATA {data}']
+    with open(path, 'wb') as f:
+        f.write(('\n'.join(header) + '\n').encode())
+        if data == 'ascii':
+            np.savetxt(f, np.array(points.tolist()), fmt='%.8g')
+        elif data == 'binary':
+            f.write(points.tobytes())
+        else:
+            raw = b''.join(np.ascontiguousarray(points[n]).tobytes() for n in names)  # column major
+            compressed = lzf_compress(raw)
+            f.write(np.array([len(compressed), len(raw)], dtype='<u4').tobytes() + compressed)
+
+
+def cloud(n=500, seed=0):
+    rng = np.random.default_rng(seed)
+    points = np.empty(n, dtype=[('x', 'f4'), ('y', 'f4'), ('z', 'f4'), ('intensity', 'f4'), ('ring', 'u2')])
+    for name in ['x', 'y', 'z']: points[name] = np.round(rng.normal(0, 20, n), 3)
+    points['intensity'] = np.round(rng.random(n), 3)
+    points['ring'] = rng.integers(0, 40, n)
+    return points
+
+
+@pytest.mark.parametrize('data', ['ascii', 'binary', 'binary_compressed'])
+def test_decode_formats(tmp_path, decoder, data):
+    points = cloud()
+    write_pcd(tmp_path / 'a.pcd', points, data)
+    decoded = pcd_io.decode_pcd(str(tmp_path / 'a.pcd'))
+    assert decoded.dtype == points.dtype
+    np.testing.assert_array_equal(decoded, points)
+
+
+@pytest.mark.skipif(not PCDS, reason='no bundled data/pcd files')
+def test_bundled_pcd(tmp_path, monkeypatch):
+    path = PCDS[0]
+    reference = None
+    if pcd_io.lzf is not None:
+        reference = pcd_io.decode_pcd(path)
+    monkeypatch.setattr(pcd_io, 'lzf', None)
+    points = pcd_io.decode_pcd(path)
+    with open(path, 'rb') as f:
+        assert len(points) == pcd_io.read_pcd_header(f)['points']
+    assert {'x', 'y', 'z', 'intensity'} <= set(points.dtype.names)
+    xyz = np.stack([points[n] for n in ['x', 'y', 'z']], 1)
+    assert np.isfinite(xyz).all() and np.abs(xyz).max() < 1000.
+    if reference is not None:
+        np.testing.assert_array_equal(points, reference)
+    # re-encoded by the test writer, the cloud decodes to the same points
+    write_pcd(tmp_path / 'copy.pcd', points)
+    np.testing.assert_array_equal(pcd_io.decode_pcd(str(tmp_path / 'copy.pcd')), points)
+
+
+def sidecars(directory):
+    return sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+
+
+def test_sidecar_cache(tmp_path):
+    path, cache_dir = tmp_path / 'a.pcd', tmp_path / pcd_io.PCD_CACHE_DIR
+    write_pcd(path, cloud(seed=0), 'binary')  # fixed size for a given point count
+    write_pcd(tmp_path / 'ab.pcd', cloud(seed=1))
+    pcd_io.read_pcd(str(tmp_path / 'ab.pcd'))
+
+    first = pcd_io.read_pcd(str(path))
+    st = os.stat(path)
+    assert isinstance(first, np.memmap) and not first.flags.writeable
+    assert f'a.pcd.{st.st_size}-{st.st_mtime_ns}.npy' in sidecars(cache_dir) and len(sidecars(cache_dir)) == 2
+    np.testing.assert_array_equal(first, cloud(seed=0))
+
+    # a hit reads the sidecar, not the source
+    sidecar = cache_dir / f'a.pcd.{st.st_size}-{st.st_mtime_ns}.npy'
+    np.save(sidecar, cloud(seed=5))
+    np.testing.assert_array_equal(pcd_io.read_pcd(str(path)), cloud(seed=5))
+    np.testing.assert_array_equal(pcd_io.read_pcd(str(path), use_cache=False), cloud(seed=0))
+
+    # same size, new mtime: the stale sidecar is replaced, other files' sidecars are kept
+    write_pcd(path, cloud(seed=2), 'binary')
+    assert os.stat(path).st_size == st.st_size
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    np.testing.assert_array_equal(pcd_io.read_pcd(str(path)), cloud(seed=2))
+    st2 = os.stat(path)
+    names = sidecars(cache_dir)
+    assert f'a.pcd.{st2.st_size}-{st2.st_mtime_ns}.npy' in names and sidecar.name not in names
+    assert len([n for n in names if n.startswith('ab.pcd.')]) == 1 and len(names) == 2
+
+    # size change
+    write_pcd(path, cloud(n=700, seed=3))
+    assert len(pcd_io.read_pcd(str(path))) == 700
+    assert len([n for n in sidecars(cache_dir) if n.startswith('a.pcd.')]) == 1
+
+    # explicit cache dir, and the LidarPointCloud view
+    pcd = pcd_io.load_point_cloud(str(path), cache_dir=str(tmp_path / 'elsewhere'))
+    assert len(sidecars(tmp_path / 'elsewhere')) == 1
+    assert pcd.points.shape == (700, 3) and len(pcd) == 700
+    np.testing.assert_array_equal(pcd.intensity, cloud(n=700, seed=3)['intensity'])
@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+import torch
+
+from lidar2dep.data.point_reduce import voxel_downsample, reduce_points, reduce_point_cloud, REDUCE_MODES
+from lidar2dep.data.pcd_io import LidarPointCloud
+
+
+def cloud(n=3000, seed=0, scale=20.):
+    rng = np.random.default_rng(seed)
+    return np.column_stack([rng.normal(0, scale, (n, 3)), rng.random(n)])
+
+
+def reference(points, voxel_size):
+    # per-point loop: {voxel: [row indices in input order]}
+    lo = points[:, 0:3].min(0)
+    voxels = {}
+    for i, p in enumerate(points):
+        voxels.setdefault(tuple(int(c) for c in np.floor((p[0:3] - lo) / voxel_size)), []).append(i)
+    return voxels
+
+
+def sorted_rows(a):
+    return a[np.lexsort(a.T[::-1])]
+
+
+@pytest.mark.parametrize('voxel_size', [0.5, 2., 7.])
+def test_voxel_first_matches_reference(voxel_size):
+    points = cloud()
+    voxels = reference(points, voxel_size)
+    first = sorted(rows[0] for rows in voxels.values())
+    out, index = voxel_downsample(points, voxel_size, mode='first', return_index=True)
+    assert index.tolist() == first
+    np.testing.assert_array_equal(out, points[first])
+    t_out, t_index = voxel_downsample(torch.from_numpy(points), voxel_size, mode='first', return_index=True)
+    assert t_index.tolist() == first
+    np.testing.assert_array_equal(t_out.numpy(), points[first])
+
+
+@pytest.mark.parametrize('voxel_size', [0.5, 2., 7.])
+def test_voxel_centroid_matches_reference(voxel_size):
+    points = cloud(seed=1)
+    expected = sorted_rows(np.array([points[rows].mean(0) for rows in reference(points, voxel_size).values()]))
+    out = voxel_downsample(points, voxel_size, mode='centroid')
+    assert out.dtype == points.dtype and len(out) == len(expected)
+    np.testing.assert_allclose(sorted_rows(out), expected, rtol=0, atol=1e-9)
+    t_out = voxel_downsample(torch.from_numpy(points.astype(np.float32)), voxel_size, mode='centroid')
+    assert t_out.dtype == torch.float32
+    np.testing.assert_allclose(sorted_rows(t_out.numpy().astype(np.float64)), expected, atol=1e-4)
+
+
+def test_voxel_keys_do_not_overflow():
+    # a 1e-6 voxel over 10 km: ~1e10 cells per axis, the linear grid index exceeds int64
+    rng = np.random.default_rng(2)
+    points = rng.uniform(-5000, 5000, (400, 3))
+    points[200:] = points[:200] + rng.uniform(0, 1e-7, (200, 3))  # every other point shares a voxel, mostly
+    voxels = reference(points, 1e-6)
+    first = sorted(rows[0] for rows in voxels.values())
+    assert len(first) < 400
+    assert voxel_downsample(points, 1e-6, mode='first', return_index=True)[1].tolist() == first
+    assert voxel_downsample(torch.from_numpy(points), 1e-6, mode='first', return_index=True)[1].tolist() == first
+    expected = sorted_rows(np.array([points[rows].mean(0) for rows in voxels.values()]))
+    np.testing.assert_allclose(sorted_rows(voxel_downsample(points, 1e-6)), expected, atol=1e-9)
+    with pytest.raises(ValueError, match='too small'):
+        voxel_downsample(points, 1e-16)
+
+    # a 2^32 x 2^32 cross-section: the linear index of x = 5 wraps around to the one of x = 0
+    points = np.array([[0., 0., 0.], [5., 0., 0.], [0., 2. ** 32 - 1, 2. ** 32 - 1]])
+    for p in [points, torch.from_numpy(points)]:
+        assert len(voxel_downsample(p, 1., mode='first')) == 3
+        assert len(voxel_downsample(p, 1.)) == 3
+
+
+def test_seeded_random_is_reproducible():
+    points = cloud()
+    a, ia = reduce_points(points, 'random', ratio=0.3, seed=7, return_index=True)
+    b, ib = reduce_points(points.copy(), 'random', ratio=0.3, seed=7, return_index=True)
+    np.testing.assert_array_equal(ia, ib)
+    np.testing.assert_array_equal(a, b)
+    assert not np.array_equal(ia, reduce_points(points, 'random', ratio=0.3, seed=8, return_index=True)[1])
+    assert abs(len(ia) - 0.3 * len(points)) < 0.05 * len(points)
+    assert (np.diff(ia) > 0).all()
+    t, it = reduce_points(torch.from_numpy(points), 'random', ratio=0.3, seed=7, return_index=True)
+    assert isinstance(t, torch.Tensor)
+    np.testing.assert_array_equal(it.numpy(), ia)
+
+
+def test_modes():
+    points = cloud(n=100)
+    assert set(REDUCE_MODES) == {'none', 'random', 'stride', 'voxel'}
+    np.testing.assert_array_equal(reduce_points(points, 'none', ratio=0.1), points)
+    np.testing.assert_array_equal(reduce_points(points, 'random', ratio=1.), points)
+    assert reduce_points(points, 'stride', ratio=0.25, return_index=True)[1].tolist() == list(range(0, 100, 4))
+    assert len(voxel_downsample(points[0:0], 1.)) == 0
+    with pytest.raises(AssertionError):
+        reduce_points(points, 'voxel')
+
+
+def test_reduce_point_cloud():
+    points = cloud(n=500, seed=3)
+    data = np.zeros(500, dtype=[('x', 'f4'), ('y', 'f4'), ('z', 'f4'), ('intensity', 'f4')])
+    for k, name in enumerate(['x', 'y', 'z', 'intensity']): data[name] = points[:, k]
+    first = reduce_point_cloud(LidarPointCloud(data.copy()), 'voxel', voxel_size=5.)
+    _, index = voxel_downsample(points[:, 0:3].astype(np.float32), 5., mode='first', return_index=True)
+    np.testing.assert_array_equal(first.data, data[index])
+    np.testing.assert_array_equal(first.intensity, data['intensity'][index])
+    np.testing.assert_array_equal(first.points, np.column_stack([data[n] for n in ['x', 'y', 'z']])[index])
+
+    centroid = reduce_point_cloud(LidarPointCloud(data.copy()), 'voxel', voxel_size=5., voxel_mode='centroid')
+    assert centroid.data is None and len(centroid.points) == len(centroid.intensity) == len(index)
@@ -0,0 +1,115 @@
+import pytest
+import torch
+from torch import nn
+
+from lidar2dep.precision import Policy, parse_policies, with_precision, PrecisionModel, MODELS
+
+
+class Net(nn.Module):
+    # small conv net standing in for LaMa / CompletionFormer: conv, norm, activation, dict output
+    def __init__(self):
+        super().__init__()
+        self.encoder = nn.Sequential(nn.Conv2d(4, 16, 3, padding=1), nn.BatchNorm2d(16), nn.ReLU())
+        self.head = nn.Conv2d(16, 1, 3, padding=1)
+        self.seen = []
+
+    def forward(self, batch):
+        self.seen.append((torch.is_autocast_enabled('cpu'), torch.get_autocast_dtype('cpu'),
+                          batch['rgb'].is_contiguous(memory_format=torch.channels_last)))
+        x = torch.cat([batch['rgb'], batch['dep']], 1)
+        pred = self.head(self.encoder(x))
+        return {'pred': pred, 'pred_init': (pred.detach(), batch['dep']), 'valid': (batch['dep'] > 0).long()}
+
+
+class Flash3DLike(nn.Module):
+    # non-standard entry points, like GaussianPredictor.set_eval / inputs keyed by tuples
+    def __init__(self):
+        super().__init__()
+        self.net = Net()
+
+    def set_eval(self):
+        self.eval()
+
+    def predict(self, inputs):
+        return self.net({'rgb': inputs[('color', 0)], 'dep': inputs[('depth', 0)]})['pred']
+
+
+def fixed(seed=0):
+    torch.manual_seed(seed)
+    net = Net().eval()
+    batch = {'rgb': torch.randn(2, 3, 24, 32), 'dep': torch.rand(2, 1, 24, 32) * (torch.rand(2, 1, 24, 32) < 0.2)}
+    return net, batch
+
+
+def test_policy_parse():
+    assert (Policy.parse('bf16+cl').precision, Policy.parse('bf16+cl').channels_last) == ('bf16', True)
+    assert str(Policy.parse('fp16')) == 'fp16' and str(Policy.parse('')) == 'fp32'
+    assert Policy.parse('fp32').is_default and not Policy.parse('fp32+cl').is_default
+    assert Policy.parse('bf16').dtype == torch.bfloat16
+    for bad in ['bf8', 'bf16+nhwc']:
+        with pytest.raises(AssertionError):
+            Policy.parse(bad)
+
+
+def test_parse_policies():
+    assert {name: str(p) for name, p in parse_policies(None).items()} == {name: 'fp32' for name in MODELS}
+    policies = parse_policies('seem=fp16, bf16+cl ,flash3d=fp32')
+    assert list(policies) == MODELS
+    assert str(policies['seem']) == 'fp16' and str(policies['flash3d']) == 'fp32'
+    assert all(str(policies[name]) == 'bf16+cl' for name in ['lama', 'completionformer', 'zoedepth'])
+    with pytest.raises(AssertionError):
+        parse_policies('sam=bf16')
+
+
+def test_fp32_is_the_model_itself():
+    net, _ = fixed()
+    assert with_precision(net, 'fp32') is net and with_precision(net, Policy()) is net
+
+
+@pytest.mark.parametrize('spec', ['bf16', 'bf16+cl'])
+def test_cpu_bf16_close_to_fp32(spec):
+    net, batch = fixed()
+    with torch.no_grad():
+        ref = net(batch)
+        model = with_precision(fixed()[0], spec)
+        out = model(batch)
+    assert isinstance(model, PrecisionModel)
+    enabled, dtype, channels_last = model.seen[-1]
+    assert enabled and dtype == torch.bfloat16 and channels_last == spec.endswith('+cl')
+    if spec.endswith('+cl'):
+        assert model.encoder[0].weight.is_contiguous(memory_format=torch.channels_last)
+    # reduced precision floats come back as float32, other tensors unchanged
+    assert out['pred'].dtype == torch.float32 and out['pred_init'][0].dtype == torch.float32
+    assert isinstance(out['pred_init'], tuple) and out['valid'].dtype == torch.int64
+    scale = ref['pred'].abs().max()
+    assert (out['pred'] - ref['pred']).abs().max() <= 0.05 * scale
+    assert torch.nn.functional.cosine_similarity(out['pred'].flatten(), ref['pred'].flatten(), 0) > 0.999
+    assert not net.seen[-1][0]  # the fp32 reference ran without autocast
+
+
+def test_proxy_forwards_eval_attributes_and_submodules():
+    net, batch = fixed()
+    net.train()
+    model = with_precision(net, 'bf16')
+    assert model.eval() is model and not net.training  # model.eval() keeps the proxy
+    model.threshold = 0.3
+    assert net.threshold == 0.3 and model.threshold == 0.3
+    encoder = model.encoder
+    assert isinstance(encoder, PrecisionModel) and isinstance(model.encoder[0], PrecisionModel)
+    with torch.no_grad():
+        features = encoder(torch.cat([batch['rgb'], batch['dep']], 1))
+    assert features.dtype == torch.float32 and features.shape == (2, 16, 24, 32)
+
+
+def test_dict_entries_and_method_calls():
+    # seem.masks entries ({'model': ..., 'config': ...}) and Flash3D-like method calls
+    config = {'out_key': 'pred'}
+    entry = with_precision({'model': Flash3DLike(), 'config': config}, 'bf16')
+    assert isinstance(entry['model'], PrecisionModel) and entry['config'] is config
+    model = entry['model']
+    model.set_eval()
+    assert not model.training
+    inputs = {('color', 0): torch.randn(1, 3, 8, 8), ('depth', 0): torch.rand(1, 1, 8, 8)}
+    with torch.no_grad():
+        out = model.predict(inputs)
+    assert out.dtype == torch.float32 and model.net.seen[-1][:2] == (True, torch.bfloat16)
@@ -0,0 +1,182 @@
+import numpy as np
+import pytest
+import torch
+
+from lidar2dep.data.projector import project_points, project_points_multi
+
+K = np.array([[40., 0., 31.5], [0., 40., 23.5], [0., 0., 1.]])
+H, W = 48, 64
+
+
+def extrinsic(yaw=0., t=(0., 0., 0.)):
+    # lidar (x forward, y left, z up) -> camera (x right, y down, z forward), rotated by `yaw` about up
+    c, s = np.cos(yaw), np.sin(yaw)
+    T = np.eye(4)
+    T[0:3, 0:3] = np.array([[0., -1., 0.], [0., 0., -1.], [1., 0., 0.]]) @ np.array([[c, -s, 0], [s, c, 0], [0, 0, 1]])
+    T[0:3, 3] = t
+    return T
+
+
+def cloud(n=4000, seed=0):
+    rng = np.random.default_rng(seed)
+    # mostly in front, some behind and some far to the side
+    return np.stack([rng.uniform(-5, 40, n), rng.uniform(-30, 30, n), rng.uniform(-3, 3, n), rng.random(n)], 1)
+
+
+def reference(points, K, T, h, w, point_size=1, near=1e-3, far=None):
+    # per-point loop z-buffer with the projector's rounding and splat footprint
+    depth, index = np.full((h, w), np.inf), np.full((h, w), -1)
+    d = range(-((point_size - 1) // 2), point_size // 2 + 1)
+    for i, p in enumerate(points[:, 0:3]):
+        x, y, z = T[0:3, 0:3] @ p + T[0:3, 3]
+        if z <= near or (far is not None and z >= far): continue
+        u, v = int(np.floor((K[0] @ [x, y, z]) / z + 0.5)), int(np.floor((K[1] @ [x, y, z]) / z + 0.5))
+        for oy in d:
+            for ox in d:
+                if 0 <= u + ox < w and 0 <= v + oy < h and np.float32(z) < depth[v + oy, u + ox]:
+                    depth[v + oy, u + ox], index[v + oy, u + ox] = np.float32(z), i
+    depth[np.isinf(depth)] = 0.
+    return depth.astype(np.float32), index
+
+
+@pytest.mark.parametrize('point_size', [1, 2, 3, 4, 5])
+def test_matches_reference(point_size):
+    points, T = cloud(), extrinsic(0.2, (0.1, 1.5, -0.3))
+    depth, index = project_points(points, K, T, H, W, point_size=point_size, far=30., return_index=True)
+    ref_depth, ref_index = reference(points, K, T, H, W, point_size, far=30.)
+    assert depth.dtype == np.float32 and depth.shape == (H, W) and index.dtype == np.int64
+    np.testing.assert_array_equal(depth, ref_depth)
+    # ties between equally deep points may resolve to either point: compare the winning depth
+    assert ((index >= 0) == (ref_index >= 0)).all()
+    np.testing.assert_array_equal((T[2, 0:3] @ points[index[index >= 0], 0:3].T + T[2, 3]).astype(np.float32),
+                                  depth[index >= 0])
+
+
+def test_nearest_point_wins():
+    T = extrinsic()
+    # three points on the optical axis (pixel (31.5, 23.5) rounds to (32, 24)), the nearest in the middle of the list
+    points = np.array([[9., 0., 0.], [2., 0., 0.], [5., 0., 0.]])
+    for order in [[0, 1, 2], [2, 1, 0], [1, 0, 2]]:
+        depth, index = project_points(points[order], K, T, H, W, return_index=True)
+        assert depth[24, 32] == 2. and order[index[24, 32]] == 1
+        assert np.count_nonzero(depth) == 1
+
+
+@pytest.mark.parametrize('point_size', [1, 2, 3, 4, 5])
+def test_splat_radius(point_size):
+    T = extrinsic()
+    depth = project_points(np.array([[4., 0., 0.]]), K, T, H, W, point_size=point_size)
+    rows, cols = np.nonzero(depth)
+    lo, hi = -((point_size - 1) // 2), point_size // 2
+    assert np.count_nonzero(depth) == point_size ** 2
+    assert (rows.min(), rows.max(), cols.min(), cols.max()) == (24 + lo, 24 + hi, 32 + lo, 32 + hi)
+    assert (depth[depth > 0] == 4.).all()
+
+
+def test_behind_and_outside_dropped():
+    T = extrinsic()
+    points = np.array([
+        [-4., 0., 0.],      # behind the camera
+        [0., 0., 0.],       # at the camera center (z <= near)
+        [4., 100., 0.],     # far left of the image
+        [4., 0., -100.],    # far below the image
+        [50., 0., 0.],      # beyond `far`
+    ])
+    for point_size in [1, 5]:
+        depth, index = project_points(points, K, T, H, W, point_size=point_size, far=40., return_index=True)
+        assert not depth.any() and (index == -1).all()
+
+    # a point just outside the border still splats its inner half into the image
+    u = -1  # pixel column left of the image: y = -(u - cx) z / fx
+    point = np.array([[4., -(u - K[0, 2]) * 4. / K[0, 0], 0.]])
+    assert not project_points(point, K, T, H, W, point_size=1).any()
+    depth = project_points(point, K, T, H, W, point_size=5)
+    assert np.nonzero(depth.any(0))[0].tolist() == [0, 1]
+
+
+def test_return_index_consistent():
+    points, T = cloud(seed=1), extrinsic(-0.1)
+    depth, index = project_points(points, K, T, H, W, point_size=3, return_index=True)
+    assert ((depth > 0) == (index >= 0)).all()
+    z = (points[:, 0:3] @ T[0:3, 0:3].T + T[0:3, 3])[:, 2].astype(np.float32)
+    np.testing.assert_array_equal(z[index[index >= 0]], depth[index >= 0])
+    assert np.array_equal(project_points(points, K, T, H, W, point_size=3), depth)
+
+
+@pytest.mark.parametrize('point_size', [1, 4])
+def test_numpy_and_torch_agree(point_size):
+    points, T = cloud(seed=2), extrinsic(0.3, (0., -2., 0.))
+    depth, index = project_points(points, K, T, H, W, point_size=point_size, far=35., return_index=True)
+    for args in [dict(points=torch.from_numpy(points)), dict(points=points, device='cpu')]:
+        t_depth, t_index = project_points(K=K, extrinsic=T, height=H, width=W, point_size=point_size, far=35.,
+                                          return_index=True, **args)
+        assert isinstance(t_depth, torch.Tensor) and t_depth.dtype == torch.float32 and t_index.dtype == torch.long
+        np.testing.assert_array_equal(t_depth.numpy(), depth)
+        assert ((t_index.numpy() >= 0) == (index >= 0)).all()
+        # ties may pick another equally deep point: the winners' depths agree
+        z = (points[:, 0:3] @ T[0:3, 0:3].T + T[0:3, 3])[:, 2].astype(np.float32)
+        np.testing.assert_array_equal(z[t_index.numpy()[index >= 0]], depth[index >= 0])
+
+
+def cameras():
+    # three cameras of different resolutions and poses
+    K2 = np.array([[25., 0., 20.], [0., 25., 15.], [0., 0., 1.]])
+    return [K, K2, K * [[0.5], [0.5], [1.]]], [extrinsic(), extrinsic(0.8, (1., 0., 2.)), extrinsic(-0.4)], \
+        [(H, W), (30, 40), (24, 32)]
+
+
+@pytest.mark.parametrize('point_size', [1, 2, 5])
+@pytest.mark.parametrize('device', [None, 'cpu'])
+def test_multi_equals_single(point_size, device):
+    points = cloud(seed=3)
+    Ks, extrinsics, sizes = cameras()
+    depths, indices = project_points_multi(points, np.stack(Ks), np.stack(extrinsics), sizes, point_size=point_size,
+                                           far=38., device=device, return_index=True)
+    assert len(depths) == len(indices) == 3
+    for K_, T, (h, w), depth, index in zip(Ks, extrinsics, sizes, depths, indices):
+        single, single_index = project_points(points, K_, T, h, w, point_size=point_size, far=38., device=device,
+                                              return_index=True)
+        assert tuple(depth.shape) == (h, w)
+        np.testing.assert_array_equal(np.asarray(depth), np.asarray(single))
+        np.testing.assert_array_equal(np.asarray(index), np.asarray(single_index))
+
+
+def rigid(yaw, t):
+    c, s = np.cos(yaw), np.sin(yaw)
+    T = np.eye(4)
+    T[0:3, 0:3] = [[c, -s, 0], [s, c, 0], [0, 0, 1]]
+    T[0:3, 3] = t
+    return T
+
+
+def test_multi_cross_views():
+    dair = pytest.importorskip('lidar2dep.dair')  # needs basicsr and the CompletionFormer package
+    # one pair: the infrastructure lidar looks down the road, the vehicle is 12 m ahead of it, turned around
+    columns = {
+        'inf_lidar2world': rigid(0.3, (100., 50., 5.))[None], 'veh_lidar2novatel': rigid(0.05, (0.5, 0., 1.5))[None],
+        'veh_novatel2world': rigid(0.3 + np.pi - 0.05, (100. + 12 * np.cos(0.3), 50. + 12 * np.sin(0.3), 3.5))[None],
+        'inf_lidar2cam': extrinsic(0.1, (0., 0.5, 0.))[None], 'veh_lidar2cam': extrinsic(-0.1, (0., 0.3, -0.2))[None],
+    }
+    columns = dair.cross_view_columns(columns)
+    veh_lidar2world = columns['veh_novatel2world'][0] @ columns['veh_lidar2novatel'][0]
+
+    world = np.concatenate([cloud(seed=4)[:, 0:3] * [0.5, 0.5, 1.] + [104., 52., 3.], np.ones((4000, 1))], 1)
+    inf_points = (np.linalg.inv(columns['inf_lidar2world'][0]) @ world.T).T[:, 0:3]
+    veh_points = (np.linalg.inv(veh_lidar2world) @ world.T).T[:, 0:3]
+    K2 = np.array([[25., 0., 20.], [0., 25., 15.], [0., 0., 1.]])
+
+    for points, own, cross in [(inf_points, 'inf_lidar2cam', 'inf_lidar2veh_cam'),
+                               (veh_points, 'veh_lidar2cam', 'veh_lidar2inf_cam')]:
+        Ks, extrinsics, sizes = np.stack([K, K2]), np.stack([columns[own][0], columns[cross][0]]), [(H, W), (30, 40)]
+        depths = project_points_multi(points, Ks, extrinsics, sizes, point_size=2)
+        for depth, K_, T, (h, w) in zip(depths, Ks, extrinsics, sizes):
+            np.testing.assert_array_equal(depth, project_points(points, K_, T, h, w, point_size=2))
+        assert depths[1].any()
+
+    # the cross view of one lidar is the other side's own view of the same points
+    inf_in_veh = project_points(inf_points, K2, columns['inf_lidar2veh_cam'][0], 30, 40)
+    veh_in_veh = project_points(veh_points, K2, columns['veh_lidar2cam'][0], 30, 40)
+    assert inf_in_veh.any()
+    np.testing.assert_allclose(inf_in_veh, veh_in_veh, atol=1e-4)
+    veh_in_inf = project_points(veh_points, K, columns['veh_lidar2inf_cam'][0], H, W)
+    np.testing.assert_allclose(veh_in_inf, project_points(inf_points, K, columns['inf_lidar2cam'][0], H, W), atol=1e-4)
@@ -0,0 +1,36 @@
+import os
+import numpy as np
+
+from lidar2dep.data.lidar import load_ring_map, ring_map_from_depth
+
+K = np.array([[700., 0., 64.], [0., 700., 48.], [0., 0., 1.]])
+
+
+def depth_file(path, seed):
+    rng = np.random.default_rng(seed)
+    depth = rng.uniform(1., 80., (96, 128)) * (rng.random((96, 128)) < 0.1)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.save(path, depth)
+    return str(path), depth
+
+
+def test_same_basename_in_shared_cache_dir(tmp_path):
+    # KITTI drives reuse the frame names: a shared cache_dir must keep them apart
+    cache_dir = str(tmp_path / 'cache')
+    a, depth_a = depth_file(tmp_path / 'drive_a' / '0000000005.npy', 0)
+    b, depth_b = depth_file(tmp_path / 'drive_b' / '0000000005.npy', 1)
+    os.utime(b, ns=(os.stat(a).st_atime_ns, os.stat(a).st_mtime_ns))  # same name, size and mtime
+    ring_a = load_ring_map(a, depth_a, K, cache_dir=cache_dir)
+    ring_b = load_ring_map(b, depth_b, K, cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == 2
+    np.testing.assert_array_equal(ring_b, ring_map_from_depth(depth_b, K))
+    np.testing.assert_array_equal(load_ring_map(a, depth_a, K, cache_dir=cache_dir), ring_a)
+
+
+def test_intrinsics_are_part_of_the_key(tmp_path):
+    path, depth = depth_file(tmp_path / 'd.npy', 0)
+    load_ring_map(path, depth, K)
+    K2 = K.copy(); K2[1, 2] = 10.
+    np.testing.assert_array_equal(load_ring_map(path, depth, K2), ring_map_from_depth(depth, K2))
+    assert len(os.listdir(tmp_path / '.ring_cache')) == 2
+    assert load_ring_map(path, depth, K.tolist()) is not None and len(os.listdir(tmp_path / '.ring_cache')) == 2
@@ -0,0 +1,131 @@
+import os
+
+import numpy as np
+import torch
+
+from lidar2dep.stage_cache import StageCache, run_stage, run_stage_many
+
+
+class Model:
+    # stands in for a LazyModel: model_id is None until its weights are known
+    def __init__(self, model_id):
+        self.model_id = model_id
+
+
+def counting(outputs):
+    calls = []
+
+    def fn():
+        calls.append(1)
+        return outputs
+    return fn, calls
+
+
+def test_hit_on_identical_inputs(tmp_path):
+    cache = StageCache(str(tmp_path))
+    image = np.arange(12, dtype=np.uint8).reshape(3, 4)
+    fn, calls = counting({'depth': torch.linspace(0, 1, 12, dtype=torch.float64).reshape(3, 4), 'none': None})
+    first = cache.run('zoe', fn, inputs=[image.copy()], params={'a': 1}, models=['zoe:v1'])
+    second = cache.run('zoe', fn, inputs=[image.copy()], params={'a': 1}, models=[Model('zoe:v1')])
+    assert len(calls) == 1
+    assert cache.stats == {'zoe/hit': 1, 'zoe/miss': 1}
+    assert set(first) == set(second) == {'depth'}
+    assert first['depth'].dtype == second['depth'].dtype == np.float32
+    np.testing.assert_array_equal(first['depth'], second['depth'])
+    key = cache.key('zoe', [image], {'a': 1}, ['zoe:v1'])
+    assert os.path.exists(cache.path('zoe', key))
+
+
+def test_miss_when_inputs_params_or_model_change(tmp_path):
+    cache = StageCache(str(tmp_path))
+    fn, calls = counting({'out': np.ones(3)})
+    base = dict(inputs=[np.zeros(4)], params={'radius': 2}, models=['seem:a'])
+    cache.run('seg', fn, **base)
+    for change in [dict(inputs=[np.zeros(5)]), dict(inputs=[np.ones(4)]), dict(params={'radius': 3}),
+                   dict(models=['seem:b'])]:
+        cache.run('seg', fn, **{**base, **change})
+    assert len(calls) == 5
+    cache.run('seg', fn, **base)
+    assert len(calls) == 5
+    assert cache.stats == {'seg/hit': 1, 'seg/miss': 5}
+
+
+def test_no_caching_without_model_identity(tmp_path):
+    cache = StageCache(str(tmp_path))
+    fn, calls = counting({'out': np.ones(3)})
+    for model in [Model(None), torch.nn.Linear(1, 1)]:
+        assert cache.key('cf', [np.zeros(2)], models=[model]) is None
+        cache.run('cf', fn, inputs=[np.zeros(2)], models=[model])
+        cache.run('cf', fn, inputs=[np.zeros(2)], models=[model])
+    assert len(calls) == 4
+    assert not cache.stats
+    assert not os.path.exists(tmp_path / 'cf')
+
+
+def test_recompute_after_unreadable_entry(tmp_path):
+    cache = StageCache(str(tmp_path))
+    fn, calls = counting({'out': np.arange(5.)})
+    cache.run('lama', fn, inputs=['a'])
+    path = cache.path('lama', cache.key('lama', ['a']))
+    with open(path, 'wb') as f:
+        f.write(b'not an npz')
+    out = cache.run('lama', fn, inputs=['a'])
+    assert len(calls) == 2
+    np.testing.assert_array_equal(out['out'], np.arange(5.))
+    # the rewritten entry is readable again
+    assert cache.run('lama', fn, inputs=['a'])['out'].tolist() == list(range(5))
+    assert len(calls) == 2
+
+
+def test_disabled(tmp_path):
+    cache = StageCache(str(tmp_path), enabled=False)
+    fn, calls = counting({'out': np.ones(2)})
+    cache.run('s', fn, inputs=['a'])
+    cache.run('s', fn, inputs=['a'])
+    assert len(calls) == 2
+    assert not os.listdir(tmp_path)
+
+
+def test_run_many_partial_hits_in_input_order(tmp_path):
+    cache = StageCache(str(tmp_path))
+    requested = []
+
+    def compute(inputs_list):
+        def fn(indices):
+            requested.append(list(indices))
+            return [{'value': np.full(2, inputs_list[i][0])} for i in indices]
+        return fn
+
+    inputs_list = [[3.], [1.], [4.], [1.5], [9.]]
+    fn = compute(inputs_list)
+    # entries 1 and 3 are cached beforehand
+    cache.run_many('sparse', compute([inputs_list[1], inputs_list[3]]), [inputs_list[1], inputs_list[3]])
+    requested.clear()
+    outputs = cache.run_many('sparse', fn, inputs_list)
+    assert requested == [[0, 2, 4]]
+    assert [out['value'][0] for out in outputs] == [3., 1., 4., 1.5, 9.]
+    assert cache.stats['sparse/hit'] == 2 and cache.stats['sparse/miss'] == 5
+    # a second pass is all hits
+    assert [out['value'][0] for out in cache.run_many('sparse', fn, inputs_list)] == [3., 1., 4., 1.5, 9.]
+    assert requested == [[0, 2, 4]]
+
+
+def test_run_many_without_identity_computes_all(tmp_path):
+    cache = StageCache(str(tmp_path))
+    requested = []
+
+    def fn(indices):
+        requested.append(list(indices))
+        return [{'value': np.full(1, i)} for i in indices]
+
+    for _ in range(2):
+        cache.run_many('cf', fn, [['a'], ['b']], models=[Model(None)])
+    assert requested == [[0, 1], [0, 1]]
+    assert not os.path.exists(tmp_path / 'cf')
+
+
+def test_without_cache():
+    out = run_stage(None, 's', lambda: {'x': torch.ones(2, dtype=torch.float16), 'y': None})
+    assert set(out) == {'x'} and out['x'].dtype == np.float32
+    outs = run_stage_many(None, 's', lambda idx: [{'i': np.array(i)} for i in idx], [['a'], ['b'], ['c']])
+    assert [int(o['i']) for o in outs] == [0, 1, 2]
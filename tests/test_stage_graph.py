@@ -0,0 +1,117 @@
+import threading
+import time
+
+import pytest
+
+from lidar2dep.stage_graph import Stage, StageGraph
+
+
+def diamond(log, sleep=0.):
+    # decode -> (project, segment) -> merge, every call logged as (stage, item, thread, start, end)
+    lock = threading.Lock()
+
+    def stage(name, fn, inputs, outputs, device='cpu'):
+        def run(**kwargs):
+            start = time.perf_counter()
+            if sleep: time.sleep(sleep)
+            out = fn(**kwargs)
+            with lock:
+                log.append((name, kwargs.get('item', kwargs.get('x')),
+                            threading.current_thread().name, start, time.perf_counter()))
+            return out
+        return Stage(name, run, inputs, outputs, device)
+
+    return StageGraph([
+        stage('merge', lambda x, depth, mask: {'out': depth * 10 + mask}, ['x', 'depth', 'mask'], ['out']),
+        stage('segment', lambda x: {'mask': x % 3}, ['x'], ['mask'], 'gpu'),
+        stage('project', lambda x: {'depth': x * 2}, ['x'], ['depth']),
+        stage('decode', lambda item: {'x': item + 1}, ['item'], ['x']),
+    ], sources=['item'])
+
+
+def test_topological_order_and_results():
+    log = []
+    graph = diamond(log)
+    assert [stage.name for stage in graph.stages] == ['decode', 'segment', 'project', 'merge']
+    results = list(graph.run([{'item': i} for i in range(6)], cpu_workers=3))
+    assert [i for i, _ in results] == list(range(6))
+    assert [context['out'] for _, context in results] == [(i + 1) * 20 + (i + 1) % 3 for i in range(6)]
+    # every stage ran after its producers on the same item
+    ends = {(name, item): (start, end) for name, item, _, start, end in log}
+    for i in range(6):
+        x = i + 1
+        assert ends[('decode', i)][1] <= min(ends[('project', x)][0], ends[('segment', x)][0])
+        assert max(ends[('project', x)][1], ends[('segment', x)][1]) <= ends[('merge', x)][0]
+
+
+def test_graph_errors():
+    with pytest.raises(ValueError, match='cycle'):
+        StageGraph([Stage('a', None, ['y'], ['x']), Stage('b', None, ['x'], ['y'])])
+    with pytest.raises(ValueError, match='produced by no stage'):
+        StageGraph([Stage('a', None, ['missing'], ['x'])])
+    with pytest.raises(ValueError, match='written by'):
+        StageGraph([Stage('a', None, [], ['x']), Stage('b', None, [], ['x'])])
+
+
+def test_bounded_queues():
+    # a fast producer feeding a slow consumer never backs the consumer's queue up past queue_size
+    graph = StageGraph([
+        Stage('fast', lambda item: {'x': item}, ['item'], ['x']),
+        Stage('slow', lambda x: time.sleep(0.01) or {'y': x}, ['x'], ['y'], 'gpu'),
+    ], sources=['item'])
+    for queue_size in [1, 2]:
+        out = [context['y'] for _, context in
+               graph.run(({'item': i} for i in range(20)), cpu_workers=4, max_inflight=8, queue_size=queue_size)]
+        assert out == list(range(20))
+        assert graph.stats['slow']['queue_max'] <= queue_size
+        assert graph.stats['fast']['queue_max'] <= 8
+        assert graph.stats['slow']['calls'] == 20
+
+
+def test_cpu_and_gpu_stages_overlap():
+    log = []
+    graph = diamond(log, sleep=0.03)
+    list(graph.run([{'item': i} for i in range(4)], cpu_workers=2, max_inflight=4))
+    gpu = [(start, end) for name, _, _, start, end in log if name == 'segment']
+    cpu = [(start, end) for name, _, _, start, end in log if name != 'segment']
+    assert all(thread.startswith('stage-gpu') for name, _, thread, _, _ in log if name == 'segment')
+    assert any(s < e2 and s2 < e for s, e in cpu for s2, e2 in gpu)
+    # 16 calls of 30 ms, far from serialized
+    assert graph.elapsed < 16 * 0.03 * 0.8
+    assert graph.busy['gpu'] > 0
+
+
+def test_failing_item_dropped_and_reported():
+    errors = []
+
+    def project(x):
+        if x == 3: raise ValueError('bad frame')
+        return {'depth': x * 2}
+
+    graph = StageGraph([
+        Stage('decode', lambda item: {'x': item + 1}, ['item'], ['x']),
+        Stage('project', project, ['x'], ['depth']),
+        Stage('segment', lambda x: time.sleep(0.01) or {'mask': x}, ['x'], ['mask'], 'gpu'),
+        Stage('merge', lambda depth, mask: {'out': depth + mask}, ['depth', 'mask'], ['out']),
+    ], sources=['item'])
+
+    done = []
+
+    def run():
+        done.extend(graph.run([{'item': i} for i in range(6)], on_error=lambda i, name, err: errors.append((i, name, err))))
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout=10)
+    assert not thread.is_alive(), 'stage graph deadlocked after a failure'
+    assert [i for i, _ in done] == [0, 1, 3, 4, 5]
+    assert [(i, name) for i, name, _ in errors] == [(2, 'project')]
+    assert isinstance(errors[0][2], ValueError)
+
+    with pytest.raises(ValueError, match='bad frame'):
+        list(graph.run([{'item': i} for i in range(6)]))
+
+
+def test_zero_inflight_does_not_spin():
+    graph = StageGraph([Stage('a', lambda item: {'x': item}, ['item'], ['x'])], sources=['item'])
+    assert [context['x'] for _, context in graph.run([{'item': 5}, {'item': 6}], max_inflight=0)] == [5, 6]
@@ -0,0 +1,142 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from lidar2dep import telemetry
+
+
+@pytest.fixture(autouse=True)
+def reset():
+    yield
+    telemetry.configure(enabled=False)
+
+
+def test_off_by_default_is_a_noop():
+    telemetry.configure(enabled=False)
+    with telemetry.span('a') as handle:
+        assert handle is None
+    assert telemetry.begin('b').end() is None
+    assert telemetry.records() == [] and telemetry.summary() == []
+
+
+def test_span_nesting():
+    telemetry.configure(cuda=False)
+    with telemetry.span('outer', 'stage', item=3) as outer:
+        with telemetry.span('inner', 'model') as inner:
+            assert inner.parent is outer
+            time.sleep(0.01)
+        assert outer.parent is None
+    inner_record, outer_record = telemetry.records()
+    assert [inner_record['name'], outer_record['name']] == ['inner', 'outer']
+    assert outer_record['args'] == {'item': 3} and inner_record['cat'] == 'model'
+    assert outer_record['start'] <= inner_record['start']
+    assert inner_record['start'] + inner_record['wall'] <= outer_record['start'] + outer_record['wall'] + 1e-6
+    assert inner_record['wall'] >= 0.01
+
+    # ending a span closes the spans left open inside it, a span opened later is top level again
+    outer = telemetry.begin('outer')
+    telemetry.begin('left open')
+    assert outer.end(iteration=7)['args'] == {'iteration': 7}
+    assert outer.end() is None
+    with telemetry.span('next') as handle:
+        assert handle.parent is None
+
+    # the stack is per thread
+    parents = []
+    with telemetry.span('main'):
+        thread = threading.Thread(target=lambda: parents.append(telemetry.begin('worker').parent))
+        thread.start()
+        thread.join()
+    assert parents == [None]
+
+
+def test_traced():
+    telemetry.configure(cuda=False)
+
+    @telemetry.traced()
+    def decode(x):
+        """decodes"""
+        return x + 1
+
+    @telemetry.traced('named', cat='io')
+    def fails():
+        raise ValueError('bad')
+
+    assert decode(1) == 2 and decode.__name__ == 'decode' and decode.__doc__ == 'decodes'
+    with pytest.raises(ValueError):
+        fails()
+    assert [(r['cat'], r['name']) for r in telemetry.records()] == [('stage', 'decode'), ('io', 'named')]
+
+
+def test_json_lines(tmp_path):
+    telemetry.configure(root=str(tmp_path), cuda=False)
+    with telemetry.span('complete', item=1, items=4):
+        pass
+    telemetry.begin('train', 'drgs').end(loss=0.5)
+    path = tmp_path / f'telemetry-{os.getpid()}.jsonl'
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [line['name'] for line in lines] == ['complete', 'train']
+    assert lines[0]['args'] == {'item': 1, 'items': 4} and lines[1]['args'] == {'loss': 0.5}
+    for line in lines:
+        assert {'name', 'cat', 'start', 'wall', 'cpu', 'rss', 'rss_delta', 'peak_rss', 'pid', 'tid', 'thread',
+                'args'} <= set(line)
+        assert 'cuda_peak' not in line
+    assert lines == telemetry.records()
+
+    # a new configuration drops the records and appends to the log
+    telemetry.configure(root=str(tmp_path), cuda=False)
+    assert telemetry.records() == []
+    with telemetry.span('again'):
+        pass
+    assert len(path.read_text().splitlines()) == 3
+
+
+def record(name, wall, cpu, items=None, cat='stage', start=0., peak_rss=2 ** 20, cuda_peak=None):
+    r = {'name': name, 'cat': cat, 'start': start, 'wall': wall, 'cpu': cpu, 'rss': 2 ** 20, 'peak_rss': peak_rss,
+         'pid': 1, 'tid': 2, 'thread': 'MainThread', 'args': {} if items is None else {'items': items}}
+    if cuda_peak is not None: r['cuda_peak'] = cuda_peak
+    return r
+
+
+def test_summary():
+    rows = telemetry.summary([
+        record('decode', 0.2, 0.1), record('complete', 1.0, 0.5, items=4, cat='model', cuda_peak=2 ** 21),
+        record('decode', 0.6, 0.3, peak_rss=3 * 2 ** 20), record('complete', 1.0, 0.5, items=4, cat='model'),
+    ])
+    assert rows == [
+        ['stage', 'decode', 2, '0.80', '400.0', '600.0', '50%', '2.50', '3', '-'],
+        ['model', 'complete', 2, '2.00', '1000.0', '1000.0', '50%', '4.00', '1', '2'],
+    ]
+
+
+def test_chrome_trace(tmp_path):
+    trace = telemetry.chrome_trace([
+        record('decode', 0.002, 0.001, start=100.), record('complete', 0.5, 0.2, start=100.001, cuda_peak=2 ** 20),
+    ])
+    assert trace['displayTimeUnit'] == 'ms'
+    complete = [e for e in trace['traceEvents'] if e['ph'] == 'X']
+    meta = [e for e in trace['traceEvents'] if e['ph'] == 'M']
+    for event in complete:
+        assert {'name', 'cat', 'ph', 'pid', 'tid', 'ts', 'dur', 'args'} <= set(event)
+        assert isinstance(event['ts'], float) and isinstance(event['dur'], float)
+    assert [e['ts'] for e in complete] == [0., pytest.approx(1000., abs=1e-3)]
+    assert [e['dur'] for e in complete] == [2000., 500000.]
+    assert complete[0]['args'] == {'cpu_ms': 1., 'rss_mib': 1.}
+    assert complete[1]['args']['cuda_peak_mib'] == 1.
+    assert meta == [{'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': 2, 'args': {'name': 'MainThread'}}]
+
+    # the exported file holds the recorded spans in that schema
+    telemetry.configure(root=str(tmp_path), cuda=False)
+    with telemetry.span('complete', item=0):
+        pass
+    path = telemetry.export_chrome_trace()
+    assert path == str(tmp_path / f'trace-{os.getpid()}.json')
+    with open(path) as f:
+        exported = json.load(f)
+    assert [(e['name'], e['ph']) for e in exported['traceEvents']] == [('complete', 'X'), ('thread_name', 'M')]
+    assert exported['traceEvents'][0]['args']['item'] == 0
+    telemetry.configure(cuda=False)
+    assert telemetry.export_chrome_trace() is None
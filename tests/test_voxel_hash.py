@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+
+from lidar2dep.data.voxel_hash import VoxelHashIndex, dedup_against
+from lidar2dep.data.frustum import frustum_mask
+
+cKDTree = pytest.importorskip('scipy.spatial').cKDTree
+
+
+def cloud(n=4000, seed=0):
+    # LiDAR-like: dense rings near the ground plus scattered clutter, 80 m across
+    rng = np.random.default_rng(seed)
+    angle, dist = rng.uniform(0, 2 * np.pi, n), rng.uniform(2., 40., n)
+    points = np.stack([dist * np.cos(angle), dist * np.sin(angle), rng.normal(-1.5, 0.3, n)], 1)
+    points[::7] += rng.normal(0, 2., (len(points[::7]), 3))
+    return points
+
+
+@pytest.fixture(scope='module')
+def data():
+    points = cloud()
+    queries = np.concatenate([points[::9] + 0.05, cloud(300, seed=1)])
+    return points, queries, cKDTree(points)
+
+
+@pytest.mark.parametrize('cell_size, radius', [(0.5, 0.3), (0.2, 0.5), (1.0, 5.0)])
+def test_radius_and_count_match_ckdtree(data, cell_size, radius):
+    points, queries, tree = data
+    index = VoxelHashIndex(points, cell_size)
+    offsets, indices, distances = index.radius_query(queries, radius)
+    ref = tree.query_ball_point(queries, radius)
+    for i, neighbors in enumerate(ref):
+        found = indices[offsets[i]:offsets[i + 1]]
+        assert sorted(found.tolist()) == sorted(neighbors)
+        d = distances[offsets[i]:offsets[i + 1]]
+        assert np.all(np.diff(d) >= 0)
+        np.testing.assert_allclose(d, np.linalg.norm(points[found] - queries[i], axis=1))
+    np.testing.assert_array_equal(index.count_within(queries, radius), [len(r) for r in ref])
+
+
+@pytest.mark.parametrize('cell_size, radius', [(0.5, 0.3), (0.2, 0.5), (1.0, 5.0)])
+def test_any_within_and_dedup_match_ckdtree(data, cell_size, radius):
+    points, queries, tree = data
+    index = VoxelHashIndex(points, cell_size)
+    dist, _ = tree.query(queries, 1, distance_upper_bound=radius)
+    np.testing.assert_array_equal(index.any_within(queries, radius), np.isfinite(dist))
+    np.testing.assert_array_equal(dedup_against(index, queries, radius), ~np.isfinite(dist))
+
+
+@pytest.mark.parametrize('k, radius', [(1, 0.5), (8, 1.0), (16, 3.0)])
+def test_knn_matches_ckdtree(data, k, radius):
+    points, queries, tree = data
+    index = VoxelHashIndex(points, 0.5)
+    indices, distances = index.knn(queries, k, radius)
+    ref_dist, ref_idx = tree.query(queries, k, distance_upper_bound=radius)
+    ref_dist, ref_idx = ref_dist.reshape(len(queries), k), ref_idx.reshape(len(queries), k)
+    np.testing.assert_allclose(distances, ref_dist)
+    missing = ~np.isfinite(ref_dist)
+    assert np.all(indices[missing] == -1)
+    # ties may swap indices: the distances of the chosen points are what must agree
+    np.testing.assert_allclose(np.linalg.norm(points[indices[~missing]] - np.repeat(queries, k, 0).reshape(len(queries), k, 3)[~missing], axis=1),
+                               ref_dist[~missing])
+
+
+def test_empty_queries_and_index():
+    index = VoxelHashIndex(np.zeros((0, 3)), 0.5)
+    assert not index.any_within(np.ones((3, 3)), 1.).any()
+    offsets, indices, _ = VoxelHashIndex(cloud(50), 0.5).radius_query(np.zeros((0, 3)), 1.)
+    assert offsets.tolist() == [0] and len(indices) == 0
+
+
+def cameras():
+    K = np.array([[400., 0., 160.], [0., 400., 120.], [0., 0., 1.]])
+    # lidar (x forward, z up) -> camera (z forward, y down), the second camera turned by 90 degrees
+    to_cam = np.array([[0., -1., 0., 0.], [0., 0., -1., 0.], [1., 0., 0., 0.], [0., 0., 0., 1.]])
+    turn = np.eye(4)
+    turn[0:2, 0:2] = [[0., 1.], [-1., 0.]]
+    return np.stack([K, K]), np.stack([to_cam, to_cam @ turn]), [(240, 320), (240, 320)]
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'margin': 0}, {'near': 5., 'far': 20.}])
+def test_frustum_query_culls_cells_and_matches_frustum_mask(kwargs):
+    points = cloud(20000)
+    Ks, extrinsics, sizes = cameras()
+    index = VoxelHashIndex(points, 0.5)
+    found = index.frustum_query(Ks, extrinsics, sizes, **kwargs)
+    np.testing.assert_array_equal(found, np.nonzero(frustum_mask(points, Ks, extrinsics, sizes, **kwargs))[0])
+    cells = index.frustum_cells(Ks, extrinsics, sizes, **kwargs)
+    assert cells.sum() < 0.75 * len(cells)  # the cells behind / beside both cameras are culled
+    # no point inside a frustum lives in a culled cell
+    inside = np.zeros(len(points), dtype=bool)
+    inside[found] = True
+    culled = np.concatenate([index.cell_points(c) for c in np.nonzero(~cells)[0]])
+    assert not inside[culled].any()